@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+
+"""Offline benchmarks of the PEMT stages against local stand-in servers."""
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""Recorded responses replayed by the stand-in servers.
+
+The mapping files are the copies shipped in data/mapper. The ChEMBL activities, PubChem compounds and SureChEMBL
+hits are generated from a seed with the shape of the real responses, so that a benchmark can be repeated at any
+scale. Fixtures are plain JSON and can be replaced by responses recorded from the real services.
+"""
+
+import json
+import os
+import random
+from typing import Dict
+
+import pandas as pd
+
+from pemt.constants import VALID_CODES
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+MAPPER_FIXTURE_DIR = os.path.join(HERE, "..", "data", "mapper")
+
+ASSIGNEES = [
+    "NOVARTIS AG",
+    "PFIZER",
+    "UNIV BOSTON",
+    "HOFFMANN LA ROCHE",
+    "BAYER AG",
+    "MERCK SHARP & DOHME",
+    "ASTRAZENECA AB",
+    "UNIV CALIFORNIA",
+]
+OTHER_CODES = ["G01N", "B01J", "C09K", "H01L"]
+
+
+def load_targets() -> Dict[str, str]:
+    """Map the UniProt identifiers of the ChEMBL mapping file to their targets, as the chemical extractor does."""
+    mapper = pd.read_csv(
+        f"{MAPPER_FIXTURE_DIR}/chembl_uniprot_mapping.txt",
+        dtype=str,
+        skiprows=1,
+        sep="\t",
+        names=["uniprot", "chembl_id", "name", "type"],
+    )
+    return mapper.set_index("uniprot")["chembl_id"].to_dict()
+
+
+def make_fixtures(num_genes: int, seed: int = 0) -> dict:
+    """Generate the responses needed to run PEMT on a number of genes.
+
+    About one gene in five has no active chemicals, chemicals are shared between genes and patents between
+    compounds, and some chemicals are unknown to PubChem or have no SureChEMBL identifier, as in real analyses.
+
+    :param num_genes: Number of UniProt identifiers of the analysis.
+    :param seed: Seed of the random generator.
+    :returns: A dictionary with the "genes" of the analysis, the ChEMBL "activities" of each target, the PubChem
+        "names" (mapping names and ChEMBL ids to CIDs) and "synonyms" of each CID, and the SureChEMBL "patents" of
+        each compound.
+    """
+    rng = random.Random(seed)
+    targets = load_targets()
+
+    genes = rng.sample(sorted(targets), min(num_genes, len(targets)))
+    chemicals = [f"CHEMBL{900000 + index}" for index in range(3 * num_genes)]
+    patents = [f"US-{5000000 + index}-A" for index in range(20 * num_genes)]
+    codes = sorted(VALID_CODES) + OTHER_CODES
+
+    activities = {}
+    for gene in genes:
+        if rng.random() < 0.2:
+            activities[targets[gene]] = []
+            continue
+
+        activities[targets[gene]] = [
+            {
+                "molecule_chembl_id": rng.choice(chemicals),
+                "pchembl_value": (
+                    None if rng.random() < 0.2 else f"{rng.uniform(4, 10):.2f}"
+                ),
+            }
+            for _ in range(rng.randint(1, 30))
+        ]
+
+    names = {}
+    synonyms = {}
+    compounds = {}
+    for cid, chembl_id in enumerate(chemicals, start=1):
+        if rng.random() < 0.1:
+            continue
+
+        name = f"compound {cid}"
+        synonyms[str(cid)] = [name, chembl_id]
+        names[name] = names[chembl_id] = cid
+
+        if rng.random() < 0.8:
+            schembl_id = f"SCHEMBL{100000 + cid}"
+            synonyms[str(cid)].append(schembl_id)
+            compounds[schembl_id] = sorted(
+                (
+                    patent_id,
+                    f"{rng.randint(1985, 2022)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                    f"{rng.choice(codes)} {rng.randint(1, 50)}/{rng.randint(0, 99):02d}",
+                    rng.choice(ASSIGNEES),
+                )
+                for patent_id in rng.sample(
+                    patents, rng.randint(0, min(120, len(patents)))
+                )
+            )
+
+    return {
+        "genes": genes,
+        "activities": activities,
+        "names": names,
+        "synonyms": synonyms,
+        "patents": compounds,
+    }
+
+
+def save_fixtures(fixtures: dict, file_path: str) -> None:
+    """Write fixtures as JSON.
+
+    :param fixtures: Fixtures as returned by :func:`make_fixtures`.
+    :param file_path: Path of the JSON file.
+    """
+    with open(file_path, "w") as f:
+        json.dump(fixtures, f)
+
+
+def load_fixtures(file_path: str) -> dict:
+    """Read fixtures written by :func:`save_fixtures`.
+
+    :param file_path: Path of the JSON file.
+    """
+    with open(file_path) as f:
+        return json.load(f)
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+
+"""Benchmark the PEMT stages at several input scales against local stand-in servers.
+
+Usage: python -m benchmarks.run --scales 10,100,1000 --latency chembl=0.2 --rate-limit pubchem=5
+"""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, Optional
+
+import click
+
+from benchmarks.fixtures import make_fixtures, save_fixtures
+from benchmarks.servers import BACKENDS, StandInServers
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+
+def run_benchmark(
+    num_genes: int,
+    latency: Optional[Dict[str, float]] = None,
+    rate_limit: Optional[Dict[str, float]] = None,
+    client_rate_limit: Optional[Dict[str, float]] = None,
+    seed: int = 0,
+) -> dict:
+    """Run the PEMT stages on a number of genes in a fresh process.
+
+    :param num_genes: Number of genes of the benchmarked analysis.
+    :param latency: Latency in seconds of each backend.
+    :param rate_limit: Requests per second allowed by each backend.
+    :param client_rate_limit: Requests per second sent by PEMT to each backend. By default, PEMT does not limit its
+        requests, so that the benchmark measures the stages rather than the rate limits.
+    :param seed: Seed of the generated fixtures.
+    :returns: The result of :func:`benchmarks.worker.run` with the requests received by each server.
+    """
+    fixtures = make_fixtures(num_genes, seed=seed)
+
+    with tempfile.TemporaryDirectory() as directory:
+        fixture_file = os.path.join(directory, "fixtures.json")
+        result_file = os.path.join(directory, "result.json")
+        save_fixtures(fixtures, fixture_file)
+
+        with StandInServers(fixtures, latency, rate_limit) as servers:
+            env = {
+                **os.environ,
+                **servers.environment,
+                "PEMT_DATA_DIR": os.path.join(directory, "data"),
+                "PEMT_RATE_LIMITS": ",".join(
+                    f"{backend}={(client_rate_limit or {}).get(backend, 0)}"
+                    for backend in BACKENDS
+                ),
+                "PYTHONPATH": os.pathsep.join(
+                    [
+                        os.path.join(HERE, "..", "src"),
+                        os.path.join(HERE, ".."),
+                        os.environ.get("PYTHONPATH", ""),
+                    ]
+                ),
+            }
+            process = subprocess.run(
+                [sys.executable, "-m", "benchmarks.worker", fixture_file, result_file],
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+            if process.returncode != 0:
+                raise RuntimeError(
+                    f"The benchmark of {num_genes} genes failed:\n{process.stderr[-2000:]}"
+                )
+
+            with open(result_file) as f:
+                result = json.load(f)
+            result["server_requests"] = servers.counts
+
+    return {"scale": num_genes, **result}
+
+
+HEADER = (
+    f"{'genes':>7} {'genes/s':>9} {'chemicals/s':>12} {'patents/s':>10} {'peak MB':>8} "
+    + " ".join(f"{backend:>10}" for backend in BACKENDS)
+)
+
+
+def format_result(result: dict) -> str:
+    """Format a benchmark result as a row under :data:`HEADER`, with the requests received by each server.
+
+    :param result: Result as returned by :func:`run_benchmark`.
+    """
+    throughput = result["throughput"]
+    return (
+        f"{result['scale']:>7} {throughput['genes/s']:>9.1f} {throughput['chemicals/s']:>12.1f} "
+        f"{throughput['patents/s']:>10.1f} {result['peak_memory_mb']:>8.0f} "
+        + " ".join(
+            f"{result['server_requests'][backend]['requests']:>10}"
+            for backend in BACKENDS
+        )
+    )
+
+
+def _parse_backend_values(ctx, param, values) -> Dict[str, float]:
+    """Parse "backend=value" options, where a value without backend applies to all backends."""
+    parsed = {}
+
+    for value in values:
+        backend, _, number = value.rpartition("=")
+        if backend and backend not in BACKENDS:
+            raise click.BadParameter(
+                f"Unknown backend {backend}, choose from {', '.join(BACKENDS)}"
+            )
+
+        try:
+            number = float(number)
+        except ValueError:
+            raise click.BadParameter(f"{value} is not a number")
+
+        for name in [backend] if backend else BACKENDS:
+            parsed[name] = number
+
+    return parsed
+
+
+@click.command()
+@click.option(
+    "--scales",
+    default="10,100,1000",
+    show_default=True,
+    help="Comma-separated numbers of genes to benchmark",
+)
+@click.option(
+    "--latency",
+    multiple=True,
+    callback=_parse_backend_values,
+    help="Latency in seconds of all backends or of one, e.g. chembl=0.2",
+)
+@click.option(
+    "--rate-limit",
+    multiple=True,
+    callback=_parse_backend_values,
+    help="Requests per second allowed by all backends or by one, e.g. pubchem=5",
+)
+@click.option(
+    "--client-rate-limit",
+    multiple=True,
+    callback=_parse_backend_values,
+    help="Requests per second sent by PEMT to all backends or to one, e.g. pubchem=5. No limit by default",
+)
+@click.option("--seed", default=0, show_default=True, help="Seed of the fixtures")
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False),
+    help="Path of a JSON file for the full results",
+)
+def main(
+    scales: str,
+    latency,
+    rate_limit,
+    client_rate_limit,
+    seed: int,
+    output: Optional[str],
+):
+    """Benchmark the PEMT stages against local stand-in servers."""
+    results = []
+    click.echo(HEADER)
+
+    for scale in scales.split(","):
+        result = run_benchmark(
+            int(scale),
+            latency=latency,
+            rate_limit=rate_limit,
+            client_rate_limit=client_rate_limit,
+            seed=seed,
+        )
+        results.append(result)
+        click.echo(format_result(result))
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+
+"""Local stand-in servers for the web services used by PEMT.
+
+Each backend runs in its own HTTP server on a free local port and answers the requests of PEMT from the fixtures,
+after a configurable latency. A token bucket limits the rate of requests: requests above the limit are answered
+with "429 Too Many Requests", as the real services do when they are overloaded.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.fixtures import MAPPER_FIXTURE_DIR
+
+"""Number of hits on a SureChEMBL result page."""
+PAGE_SIZE = 50
+
+BACKENDS = ("github", "chembl", "pubchem", "surechembl")
+
+PUBCHEM_NOT_FOUND = {"Fault": {"Code": "PUGREST.NotFound", "Message": "No CID found"}}
+
+
+class TokenBucket:
+    """Rate limiter allowing bursts of up to one second of requests."""
+
+    def __init__(self, rate: float):
+        """Start with a full bucket.
+
+        :param rate: Number of requests allowed per second.
+        """
+        self.rate = rate
+        self.tokens = max(rate, 1.0)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> bool:
+        """Take a token, returning False if the bucket is empty."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            if self.tokens < 1:
+                return False
+
+            self.tokens -= 1
+            return True
+
+
+class StandInServer(ThreadingHTTPServer):
+    """HTTP server replaying the fixtures of one backend."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        backend: str,
+        fixtures: dict,
+        latency: float = 0.0,
+        rate_limit: Optional[float] = None,
+    ):
+        """Bind the server to a free local port.
+
+        :param backend: Name of the backend. It can be either of these: github, chembl, pubchem, surechembl.
+        :param fixtures: Fixtures as returned by :func:`benchmarks.fixtures.make_fixtures`.
+        :param latency: Seconds waited before answering each request.
+        :param rate_limit: Number of requests per second above which requests are rejected. No limit if None.
+        """
+        assert backend in BACKENDS
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.backend = backend
+        self.fixtures = fixtures
+        self.latency = latency
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.counts = {"requests": 0, "throttled": 0, "connections": 0}
+        self.counts_lock = threading.Lock()
+
+    def process_request(self, request, client_address) -> None:
+        """Count the connections, which clients with keep-alive re-use for several requests."""
+        with self.counts_lock:
+            self.counts["connections"] += 1
+        super().process_request(request, client_address)
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, throttled: bool) -> None:
+        """Count a request."""
+        with self.counts_lock:
+            self.counts["requests"] += 1
+            self.counts["throttled"] += throttled
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Dispatch the requests to the handler of the backend of the server."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which Nagle's algorithm would delay on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args) -> None:
+        """Keep the benchmark output clean."""
+
+    def do_GET(self) -> None:
+        """Answer a GET request."""
+        self._answer(b"")
+
+    def do_POST(self) -> None:
+        """Answer a POST request."""
+        self._answer(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+
+    def _answer(self, body: bytes) -> None:
+        server = self.server
+        throttled = server.bucket is not None and not server.bucket.take()
+        server.count(throttled)
+
+        if throttled:
+            self._send(429, b"Too Many Requests", "text/plain", {"Retry-After": "1"})
+            return
+
+        time.sleep(server.latency)
+        url = urlparse(self.path)
+        status, payload = getattr(self, f"_{server.backend}")(url, body)
+
+        if isinstance(payload, bytes):
+            self._send(status, payload, "text/plain")
+        else:
+            self._send(status, json.dumps(payload).encode(), "application/json")
+
+    def _send(
+        self,
+        status: int,
+        payload: bytes,
+        content_type: str,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _github(self, url, body: bytes) -> Tuple[int, bytes]:
+        """Serve the mapping files, like GitHub serves the raw files of the repository."""
+        file_name = url.path.rsplit("/", 1)[-1]
+        if file_name not in ("chembl_uniprot_mapping.txt", "hgnc_mapper.tsv"):
+            return 404, b"Not Found"
+
+        with open(f"{MAPPER_FIXTURE_DIR}/{file_name}", "rb") as f:
+            return 200, f.read()
+
+    def _chembl(self, url, body: bytes) -> Tuple[int, dict]:
+        """Serve the activities of targets, a page at a time."""
+        if not url.path.endswith("/activity.json"):
+            return 404, {"error_message": "Not Found"}
+
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        limit = int(params.get("limit", 20))
+        offset = int(params.get("offset", 0))
+
+        activities = self.server.fixtures["activities"].get(
+            params.get("target_chembl_id"), []
+        )
+        page = activities[offset : offset + limit]
+        if params.get("only"):
+            fields = params["only"].split(",")
+            page = [{key: activity.get(key) for key in fields} for activity in page]
+
+        return 200, {
+            "activities": page,
+            "page_meta": {
+                "limit": limit,
+                "offset": offset,
+                "total_count": len(activities),
+            },
+        }
+
+    def _pubchem(self, url, body: bytes) -> Tuple[int, dict]:
+        """Serve the synonyms of the compound with a name."""
+        if not url.path.endswith("/compound/name/synonyms/JSON"):
+            return 400, {"Fault": {"Code": "PUGREST.BadRequest"}}
+
+        form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        cid = self.server.fixtures["names"].get(form.get("name"))
+        if cid is None:
+            return 404, PUBCHEM_NOT_FOUND
+
+        return 200, {
+            "InformationList": {
+                "Information": [
+                    {"CID": cid, "Synonym": self.server.fixtures["synonyms"][str(cid)]}
+                ]
+            }
+        }
+
+    def _surechembl(self, url, body: bytes) -> Tuple[int, dict]:
+        """Serve the patent hits of a compound, a result page at a time."""
+        parts = url.path.strip("/").split("/")
+        if len(parts) != 3 or parts[0] != "chemical" or parts[2] != "patents":
+            return 404, {"error": "Not Found"}
+
+        hits = self.server.fixtures["patents"].get(parts[1], [])
+        page = int(parse_qs(url.query).get("page", ["1"])[0])
+        next_page = (
+            f"{self.server.url}/chemical/{parts[1]}/patents?page={page + 1}"
+            if page * PAGE_SIZE < len(hits)
+            else None
+        )
+
+        return 200, {
+            "total": len(hits),
+            "hits": hits[(page - 1) * PAGE_SIZE : page * PAGE_SIZE],
+            "next": next_page,
+        }
+
+
+class StandInServers:
+    """The stand-in servers of all backends, started in background threads."""
+
+    def __init__(
+        self,
+        fixtures: dict,
+        latency: Optional[Dict[str, float]] = None,
+        rate_limit: Optional[Dict[str, float]] = None,
+    ):
+        """Create the servers.
+
+        :param fixtures: Fixtures as returned by :func:`benchmarks.fixtures.make_fixtures`.
+        :param latency: Latency in seconds of each backend. Backends without latency answer right away.
+        :param rate_limit: Requests per second allowed by each backend. Backends without limit accept all requests.
+        """
+        latency = latency or {}
+        rate_limit = rate_limit or {}
+        self.servers = {
+            backend: StandInServer(
+                backend,
+                fixtures,
+                latency=latency.get(backend, 0.0),
+                rate_limit=rate_limit.get(backend),
+            )
+            for backend in BACKENDS
+        }
+        self.threads = []
+
+    @property
+    def environment(self) -> Dict[str, str]:
+        """Environment variables pointing PEMT at the servers."""
+        return {
+            "PEMT_MAPPER_URL": self.servers["github"].url,
+            "PEMT_CHEMBL_URL": self.servers["chembl"].url,
+            "PEMT_PUBCHEM_URL": self.servers["pubchem"].url,
+            "PEMT_SURECHEMBL_URL": self.servers["surechembl"].url,
+        }
+
+    @property
+    def counts(self) -> Dict[str, dict]:
+        """Number of requests, throttled requests and connections received by each server."""
+        return {
+            backend: dict(server.counts) for backend, server in self.servers.items()
+        }
+
+    def __enter__(self) -> "StandInServers":
+        for server in self.servers.values():
+            thread = threading.Thread(
+                target=server.serve_forever, args=(0.05,), daemon=True
+            )
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+        for thread in self.threads:
+            thread.join()
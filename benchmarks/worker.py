@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""Run the PEMT stages once against the stand-in servers and report their throughput.
+
+The worker runs in a fresh process with the environment pointing PEMT at the servers and at an empty data
+directory, so that every scale starts without cached files and its peak memory is its own.
+
+Usage: python -m benchmarks.worker <fixture file> <result file>
+"""
+
+import json
+import resource
+import sys
+import time
+from typing import Callable, Optional, Tuple
+from urllib.request import urlopen
+
+"""Name of the benchmarked analysis."""
+ANALYSIS_NAME = "benchmark"
+
+
+def _get_json(url: str):
+    """Get a JSON document."""
+    with urlopen(url) as response:
+        return json.load(response)
+
+
+def fetch_patent_hits(
+    schembl_id: str,
+    progress: Optional[dict] = None,
+    checkpoint: Optional[Callable[[dict], None]] = None,
+    **kwargs,
+) -> Tuple[set, int, bool]:
+    """Get the patent hits of a compound from the SureChEMBL stand-in.
+
+    It replaces :func:`pemt.patent_extractor.patent_enrichment.get_patent_hits`, whose Chrome browser cannot run
+    in a benchmark. The result pages are requested and checkpointed in the same way.
+    """
+    from pemt import client
+    from pemt.constants import SURECHEMBL_URL
+
+    if progress is None:
+        progress = {}
+
+    progress.setdefault("rows", [])
+    url = progress.get("url") or f"{SURECHEMBL_URL}/chemical/{schembl_id}/patents"
+
+    while url:
+        page = client.call("surechembl", _get_json, url)
+
+        progress["rows"].extend(page["hits"])
+        progress["total"] = page["total"]
+        progress["page"] = progress.get("page", 0) + 1
+        progress["url"] = url = page["next"]
+        progress["complete"] = url is None
+        if checkpoint is not None:
+            checkpoint(progress)
+
+    return set(tuple(row) for row in progress["rows"]), progress["total"], True
+
+
+def run(fixture_file: str) -> dict:
+    """Run the chemical extractor, the chemical harmonizer and the patent extractor on the genes of the fixtures.
+
+    :param fixture_file: Path of the fixtures served by the stand-in servers.
+    :returns: The number of items, seconds and throughput of each stage, the peak memory in MB and the requests
+        made to each backend.
+    """
+    from benchmarks.fixtures import load_fixtures
+    from pemt import metrics
+    from pemt.chemical_extractor.experimental_data_extraction import extract_chemicals
+    from pemt.patent_extractor import patent_enrichment
+    from pemt.patent_extractor.patent_chemical_harmonizer import (
+        ChemicalHarmonizer,
+        harmonize_chemicals,
+    )
+
+    patent_enrichment.get_patent_hits = fetch_patent_hits
+    genes = load_fixtures(fixture_file)["genes"]
+
+    metrics.reset()
+    seconds = {}
+
+    start = time.perf_counter()
+    gene_chemical_dict = extract_chemicals(
+        ANALYSIS_NAME, gene_list=genes, is_uniprot=True
+    )
+    seconds["chemicals"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    harmonize_chemicals(ANALYSIS_NAME)
+    seconds["harmonizer"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    patent_enrichment.extract_patent(ANALYSIS_NAME, chrome_driver_path="")
+    seconds["patents"] = time.perf_counter() - start
+
+    compounds = ChemicalHarmonizer(ANALYSIS_NAME).chemical_df["schembl_id"].dropna()
+    archives = [
+        patent_enrichment.load_patent_archive(schembl_id)
+        for schembl_id in compounds.unique()
+    ]
+    counts = {
+        "genes": len(gene_chemical_dict),
+        "chemicals": len(
+            {
+                chemical
+                for chemicals in gene_chemical_dict.values()
+                for chemical in chemicals
+            }
+        ),
+        "compounds": compounds.nunique(),
+        "patents": sum(len(hit_df) for hit_df in archives if hit_df is not None),
+    }
+
+    return {
+        "counts": counts,
+        "seconds": seconds,
+        "throughput": {
+            "genes/s": counts["genes"] / seconds["chemicals"],
+            "chemicals/s": counts["chemicals"] / seconds["harmonizer"],
+            "patents/s": counts["patents"] / seconds["patents"],
+        },
+        # The maximum resident set size is reported in kilobytes on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "requests": metrics.snapshot()["requests"],
+    }
+
+
+if __name__ == "__main__":
+    fixture_file, result_file = sys.argv[1:]
+    with open(result_file, "w") as f:
+        json.dump(run(fixture_file), f, indent=2)
@@ -4,12 +4,11 @@
 
 import logging
 import os
-import xml.etree.ElementTree as ET
 
 import pandas as pd
-from tqdm import tqdm
 
 from pemt.chemical_extractor.experimental_data_extraction import extract_chemicals
+from pemt.chemical_extractor.orphanet import read_orphanet_genes, read_prevalences
 from pemt.constants import PATENT_DIR
 from pemt.patent_extractor.patent_chemical_harmonizer import harmonize_chemicals
 from pemt.patent_extractor.patent_enrichment import extract_patent
@@ -23,24 +22,11 @@ def get_top_disease():
     """Get top 5 rare diseases based on the epidemiology found in Orphanet"""
 
     # Data available at http://www.orphadata.org/cgi-bin/epidemio.html
-    tree = ET.parse("orphanet_epidem_data.xml")
-    root = tree.getroot()
+    prevalences = read_prevalences("orphanet_epidem_data.xml")
 
-    orphanet_data = []
-
-    for disease_data in tqdm(root.find("DisorderList"), desc="Reading XML file"):
-        df_data = {}
-        for data in disease_data:
-            if data.tag == "OrphaCode":
-                df_data["orphanet id"] = data.text
-            elif data.tag == "Name":
-                df_data["name"] = data.text
-            elif data.tag == "PrevalenceList":
-                df_data["prevalence count"] = int(data.attrib.get("count"))
-
-        orphanet_data.append(df_data)
-
-    orphanet_df = pd.DataFrame(orphanet_data)
+    orphanet_df = pd.DataFrame(
+        prevalences.items(), columns=["orphanet id", "prevalence count"]
+    )
     orphanet_df.sort_values(by="prevalence count", ascending=False, inplace=True)
     orphanet_df.to_csv("epidemologic_distribution_orphanet.tsv", sep="\t", index=False)
 
@@ -48,38 +34,12 @@ def get_top_disease():
 def get_top_gene():
     """Get genes linked to top 5 diseases (based on epidemiological data)"""
 
-    top_diseases = pd.read_csv(
-        "epidemologic_distribution_orphanet.tsv", sep="\t", dtype=str
-    )
-
     # Data available at http://www.orphadata.org/cgi-bin/index.php
-    tree = ET.parse("orphanet_disgene_data.xml")
-    root = tree.getroot()
-
-    orphanet_genes = []
-
-    for disease_data in tqdm(root.find("DisorderList"), desc="Reading XML file"):
-        df_data = {}
-        for data in disease_data:
-            if data.tag == "OrphaCode":
-                df_data["orphanet id"] = data.text
-            elif data.tag == "Name":
-                df_data["name"] = data.text
-            elif data.tag == "DisorderGeneAssociationList":
-                for rel_data in data:
-                    for rel in rel_data:
-                        if rel.tag == "Gene":
-                            df_data["Symbol"] = rel.find("Symbol").text
-
-        orphanet_genes.append(df_data)
-
-    orphanet_gene_df = pd.DataFrame(orphanet_genes)
-
-    # Merge the data to add prelevance count to each row
-    gene_prelevance_df = orphanet_gene_df.merge(top_diseases, on="orphanet id")
-    gene_prelevance_df["prevalence count"] = gene_prelevance_df[
-        "prevalence count"
-    ].astype(int)
+    gene_prelevance_df = pd.DataFrame(
+        read_orphanet_genes(
+            "orphanet_disgene_data.xml", prevalence_file_path="orphanet_epidem_data.xml"
+        )
+    )
 
     # Sort column by prelevance
     gene_prelevance_df.sort_values(by="prevalence count", ascending=False, inplace=True)
@@ -115,20 +75,17 @@ def run_from_gene_pipeline(name: str, genes: list, os: str):
 def main():
     """Main function to demonstrate usecase of PEMT."""
 
-    if not os.path.exists("epidemologic_distribution_orphanet.tsv"):
-        get_top_disease()
-
     if not os.path.exists("orphanet_gene_by_prevelance.tsv"):
         get_top_gene()
 
     df = pd.read_csv(
         "orphanet_gene_by_prevelance.tsv",
         sep="\t",
-        usecols=["Symbol", "prevalence count"],
+        usecols=["symbol", "prevalence count"],
         dtype=str,
     )
     df = df[df["prevalence count"].astype(int) > 9]
-    gene_list = set(df["Symbol"].to_list())
+    gene_list = set(df["symbol"].dropna().to_list())
 
     run_from_gene_pipeline(name="rare disease", genes=list(gene_list), os="windows")
 
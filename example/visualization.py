@@ -4,16 +4,17 @@
 
 import json
 import os
-import xml.etree.ElementTree as ET
-from collections import defaultdict
 
 import matplotlib as mpl
 import matplotlib.pylab as plt
 import pandas as pd
 import seaborn as sns
-from tqdm import tqdm
 
+from pemt.analysis import chemicals_per_gene, summarize_patents
+from pemt.chemical_extractor.orphanet import read_disorder_genes
 from pemt.constants import DATA_DIR, MAPPER_DIR, PATENT_DIR
+from pemt.patent_extractor.assignee_normalizer import normalize_assignees
+from pemt.utils import attach_genes
 
 PLOT_DIR = f"{DATA_DIR}/plots"
 os.makedirs(PLOT_DIR, exist_ok=True)
@@ -34,13 +35,8 @@ def gene_chemical_analysis():
     chemicals = set(chemicals)
     print(f"Number of chemicals - {len(chemicals)}")
 
-    new_data = []
-    for gene, chemicals in tqdm(gene_dict.items()):
-        new_data.append({"gene": gene, "chemicals": len(chemicals)})
-
-    df = pd.DataFrame(new_data)
-    df.sort_values(by="chemicals", ascending=False, inplace=True)
-    df = df[df["chemicals"] > 0]
+    # Chemicals per gene, sorted by decreasing count and without the genes with none
+    df = chemicals_per_gene(gene_dict)
 
     # grid lines
     plt.figure(figsize=(12, 5))
@@ -87,41 +83,14 @@ def patent_analysis():
     )
     chemical_patent_df = chemical_patent_df[chemical_patent_df["patent_id"].notna()]
 
-    patents = set(chemical_patent_df["patent_id"].unique())
-
-    countries = defaultdict(int)
-    patent_position = defaultdict(int)
-
-    for patent in tqdm(patents):
-        country = patent.split("-")[0]
-        position = patent.split("-")[-1]
-        countries[country] += 1
-        patent_position[position] += 1
-
-    print(countries)
-    print(patent_position)
-
-    patent_year = defaultdict(set)
-    ipc_codes = defaultdict(set)
-    assignees = set()
+    summaries, num_patents = summarize_patents(chemical_patent_df)
 
-    for row in tqdm(chemical_patent_df.values):
-        (chemical_id, surechembl_id, patent_id, date, ipc, assignee) = row
+    print(f"Number of patents - {num_patents}")
+    print(summaries["country"])
+    print(summaries["kind"])
+    print(summaries["ipc_class"])
 
-        year = date.split("-")[0]
-        patent_year[year].add(patent_id)
-        code = ipc.split()[0]
-        ipc_codes[code].add(patent_id)
-        assignees.add(assignee)
-
-    patent_year = {year: len(patents) for year, patents in patent_year.items()}
-    ipc_codes = {ipc: len(patents) for ipc, patents in ipc_codes.items()}
-
-    print(ipc_codes)
-
-    year_df = pd.DataFrame(patent_year, index=[0]).transpose().reset_index()
-    year_df.columns = ["year", "count"]
-    year_df.sort_values(by="year", inplace=True)
+    year_df = summaries["year"].rename(columns={"patents": "count"})
 
     # grid lines
     plt.figure(figsize=(12, 5))
@@ -145,29 +114,9 @@ def patent_analysis():
 
 def orphanet_data_analysis():
     # Data available at http://www.orphadata.org/cgi-bin/index.php
-    tree = ET.parse("orphanet_disgene_data.xml")
-    root = tree.getroot()
-
-    orphanet_genes = []
-
-    for disease_data in tqdm(root.find("DisorderList"), desc="Reading XML file"):
-        df_data = {}
-        for data in disease_data:
-            if data.tag == "OrphaCode":
-                df_data["orphanet id"] = data.text
-            elif data.tag == "Name":
-                df_data["name"] = data.text
-            elif data.tag == "DisorderGeneAssociationList":
-                for rel_data in data:
-                    for rel in rel_data:
-                        if rel.tag == "Gene":
-                            df_data["Symbol"] = rel.find("Symbol").text
-
-        orphanet_genes.append(df_data)
-
-    orphanet_gene_df = pd.DataFrame(orphanet_genes)
+    orphanet_gene_df = pd.DataFrame(read_disorder_genes("orphanet_disgene_data.xml"))
     diseases = set(orphanet_gene_df["orphanet id"].tolist())
-    genes = set(orphanet_gene_df["Symbol"].tolist())
+    genes = set(orphanet_gene_df["symbol"].dropna().tolist())
 
     print(f"Orphanet has {len(diseases)} diseases and {len(genes)} genes.")
 
@@ -182,17 +131,7 @@ def gene_data_generator():
     # Genes chemical data
     gene_dict = json.load(open(f"{MAPPER_DIR}/rare disease_gene_to_chemicals.json"))
 
-    chemical_dict = defaultdict(set)
-
-    for gene, chemical_ids in tqdm(
-        gene_dict.items(), desc="Creating the chemical-gene dictionary"
-    ):
-        for chemical in chemical_ids:
-            chemical_dict[chemical].add(gene)
-
-    chemical_patent_df["genes"] = chemical_patent_df["chembl"].map(
-        lambda x: ", ".join(chemical_dict.get(x, []))
-    )
+    chemical_patent_df = attach_genes(chemical_patent_df, gene_dict)
 
     chemical_patent_df.to_csv(
         f"{PATENT_DIR}/gene_enumerated_patent_data.tsv", sep="\t", index=False
@@ -207,84 +146,8 @@ def assignee_analysis():
         usecols=["patent_id", "assignee"],
     )
 
-    assignee_dict = {
-        "COHEN FREDERICK": "Private",
-        "GENENTECH INC": "Industry",
-        "ARVINAS OPERATIONS INC": "Industry",
-        "CULLGEN SHANGHAI INC": "Industry",
-        "PORTER DALE": "Private",
-        "ARVINAS INC": "Industry",
-        "UNIV JOHNS HOPKINS": "Academia",
-        "WARNER LAMBERT CO": "Industry",
-        "THERAVANCE INC": "Industry",
-        "ADVANCED MEDICINE INC": "Industry",
-        "EISAI R&D MAN CO LTD": "Industry",
-        "THERAVANCE BIOPHARMA R&D IP, LLC": "Industry",
-        "ESAI R & D MAN CO LTD": "Industry",
-        "GRIFFIN JOHN H": "Private",
-        "US HEALTH": "Industry",
-        "IMCLONE SYSTEMS INC": "Industry",
-        "FUJIFILM CELLULAR DYNAMICS INC": "Industry",
-        "ALMAC DISCOVERY LTD": "Industry",
-        "SCHERING CORP": "Industry",
-        "WONG ALBERT J": "Private",
-        "INST QUIMIC DE SARRIA CETS FUNDACIO PRIVADA": "Academia",
-        "HILLAN KENNETH J": "Private",
-        "SESHAGIRI SOMASEKAR": "Private",
-        "AUCKLAND UNISERVICES LTD": "Academia",
-        "AXXIMA PHARMACEUTICALS AG": "Industry",
-        "BHIDE RAJEEV S": "Private",
-        "SQUIBB BRISTOL MYERS CO": "Industry",
-        "BRISTOL-MYERS SQUIBB COMPANY": "Industry",
-        "HOFFMANN LA ROCHE": "Industry",
-        "JANSSEN PHARMACEUTICA NV": "Industry",
-        "ALECTOS THERAPEUTICS INC": "Industry",
-        "ACADEMIA SINICA": "Academia",
-        "BAYER SCHERING PHARMA AG": "Industry",
-        "HARVARD COLLEGE": "Academia",
-        "VASCULAR BIOGENICS LTD": "Industry",
-        "YUAN JUNYING": "Private",
-        "PRENDERGAST GEORGE C": "Private",
-        "INST MEDIZINTECHNOLOGIE MAGDEB": "Academia",
-        "ELAN PHARM INC": "Industry",
-        "SEVERSON BILL": "Private",
-        "UNIV UTAH RES FOUND": "Academia",
-        "UNIV ROCHESTER": "Academia",
-        "FABIUS BIOTECHNOLOGY": "Industry",
-        "KANONCURE INC": "Industry",
-        "KADMON CORP LLC": "Industry",
-        "ABBOTT LABORATORIES": "Industry",
-        "ABBVIE INC.": "Industry",
-        "NOVARTIS AG": "Industry",
-        "CHAN HO MAN": "Private",
-        "BROGDON JENNIFER": "Private",
-        "CERO THERAPEUTICS INC": "Industry",
-        "ASHWELL MARK A": "Private",
-        "ARQULE INC": "Industry",
-        "UNIV PENNSYLVANIA": "Academia",
-        "ALI SYED M": "Private",
-        "CHIRON CORP": "Industry",
-        "ASTEX THERAPEUTICS LTD": "Industry",
-        "LEXICON PHARMACEUTICALS INC": "Industry",
-        "MANSFIELD ROBERT K": "Private",
-        "BUSCHMANN NICOLE": "Private",
-        "BLANCHARD STÉPHANIE": "Private",
-        "UNIV NEW YORK": "Academia",
-        "S BIO PTE LTD": "Industry",
-        "DESIGN THERAPEUTICS INC": "Industry",
-        "UNIV QUEENSLAND": "Academia",
-        "IND RES LTD": "Industry",
-        "EINSTEIN COLL MED": "Academia",
-        "ATHYRIUM OPPORTUNITIES III CO-INVEST 1 LP": "Industry",
-        "FURNEAUX RICHARD H": "Private",
-        "SINCLAIR DAVID A": "Private",
-        "VIFOR INT AG": "Industry",
-        "UNIV COLUMBIA": "Academia",
-        "UNIV BOSTON": "Academia",
-        "UNIV SOUTH FLORIDA": "Academia",
-    }
-
-    df["assignee_type"] = df["assignee"].map(assignee_dict)
+    # Merge the spellings of the assignees and classify them as Industry, Academia or Private
+    df = normalize_assignees(df)
 
     df.drop_duplicates(inplace=True)
 
@@ -1,3 +1,40 @@
 # -*- coding: utf-8 -*-
 
-"""A Python package for Patent EnrichMent Tool."""
+"""A Python package for Patent EnrichMent Tool.
+
+Importing PEMT has no side effects. The data directories are created by :func:`init`, which the command line
+interface and the extractors call before they write any file.
+"""
+
+import logging
+import os
+import threading
+from typing import Optional
+
+__all__ = ["init"]
+
+_initialized = False
+_init_lock = threading.Lock()
+
+
+def init(log_level: Optional[int] = None) -> None:
+    """Prepare PEMT to run. Calling it again does nothing, except changing the log level.
+
+    :param log_level: Level of the PEMT loggers, e.g. logging.INFO. By default, the level is left to the
+        application.
+    """
+    global _initialized
+
+    if log_level is not None:
+        logging.getLogger(__name__).setLevel(log_level)
+
+    with _init_lock:
+        if _initialized:
+            return
+
+        from pemt.constants import ARCHIVE_DIR, DATA_DIR, MAPPER_DIR, PATENT_DIR
+
+        for directory in (DATA_DIR, MAPPER_DIR, PATENT_DIR, ARCHIVE_DIR):
+            os.makedirs(directory, exist_ok=True)
+
+        _initialized = True
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""Summaries of the patents of an analysis.
+
+The patents are counted once per country, kind code, publication year, IPC class, assignee and gene, with string
+and groupby operations over whole columns. The patent data can be given as one table or as chunks, e.g. read from
+a file with :func:`pemt.tables.read_table_chunks`, to summarize tables larger than memory: between chunks, only the
+patents and gene-patent pairs already counted are kept, so that a patent linked to several chemicals is counted
+once.
+"""
+
+import logging
+import os
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from pemt.constants import PATENT_DIR, REPORT_DIR
+from pemt.id_store import as_gene_chemical_map
+
+logger = logging.getLogger(__name__)
+
+"""Dimensions the patents are counted by. Assignee types are only counted when the assignees are normalized."""
+SUMMARIES = (
+    "country",
+    "kind",
+    "year",
+    "ipc_class",
+    "assignee",
+    "assignee_type",
+    "gene",
+)
+
+
+def _first_seen(values: pd.Series, seen: set) -> np.ndarray:
+    """Mark the distinct values that are not in a set yet and add them to it."""
+    mask = np.fromiter(
+        (value not in seen for value in values), dtype=bool, count=len(values)
+    )
+    seen.update(values[mask])
+    return mask
+
+
+def gene_chemical_frame(gene_chemical_dict: Mapping[str, list]) -> pd.DataFrame:
+    """Get the distinct gene-chemical pairs of an analysis.
+
+    :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals.
+    :returns: Dataframe with a "gene" and a "chembl" column.
+    """
+    return as_gene_chemical_map(gene_chemical_dict).to_frame()
+
+
+def chemicals_per_gene(gene_chemical_dict: Mapping[str, list]) -> pd.DataFrame:
+    """Count the chemicals of every gene.
+
+    :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals.
+    :returns: Dataframe with a "gene" and a "chemicals" column, sorted by decreasing count. Genes without chemicals
+        are left out.
+    """
+    return (
+        gene_chemical_frame(gene_chemical_dict)
+        .groupby("gene")
+        .size()
+        .rename("chemicals")
+        .reset_index()
+        .sort_values(["chemicals", "gene"], ascending=[False, True], ignore_index=True)
+    )
+
+
+class PatentSummary:
+    """Counts of distinct patents by country, kind, year, IPC class, assignee and gene, accumulated over chunks."""
+
+    def __init__(
+        self,
+        gene_chemical_dict: Optional[Mapping[str, list]] = None,
+        normalize_assignees: bool = False,
+    ):
+        """Create an empty summary.
+
+        :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals. If given, the patents are
+            also counted per gene of their chemicals.
+        :param normalize_assignees: Boolean indicating whether the spellings of an assignee are counted together,
+            see :mod:`pemt.patent_extractor.assignee_normalizer`. The assignees are then also counted by type.
+        """
+        self.counts: Dict[str, pd.Series] = {}
+        self.num_rows = 0
+        self._patents = set()
+        self._gene_patents = set()
+        self._gene_df = (
+            None
+            if gene_chemical_dict is None
+            else gene_chemical_frame(gene_chemical_dict)
+        )
+        self._normalizer = None
+
+        if normalize_assignees:
+            from pemt.patent_extractor.assignee_normalizer import AssigneeNormalizer
+
+            self._normalizer = AssigneeNormalizer()
+
+    @property
+    def num_patents(self) -> int:
+        """Number of distinct patents counted so far."""
+        return len(self._patents)
+
+    def _count(self, dimension: str, values: pd.Series) -> None:
+        """Add the counts of the values of a dimension."""
+        counts = values.replace("", np.nan).value_counts()
+        if dimension in self.counts:
+            counts = self.counts[dimension].add(counts, fill_value=0)
+        self.counts[dimension] = counts
+
+    def add(self, patent_df: pd.DataFrame) -> None:
+        """Count the patents of a table or of a chunk of it that have not been counted yet.
+
+        :param patent_df: The wide patent data, see :meth:`pemt.patent_extractor.patent_store.PatentStore.to_wide`.
+            Rows without a patent are skipped.
+        """
+        patent_ids = patent_df["patent_id"].astype(object)
+        patent_df = patent_df[patent_ids.notna() & (patent_ids != "")]
+        self.num_rows += len(patent_df)
+
+        patents = patent_df.drop_duplicates("patent_id")
+        patents = patents[_first_seen(patents["patent_id"], self._patents)]
+
+        # Patent ids are <country>-<number>-<kind>, e.g. US-2010123456-A1
+        parts = patents["patent_id"].astype(str).str.split("-")
+        self._count("country", parts.str[0])
+        self._count("kind", parts.str[-1])
+        self._count(
+            "year",
+            pd.to_datetime(patents["date"], errors="coerce").dt.year.astype("Int64"),
+        )
+        self._count(
+            "ipc_class",
+            patents["ipc"].astype(object).fillna("").astype(str).str.split(n=1).str[0],
+        )
+
+        assignees = patents["assignee"].astype(object)
+        if self._normalizer is None:
+            self._count("assignee", assignees)
+        else:
+            decisions = self._normalizer.normalize(assignees.dropna().unique())
+            self._count(
+                "assignee",
+                assignees.map(
+                    {name: canonical for name, (canonical, _) in decisions.items()}
+                ),
+            )
+            self._count(
+                "assignee_type",
+                assignees.map({name: kind for name, (_, kind) in decisions.items()}),
+            )
+
+        if self._gene_df is not None:
+            gene_patents = (
+                patent_df[["chembl", "patent_id"]]
+                .drop_duplicates()
+                .merge(self._gene_df, on="chembl")[["gene", "patent_id"]]
+                .drop_duplicates()
+            )
+            keys = gene_patents["gene"] + "\t" + gene_patents["patent_id"].astype(str)
+            self._count(
+                "gene",
+                gene_patents["gene"][_first_seen(keys, self._gene_patents)],
+            )
+
+    def to_frames(self) -> Dict[str, pd.DataFrame]:
+        """Get the summaries as tables with the values of a dimension and their number of patents.
+
+        The years are sorted in order, the other dimensions by decreasing number of patents.
+        """
+        if self._normalizer is not None:
+            self._normalizer.save()
+
+        frames = {}
+        for dimension in SUMMARIES:
+            if dimension not in self.counts:
+                continue
+
+            frame = (
+                self.counts[dimension]
+                .astype(int)
+                .rename_axis(dimension)
+                .reset_index(name="patents")
+            )
+            if dimension == "year":
+                frame = frame.sort_values("year", ignore_index=True)
+            else:
+                frame = frame.sort_values(
+                    ["patents", dimension], ascending=[False, True], ignore_index=True
+                )
+            frames[dimension] = frame
+
+        return frames
+
+
+def summarize_patents(
+    patent_data: Union[pd.DataFrame, Iterable[pd.DataFrame]],
+    gene_chemical_dict: Optional[Mapping[str, list]] = None,
+    normalize_assignees: bool = False,
+) -> Tuple[Dict[str, pd.DataFrame], int]:
+    """Summarize patent data by country, kind, year, IPC class, assignee and gene.
+
+    :param patent_data: The wide patent data, or chunks of it.
+    :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals, to count the patents per gene.
+    :param normalize_assignees: Boolean indicating whether the spellings of an assignee are counted together.
+    :returns: The summaries, see :meth:`PatentSummary.to_frames`, and the number of distinct patents.
+    """
+    summary = PatentSummary(gene_chemical_dict, normalize_assignees)
+
+    for chunk in (
+        [patent_data] if isinstance(patent_data, pd.DataFrame) else patent_data
+    ):
+        summary.add(chunk)
+
+    return summary.to_frames(), summary.num_patents
+
+
+def write_report(
+    analysis_name: str,
+    table_format: str = "tsv",
+    chunk_size: Optional[int] = None,
+    with_genes: bool = True,
+    normalize_assignees: bool = False,
+) -> Tuple[Dict[str, pd.DataFrame], List[str]]:
+    """Summarize the patents of an analysis and write the summaries as TSV files under data/reports.
+
+    :param analysis_name: Name of the analysis.
+    :param table_format: Format the patent data of the analysis was written in.
+    :param chunk_size: Number of rows of patent data read at a time. By default, it is read at once.
+    :param with_genes: Boolean indicating whether the patents are counted per gene.
+    :param normalize_assignees: Boolean indicating whether the spellings of an assignee are counted together.
+    :returns: The summaries and the paths of the written files.
+    :raises FileNotFoundError: If the analysis has no patent data.
+    """
+    from pemt.chemical_extractor.experimental_data_extraction import (
+        load_gene_chemicals,
+    )
+    from pemt.tables import (
+        file_format,
+        find_table,
+        read_table,
+        read_table_chunks,
+        write_table,
+    )
+
+    file_path = find_table(
+        f"{PATENT_DIR}/cleaned_{analysis_name}_patent_data", file_format(table_format)
+    )
+    if file_path is None:
+        raise FileNotFoundError(f"There is no patent data for {analysis_name}")
+
+    patent_data = (
+        read_table(file_path)
+        if chunk_size is None
+        else read_table_chunks(file_path, chunk_size)
+    )
+    gene_chemical_dict = (
+        load_gene_chemicals(analysis_name, table_format) if with_genes else None
+    )
+    summaries, num_patents = summarize_patents(
+        patent_data, gene_chemical_dict or None, normalize_assignees
+    )
+    if gene_chemical_dict:
+        summaries["gene_chemicals"] = chemicals_per_gene(gene_chemical_dict)
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    output_files = [
+        write_table(frame, f"{REPORT_DIR}/{analysis_name}_{dimension}")
+        for dimension, frame in summaries.items()
+    ]
+
+    logger.info(f"Summarized {num_patents} patents of {analysis_name}")
+    return summaries, output_files
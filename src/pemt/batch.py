@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+"""Running PEMT for several analyses in one process.
+
+The target mappers and the ChEMBL to SureChEMBL mapper are loaded once for all analyses. Genes, chemicals and
+compounds shared by several analyses are looked up only once: each stage works through the deduplicated items
+of all analyses and then records the results in the files of every analysis that needs them.
+"""
+
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List
+
+import pandas as pd
+from tqdm import tqdm
+
+from pemt import init, metrics
+from pemt.chemical_extractor.experimental_data_extraction import (
+    get_target,
+    load_gene_chemicals,
+    load_target_mappers,
+    read_proteins,
+    save_gene_chemicals,
+    target_to_chemical,
+)
+from pemt.patent_extractor.patent_chemical_harmonizer import ChemicalHarmonizer
+from pemt.patent_extractor.patent_enrichment import (
+    PatentExtractor,
+    export_patent_data,
+)
+
+logger = logging.getLogger(__name__)
+
+BATCH_COLUMNS = ["name", "data", "input_type", "uniprot"]
+
+
+def read_batch_file(file_path: str) -> List[dict]:
+    """Read the analyses of a batch.
+
+    The tab-separated file has a "name" and a "data" column with the name and gene file of each analysis. The
+    optional "input_type" and "uniprot" columns give the separator of the gene file (comma by default) and whether
+    it has UniProt identifiers (true by default). Relative gene file paths are relative to the batch file.
+
+    :param file_path: Path of the batch file.
+    """
+    df = pd.read_csv(file_path, sep="\t", dtype=str)
+
+    if not {"name", "data"}.issubset(df.columns):
+        raise ValueError(
+            f'Please ensure that the batch file has a "name" and a "data" column'
+        )
+
+    if df["name"].duplicated().any():
+        raise ValueError(
+            f"Duplicate analysis names in the batch file: {', '.join(df['name'][df['name'].duplicated()])}"
+        )
+
+    df = df.reindex(columns=BATCH_COLUMNS)
+    df["input_type"] = df["input_type"].fillna("comma")
+    df["uniprot"] = ~df["uniprot"].fillna("true").str.lower().isin(["false", "no", "0"])
+
+    directory = os.path.dirname(os.path.abspath(file_path))
+    df["data"] = [os.path.join(directory, data_path) for data_path in df["data"]]
+
+    return df.to_dict("records")
+
+
+@metrics.stage("chemicals")
+def _extract_chemicals(
+    analyses: List[dict], table_format: str = "tsv"
+) -> Dict[str, dict]:
+    """Extract the chemicals of the genes of all analyses, looking up every gene once."""
+    chembl_mapper, hgnc_mapper = load_target_mappers()
+
+    gene_chemicals = {}
+    targets = {}
+    proteins = {}
+
+    for analysis in analyses:
+        gene_chemical_dict = load_gene_chemicals(analysis["name"], table_format)
+        gene_chemicals[analysis["name"]] = gene_chemical_dict
+
+        # Genes extracted earlier for any analysis are re-used by all of them
+        for identifier, chemicals in gene_chemical_dict.items():
+            targets.setdefault((identifier, analysis["uniprot"]), chemicals)
+
+        proteins[analysis["name"]] = read_proteins(
+            gene_file_path=analysis["data"],
+            file_separator=analysis["input_type"],
+            is_uniprot=analysis["uniprot"],
+        )
+
+    for analysis in analyses:
+        for identifier in proteins[analysis["name"]]:
+            metrics.cache("genes", hit=(identifier, analysis["uniprot"]) in targets)
+
+    missing = list(
+        dict.fromkeys(
+            (identifier, analysis["uniprot"])
+            for analysis in analyses
+            for identifier in proteins[analysis["name"]]
+            if (identifier, analysis["uniprot"]) not in targets
+        )
+    )
+
+    chembl_targets = {}
+    for identifier, is_uniprot in tqdm(
+        missing, desc="Extracting chemicals for targets"
+    ):
+        targets[(identifier, is_uniprot)] = target_to_chemical(
+            protein=identifier,
+            protein_mapping=hgnc_mapper,
+            chemical_mapping=chembl_mapper,
+            is_uniprot=is_uniprot,
+        )
+        chembl_targets[(identifier, is_uniprot)] = get_target(
+            protein=identifier,
+            protein_mapping=hgnc_mapper,
+            chemical_mapping=chembl_mapper,
+            is_uniprot=is_uniprot,
+        )
+
+    for analysis in analyses:
+        gene_chemical_dict = gene_chemicals[analysis["name"]]
+        for identifier in proteins[analysis["name"]]:
+            gene_chemical_dict[identifier] = targets[(identifier, analysis["uniprot"])]
+
+        save_gene_chemicals(
+            analysis["name"],
+            gene_chemical_dict,
+            table_format,
+            {
+                identifier: chembl_targets.get((identifier, analysis["uniprot"]))
+                for identifier in proteins[analysis["name"]]
+            },
+        )
+
+    return gene_chemicals
+
+
+@metrics.stage("harmonizer")
+def _harmonize_chemicals(
+    gene_chemicals: Dict[str, dict], table_format: str
+) -> Dict[str, ChemicalHarmonizer]:
+    """Harmonize the chemicals of all analyses, mapping every chemical once."""
+    harmonizers = {
+        name: ChemicalHarmonizer(name, table_format=table_format)
+        for name in gene_chemicals
+    }
+
+    # Chemicals harmonized earlier for any analysis are re-used by all of them
+    resolved = {}
+    for harmonizer in harmonizers.values():
+        for chembl_id, row in harmonizer.chemicals.items():
+            if not pd.isna(row["schembl_id"]):
+                resolved.setdefault(chembl_id, (row["schembl_id"], row["name"]))
+
+    owners = defaultdict(list)
+    for name, gene_chemical_dict in gene_chemicals.items():
+        for chemicals in gene_chemical_dict.values():
+            for chembl_id in chemicals:
+                if name not in owners[chembl_id]:
+                    owners[chembl_id].append(name)
+
+    for chembl_id, names in tqdm(
+        owners.items(), desc="Harmonizing chemicals for patent retrieval"
+    ):
+        if chembl_id not in resolved:
+            harmonizer = harmonizers[names[0]]
+            resolved[chembl_id] = (
+                harmonizer.harmonize(chembl_id),
+                harmonizer.chemical_names[chembl_id],
+            )
+
+        surechembl_id, chemical_name = resolved[chembl_id]
+
+        for name in names:
+            harmonizer = harmonizers[name]
+            cached = harmonizer.chemicals.get(chembl_id)
+
+            if surechembl_id is None:
+                harmonizer.chemical_names.setdefault(chembl_id, chemical_name)
+            elif cached is None or pd.isna(cached["schembl_id"]):
+                harmonizer.add(chembl_id, surechembl_id, chemical_name)
+
+    for harmonizer in harmonizers.values():
+        harmonizer.save(drop_unmapped=True)
+
+    return harmonizers
+
+
+def run_batch(
+    analyses: List[dict],
+    chrome_driver_path: str,
+    os_system: str = "linux",
+    patent_year: int = 2000,
+    table_format: str = "tsv",
+) -> Dict[str, List[str]]:
+    """Run the three PEMT stages for several analyses.
+
+    :param analyses: The analyses, as read by :func:`read_batch_file`.
+    :param chrome_driver_path: The path of the chrome driver is located.
+    :param os_system: The OS on which the code is running. It can be either of these: linux, mac, window.
+    :param patent_year: The cutt-off year for searching the patent documents
+    :param table_format: Format of the chemical and patent tables. It can be either of these: tsv, parquet, feather.
+    :returns: The patent files written for each analysis. Analyses without patents have no files.
+    """
+    init()
+
+    gene_chemicals = _extract_chemicals(analyses, table_format)
+    harmonizers = _harmonize_chemicals(gene_chemicals, table_format)
+
+    extractors = {
+        name: PatentExtractor(
+            analysis_name=name,
+            chrome_driver_path=chrome_driver_path,
+            os_system=os_system,
+            patent_year=patent_year,
+            table_format=table_format,
+        )
+        for name in harmonizers
+    }
+
+    compounds = defaultdict(list)
+    for name, harmonizer in harmonizers.items():
+        for chembl_id, surechembl_id in (
+            harmonizer.chemical_df[["chembl", "schembl_id"]].dropna().values
+        ):
+            compounds[surechembl_id].append((name, chembl_id))
+
+    try:
+        with metrics.stage("patents"):
+            for surechembl_id, users in tqdm(
+                compounds.items(), desc="Extracting patents for compounds"
+            ):
+                # The hits of a compound are scraped or read from the archive once for all analyses
+                hit_df = None
+                for name, chembl_id in users:
+                    hit_df = extractors[name].extract(chembl_id, surechembl_id, hit_df)
+    except BaseException:
+        for extractor in extractors.values():
+            extractor.store.save()
+        raise
+
+    patent_files = {}
+    for name, extractor in extractors.items():
+        patent_df = extractor.close()
+
+        if patent_df.empty:
+            logger.warning(f"No patents found for {name}")
+            patent_files[name] = []
+            continue
+
+        patent_files[name] = export_patent_data(
+            analysis_name=name,
+            patent_df=patent_df,
+            gene_chemical_dict=gene_chemicals[name],
+            table_format=table_format,
+        )
+
+    return patent_files
@@ -5,27 +5,98 @@
 import json
 import logging
 import os
-from collections import defaultdict
-from typing import List
+from typing import Awaitable, Dict, List, Mapping, Optional, Tuple
 
 import pandas as pd
-from chembl_webresource_client.new_client import new_client
 from tqdm import tqdm
 
-from pemt.constants import MAPPER_DIR
+from pemt import client, init, metrics
+from pemt.constants import CHEMBL_URL, MAPPER_DIR, MAPPER_URL, WORKSPACE_FORMAT
+from pemt.id_store import GeneChemicalMap, as_gene_chemical_map
+from pemt.sharding import Shard, in_shard, shard_name
 from pemt.utils import hgnc_to_chembl, uniprot_to_chembl
+from pemt.workspace import get_workspace, workspace_exists
 
 logger = logging.getLogger(__name__)
 
-# Change logging level for packages
-chembl_logger = logging.getLogger("chembl_webresource_client")
-chembl_logger.setLevel(logging.WARNING)
+"""Number of activities requested from ChEMBL at once, the most its web services allow."""
+CHEMBL_PAGE_SIZE = 1000
 
-activity = new_client.activity
+"""Number of newly extracted genes after which the gene to chemical mapping is saved."""
+CHECKPOINT_GENES = 50
 
-tqdm.pandas()
 
-os.makedirs(MAPPER_DIR, exist_ok=True)
+def _activity_params(target_chembl: str) -> dict:
+    """Get the query of the first page of the activities of a ChEMBL target."""
+    return {
+        "target_chembl_id": target_chembl,
+        "assay_type_iregex": "(B|F)",
+        "only": "pchembl_value,molecule_chembl_id",
+        "limit": CHEMBL_PAGE_SIZE,
+        "offset": 0,
+    }
+
+
+def get_activities(target_chembl: str) -> List[dict]:
+    """Get the pChEMBL values and molecules of the binding and functional assays of a ChEMBL target.
+
+    A page that ChEMBL does not find, e.g. of an unknown target, has no activities.
+
+    :param target_chembl: ChEMBL identifier of the target.
+    """
+    params = _activity_params(target_chembl)
+    activities = []
+
+    while True:
+        page = client.fetch_json(
+            "chembl", "GET", f"{CHEMBL_URL}/activity.json", params=params
+        )
+        if page is None:
+            return activities
+
+        activities.extend(page["activities"])
+        params["offset"] += len(page["activities"])
+
+        if (
+            not page["activities"]
+            or params["offset"] >= page["page_meta"]["total_count"]
+        ):
+            return activities
+
+
+async def get_activities_async(target_chembl: str) -> List[dict]:
+    """Get the activities of a ChEMBL target from an event loop, see :func:`get_activities`.
+
+    Once the first page tells the number of activities, the other pages are requested concurrently, a window of
+    them at a time, see :func:`pemt.client.map_async`.
+
+    :param target_chembl: ChEMBL identifier of the target.
+    """
+    url = f"{CHEMBL_URL}/activity.json"
+    params = _activity_params(target_chembl)
+
+    page = await client.fetch_json_async("chembl", "GET", url, params=params)
+    if page is None:
+        return []
+
+    activities = list(page["activities"])
+    if not activities:
+        return activities
+
+    async def fetch_page(offset: int) -> dict:
+        return await client.fetch_json_async(
+            "chembl", "GET", url, params={**params, "offset": offset}
+        )
+
+    pages = client.map_async(
+        fetch_page,
+        range(len(activities), page["page_meta"]["total_count"], len(activities)),
+        client.task_window("chembl"),
+    )
+    async for _, page in pages:
+        if page is not None:
+            activities.extend(page["activities"])
+    return activities
 
 
 def get_chemical_overview(file_path: str) -> None:
@@ -33,21 +104,44 @@ def get_chemical_overview(file_path: str) -> None:
 
     :param file_path: Path of the JSON file storing the gene and chemical information.
     """
-    gene_chemical_dict = json.load(open(file_path))
-
-    counter_dict = defaultdict(int)
+    _log_chemical_overview(json.load(open(file_path)))
 
-    for gene, counter in tqdm(gene_chemical_dict.items()):
-        counter_dict[gene] += len(counter)
 
-    counter_dict = dict(
-        sorted(counter_dict.items(), key=lambda item: item[1], reverse=True)
+def _log_chemical_overview(gene_chemical_dict: Mapping[str, List[str]]) -> None:
+    """Report the number of genes without chemicals."""
+    num_genes = int((as_gene_chemical_map(gene_chemical_dict).sizes() == 0).sum())
+    logger.warning(
+        f"{num_genes} genes found with no relevant chemical bioassay information."
     )
 
-    df = pd.DataFrame(counter_dict, index=[0]).transpose()
-    value_count_dict = df[0].value_counts().to_dict()
-    logger.warning(
-        f"{value_count_dict[0]} genes found with no relevant chemical bioassay information."
+
+def get_target(
+    chemical_mapping: dict,
+    protein: str,
+    protein_mapping: dict = None,
+    is_uniprot: bool = False,
+) -> Optional[str]:
+    """Get the ChEMBL target of a protein.
+
+    :param chemical_mapping: A dictionary mapping the UNIPROT identifiers to ChEMBL identifiers
+    :param protein: The protein name or identifier
+    :param protein_mapping: A dictionary mapping the HGNC symbols to UNIPROT identifiers.
+    :param is_uniprot: Boolean indicating whether the protein is an HGNC symbol or UNIPROT identifier.
+    """
+    if is_uniprot:
+        return uniprot_to_chembl(chemical_mapper=chemical_mapping, uniprot_id=protein)
+
+    try:
+        assert protein_mapping is not None
+    except AssertionError:
+        raise ValueError(
+            f"HGNC symbol given without passing the HGNC to UNIPROT mapping file. \
+        Either pass the mapping file to hgnc_mapping variable or set the parameter is_uniprot=True"
+        )
+    return hgnc_to_chembl(
+        uniprot_mapper=protein_mapping,
+        chemical_mapper=chemical_mapping,
+        hgnc_symbol=protein,
     )
 
 
@@ -68,33 +162,48 @@ def target_to_chemical(
     If using UniProt ids for protein, set the value to "True" and the protein_mapping parameter can be omitted.
     If using HGNC symbols, then the protein mapping dictionary needs to be provided.
     """
-    chemicals = []
+    target_chembl = get_target(
+        chemical_mapping=chemical_mapping,
+        protein=protein,
+        protein_mapping=protein_mapping,
+        is_uniprot=is_uniprot,
+    )
 
-    if not is_uniprot:
-        try:
-            assert protein_mapping is not None
-        except AssertionError:
-            raise ValueError(
-                f"HGNC symbol given without passing the HGNC to UNIPROT mapping file. \
-            Either pass the mapping file to hgnc_mapping variable or set the parameter is_uniprot=True"
-            )
-        target_chembl = hgnc_to_chembl(
-            uniprot_mapper=protein_mapping,
-            chemical_mapper=chemical_mapping,
-            hgnc_symbol=protein,
-        )
-    else:
-        target_chembl = uniprot_to_chembl(
-            chemical_mapper=chemical_mapping, uniprot_id=protein
-        )
+    if not target_chembl:
+        return []
+
+    return _active_chemicals(get_activities(target_chembl))
+
+
+async def target_to_chemical_async(
+    chemical_mapping: dict,
+    protein: str,
+    protein_mapping: dict = None,
+    is_uniprot: bool = False,
+) -> List[dict]:
+    """Retrieve the bioactive chemicals of a protein from an event loop, see :func:`target_to_chemical`.
+
+    :param chemical_mapping: A dictionary mapping the UNIPROT identifiers to ChEMBL identifiers
+    :param protein: The protein name or identifier
+    :param protein_mapping: A dictionary mapping the HGNC symbols to UNIPROT identifiers.
+    :param is_uniprot: Boolean indicating whether the protein is an HGNC symbol or UNIPROT identifier.
+    """
+    target_chembl = get_target(
+        chemical_mapping=chemical_mapping,
+        protein=protein,
+        protein_mapping=protein_mapping,
+        is_uniprot=is_uniprot,
+    )
 
     if not target_chembl:
-        return chemicals
+        return []
+
+    return _active_chemicals(await get_activities_async(target_chembl))
+
 
-    prot_activity_data = activity.filter(
-        target_chembl_id=target_chembl,
-        assay_type_iregex="(B|F)",
-    ).only(["pchembl_value", "molecule_chembl_id"])
+def _active_chemicals(prot_activity_data: List[dict]) -> List[str]:
+    """Get the molecules of the activities with a pChEMBL value of at least 6."""
+    chemicals = []
 
     if len(prot_activity_data) < 1:
         return chemicals
@@ -116,29 +225,13 @@ def target_to_chemical(
     return chemicals
 
 
-def extract_chemicals(
-    analysis_name: str,
-    gene_list: list = None,
-    gene_file_path: str = None,
-    file_separator: str = "comma",
-    is_uniprot: bool = False,
-    chembl_version: str = "30",
-):
-    """Enrich genes with chemical data from CheMBL bioassays.
-
-    :param analysis_name: The name of the analysis you want to run. This name would be used to save the resultant file
-    :param gene_list: The list of gene you want to extract chemicals for.
-    :param gene_file_path: The path of the gene file
-    :param file_separator: The separator used within the file. This can be 'comma', 'tab', or 'semicolon'.  By default,
-    the file separator is set to csv.
-    :param is_uniprot: A boolean value indicating whether the given gene list or file containing uniprot ids or HGNC
-    symbols. By default, the value is set to False indicating that a "symbol" column is present with the respective
-    HGNC symbols. If set to True, the file with "uniprot" column is expected.
-    """
-
+def load_target_mappers() -> Tuple[Dict[str, str], Dict[str, str]]:
+    """Load the mappers from UniProt identifiers to ChEMBL targets and from HGNC symbols to UniProt identifiers."""
     # Load chembl target mapper files
-    chembl_mapper = pd.read_csv(
-        "https://raw.githubusercontent.com/Fraunhofer-ITMP/PEMT/main/data/mapper/chembl_uniprot_mapping.txt",
+    chembl_mapper = client.call(
+        "github",
+        pd.read_csv,
+        f"{MAPPER_URL}/chembl_uniprot_mapping.txt",
         dtype=str,
         skiprows=1,
         sep="\t",
@@ -148,53 +241,211 @@ def extract_chemicals(
     chembl_mapper.set_index("uniprot", inplace=True)
     chembl_mapper = chembl_mapper.to_dict()["chembl_id"]
 
-    hgnc_mapper = pd.read_csv(
-        "https://raw.githubusercontent.com/Fraunhofer-ITMP/PEMT/main/data/mapper/hgnc_mapper.tsv",
+    hgnc_mapper = client.call(
+        "github",
+        pd.read_csv,
+        f"{MAPPER_URL}/hgnc_mapper.tsv",
         sep="\t",
         index_col="Approved symbol",
     ).to_dict()["UniProt ID(supplied by UniProt)"]
 
-    # Loop to get and store the genes-chemical information from ChEMBL
-    if os.path.exists(f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json"):
-        gene_chemical_dict = json.load(
-            open(f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json")
-        )
-    else:
-        gene_chemical_dict = defaultdict()
+    return chembl_mapper, hgnc_mapper
 
-    new_count = 0
+
+def read_proteins(
+    gene_list: list = None,
+    gene_file_path: str = None,
+    file_separator: str = "comma",
+    is_uniprot: bool = False,
+) -> list:
+    """Get the proteins of interest from a list or a gene file.
+
+    :param gene_list: The list of gene you want to extract chemicals for.
+    :param gene_file_path: The path of the gene file, or of the Orphanet gene dump (en_product6.xml), see
+        :mod:`pemt.chemical_extractor.orphanet`.
+    :param file_separator: The separator used within the file. This can be 'comma', 'tab', or 'semicolon'.
+    :param is_uniprot: A boolean value indicating whether the file has a "uniprot" or a "symbol" column.
+    """
+    if not gene_file_path:
+        return gene_list
+
+    if gene_file_path.endswith(".xml"):
+        from pemt.chemical_extractor.orphanet import orphanet_gene_list
+
+        return orphanet_gene_list(gene_file_path, is_uniprot=is_uniprot)
 
     # Extract the gene
-    if file_separator == "comma":
+    if file_separator in ("comma", ","):
         _separator = ","
-    elif file_separator == "semicolon":
+    elif file_separator in ("semicolon", ";"):
         _separator = ";"
     else:
-        assert file_separator == "tab"
+        assert file_separator in ("tab", "\t")
         _separator = "\t"
 
-    if gene_file_path:
-        df = pd.read_csv(gene_file_path, sep=_separator)
-        if is_uniprot:
-            if "uniprot" not in list(df.columns):
-                raise ValueError(
-                    f'Please rename columns to : "uniprot" in case of uniprot id or "symbol" in case of HGNC symbols'
-                )
-        elif not is_uniprot:
-            if "symbol" not in list(df.columns):
-                raise ValueError(
-                    f'Please rename columns to : "uniprot" in case of uniprot id or "symbol" in case of HGNC symbols'
-                )
+    df = pd.read_csv(gene_file_path, sep=_separator)
+    column = "uniprot" if is_uniprot else "symbol"
+
+    if column not in list(df.columns):
+        raise ValueError(
+            f'Please rename columns to : "uniprot" in case of uniprot id or "symbol" in case of HGNC symbols'
+        )
+
+    # Keep the order of the file while removing duplicates
+    return list(dict.fromkeys(df[column].tolist()))
+
+
+def gene_chemicals_path(analysis_name: str) -> str:
+    """Get the path of the JSON file with the gene to chemical mapping of an analysis.
+
+    :param analysis_name: The name of the analysis.
+    """
+    return f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json"
+
+
+def has_gene_chemicals(analysis_name: str, table_format: str = "tsv") -> bool:
+    """Check whether the chemicals of the genes of an analysis have been extracted before.
+
+    :param analysis_name: The name of the analysis.
+    :param table_format: Format of the analysis. With "sqlite", the mapping is looked up in its workspace.
+    """
+    if table_format == WORKSPACE_FORMAT:
+        return workspace_exists(analysis_name) and get_workspace(
+            analysis_name
+        ).has_stage("chemicals")
+
+    return os.path.exists(gene_chemicals_path(analysis_name))
+
+
+def load_gene_chemicals(
+    analysis_name: str, table_format: str = "tsv"
+) -> GeneChemicalMap:
+    """Load the gene to chemical mapping of an analysis, if it has been extracted before.
+
+    :param analysis_name: The name of the analysis.
+    :param table_format: Format of the analysis. With "sqlite", the mapping is read from its workspace.
+    :returns: The mapping, with the identifiers interned, see :class:`pemt.id_store.GeneChemicalMap`. It is
+        empty if the mapping has not been extracted yet.
+    """
+    if not has_gene_chemicals(analysis_name, table_format):
+        return GeneChemicalMap()
+
+    if table_format == WORKSPACE_FORMAT:
+        return get_workspace(analysis_name).load_gene_chemicals()
+
+    with open(gene_chemicals_path(analysis_name)) as f:
+        return GeneChemicalMap(json.load(f))
+
+
+def save_gene_chemicals(
+    analysis_name: str,
+    gene_chemical_dict: Mapping[str, List[str]],
+    table_format: str = "tsv",
+    targets: Optional[Dict[str, Optional[str]]] = None,
+) -> None:
+    """Save the gene to chemical mapping of an analysis for re-use.
+
+    :param analysis_name: The name of the analysis.
+    :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals.
+    :param table_format: Format of the analysis. With "sqlite", only the genes that are not in the workspace yet
+        are written, together with their ChEMBL target if given.
+    :param targets: Dictionary mapping genes to their ChEMBL target.
+    """
+    if table_format == WORKSPACE_FORMAT:
+        get_workspace(analysis_name).add_gene_chemicals(gene_chemical_dict, targets)
+        return
+
+    with open(gene_chemicals_path(analysis_name), "w") as f:
+        json.dump(dict(gene_chemical_dict.items()), f, ensure_ascii=False, indent=2)
 
-    if gene_file_path and _separator and is_uniprot:
-        proteins = set(pd.read_csv(gene_file_path, sep=_separator)["uniprot"].tolist())
-    elif gene_file_path and _separator and not is_uniprot:
-        proteins = set(pd.read_csv(gene_file_path, sep=_separator)["symbol"].tolist())
-    else:
-        proteins = gene_list
+
+def _extraction_inputs(
+    analysis_name: str,
+    gene_list: list,
+    gene_file_path: str,
+    file_separator: str,
+    is_uniprot: bool,
+    shard: Optional[Shard],
+    table_format: str,
+) -> Tuple[Dict[str, str], Dict[str, str], GeneChemicalMap, List[str]]:
+    """Load the target mappers, the genes extracted before and the genes of an analysis that are in a shard."""
+    chembl_mapper, hgnc_mapper = load_target_mappers()
+
+    # Loop to get and store the genes-chemical information from ChEMBL
+    gene_chemical_dict = load_gene_chemicals(analysis_name, table_format)
+
+    proteins = read_proteins(
+        gene_list=gene_list,
+        gene_file_path=gene_file_path,
+        file_separator=file_separator,
+        is_uniprot=is_uniprot,
+    )
+    proteins = [identifier for identifier in proteins if in_shard(identifier, shard)]
+
+    return chembl_mapper, hgnc_mapper, gene_chemical_dict, proteins
+
+
+@metrics.stage("chemicals")
+def extract_chemicals(
+    analysis_name: str,
+    gene_list: list = None,
+    gene_file_path: str = None,
+    file_separator: str = "comma",
+    is_uniprot: bool = False,
+    chembl_version: str = "30",
+    shard: Optional[Shard] = None,
+    table_format: str = "tsv",
+    use_async: bool = False,
+):
+    """Enrich genes with chemical data from CheMBL bioassays.
+
+    :param analysis_name: The name of the analysis you want to run. This name would be used to save the resultant file
+    :param gene_list: The list of gene you want to extract chemicals for.
+    :param gene_file_path: The path of the gene file, or of the Orphanet gene dump (en_product6.xml).
+    :param file_separator: The separator used within the file. This can be 'comma', 'tab', or 'semicolon'.  By default,
+    the file separator is set to csv.
+    :param is_uniprot: A boolean value indicating whether the given gene list or file containing uniprot ids or HGNC
+    symbols. By default, the value is set to False indicating that a "symbol" column is present with the respective
+    HGNC symbols. If set to True, the file with "uniprot" column is expected.
+    :param shard: The (index, count) of the shard to run, see :mod:`pemt.sharding`. Only the genes of the shard are
+    processed and the results are saved under the name of the shard.
+    :param table_format: Format of the analysis. With "sqlite", the genes are stored in its workspace together with
+    their ChEMBL target.
+    :param use_async: Boolean indicating whether the genes are extracted concurrently by
+    :func:`extract_chemicals_async` in an event loop of its own.
+    """
+    init()
+
+    if use_async:
+        return client.run_async(
+            _extract_chemicals_async(
+                analysis_name,
+                gene_list,
+                gene_file_path,
+                file_separator,
+                is_uniprot,
+                shard,
+                table_format,
+            )
+        )
+
+    analysis_name = shard_name(analysis_name, shard)
+    chembl_mapper, hgnc_mapper, gene_chemical_dict, proteins = _extraction_inputs(
+        analysis_name,
+        gene_list,
+        gene_file_path,
+        file_separator,
+        is_uniprot,
+        shard,
+        table_format,
+    )
+    targets = {}
+
+    new_count = 0
 
     # Loop to get chemicals related to target
     for identifier in tqdm(proteins, desc="Extracting chemicals for targets"):
+        metrics.cache("genes", hit=identifier in gene_chemical_dict)
         if identifier in gene_chemical_dict:
             continue
 
@@ -207,18 +458,140 @@ def extract_chemicals(
             is_uniprot=is_uniprot,
         )
         gene_chemical_dict[identifier] = chemical_list
+        targets[identifier] = get_target(
+            protein=identifier,
+            protein_mapping=hgnc_mapper,
+            chemical_mapping=chembl_mapper,
+            is_uniprot=is_uniprot,
+        )
 
-        if new_count == 50:
-            with open(f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json", "w") as f:
-                json.dump(gene_chemical_dict, f, ensure_ascii=False, indent=2)
+        if new_count == CHECKPOINT_GENES:
+            save_gene_chemicals(
+                analysis_name, gene_chemical_dict, table_format, targets
+            )
             new_count = 0
 
     # Save dict for re-use
-    if new_count > 0:
-        with open(f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json", "w") as f:
-            json.dump(gene_chemical_dict, f, ensure_ascii=False, indent=2)
+    if new_count > 0 or not has_gene_chemicals(analysis_name, table_format):
+        save_gene_chemicals(analysis_name, gene_chemical_dict, table_format, targets)
 
     # Get genes with no chemical hits
-    get_chemical_overview(f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json")
+    _log_chemical_overview(gene_chemical_dict)
 
     return gene_chemical_dict
+
+
+async def _extract_chemicals_async(
+    analysis_name: str,
+    gene_list: list,
+    gene_file_path: str,
+    file_separator: str,
+    is_uniprot: bool,
+    shard: Optional[Shard],
+    table_format: str,
+) -> GeneChemicalMap:
+    """Extract the chemicals of the genes of an analysis concurrently, see :func:`extract_chemicals_async`."""
+    analysis_name = shard_name(analysis_name, shard)
+    chembl_mapper, hgnc_mapper, gene_chemical_dict, proteins = _extraction_inputs(
+        analysis_name,
+        gene_list,
+        gene_file_path,
+        file_separator,
+        is_uniprot,
+        shard,
+        table_format,
+    )
+    targets = {}
+
+    new_genes = {}
+    for identifier in proteins:
+        metrics.cache(
+            "genes", hit=identifier in gene_chemical_dict or identifier in new_genes
+        )
+        if identifier not in gene_chemical_dict:
+            new_genes[identifier] = None
+
+    def extract(identifier: str) -> Awaitable[List[str]]:
+        return target_to_chemical_async(
+            protein=identifier,
+            protein_mapping=hgnc_mapper,
+            chemical_mapping=chembl_mapper,
+            is_uniprot=is_uniprot,
+        )
+
+    # A window of genes is requested at once, within the limits of the ChEMBL client
+    results = client.map_async(extract, new_genes, client.task_window("chembl"))
+    new_count = 0
+    try:
+        # The genes are added in order, so that the mapping is the same as the one of the synchronous stage
+        with tqdm(
+            total=len(new_genes), desc="Extracting chemicals for targets"
+        ) as progress:
+            async for identifier, chemical_list in results:
+                progress.update()
+                gene_chemical_dict[identifier] = chemical_list
+                targets[identifier] = get_target(
+                    protein=identifier,
+                    protein_mapping=hgnc_mapper,
+                    chemical_mapping=chembl_mapper,
+                    is_uniprot=is_uniprot,
+                )
+
+                new_count += 1
+                if new_count == CHECKPOINT_GENES:
+                    save_gene_chemicals(
+                        analysis_name, gene_chemical_dict, table_format, targets
+                    )
+                    new_count = 0
+    finally:
+        # Stop the requests of the other genes if one failed
+        await results.aclose()
+
+    # Save dict for re-use
+    if new_count > 0 or not has_gene_chemicals(analysis_name, table_format):
+        save_gene_chemicals(analysis_name, gene_chemical_dict, table_format, targets)
+
+    # Get genes with no chemical hits
+    _log_chemical_overview(gene_chemical_dict)
+
+    return gene_chemical_dict
+
+
+async def extract_chemicals_async(
+    analysis_name: str,
+    gene_list: list = None,
+    gene_file_path: str = None,
+    file_separator: str = "comma",
+    is_uniprot: bool = False,
+    shard: Optional[Shard] = None,
+    table_format: str = "tsv",
+) -> GeneChemicalMap:
+    """Enrich genes with chemical data from ChEMBL bioassays from an event loop.
+
+    The genes are requested concurrently, a window of twice the concurrency limit of ChEMBL at a time, see
+    :func:`pemt.client.map_async`, with at most as many requests in flight as the limit allows. The genes extracted
+    before are skipped and the mapping is saved every :data:`CHECKPOINT_GENES` genes, as with
+    :func:`extract_chemicals`. The aiohttp sessions are left open for the other stages of the loop and closed by
+    :func:`pemt.client.close_async_sessions`.
+
+    :param analysis_name: The name of the analysis. This name would be used to save the resultant file.
+    :param gene_list: The list of gene you want to extract chemicals for.
+    :param gene_file_path: The path of the gene file, or of the Orphanet gene dump (en_product6.xml).
+    :param file_separator: The separator used within the file. This can be 'comma', 'tab', or 'semicolon'.
+    :param is_uniprot: A boolean value indicating whether the genes are UniProt ids or HGNC symbols.
+    :param shard: The (index, count) of the shard to run, see :mod:`pemt.sharding`.
+    :param table_format: Format of the analysis. With "sqlite", the genes are stored in its workspace.
+    :returns: The gene to chemical mapping of the analysis.
+    """
+    init()
+
+    with metrics.stage("chemicals"):
+        return await _extract_chemicals_async(
+            analysis_name,
+            gene_list,
+            gene_file_path,
+            file_separator,
+            is_uniprot,
+            shard,
+            table_format,
+        )
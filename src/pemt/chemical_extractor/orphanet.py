@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+"""Genes of rare diseases from the Orphanet XML dumps.
+
+The dumps of the gene associations (en_product6.xml) and of the epidemiology (en_product9_prev.xml) of the
+disorders are available at http://www.orphadata.org. They are parsed incrementally: every disorder is read, turned
+into records and cleared before the next one, so that large releases are parsed in constant memory.
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+"""Source of the UniProt accessions among the external references of an Orphanet gene."""
+UNIPROT_SOURCE = "SwissProt"
+
+
+def iter_disorders(file_path: str) -> Iterator[ET.Element]:
+    """Iterate over the disorders of an Orphanet XML dump, clearing each one once it has been processed.
+
+    :param file_path: Path of the XML dump.
+    :returns: The top-level "Disorder" elements. An element is only complete until the next one is requested.
+    """
+    # Open elements, to detach each disorder from its parent, e.g. the DisorderList, once processed
+    ancestors = []
+    depth = 0
+
+    for event, element in ET.iterparse(file_path, events=("start", "end")):
+        if event == "start":
+            ancestors.append(element)
+        else:
+            ancestors.pop()
+
+        if element.tag != "Disorder":
+            continue
+
+        # Disorders can refer to other disorders, which are part of the top-level one
+        if event == "start":
+            depth += 1
+            continue
+
+        depth -= 1
+        if depth == 0:
+            yield element
+            element.clear()
+            if ancestors:
+                ancestors[-1].remove(element)
+
+
+def _text(element: ET.Element, path: str) -> Optional[str]:
+    """Get the stripped text of a sub-element, or None if it is missing or empty."""
+    text = element.findtext(path)
+    return text.strip() or None if text else None
+
+
+def read_disorder_genes(file_path: str) -> Iterator[dict]:
+    """Read the gene associations of the disorders from the Orphanet gene dump (en_product6.xml).
+
+    :param file_path: Path of the XML dump.
+    :returns: One record per disorder and gene, with the "orphanet id" and "name" of the disorder, the "symbol"
+        and "uniprot" id of the gene, and the "association type" and "association status".
+    """
+    for disorder in iter_disorders(file_path):
+        orphanet_id = _text(disorder, "OrphaCode")
+        name = _text(disorder, "Name")
+
+        for association in disorder.iterfind(
+            "DisorderGeneAssociationList/DisorderGeneAssociation"
+        ):
+            gene = association.find("Gene")
+            if gene is None:
+                continue
+
+            uniprot = None
+            for reference in gene.iterfind("ExternalReferenceList/ExternalReference"):
+                if _text(reference, "Source") == UNIPROT_SOURCE:
+                    uniprot = _text(reference, "Reference")
+                    break
+
+            yield {
+                "orphanet id": orphanet_id,
+                "name": name,
+                "symbol": _text(gene, "Symbol"),
+                "uniprot": uniprot,
+                "association type": _text(
+                    association, "DisorderGeneAssociationType/Name"
+                ),
+                "association status": _text(
+                    association, "DisorderGeneAssociationStatus/Name"
+                ),
+            }
+
+
+def read_prevalences(file_path: str) -> Dict[str, int]:
+    """Read the number of prevalence records of the disorders from the Orphanet epidemiology dump
+    (en_product9_prev.xml).
+
+    :param file_path: Path of the XML dump.
+    :returns: Dictionary mapping the Orphanet ids of the disorders to their number of prevalence records.
+    """
+    prevalences = {}
+    for disorder in iter_disorders(file_path):
+        prevalence_list = disorder.find("PrevalenceList")
+        prevalences[_text(disorder, "OrphaCode")] = (
+            0 if prevalence_list is None else int(prevalence_list.get("count", 0))
+        )
+    return prevalences
+
+
+def read_orphanet_genes(
+    gene_file_path: str,
+    prevalence_file_path: Optional[str] = None,
+    min_prevalence: int = 0,
+) -> Iterator[dict]:
+    """Read the disorder-gene pairs of Orphanet, optionally with the prevalence of the disorders.
+
+    :param gene_file_path: Path of the gene dump (en_product6.xml).
+    :param prevalence_file_path: Path of the epidemiology dump (en_product9_prev.xml). If given, the records have
+        a "prevalence count" and the disorders without prevalence records are left out.
+    :param min_prevalence: Minimum number of prevalence records of the disorders.
+    :returns: The records of :func:`read_disorder_genes`.
+    """
+    prevalences = (
+        None if prevalence_file_path is None else read_prevalences(prevalence_file_path)
+    )
+
+    for record in read_disorder_genes(gene_file_path):
+        if prevalences is not None:
+            record["prevalence count"] = prevalences.get(record["orphanet id"])
+            if record["prevalence count"] is None:
+                continue
+
+        if record.get("prevalence count", 0) >= min_prevalence:
+            yield record
+
+
+def orphanet_gene_list(
+    gene_file_path: str,
+    is_uniprot: bool = False,
+    prevalence_file_path: Optional[str] = None,
+    min_prevalence: int = 0,
+) -> List[str]:
+    """Get the genes of the disorders of Orphanet, e.g. as the gene list of
+    :func:`pemt.chemical_extractor.experimental_data_extraction.extract_chemicals`.
+
+    :param gene_file_path: Path of the gene dump (en_product6.xml).
+    :param is_uniprot: Boolean indicating whether the UniProt ids or the HGNC symbols of the genes are returned.
+    :param prevalence_file_path: Path of the epidemiology dump (en_product9_prev.xml), to filter the disorders by
+        prevalence.
+    :param min_prevalence: Minimum number of prevalence records of the disorders.
+    :returns: The distinct genes, in the order of the dump.
+    """
+    column = "uniprot" if is_uniprot else "symbol"
+    genes = dict.fromkeys(
+        record[column]
+        for record in read_orphanet_genes(
+            gene_file_path, prevalence_file_path, min_prevalence
+        )
+        if record[column]
+    )
+    logger.info(f"Read {len(genes)} genes from {gene_file_path}")
+    return list(genes)
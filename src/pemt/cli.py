@@ -1,20 +1,27 @@
 # -*- coding: utf-8 -*-
 
-"""Command line interface."""
+"""Command line interface.
 
-import json
+The extractors and their backends (pandas, ChEMBL client, Selenium) are imported within the commands, so that
+the CLI starts fast and commands work without the backends they do not use.
+"""
+
+import functools
 import logging
-from collections import defaultdict
+from contextlib import nullcontext
+from typing import Callable, Optional
 
 import click
-import numpy as np
-import pandas as pd
-from tqdm import tqdm
 
-from pemt.chemical_extractor.experimental_data_extraction import extract_chemicals
-from pemt.constants import MAPPER_DIR, PATENT_DIR
-from pemt.patent_extractor.patent_chemical_harmonizer import harmonize_chemicals
-from pemt.patent_extractor.patent_enrichment import extract_patent
+from pemt import init
+from pemt.constants import (
+    MAPPER_DIR,
+    PATENT_DIR,
+    PROFILE_DIR,
+    TABLE_FORMATS,
+    VALID_CODES,
+    WORKSPACE_FORMAT,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -23,11 +30,53 @@ logger = logging.getLogger(__name__)
 def main():
     """Run PEMT."""
     logging.basicConfig(format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
+    init(log_level=logging.INFO)
+
+
+def _record_metrics(command: Callable) -> Callable:
+    """Record the metrics of a command, write them to the metrics directory and summarize them at the end.
+
+    Commands with the --profile option also have their stages profiled, see :mod:`pemt.profiling`.
+    """
+
+    @functools.wraps(command)
+    def wrapper(profile: bool = False, **kwargs):
+        from pemt import metrics
+
+        profiler = None
+        if profile:
+            from pemt.profiling import Profiler
+
+            profiler = Profiler()
+
+        metrics.reset()
+        try:
+            with profiler or nullcontext():
+                return command(**kwargs)
+        finally:
+            labels = {
+                "analysis": kwargs.get("name") or "batch",
+                "command": command.__name__.replace("_", "-"),
+            }
+            run_name = f"{labels['analysis']}_{labels['command']}"
+            summary = metrics.format_summary(metrics.write_metrics(run_name, labels))
+            if summary:
+                click.echo(summary)
+
+            if profiler is not None:
+                from pemt.profiling import format_summary
+
+                profile_summary = format_summary(profiler.write(run_name, labels))
+                if profile_summary:
+                    click.echo(profile_summary)
+                click.echo(f"Profiles can be found under {PROFILE_DIR}")
+
+    return wrapper
 
 
 input_data = click.option(
     "--data",
-    help="Path to tab-separated gene data file",
+    help="Path to tab-separated gene data file, or to the Orphanet gene dump (en_product6.xml)",
     type=click.Path(file_okay=True, dir_okay=False, exists=True),
     required=True,
 )
@@ -78,14 +127,374 @@ chemcial_data = click.option(
     default="",
 )
 
+table_format = click.option(
+    "--format",
+    "table_format",
+    type=click.Choice(TABLE_FORMATS + (WORKSPACE_FORMAT,), case_sensitive=False),
+    default="tsv",
+    help="Format of the chemical and patent tables. Parquet and Feather files are smaller and faster to load. "
+    "With sqlite, the whole analysis is kept in a single SQLite workspace.",
+)
+
+
+def _parse_shard(ctx, param, value: Optional[str]) -> Optional[tuple]:
+    """Parse the --shard option."""
+    from pemt.sharding import parse_shard
+
+    if value is None:
+        return None
+
+    try:
+        return parse_shard(value)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+
+shard_option = click.option(
+    "--shard",
+    help="Only process the share i/N (i from 0 to N - 1) of the genes or chemicals. Combine the shards with `pemt merge`.",
+    type=str,
+    default=None,
+    callback=_parse_shard,
+)
+force_run = click.option(
+    "--force/--no-force",
+    default=False,
+    help="Re-run all stages, even those whose inputs and parameters did not change since the last run",
+)
+async_option = click.option(
+    "--async/--no-async",
+    "use_async",
+    default=False,
+    help="Send the requests to ChEMBL and PubChem concurrently from an event loop. Requires aiohttp.",
+)
+
+rescrape_option = click.option(
+    "--rescrape/--no-rescrape",
+    default=False,
+    help="Scrape SureChEMBL again for all compounds, not only for those whose archived patents are incomplete",
+)
+profile_option = click.option(
+    "--profile/--no-profile",
+    default=False,
+    help="Profile the CPU time and memory of each stage and write the profiles under data/profiles",
+)
+
+
+def _chemical_stage_inputs(
+    data: str, input_type: str, uniprot: bool, table_format: str = "tsv"
+) -> str:
+    """Get the hash of the inputs of the chemical extractor."""
+    from pemt.manifest import input_hash
+
+    return input_hash(
+        [data], {"input_type": input_type, "uniprot": uniprot, "format": table_format}
+    )
+
+
+def _chemical_stage_outputs(name: str, table_format: str = "tsv") -> list:
+    """Get the paths of the files, or the workspace tables, written by the chemical extractor."""
+    from pemt.workspace import workspace_table
+
+    if table_format == WORKSPACE_FORMAT:
+        return [workspace_table(name, "genes"), workspace_table(name, "gene_chemicals")]
+
+    return [f"{MAPPER_DIR}/{name}_gene_to_chemicals.json"]
+
+
+def _harmonizer_stage_inputs(
+    name: str, chemical_data: str = "", table_format: str = "tsv"
+) -> str:
+    """Get the hash of the inputs of the chemical harmonizer."""
+    from pemt.manifest import input_hash
+
+    if chemical_data:
+        return input_hash(
+            [chemical_data], {"from_genes": False, "format": table_format}
+        )
+
+    return input_hash(
+        _chemical_stage_outputs(name, table_format),
+        {"from_genes": True, "format": table_format},
+    )
+
+
+def _harmonizer_stage_outputs(name: str, table_format: str = "tsv") -> list:
+    """Get the paths of the files, or the workspace tables, written by the chemical harmonizer."""
+    from pemt.tables import table_path
+    from pemt.workspace import workspace_table
+
+    if table_format == WORKSPACE_FORMAT:
+        return [
+            workspace_table(name, "chemicals"),
+            workspace_table(name, "chemical_names"),
+        ]
+
+    return [
+        table_path(f"{PATENT_DIR}/{name}_chemicals", table_format),
+        f"{MAPPER_DIR}/{name}_chemical_names.json",
+    ]
+
+
+def _run_chemical_stage(
+    name: str,
+    data: str,
+    input_type: str,
+    uniprot: bool,
+    force: bool,
+    shard: Optional[tuple] = None,
+    table_format: str = "tsv",
+    use_async: bool = False,
+) -> dict:
+    """Run the chemical extractor unless it is up to date with the gene file."""
+    from pemt.chemical_extractor.experimental_data_extraction import (
+        extract_chemicals,
+        load_gene_chemicals,
+    )
+    from pemt.manifest import clear_manifest, is_fresh, write_manifest
+
+    # Shards resume from their checkpoints, their manifest is that of the merged analysis
+    if shard is not None:
+        return extract_chemicals(
+            analysis_name=name,
+            gene_file_path=data,
+            file_separator=input_type,
+            is_uniprot=uniprot,
+            shard=shard,
+            table_format=table_format,
+            use_async=use_async,
+        )
+
+    inputs = _chemical_stage_inputs(data, input_type, uniprot, table_format)
+
+    if not force and is_fresh(name, "chemicals", inputs):
+        click.echo(f"Chemical extraction is up to date, skipping")
+        return load_gene_chemicals(name, table_format)
+
+    clear_manifest(name, "chemicals")
+
+    gene_chemical_dict = extract_chemicals(
+        analysis_name=name,
+        gene_file_path=data,
+        file_separator=input_type,
+        is_uniprot=uniprot,
+        table_format=table_format,
+        use_async=use_async,
+    )
+
+    write_manifest(
+        name, "chemicals", inputs, _chemical_stage_outputs(name, table_format)
+    )
+    return gene_chemical_dict
+
+
+def _run_harmonizer_stage(
+    name: str,
+    force: bool,
+    chemical_data: str = "",
+    table_format: str = "tsv",
+    shard: Optional[tuple] = None,
+    use_async: bool = False,
+) -> None:
+    """Run the chemical harmonizer unless it is up to date with its chemicals."""
+    import pandas as pd
+
+    from pemt.manifest import clear_manifest, is_fresh, write_manifest
+    from pemt.patent_extractor.patent_chemical_harmonizer import (
+        harmonize_chemicals,
+        write_chemical_table,
+    )
+    from pemt.sharding import shard_name
+
+    if shard is not None:
+        if chemical_data:
+            df = pd.read_csv(chemical_data, sep="\t", dtype=str)
+            write_chemical_table(df, shard_name(name, shard), table_format)
+
+        harmonize_chemicals(
+            analysis_name=name,
+            from_genes=not chemical_data,
+            table_format=table_format,
+            shard=shard,
+            use_async=use_async,
+        )
+        return
+
+    inputs = _harmonizer_stage_inputs(name, chemical_data, table_format)
+
+    if not force and is_fresh(name, "harmonizer", inputs):
+        click.echo(f"Chemical harmonization is up to date, skipping")
+        return
+
+    clear_manifest(name, "harmonizer")
+
+    if chemical_data:
+        df = pd.read_csv(chemical_data, sep="\t", dtype=str)
+
+        write_chemical_table(df, name, table_format)
+
+        harmonize_chemicals(
+            analysis_name=name,
+            from_genes=False,
+            table_format=table_format,
+            use_async=use_async,
+        )
+    else:
+        harmonize_chemicals(
+            analysis_name=name, table_format=table_format, use_async=use_async
+        )
+
+    write_manifest(
+        name, "harmonizer", inputs, _harmonizer_stage_outputs(name, table_format)
+    )
+
+
+def _patent_stage_inputs(
+    name: str, year: int, with_genes: bool = True, table_format: str = "tsv"
+) -> str:
+    """Get the hash of the inputs of the patent extractor."""
+    from pemt.manifest import input_hash
+
+    input_files = _harmonizer_stage_outputs(name, table_format)[:1]
+    if with_genes:
+        input_files += _chemical_stage_outputs(name, table_format)
+
+    return input_hash(
+        input_files,
+        {"year": year, "ipc_codes": sorted(VALID_CODES), "format": table_format},
+    )
+
+
+def _patent_stage_outputs(
+    name: str, patent_files: list, table_format: str = "tsv"
+) -> list:
+    """Get the paths of the patent store and of the patent files written by the patent extractor."""
+    from pemt.patent_extractor.patent_store import PatentStore
+    from pemt.workspace import workspace_table
+
+    if table_format == WORKSPACE_FORMAT:
+        return [
+            workspace_table(name, table)
+            for table in ("patents", "patent_chemicals", "edges")
+        ] + patent_files
+
+    store = PatentStore(name, table_format)
+    return [store.patent_file, store.chemical_file, store.edge_file] + patent_files
+
+
+def _run_patent_stage(
+    name: str,
+    chromedriver_path: str,
+    os: str,
+    year: int,
+    force: bool,
+    with_genes: bool = True,
+    table_format: str = "tsv",
+    shard: Optional[tuple] = None,
+    rescrape: bool = False,
+) -> None:
+    """Run the patent extractor and write the final outputs unless they are up to date with the chemicals.
+
+    The outputs are not marked as up to date while some compounds have incomplete archived patents, so that the
+    next run scrapes them again.
+    """
+    from pemt.chemical_extractor.experimental_data_extraction import (
+        load_gene_chemicals,
+    )
+    from pemt.manifest import clear_manifest, is_fresh, write_manifest
+    from pemt.patent_extractor.patent_enrichment import (
+        export_patent_data,
+        extract_patent,
+        incomplete_archives,
+        read_chemicals,
+    )
+
+    # The patents of a shard are exported when the shards are merged
+    if shard is not None:
+        extract_patent(
+            analysis_name=name,
+            chrome_driver_path=chromedriver_path,
+            os_system=os,
+            patent_year=year,
+            table_format=table_format,
+            shard=shard,
+            rescrape=rescrape,
+        )
+        click.echo(f"Done with retrival of patents for shard {shard[0]}/{shard[1]}")
+        return
+
+    inputs = _patent_stage_inputs(name, year, with_genes, table_format)
+
+    if not force and not rescrape and is_fresh(name, "patents", inputs):
+        click.echo(f"Patent extraction is up to date, skipping")
+        click.echo(f"Data file can be found under {PATENT_DIR}")
+        return
+
+    clear_manifest(name, "patents")
+
+    click.echo(f"Starting the patent extractor pipeline for {name}")
+
+    patent_df = extract_patent(
+        analysis_name=name,
+        chrome_driver_path=chromedriver_path,
+        os_system=os,
+        patent_year=year,
+        table_format=table_format,
+        rescrape=rescrape,
+    )
+
+    if patent_df.empty:
+        click.echo(f"No patents found!")
+        return None
+
+    patent_files = export_patent_data(
+        analysis_name=name,
+        patent_df=patent_df,
+        gene_chemical_dict=(
+            load_gene_chemicals(name, table_format) if with_genes else None
+        ),
+        table_format=table_format,
+    )
+
+    incomplete = incomplete_archives(
+        read_chemicals(name, table_format)["schembl_id"].dropna().unique()
+    )
+    if incomplete:
+        click.echo(
+            f"The patents of {len(incomplete)} compounds could not all be scraped, run again to complete them"
+        )
+    else:
+        write_manifest(
+            name,
+            "patents",
+            inputs,
+            _patent_stage_outputs(name, patent_files, table_format),
+        )
+
+    click.echo(f"Done with retrival of patents")
+    click.echo(f"Data file can be found under {PATENT_DIR}")
+
 
 @main.command(help="Extract chemicals for genes of interest")
+@_record_metrics
 @analysis_name
 @input_data
 @input_data_type
 @has_uniprot
+@table_format
+@shard_option
+@force_run
+@async_option
+@profile_option
 def run_chemical_extractor(
-    name: str, data: str, input_type: str, uniprot: bool
+    name: str,
+    data: str,
+    input_type: str,
+    uniprot: bool,
+    table_format: str,
+    shard: Optional[tuple],
+    force: bool,
+    use_async: bool,
 ) -> None:
     """Extracting chemicals for genes with experiemtal data."""
     click.echo(f"Starting the chemical extractor pipeline for {name}")
@@ -95,11 +504,15 @@ def run_chemical_extractor(
     else:
         with_uniprot = False
 
-    gene_chemical_dict = extract_chemicals(
-        analysis_name=name,
-        gene_file_path=data,
-        file_separator=input_type,
-        is_uniprot=with_uniprot,
+    gene_chemical_dict = _run_chemical_stage(
+        name=name,
+        data=data,
+        input_type=input_type,
+        uniprot=with_uniprot,
+        force=force,
+        shard=shard,
+        table_format=table_format,
+        use_async=use_async,
     )
 
     click.echo(
@@ -109,12 +522,19 @@ def run_chemical_extractor(
 
 
 @main.command(help="Extract patent for filtered chemicals")
+@_record_metrics
 @analysis_name
 @system_name
 @chromedriver_path
 @patent_year
 @from_chemical
 @chemcial_data
+@table_format
+@shard_option
+@force_run
+@rescrape_option
+@async_option
+@profile_option
 def run_patent_extractor(
     name: str,
     os: str,
@@ -122,61 +542,82 @@ def run_patent_extractor(
     year: str,
     chemical: bool,
     chemical_data: str,
+    table_format: str,
+    shard: Optional[tuple],
+    force: bool,
+    rescrape: bool,
+    use_async: bool,
 ) -> None:
     """Extracting patent from chemical data."""
     click.echo(f"Starting to pre-process the chemical data for patent retrieval")
 
-    if chemical:
-        df = pd.read_csv(chemical_data, sep="\t", dtype=str)
+    _run_harmonizer_stage(
+        name=name,
+        force=force,
+        chemical_data=chemical_data if chemical else "",
+        table_format=table_format,
+        shard=shard,
+        use_async=use_async,
+    )
 
-        df.to_csv(f"{PATENT_DIR}/{name}_chemicals.tsv", sep="\t", index=False)
+    _run_patent_stage(
+        name=name,
+        chromedriver_path=chromedriver_path,
+        os=os,
+        year=year,
+        force=force,
+        with_genes=not chemical,
+        table_format=table_format,
+        shard=shard,
+        rescrape=rescrape,
+    )
 
-        harmonize_chemicals(analysis_name=name, from_genes=False)
-    else:
-        harmonize_chemicals(analysis_name=name)
 
-    click.echo(f"Starting the patent extractor pipeline for {name}")
+@main.command(help="Re-filter archived patents without scraping SureChEMBL again")
+@_record_metrics
+@analysis_name
+@patent_year
+@click.option(
+    "--ipc-codes",
+    help="Comma separated list of IPC classes to keep. By default, the PEMT drug discovery classes are used.",
+    type=str,
+    default=",".join(sorted(VALID_CODES)),
+)
+@table_format
+def run_patent_filter(name: str, year: int, ipc_codes: str, table_format: str) -> None:
+    """Filtering the archived patents by year and IPC class."""
+    from pemt.manifest import clear_manifest
+    from pemt.patent_extractor.patent_enrichment import (
+        export_patent_data,
+        refilter_patents,
+    )
 
-    patent_df = extract_patent(
+    click.echo(f"Re-filtering the archived patents for {name}")
+
+    # The patent store no longer matches the parameters of the last patent extraction
+    clear_manifest(name, "patents")
+
+    patent_df = refilter_patents(
         analysis_name=name,
-        chrome_driver_path=chromedriver_path,
-        os_system=os,
         patent_year=year,
+        valid_codes={code.strip() for code in ipc_codes.split(",") if code.strip()},
+        table_format=table_format,
     )
 
     if patent_df.empty:
         click.echo(f"No patents found!")
         return None
 
-    # Since the original patent data has chemical with no patents, we remove those entries from the data
-    patent_df = patent_df[~patent_df["patent_id"].isna()]
-    patent_df.to_csv(
-        f"{PATENT_DIR}/cleaned_{name}_patent_data.tsv", sep="\t", index=False
-    )
-
-    if chemical:
-        click.echo(f"Done with retrival of patents")
-        click.echo(f"Data file can be found under {PATENT_DIR}")
-        return
-
-    gene_chemical_data = json.load(open(f"{MAPPER_DIR}/{name}_gene_to_chemicals.json"))
-    chemical_to_gene_mapper = defaultdict(set)
-
-    for gene, chemicals in tqdm(gene_chemical_data.items()):
-        for chemical in chemicals:
-            chemical_to_gene_mapper[chemical].add(gene)
-
-    patent_df["genes"] = patent_df["chembl"].map(
-        lambda x: ", ".join(chemical_to_gene_mapper[x])
+    export_patent_data(
+        analysis_name=name, patent_df=patent_df, table_format=table_format
     )
 
-    patent_df.to_csv(f"{PATENT_DIR}/{name}_gene_patent_data.tsv", sep="\t", index=False)
-
-    click.echo(f"Done with retrival of patents")
+    click.echo(f"Kept {patent_df['patent_id'].nunique()} patents")
     click.echo(f"Data file can be found under {PATENT_DIR}")
 
 
 @main.command(help="Run the PEMT tool with gene data")
+@_record_metrics
 @analysis_name
 @input_data
 @input_data_type
@@ -184,6 +625,23 @@ def run_patent_extractor(
 @chromedriver_path
 @system_name
 @patent_year
+@click.option(
+    "--pipeline/--no-pipeline",
+    default=False,
+    help="Run the three stages concurrently, passing chemicals on as soon as they are found.",
+)
+@click.option(
+    "--queue-size",
+    help="Maximum number of items waiting between two stages when running with --pipeline",
+    type=int,
+    default=100,
+)
+@table_format
+@shard_option
+@force_run
+@rescrape_option
+@async_option
+@profile_option
 def run_pemt(
     name: str,
     data: str,
@@ -192,22 +650,88 @@ def run_pemt(
     chromedriver_path: str,
     os: str,
     year: str,
+    pipeline: bool,
+    queue_size: int,
+    table_format: str,
+    shard: Optional[tuple],
+    force: bool,
+    rescrape: bool,
+    use_async: bool,
 ) -> None:
     """Runs the PEMT tool with all the components together."""
-    click.echo(f"Starting to run PEMT workflow for {name}")
+    from pemt.manifest import clear_manifest, is_fresh, write_manifest
+    from pemt.pipeline import run_pipeline
 
-    click.echo(f"Running the chemical extractor pipeline")
+    if pipeline and shard is not None:
+        raise click.UsageError("--pipeline cannot be combined with --shard")
+
+    click.echo(f"Starting to run PEMT workflow for {name}")
 
     if uniprot:
         with_uniprot = True
     else:
         with_uniprot = False
 
-    gene_chemical_dict = extract_chemicals(
-        analysis_name=name,
-        gene_file_path=data,
-        file_separator=input_type,
-        is_uniprot=with_uniprot,
+    # Streaming only pays off when chemicals still have to be extracted or harmonized
+    if pipeline and (
+        force
+        or not is_fresh(
+            name,
+            "chemicals",
+            _chemical_stage_inputs(data, input_type, with_uniprot, table_format),
+        )
+        or not is_fresh(
+            name,
+            "harmonizer",
+            _harmonizer_stage_inputs(name, table_format=table_format),
+        )
+    ):
+        click.echo(f"Running the chemical and patent extractor pipelines together")
+
+        for stage in ("chemicals", "harmonizer", "patents"):
+            clear_manifest(name, stage)
+
+        run_pipeline(
+            analysis_name=name,
+            chrome_driver_path=chromedriver_path,
+            os_system=os,
+            patent_year=year,
+            gene_file_path=data,
+            file_separator=input_type,
+            is_uniprot=with_uniprot,
+            queue_size=queue_size,
+            table_format=table_format,
+            rescrape=rescrape,
+        )
+
+        write_manifest(
+            name,
+            "chemicals",
+            _chemical_stage_inputs(data, input_type, with_uniprot, table_format),
+            _chemical_stage_outputs(name, table_format),
+        )
+        write_manifest(
+            name,
+            "harmonizer",
+            _harmonizer_stage_inputs(name, table_format=table_format),
+            _harmonizer_stage_outputs(name, table_format),
+        )
+
+        # The patents are all in the store now, only the final outputs remain to be written
+        force = False
+        rescrape = False
+
+    click.echo(f"Running the chemical extractor pipeline")
+
+    gene_chemical_dict = _run_chemical_stage(
+        name=name,
+        data=data,
+        input_type=input_type,
+        uniprot=with_uniprot,
+        force=force,
+        shard=shard,
+        table_format=table_format,
+        use_async=use_async,
     )
 
     click.echo(
@@ -216,40 +740,269 @@ def run_pemt(
 
     click.echo(f"Ppre-processing the chemical data for patent retrieval")
 
-    harmonize_chemicals(analysis_name=name)
+    _run_harmonizer_stage(
+        name=name,
+        force=force,
+        table_format=table_format,
+        shard=shard,
+        use_async=use_async,
+    )
 
     click.echo(f"Running the patent extractor pipeline")
 
-    patent_df = extract_patent(
-        analysis_name=name,
+    _run_patent_stage(
+        name=name,
+        chromedriver_path=chromedriver_path,
+        os=os,
+        year=year,
+        force=force,
+        table_format=table_format,
+        shard=shard,
+        rescrape=rescrape,
+    )
+
+
+@main.command(help="Combine the files of the shards of an analysis")
+@_record_metrics
+@analysis_name
+@click.option(
+    "--shards",
+    help="Number of shards the analysis was split into, i.e. the N of --shard i/N",
+    type=click.IntRange(min=1),
+    required=True,
+)
+@table_format
+def merge(name: str, shards: int, table_format: str) -> None:
+    """Merging the gene, chemical and patent files of all shards of an analysis."""
+    from pemt.manifest import clear_manifest
+    from pemt.merge import merge_shards
+
+    try:
+        stages = merge_shards(
+            analysis_name=name, num_shards=shards, table_format=table_format
+        )
+    except ValueError as error:
+        raise click.ClickException(str(error))
+
+    if not stages:
+        click.echo(f"No shards found for {name}")
+        return
+
+    # The merged files were not written by a run of the stages
+    for stage in stages:
+        clear_manifest(name, stage)
+
+    click.echo(f"Merged the {', '.join(stages)} stages of {shards} shards")
+    click.echo(f"Data file can be found under {PATENT_DIR}")
+
+
+@main.command(help="Run the PEMT tool for several analyses in one process")
+@_record_metrics
+@click.option(
+    "--batch",
+    "batch_file",
+    help="Tab-separated file with a 'name' and a 'data' column, and optionally an 'input_type' and 'uniprot' column",
+    type=click.Path(file_okay=True, dir_okay=False, exists=True),
+    required=True,
+)
+@chromedriver_path
+@system_name
+@patent_year
+@table_format
+@force_run
+def run_batch(
+    batch_file: str,
+    chromedriver_path: str,
+    os: str,
+    year: int,
+    table_format: str,
+    force: bool,
+) -> None:
+    """Runs the PEMT tool for all analyses of a batch, sharing the mappers and lookups between them."""
+    from pemt import batch
+    from pemt.manifest import clear_manifest, is_fresh, write_manifest
+
+    analyses = batch.read_batch_file(batch_file)
+
+    if not force:
+        analyses = [
+            analysis
+            for analysis in analyses
+            if not (
+                is_fresh(
+                    analysis["name"],
+                    "chemicals",
+                    _chemical_stage_inputs(
+                        analysis["data"],
+                        analysis["input_type"],
+                        analysis["uniprot"],
+                        table_format,
+                    ),
+                )
+                and is_fresh(
+                    analysis["name"],
+                    "harmonizer",
+                    _harmonizer_stage_inputs(
+                        analysis["name"], table_format=table_format
+                    ),
+                )
+                and is_fresh(
+                    analysis["name"],
+                    "patents",
+                    _patent_stage_inputs(
+                        analysis["name"], year, table_format=table_format
+                    ),
+                )
+            )
+        ]
+
+    if not analyses:
+        click.echo(f"All analyses are up to date, skipping")
+        return
+
+    click.echo(f"Starting to run PEMT workflow for {len(analyses)} analyses")
+
+    for analysis in analyses:
+        for stage in ("chemicals", "harmonizer", "patents"):
+            clear_manifest(analysis["name"], stage)
+
+    patent_files = batch.run_batch(
+        analyses=analyses,
         chrome_driver_path=chromedriver_path,
         os_system=os,
         patent_year=year,
+        table_format=table_format,
     )
 
-    if patent_df.empty:
-        click.echo(f"No patents found!")
-        return None
+    for analysis in analyses:
+        name = analysis["name"]
+
+        write_manifest(
+            name,
+            "chemicals",
+            _chemical_stage_inputs(
+                analysis["data"],
+                analysis["input_type"],
+                analysis["uniprot"],
+                table_format,
+            ),
+            _chemical_stage_outputs(name, table_format),
+        )
+        write_manifest(
+            name,
+            "harmonizer",
+            _harmonizer_stage_inputs(name, table_format=table_format),
+            _harmonizer_stage_outputs(name, table_format),
+        )
+
+        if patent_files[name]:
+            write_manifest(
+                name,
+                "patents",
+                _patent_stage_inputs(name, year, table_format=table_format),
+                _patent_stage_outputs(name, patent_files[name], table_format),
+            )
 
-    # Since the original patent data has chemical with no patents, we remove those entries from the data
-    patent_df = patent_df[~patent_df["patent_id"].isna()]
-    patent_df.to_csv(
-        f"{PATENT_DIR}/cleaned_{name}_patent_data.tsv", sep="\t", index=False
-    )
+    click.echo(f"Done with retrival of patents")
+    click.echo(f"Data file can be found under {PATENT_DIR}")
 
-    chemical_to_gene_mapper = defaultdict(set)
 
-    for gene, chemicals in tqdm(gene_chemical_data.items()):
-        for chemical in chemicals:
-            chemical_to_gene_mapper[chemical].add(gene)
+@main.command(help="Write the files of an analysis kept in a SQLite workspace")
+@analysis_name
+@click.option(
+    "--format",
+    "table_format",
+    type=click.Choice(TABLE_FORMATS, case_sensitive=False),
+    default="tsv",
+    help="Format of the chemical and patent tables.",
+)
+def export(name: str, table_format: str) -> None:
+    """Exporting the workspace of an analysis to JSON and table files."""
+    from pemt.workspace import export_workspace
 
-    patent_df["genes"] = patent_df["chembl"].map(
-        lambda x: ", ".join(chemical_to_gene_mapper[x])
-    )
+    try:
+        output_files = export_workspace(name, table_format)
+    except FileNotFoundError as error:
+        raise click.ClickException(str(error))
 
-    patent_df.to_csv(f"{PATENT_DIR}/{name}_gene_patent_data.tsv", sep="\t", index=False)
+    click.echo(f"Wrote {len(output_files)} files for {name}")
+    click.echo(f"Data files can be found under {MAPPER_DIR} and {PATENT_DIR}")
 
-    click.echo(f"Done with retrival of patents")
+
+@main.command(help="Look up genes, chemicals or patents in the results of an analysis")
+@analysis_name
+@click.argument("what", type=click.Choice(["genes", "chemicals", "patents"]))
+@click.option("--gene", help="Only results linked to this gene")
+@click.option("--chemical", help="Only results linked to this ChEMBL chemical")
+@click.option("--patent", help="Only results linked to this patent")
+@click.option("--assignee", help="Only results linked to patents of this assignee")
+@click.option(
+    "--since", type=int, help="Only results linked to patents from this year on"
+)
+@click.option(
+    "--until", type=int, help="Only results linked to patents up to this year"
+)
+@click.option(
+    "--ipc", help="Only results linked to patents with this IPC code, e.g. A61P"
+)
+@table_format
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    help="Rebuild the index of the results even if it is up to date",
+)
+def query(name: str, what: str, table_format: str, rebuild: bool, **filters) -> None:
+    """Printing the results of a lookup in the index of an analysis as tab-separated rows."""
+    from pemt.index import RESULT_COLUMNS, get_index
+
+    try:
+        index = get_index(name, table_format, rebuild=rebuild)
+    except FileNotFoundError as error:
+        raise click.ClickException(str(error))
+
+    click.echo("\t".join(RESULT_COLUMNS[what]))
+    for row in index.find(what, **filters):
+        click.echo("\t".join("" if value is None else str(value) for value in row))
+    index.close()
+
+
+@main.command(
+    help="Summarize the patents of an analysis by country, kind, year, IPC class, assignee and gene"
+)
+@analysis_name
+@table_format
+@click.option(
+    "--chunk-size",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Read the patent data this many rows at a time, for tables larger than memory",
+)
+@click.option(
+    "--normalize-assignees/--no-normalize-assignees",
+    default=False,
+    help="Count the spellings of an assignee together and count the assignees by type",
+)
+def report(
+    name: str, table_format: str, chunk_size: Optional[int], normalize_assignees: bool
+) -> None:
+    """Writing the summaries of the patents of an analysis and printing their top values."""
+    from pemt.analysis import write_report
+    from pemt.constants import REPORT_DIR
+
+    try:
+        summaries, _ = write_report(
+            name,
+            table_format=table_format,
+            chunk_size=chunk_size,
+            normalize_assignees=normalize_assignees,
+        )
+    except FileNotFoundError as error:
+        raise click.ClickException(str(error))
+
+    for dimension, frame in summaries.items():
+        top = ", ".join(f"{value} ({count})" for value, count in frame.head(5).values)
+        click.echo(f"{dimension}: {top}")
+    click.echo(f"Reports can be found under {REPORT_DIR}")
 
 
 if __name__ == "__main__":
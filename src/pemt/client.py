@@ -0,0 +1,1050 @@
+# -*- coding: utf-8 -*-
+
+"""Shared client layer for the calls to the web services.
+
+Every request to GitHub, ChEMBL, PubChem and SureChEMBL goes through :func:`call`, which
+
+- waits for a token of the rate limiter of the service, so that concurrent stages together stay under its limit,
+- retries throttled (429) and failed (5xx, connection errors, timeouts) requests with exponential backoff and full
+  jitter, honouring the Retry-After header when the service sends one,
+- stops calling a service that keeps failing for a while (circuit breaking), instead of piling up retries,
+- waits for a free slot of the service, whose number adapts to how the service copes with the load (AIMD).
+
+Other errors, e.g. a compound that is not found, are raised right away.
+
+The JSON APIs of ChEMBL and PubChem are called with :func:`fetch_json` through one pooled keep-alive session per
+service, so that consecutive requests re-use their connections instead of paying TCP and TLS setup every time.
+
+The asynchronous stages call them with :func:`fetch_json_async` instead, through :func:`call_async`, which applies
+the same rate limiters, retries and circuit breakers from an asyncio event loop and caps the number of requests in
+flight to each service. It needs aiohttp, which is installed with ``pip install pemt[async]``.
+
+JSON requests are abandoned after the timeout of their service and retried. With a hedge budget, a JSON request
+that is still unanswered after the usual (95th percentile) latency of its service is also sent a second time, and
+the first answer is taken, so that a few slow requests do not hold up a whole stage. The duplicates are limited
+to the budget, a share of the requests, and only sent when the rate limiter has a token to spare.
+"""
+
+import asyncio
+import collections
+import itertools
+import logging
+import math
+import os
+import random
+import threading
+import time
+import weakref
+from concurrent import futures
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Optional,
+    Tuple,
+    TypeVar,
+)
+
+from pemt import metrics
+from pemt.constants import (
+    CONCURRENCY_LIMITS,
+    HEDGE_BUDGET,
+    HEDGE_PERCENTILE,
+    HTTP_POOL_SIZE,
+    INITIAL_CONCURRENCY,
+    LATENCY_TOLERANCE,
+    MIN_HEDGE_SAMPLES,
+    RATE_LIMITS,
+    REQUEST_TIMEOUTS,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+"""HTTP status codes of responses that are retried."""
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+"""Exceptions raised for connection failures and timeouts, by class name, including those of requests, aiohttp
+and Selenium, which are only imported when needed."""
+TRANSIENT_ERRORS = {
+    "URLError",
+    "ConnectionError",
+    "TimeoutError",
+    "timeout",
+    "RemoteDisconnected",
+    "Timeout",
+    "ClientConnectionError",
+    "ClientPayloadError",
+    "WebDriverException",
+}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a service is not called because it failed too often."""
+
+
+class TokenBucket:
+    """Thread-safe rate limiter allowing short bursts."""
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+        """Start with a full bucket.
+
+        :param rate: Number of calls allowed per second. No limit if None or 0.
+        :param burst: Number of calls allowed at once. By default, one second of calls.
+        """
+        self.rate = rate or None
+        self.capacity = burst or max(self.rate or 1.0, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, possibly ahead of time.
+
+        :returns: The seconds to wait before the token can be used.
+        """
+        if self.rate is None:
+            return 0.0
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            # The token is reserved now, so that waiting callers are served in turn
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def try_acquire(self) -> bool:
+        """Take a token only if one is available right away.
+
+        :returns: Boolean indicating whether a token was taken.
+        """
+        if self.rate is None:
+            return True
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def acquire(self) -> float:
+        """Take a token, waiting for one if the bucket is empty.
+
+        :returns: The seconds waited.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        """Take a token, waiting for one without blocking the event loop if the bucket is empty.
+
+        :returns: The seconds waited.
+        """
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class CircuitBreaker:
+    """Stop calling a service after several failures in a row, and try again after a while."""
+
+    def __init__(self, failure_threshold: int = 10, reset_seconds: float = 60.0):
+        """Start closed, i.e. letting calls through.
+
+        :param failure_threshold: Number of failures in a row after which the circuit opens.
+        :param reset_seconds: Seconds after which an open circuit lets a call through again.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def check(self, service: str) -> None:
+        """Raise :class:`CircuitOpenError` if the circuit is open.
+
+        :param service: Name of the service, for the error message.
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return
+
+            remaining = self.opened_at + self.reset_seconds - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(
+                    f"{service} failed {self.failures} times in a row, not calling it for another {remaining:.0f}s"
+                )
+
+            # Half open: calls go through again, but the next failure opens the circuit right away
+            self.opened_at = None
+            self.failures = self.failure_threshold - 1
+
+    def record(self, success: bool) -> None:
+        """Record the outcome of a call.
+
+        :param success: Boolean indicating whether the service answered.
+        """
+        with self.lock:
+            if success:
+                self.failures = 0
+                return
+
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ConcurrencyController:
+    """Limit of the requests in flight to a service, adapted with additive increase and multiplicative decrease.
+
+    The limit starts low and doubles with every round of successful requests that use it all (slow start), until
+    the service first shows signs of overload. It is then halved on every sign of overload, at most once per round
+    trip, and raised by one per round of successful requests otherwise, so that it settles around the highest load
+    the service takes. The service is overloaded when requests fail with a transient error, e.g. are throttled
+    (429) or time out, or when its recent latency is :data:`pemt.constants.LATENCY_TOLERANCE` times its lowest.
+
+    The requests of threads wait for a slot with :meth:`slot`, those of event loops with :meth:`acquire_async`.
+    Both are queued in one line and each released slot is handed over to the longest waiting request, so that
+    neither kind is starved by the other under mixed load and thousands of them can wait without being woken up in
+    vain.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_limit: int,
+        initial_limit: int = INITIAL_CONCURRENCY,
+        min_limit: int = 1,
+        decrease: float = 0.5,
+        latency_tolerance: float = LATENCY_TOLERANCE,
+        adaptive: bool = True,
+    ):
+        """Create the controller.
+
+        :param name: Name of the service, used for the metrics.
+        :param max_limit: Highest number of requests in flight.
+        :param initial_limit: Number of requests in flight at first.
+        :param min_limit: Lowest number of requests in flight.
+        :param decrease: Factor by which the limit is lowered when the service is overloaded.
+        :param latency_tolerance: Ratio of the recent to the lowest latency above which the service is overloaded.
+        :param adaptive: Boolean indicating whether the limit adapts. If not, it stays at the highest one.
+        """
+        self.name = name
+        self.max_limit = max(min_limit, max_limit)
+        self.min_limit = min_limit
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.adaptive = adaptive
+        self.limit = float(
+            min(self.max_limit, max(min_limit, initial_limit))
+            if adaptive
+            else self.max_limit
+        )
+        self.in_flight = 0
+        self.slow_start = True
+        # Smoothed recent latency and lowest latency, which slowly rises again to forget past lows
+        self.latency: Optional[float] = None
+        self.min_latency: Optional[float] = None
+        self.decreased_at = -math.inf
+        self.condition = threading.Condition()
+        # Requests waiting for a slot, in order, with the loop of those of event loops or None for those of threads
+        self.waiters: "collections.deque[Tuple[Optional[asyncio.AbstractEventLoop], Any]]" = (
+            collections.deque()
+        )
+        metrics.concurrency_limit(name, self.limit)
+
+    @property
+    def slots(self) -> int:
+        """Number of requests allowed in flight at the moment."""
+        return max(self.min_limit, int(self.limit))
+
+    def try_acquire(self) -> bool:
+        """Take a slot only if one is free and no other request waits for it.
+
+        :returns: Boolean indicating whether a slot was taken.
+        """
+        with self.condition:
+            if self.in_flight >= self.slots or self._has_waiters():
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self) -> None:
+        """Take a slot, queueing without blocking the event loop until one is handed over if none is free."""
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            if self.in_flight < self.slots and not self._has_waiters():
+                self.in_flight += 1
+                return
+            waiter = loop.create_future()
+            self.waiters.append((loop, waiter))
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # A slot handed over before the cancellation is given back, a queued request is skipped when its turn
+            # comes
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                waiter.cancel()
+            raise
+
+    def _has_waiters(self) -> bool:
+        """Check whether requests wait for a slot. The caller holds the lock."""
+        while self.waiters and self.waiters[0][1].done():
+            self.waiters.popleft()
+        return bool(self.waiters)
+
+    def _hand_over(self) -> None:
+        """Hand the free slots over to the longest waiting requests, one each. The caller holds the lock."""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        while self.waiters and self.in_flight < self.slots:
+            loop, waiter = self.waiters.popleft()
+            if waiter.done():
+                continue
+
+            self.in_flight += 1
+            if loop is None or loop is running_loop:
+                waiter.set_result(None)
+                continue
+            try:
+                loop.call_soon_threadsafe(self._grant, waiter)
+            except RuntimeError:
+                # The loop of the request is closed
+                self.in_flight -= 1
+
+    def _grant(self, waiter: asyncio.Future) -> None:
+        """Wake a request of another thread's event loop up with the slot handed over to it, or take the slot back
+        if the request was cancelled meanwhile."""
+        if waiter.done():
+            self.release()
+        else:
+            waiter.set_result(None)
+
+    def acquire(self) -> None:
+        """Take a slot, queueing behind the requests already waiting until one is handed over if none is free."""
+        with self.condition:
+            if self.in_flight < self.slots and not self._has_waiters():
+                self.in_flight += 1
+                return
+            waiter = futures.Future()
+            self.waiters.append((None, waiter))
+
+        try:
+            waiter.result()
+        except BaseException:
+            # e.g. KeyboardInterrupt, a slot handed over meanwhile is given back
+            with self.condition:
+                if not waiter.cancel():
+                    self.release()
+            raise
+
+    def release(self) -> None:
+        """Release a slot, handing it over to the longest waiting request."""
+        with self.condition:
+            self.in_flight -= 1
+            self._hand_over()
+
+    def has_free_slot(self) -> bool:
+        """Check whether a request could be sent right away."""
+        with self.condition:
+            return self.in_flight < self.slots
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot while making a request, and record its latency if it succeeds."""
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+            self.record_success(time.monotonic() - start)
+        finally:
+            self.release()
+
+    def record_success(self, latency: float) -> None:
+        """Adapt the limit to a successful request, made while holding a slot.
+
+        :param latency: Seconds the request took.
+        """
+        if not self.adaptive:
+            return
+
+        with self.condition:
+            self.latency = (
+                latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            )
+            self.min_latency = (
+                latency
+                if self.min_latency is None
+                else min(latency, self.min_latency * 1.001)
+            )
+
+            if self.latency > self.latency_tolerance * self.min_latency:
+                self._decrease()
+            elif self.in_flight >= self.slots and self.limit < self.max_limit:
+                # The limit is only raised while it holds requests back
+                self.limit = min(
+                    self.max_limit,
+                    self.limit + (1.0 if self.slow_start else 1.0 / self.limit),
+                )
+                metrics.concurrency_limit(self.name, self.limit)
+                self._hand_over()
+
+    def record_overload(self) -> None:
+        """Lower the limit after a request was throttled or failed with a transient error."""
+        if not self.adaptive:
+            return
+
+        with self.condition:
+            self._decrease()
+
+    def _decrease(self) -> None:
+        """Lower the limit, unless it was lowered less than a round trip ago. The caller holds the lock."""
+        now = time.monotonic()
+        if now - self.decreased_at < (self.latency or 0.0):
+            return
+
+        self.decreased_at = now
+        self.slow_start = False
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        metrics.concurrency_limit(self.name, self.limit)
+
+
+class Service:
+    """Rate limiter, concurrency controller, retry policy and circuit breaker of one web service."""
+
+    def __init__(
+        self,
+        name: str,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        failure_threshold: int = 10,
+        reset_seconds: float = 60.0,
+        concurrency: int = HTTP_POOL_SIZE,
+        timeout: Optional[float] = None,
+        hedge_budget: float = 0.0,
+        adaptive: bool = True,
+    ):
+        """Create the policy of a service.
+
+        :param name: Name of the service, used for the metrics and logs.
+        :param rate: Number of calls allowed per second. No limit if None or 0.
+        :param burst: Number of calls allowed at once. By default, one second of calls.
+        :param max_retries: Number of times a failed call is retried.
+        :param backoff: Upper bound in seconds of the wait before the first retry. It doubles with every retry.
+        :param max_backoff: Upper bound in seconds of the wait before any retry.
+        :param failure_threshold: Number of failures in a row after which the service is not called anymore.
+        :param reset_seconds: Seconds after which a service that failed too often is called again.
+        :param concurrency: Highest number of calls in flight at once.
+        :param timeout: Seconds after which a JSON request is abandoned and retried. No timeout if None or 0.
+        :param hedge_budget: Share of the JSON requests that may be sent a second time when slow, e.g. 0.05. No
+            request is sent twice if 0.
+        :param adaptive: Boolean indicating whether the number of calls in flight adapts to the latency and
+            throttling of the service, see :class:`ConcurrencyController`. If not, it stays at the highest one.
+        """
+        self.name = name
+        self.bucket = TokenBucket(rate, burst)
+        self.concurrency = concurrency
+        self.controller = ConcurrencyController(name, concurrency, adaptive=adaptive)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_seconds)
+        self.timeout = timeout or None
+        self.hedge_budget = hedge_budget
+        self.hedgeable_calls = 0
+        self.hedges = 0
+        self.lock = threading.Lock()
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """Get the seconds to wait before retrying a failed call.
+
+        :param attempt: Number of the failed attempt, starting at 0.
+        :param error: The error of the failed attempt.
+        """
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+        retry_after = _retry_after(error)
+        return min(self.max_backoff, max(delay, retry_after or 0.0))
+
+    def hedge_delay(self) -> Optional[float]:
+        """Count a request that may be hedged and get the seconds after which it is sent again.
+
+        :returns: The recent :data:`pemt.constants.HEDGE_PERCENTILE` latency of the service, or None if its
+            requests are not hedged or too few of them were made yet.
+        """
+        if self.hedge_budget <= 0:
+            return None
+
+        with self.lock:
+            self.hedgeable_calls += 1
+        if metrics.num_latencies(self.name) < MIN_HEDGE_SAMPLES:
+            return None
+        return metrics.latency_percentile(self.name, HEDGE_PERCENTILE)
+
+    def take_hedge(self) -> bool:
+        """Check whether a slow request can be sent again, within the hedge budget and the rate limit.
+
+        :returns: Boolean indicating whether the duplicate request is allowed. If so, it is counted against the
+            budget and has taken a token of the rate limiter.
+        """
+        with self.lock:
+            if self.hedges + 1 > self.hedge_budget * self.hedgeable_calls:
+                return False
+            if not self.bucket.try_acquire():
+                return False
+            self.hedges += 1
+            return True
+
+
+_services: Dict[str, Service] = {}
+_services_lock = threading.Lock()
+_sessions: Dict[str, Any] = {}
+# Event loop -> service -> aiohttp session, as these can only be used from the loop they were made in
+_async_sessions: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _rate_limits() -> Dict[str, float]:
+    """Get the rate limits of the services, overridden by the PEMT_RATE_LIMITS environment variable.
+
+    The variable holds comma-separated "service=rate" pairs, e.g. "pubchem=5,chembl=20". A rate of 0 removes the
+    limit.
+    """
+    rates = dict(RATE_LIMITS)
+
+    for pair in filter(None, os.environ.get("PEMT_RATE_LIMITS", "").split(",")):
+        service, _, rate = pair.partition("=")
+        rates[service.strip()] = float(rate)
+
+    return rates
+
+
+def _concurrency_limits() -> Dict[str, int]:
+    """Get the number of asynchronous requests in flight to the services, overridden by the PEMT_CONCURRENCY
+    environment variable.
+
+    The variable holds comma-separated "service=requests" pairs, e.g. "chembl=100,pubchem=10".
+    """
+    limits = dict(CONCURRENCY_LIMITS)
+
+    for pair in filter(None, os.environ.get("PEMT_CONCURRENCY", "").split(",")):
+        service, _, limit = pair.partition("=")
+        limits[service.strip()] = int(limit)
+
+    return limits
+
+
+def _timeouts() -> Dict[str, float]:
+    """Get the request timeouts of the services, overridden by the PEMT_TIMEOUTS environment variable.
+
+    The variable holds comma-separated "service=seconds" pairs, e.g. "chembl=10,pubchem=20". A timeout of 0
+    removes it.
+    """
+    timeouts = dict(REQUEST_TIMEOUTS)
+
+    for pair in filter(None, os.environ.get("PEMT_TIMEOUTS", "").split(",")):
+        service, _, timeout = pair.partition("=")
+        timeouts[service.strip()] = float(timeout)
+
+    return timeouts
+
+
+def _hedge_budget() -> float:
+    """Get the hedge budget of the services, overridden by the PEMT_HEDGE_BUDGET environment variable."""
+    return float(os.environ.get("PEMT_HEDGE_BUDGET", HEDGE_BUDGET))
+
+
+def _defaults(name: str) -> Dict[str, Any]:
+    """Get the default rate and concurrency limits, timeout and hedge budget of a service.
+
+    The concurrency limit adapts unless the PEMT_ADAPTIVE_CONCURRENCY environment variable is "0", in which case
+    the highest one is used throughout.
+    """
+    return {
+        "rate": _rate_limits().get(name),
+        "concurrency": _concurrency_limits().get(name, HTTP_POOL_SIZE),
+        "timeout": _timeouts().get(name),
+        "hedge_budget": _hedge_budget(),
+        "adaptive": os.environ.get("PEMT_ADAPTIVE_CONCURRENCY", "1") != "0",
+    }
+
+
+def get_service(name: str) -> Service:
+    """Get the policy of a service, creating it with the default limits, timeout and hedge budget on first use.
+
+    :param name: Name of the service, e.g. "chembl" or "pubchem".
+    """
+    with _services_lock:
+        if name not in _services:
+            _services[name] = Service(name, **_defaults(name))
+        return _services[name]
+
+
+def configure(name: str, **kwargs) -> Service:
+    """Replace the policy of a service.
+
+    :param name: Name of the service, e.g. "chembl" or "pubchem".
+    :param kwargs: Parameters of :class:`Service`. The rate and concurrency limits, timeout and hedge budget
+        default to those of the service.
+    """
+    kwargs = {**_defaults(name), **kwargs}
+    with _services_lock:
+        _services[name] = Service(name, **kwargs)
+        return _services[name]
+
+
+def _status(error: Exception) -> Optional[int]:
+    """Get the HTTP status code of an error of urllib, pubchempy, requests or aiohttp."""
+    for attribute in ("code", "status"):
+        code = getattr(error, attribute, None)
+        if isinstance(code, int):
+            return code
+
+    return getattr(getattr(error, "response", None), "status_code", None)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Get the seconds to wait given by the Retry-After header of a throttled response."""
+    headers = getattr(error, "headers", None) or getattr(
+        getattr(error, "response", None), "headers", None
+    )
+    if not headers:
+        return None
+
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """Check whether a failed call should be retried.
+
+    :param error: The error of the call.
+    """
+    status = _status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+
+    return any(cls.__name__ in TRANSIENT_ERRORS for cls in type(error).__mro__)
+
+
+def _retry_delay(
+    policy: Service, service: str, attempt: int, error: Exception
+) -> Optional[float]:
+    """Record a failed call and get the seconds to wait before retrying it.
+
+    :returns: The delay, or None if the call is not retried and its error is to be raised.
+    """
+    if not is_retryable(error):
+        # The service answered, e.g. that a compound does not exist
+        policy.breaker.record(success=True)
+        return None
+
+    policy.breaker.record(success=False)
+    policy.controller.record_overload()
+    if attempt >= policy.max_retries:
+        return None
+
+    delay = policy.delay(attempt, error)
+    logger.warning(f"Request to {service} failed ({error!r}), retrying in {delay:.1f}s")
+    metrics.retry(service)
+    return delay
+
+
+_hedge_executor: Optional[futures.ThreadPoolExecutor] = None
+
+
+def _get_hedge_executor() -> futures.ThreadPoolExecutor:
+    """Get the threads running the hedged requests, starting them on first use."""
+    global _hedge_executor
+
+    with _services_lock:
+        if _hedge_executor is None:
+            _hedge_executor = futures.ThreadPoolExecutor(
+                max_workers=4 * HTTP_POOL_SIZE, thread_name_prefix="pemt-hedge"
+            )
+        return _hedge_executor
+
+
+def _attempt(policy: Service, service: str, func: Callable[..., T], args, kwargs) -> T:
+    """Make one attempt of a call in a slot of the service, recorded in its request metrics."""
+    with policy.controller.slot(), metrics.request(service):
+        return func(*args, **kwargs)
+
+
+def _hedged_attempt(
+    policy: Service, service: str, func: Callable[..., T], args, kwargs
+) -> T:
+    """Make one attempt of a call, sending it a second time if it is slower than usual.
+
+    :returns: The first result. An error is only raised if both requests fail.
+    """
+    delay = policy.hedge_delay()
+    if delay is None:
+        return _attempt(policy, service, func, args, kwargs)
+
+    executor = _get_hedge_executor()
+    primary = executor.submit(_attempt, policy, service, func, args, kwargs)
+    done, _ = futures.wait([primary], timeout=delay)
+    if done or not policy.controller.has_free_slot() or not policy.take_hedge():
+        return primary.result()
+
+    hedge = executor.submit(_attempt, policy, service, func, args, kwargs)
+    pending, error = {primary, hedge}, None
+    while pending:
+        done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                metrics.hedge(service, won=future is hedge)
+                return future.result()
+            error = error or future.exception()
+
+    metrics.hedge(service, won=False)
+    raise error
+
+
+def call(service: str, func: Callable[..., T], *args, **kwargs) -> T:
+    """Call a web service through its rate limiter, retrying transient failures.
+
+    Each attempt is recorded in the request metrics of the service and each retry in its retry metrics.
+
+    :param service: Name of the service, e.g. "chembl" or "pubchem".
+    :param func: Function making the request.
+    :param args: Positional arguments of the function.
+    :param kwargs: Keyword arguments of the function.
+    :returns: The result of the function.
+    :raises CircuitOpenError: If the service failed too often recently.
+    """
+    return _call(service, func, args, kwargs)
+
+
+def _call(
+    service: str, func: Callable[..., T], args, kwargs, hedged: bool = False
+) -> T:
+    """Call a web service as :func:`call` does, hedging slow idempotent requests if asked to."""
+    policy = get_service(service)
+    attempt = 0
+
+    while True:
+        policy.breaker.check(service)
+        policy.bucket.acquire()
+
+        try:
+            if hedged:
+                # The requests run in other threads while this one waits for the first answer
+                with metrics.network_wait():
+                    result = _hedged_attempt(policy, service, func, args, kwargs)
+            else:
+                result = _attempt(policy, service, func, args, kwargs)
+        except Exception as error:
+            delay = _retry_delay(policy, service, attempt, error)
+            if delay is None:
+                raise
+
+            time.sleep(delay)
+            attempt += 1
+        else:
+            policy.breaker.record(success=True)
+            return result
+
+
+async def call_async(
+    service: str, func: Callable[..., Awaitable[T]], *args, **kwargs
+) -> T:
+    """Call a web service from an event loop, as :func:`call` does, with at most as many calls in flight as the
+    concurrency limit of the service.
+
+    Calls waiting for their turn, a token of the rate limiter or a retry do not hold one of the slots.
+
+    :param service: Name of the service, e.g. "chembl" or "pubchem".
+    :param func: Coroutine function making the request.
+    :param args: Positional arguments of the function.
+    :param kwargs: Keyword arguments of the function.
+    :returns: The result of the function.
+    :raises CircuitOpenError: If the service failed too often recently.
+    """
+    return await _call_async(service, func, args, kwargs)
+
+
+async def _attempt_async(
+    policy: Service, service: str, func: Callable[..., Awaitable[T]], args, kwargs
+) -> T:
+    """Make one attempt of an asynchronous call in a slot of the service, recorded in its request metrics."""
+    await policy.controller.acquire_async()
+    start = time.monotonic()
+    try:
+        with metrics.request(service):
+            result = await func(*args, **kwargs)
+        policy.controller.record_success(time.monotonic() - start)
+        return result
+    finally:
+        policy.controller.release()
+
+
+async def _hedged_attempt_async(
+    policy: Service, service: str, func: Callable[..., Awaitable[T]], args, kwargs
+) -> T:
+    """Make one attempt of an asynchronous call, sending it a second time if it is slower than usual and a slot of
+    the service is free. The request that loses is cancelled.
+
+    :returns: The first result. An error is only raised if both requests fail.
+    """
+    delay = policy.hedge_delay()
+    if delay is None:
+        return await _attempt_async(policy, service, func, args, kwargs)
+
+    primary = asyncio.ensure_future(_attempt_async(policy, service, func, args, kwargs))
+    pending = {primary}
+    try:
+        done, _ = await asyncio.wait(pending, timeout=delay)
+        if done or not policy.controller.has_free_slot() or not policy.take_hedge():
+            return await primary
+
+        hedge = asyncio.ensure_future(
+            _attempt_async(policy, service, func, args, kwargs)
+        )
+        pending, error = {primary, hedge}, None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    metrics.hedge(service, won=task is hedge)
+                    return task.result()
+                error = error or task.exception()
+
+        metrics.hedge(service, won=False)
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _call_async(
+    service: str,
+    func: Callable[..., Awaitable[T]],
+    args,
+    kwargs,
+    hedged: bool = False,
+) -> T:
+    """Call a web service as :func:`call_async` does, hedging slow idempotent requests if asked to."""
+    policy = get_service(service)
+    attempt = 0
+
+    while True:
+        policy.breaker.check(service)
+        await policy.bucket.acquire_async()
+
+        try:
+            result = await (
+                _hedged_attempt_async(policy, service, func, args, kwargs)
+                if hedged
+                else _attempt_async(policy, service, func, args, kwargs)
+            )
+        except Exception as error:
+            delay = _retry_delay(policy, service, attempt, error)
+            if delay is None:
+                raise
+
+            await asyncio.sleep(delay)
+            attempt += 1
+        else:
+            policy.breaker.record(success=True)
+            return result
+
+
+def get_session(service: str):
+    """Get the pooled HTTP session of a service, creating it on first use.
+
+    The session keeps up to PEMT_POOL_SIZE (by default :data:`pemt.constants.HTTP_POOL_SIZE`) connections alive,
+    enough for concurrent stages to share it. Retries are left to :func:`call`.
+
+    :param service: Name of the service, e.g. "chembl" or "pubchem".
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _services_lock:
+        if service not in _sessions:
+            pool_size = int(os.environ.get("PEMT_POOL_SIZE", HTTP_POOL_SIZE))
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size, max_retries=0
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[service] = session
+        return _sessions[service]
+
+
+def _request_json(service: str, method: str, url: str, **kwargs) -> Optional[Any]:
+    """Make a request with the session of a service and parse its JSON answer, or None if not found."""
+    kwargs.setdefault("timeout", get_service(service).timeout)
+    response = get_session(service).request(method, url, **kwargs)
+    if response.status_code == 404:
+        return None
+
+    response.raise_for_status()
+    return response.json()
+
+
+def fetch_json(service: str, method: str, url: str, **kwargs) -> Optional[Any]:
+    """Request a JSON document from a service through :func:`call`, with the timeout of the service, sending the
+    request a second time if it is slow and the service has a hedge budget.
+
+    :param service: Name of the service, e.g. "chembl" or "pubchem".
+    :param method: HTTP method, e.g. "GET" or "POST".
+    :param url: URL of the document.
+    :param kwargs: Arguments of :meth:`requests.Session.request`, e.g. params or data.
+    :returns: The parsed document, or None if the service answered "404 Not Found".
+    """
+    return _call(service, _request_json, (service, method, url), kwargs, hedged=True)
+
+
+def get_async_session(service: str):
+    """Get the aiohttp session of a service for the running event loop, creating it on first use.
+
+    The session keeps as many connections as the concurrency limit of the service allows. The sessions of a loop
+    are closed by :func:`close_async_sessions`.
+
+    :param service: Name of the service, e.g. "chembl" or "pubchem".
+    """
+    import aiohttp
+
+    sessions = _async_sessions.setdefault(asyncio.get_running_loop(), {})
+    if service not in sessions:
+        sessions[service] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=get_service(service).concurrency)
+        )
+    return sessions[service]
+
+
+async def close_async_sessions() -> None:
+    """Close the aiohttp sessions of the running event loop."""
+    sessions = _async_sessions.pop(asyncio.get_running_loop(), {})
+    for session in sessions.values():
+        await session.close()
+
+
+def task_window(service: str) -> int:
+    """Get the number of calls to a service the asynchronous stages keep in progress at once.
+
+    It is twice the highest number of requests in flight to the service, so that calls are ready to take the slots
+    that free up, without creating a task for every item of a stage up front.
+
+    :param service: Name of the service, e.g. "chembl" or "pubchem".
+    """
+    return 2 * get_service(service).concurrency
+
+
+async def map_async(
+    func: Callable[[Any], Awaitable[T]], items: Iterable, window: int
+) -> AsyncIterator[Tuple[Any, T]]:
+    """Run a coroutine function over items with a bounded number of them in progress, in order.
+
+    The next item is started whenever the result of the oldest one is taken. If a call fails or the iteration
+    stops early, the calls in progress are cancelled.
+
+    :param func: Coroutine function called with each item.
+    :param items: The items, which are read as they are needed.
+    :param window: Number of calls in progress at once, e.g. :func:`task_window`.
+    :returns: The items with their results, in the order of the items.
+    """
+    items = iter(items)
+    pending = collections.deque(
+        (item, asyncio.ensure_future(func(item)))
+        for item in itertools.islice(items, max(1, window))
+    )
+
+    try:
+        while pending:
+            item, task = pending[0]
+            result = await task
+            pending.popleft()
+            for next_item in itertools.islice(items, 1):
+                pending.append((next_item, asyncio.ensure_future(func(next_item))))
+            yield item, result
+    finally:
+        for _, task in pending:
+            task.cancel()
+        await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
+
+
+def run_async(coroutine: Awaitable[T]) -> T:
+    """Run a coroutine, e.g. an asynchronous stage, in an event loop of its own and close its aiohttp sessions.
+
+    :param coroutine: The coroutine to run.
+    :returns: The result of the coroutine.
+    """
+
+    async def run() -> T:
+        try:
+            return await coroutine
+        finally:
+            await close_async_sessions()
+
+    return asyncio.run(run())
+
+
+async def _request_json_async(
+    service: str, method: str, url: str, **kwargs
+) -> Optional[Any]:
+    """Make a request with the aiohttp session of a service and parse its JSON answer, or None if not found."""
+    timeout = get_service(service).timeout
+    if timeout and "timeout" not in kwargs:
+        import aiohttp
+
+        kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+    async with get_async_session(service).request(method, url, **kwargs) as response:
+        if response.status == 404:
+            return None
+
+        response.raise_for_status()
+        return await response.json(content_type=None)
+
+
+async def fetch_json_async(
+    service: str, method: str, url: str, **kwargs
+) -> Optional[Any]:
+    """Request a JSON document from a service through :func:`call_async`, with the timeout and hedging of
+    :func:`fetch_json`.
+
+    :param service: Name of the service, e.g. "chembl" or "pubchem".
+    :param method: HTTP method, e.g. "GET" or "POST".
+    :param url: URL of the document.
+    :param kwargs: Arguments of :meth:`aiohttp.ClientSession.request`, e.g. params or data.
+    :returns: The parsed document, or None if the service answered "404 Not Found".
+    """
+    return await _call_async(
+        service, _request_json_async, (service, method, url), kwargs, hedged=True
+    )
@@ -6,9 +6,78 @@ import os
 
 """File paths."""
 HERE = os.path.dirname(os.path.realpath(__file__))
-DATA_DIR = os.path.join(HERE, "../../data")
+DATA_DIR = os.environ.get("PEMT_DATA_DIR", os.path.join(HERE, "../../data"))
 PATENT_DIR = os.path.join(DATA_DIR, "patent_dumps")
 MAPPER_DIR = os.path.join(DATA_DIR, "mapper")
+ARCHIVE_DIR = os.path.join(PATENT_DIR, "archive")
+MANIFEST_DIR = os.path.join(DATA_DIR, "manifests")
+METRICS_DIR = os.path.join(DATA_DIR, "metrics")
+WORKSPACE_DIR = os.path.join(DATA_DIR, "workspaces")
+INDEX_DIR = os.path.join(DATA_DIR, "indexes")
+REPORT_DIR = os.path.join(DATA_DIR, "reports")
+PROFILE_DIR = os.path.join(DATA_DIR, "profiles")
+ASSIGNEE_FILE = os.path.join(MAPPER_DIR, "assignees.json")
+
+"""Web services. They can be pointed elsewhere, e.g. at the local stand-in servers of the benchmarks."""
+MAPPER_URL = os.environ.get(
+    "PEMT_MAPPER_URL",
+    "https://raw.githubusercontent.com/Fraunhofer-ITMP/PEMT/main/data/mapper",
+)
+CHEMBL_URL = os.environ.get("PEMT_CHEMBL_URL", "https://www.ebi.ac.uk/chembl/api/data")
+PUBCHEM_URL = os.environ.get(
+    "PEMT_PUBCHEM_URL", "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+)
+SURECHEMBL_URL = os.environ.get("PEMT_SURECHEMBL_URL", "https://www.surechembl.org")
+HGNC_URL = os.environ.get("PEMT_HGNC_URL", "https://www.genenames.org")
+
+"""Requests per second sent to each web service, see :mod:`pemt.client`. PubChem allows at most 5."""
+RATE_LIMITS = {
+    "github": 5.0,
+    "chembl": 10.0,
+    "pubchem": 5.0,
+    "surechembl": 1.0,
+    "genenames": 1.0,
+}
+
+"""Connections kept alive to each web service, see :func:`pemt.client.get_session`."""
+HTTP_POOL_SIZE = 10
+
+"""Highest number of requests in flight at once to each web service, see :class:`pemt.client.ConcurrencyController`.
+Other services get :data:`HTTP_POOL_SIZE`."""
+CONCURRENCY_LIMITS = {"github": 10, "chembl": 50, "pubchem": 20, "surechembl": 5}
+
+"""Number of requests in flight at once to a web service before its limit adapts to its latency and throttling."""
+INITIAL_CONCURRENCY = 4
+
+"""Ratio of the recent latency of a web service to its lowest latency above which its limit of requests in flight
+is lowered, as it is overloaded."""
+LATENCY_TOLERANCE = 3.0
+
+"""Seconds after which a request to each web service is abandoned and retried, see :func:`pemt.client.fetch_json`.
+Other services get no timeout."""
+REQUEST_TIMEOUTS = {
+    "github": 60.0,
+    "chembl": 30.0,
+    "pubchem": 30.0,
+    "surechembl": 60.0,
+    "genenames": 60.0,
+}
+
+"""Share of the JSON requests to a web service that may be sent twice when the first one is slower than usual,
+see :func:`pemt.client.fetch_json`. Hedging is off by default."""
+HEDGE_BUDGET = 0.0
+
+"""Percentile of the recent latencies of a service after which a slow request is sent again."""
+HEDGE_PERCENTILE = 95
+
+"""Number of requests to a service whose latency must be known before slow requests are sent again."""
+MIN_HEDGE_SAMPLES = 20
+
+"""Formats of the chemical and patent tables."""
+TABLE_FORMATS = ("tsv", "parquet", "feather")
+
+"""Format keeping the whole state of an analysis in a single SQLite workspace, see :mod:`pemt.workspace`."""
+WORKSPACE_FORMAT = "sqlite"
 
 """Valid IPC codes."""
 VALID_CODES = {
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+
+"""Compact storage of the chemicals of the genes of an analysis.
+
+A genome-wide mapping of genes to their ChEMBL chemicals as a dictionary of lists holds one string object per
+occurrence of a chemical, although most chemicals are active on many genes. :class:`GeneChemicalMap` numbers the
+genes and chemicals instead, keeping every identifier once, and stores the chemicals of the genes as one int32
+array of chemical numbers with the offsets of the genes in it, as in a CSR sparse matrix.
+
+The map behaves as a dictionary of lists of ChEMBL ids, which are decoded on access, and is converted to and from
+the JSON file of the mapping when it is loaded and saved.
+"""
+
+from array import array
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class IdTable:
+    """Identifiers numbered in the order they are first seen, each stored once."""
+
+    def __init__(self, identifiers: Iterable[str] = ()):
+        """Create a table.
+
+        :param identifiers: The first identifiers of the table.
+        """
+        self.ids: List[str] = []
+        self.codes: Dict[str, int] = {}
+        for identifier in identifiers:
+            self.encode(identifier)
+
+    def __len__(self) -> int:
+        """Number of identifiers in the table."""
+        return len(self.ids)
+
+    def __contains__(self, identifier: str) -> bool:
+        """Check whether an identifier is in the table."""
+        return identifier in self.codes
+
+    def code(self, identifier: str) -> Optional[int]:
+        """Get the number of an identifier, or None if it is not in the table."""
+        return self.codes.get(identifier)
+
+    def encode(self, identifier: str) -> int:
+        """Get the number of an identifier, adding it to the table if it is new."""
+        code = self.codes.get(identifier)
+        if code is None:
+            code = self.codes[identifier] = len(self.ids)
+            self.ids.append(identifier)
+        return code
+
+    def encode_many(self, identifiers: Iterable[str]) -> array:
+        """Get the numbers of identifiers as an int32 array, adding the new ones to the table."""
+        codes, ids = self.codes, self.ids
+        encoded = array("i")
+        for identifier in identifiers:
+            code = codes.get(identifier)
+            if code is None:
+                code = codes[identifier] = len(ids)
+                ids.append(identifier)
+            encoded.append(code)
+        return encoded
+
+    def decode(self, codes: Iterable[int]) -> List[str]:
+        """Get the identifiers of numbers of the table."""
+        ids = self.ids
+        return [ids[code] for code in codes]
+
+
+class GeneChemicalMap(MutableMapping):
+    """Mapping of genes to their ChEMBL chemicals, with the identifiers interned as integers.
+
+    Genes are added in order and their chemicals appended to a shared array, so that adding a new gene is cheap.
+    Replacing or removing the chemicals of a gene rewrites the arrays.
+    """
+
+    def __init__(self, gene_chemical_dict: Optional[Mapping[str, List[str]]] = None):
+        """Create a map.
+
+        :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals, e.g. as read from the JSON
+            file of an analysis.
+        """
+        self.genes = IdTable()
+        self.chemicals = IdTable()
+        # The chemicals of gene i are _indices[_indptr[i]:_indptr[i + 1]]
+        self._indptr = array("q", [0])
+        self._indices = array("i")
+
+        if gene_chemical_dict is not None:
+            self.update(gene_chemical_dict)
+
+    @property
+    def indptr(self) -> np.ndarray:
+        """Offsets of the chemicals of each gene in :attr:`indices`, with one more entry than there are genes."""
+        return np.array(self._indptr, dtype=np.int64)
+
+    @property
+    def indices(self) -> np.ndarray:
+        """Numbers of the chemicals of all genes, gene after gene."""
+        return np.array(self._indices, dtype=np.int32)
+
+    def __len__(self) -> int:
+        """Number of genes."""
+        return len(self.genes)
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over the genes in the order they were added."""
+        return iter(self.genes.ids)
+
+    def __contains__(self, gene: object) -> bool:
+        """Check whether a gene is in the map."""
+        return gene in self.genes
+
+    def __getitem__(self, gene: str) -> List[str]:
+        """Get the ChEMBL ids of the chemicals of a gene."""
+        row = self.genes.code(gene)
+        if row is None:
+            raise KeyError(gene)
+        return self.chemicals.decode(
+            self._indices[self._indptr[row] : self._indptr[row + 1]]
+        )
+
+    def __setitem__(self, gene: str, chembl_ids: Iterable[str]) -> None:
+        """Set the chemicals of a gene."""
+        codes = self.chemicals.encode_many(chembl_ids)
+
+        row = self.genes.code(gene)
+        if row is None:
+            self.genes.encode(gene)
+            self._indices.extend(codes)
+            self._indptr.append(len(self._indices))
+            return
+
+        start, end = self._indptr[row], self._indptr[row + 1]
+        self._indices[start:end] = codes
+        shift = len(codes) - (end - start)
+        for idx in range(row + 1, len(self._indptr)):
+            self._indptr[idx] += shift
+
+    def __delitem__(self, gene: str) -> None:
+        """Remove a gene and its chemicals."""
+        row = self.genes.code(gene)
+        if row is None:
+            raise KeyError(gene)
+
+        start, end = self._indptr[row], self._indptr[row + 1]
+        del self._indices[start:end]
+        self._indptr = array(
+            "q",
+            self._indptr[: row + 1]
+            + array(
+                "q", (offset - (end - start) for offset in self._indptr[row + 2 :])
+            ),
+        )
+        self.genes = IdTable(self.genes.ids[:row] + self.genes.ids[row + 1 :])
+
+    def __repr__(self) -> str:
+        """Describe the size of the map."""
+        return (
+            f"<{self.__class__.__name__} of {len(self.genes)} genes, {len(self.chemicals)} chemicals and "
+            f"{len(self._indices)} links>"
+        )
+
+    def sizes(self) -> np.ndarray:
+        """Number of chemicals of each gene, in the order of the genes."""
+        return np.diff(self.indptr)
+
+    def pairs(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the gene-chemical links as the numbers of their genes and chemicals."""
+        return np.repeat(np.arange(len(self.genes)), self.sizes()), self.indices
+
+    def distinct_chemicals(self) -> List[str]:
+        """Get the ChEMBL ids of the chemicals of the genes, each once, in the order they were first seen."""
+        return self.chemicals.decode(np.unique(self.indices).tolist())
+
+    def to_frame(self) -> pd.DataFrame:
+        """Get the distinct gene-chemical pairs as a dataframe with a "gene" and a "chembl" column."""
+        gene_codes, chemical_codes = self.pairs()
+        return pd.DataFrame(
+            {
+                "gene": np.array(self.genes.ids, dtype=object)[gene_codes],
+                "chembl": np.array(self.chemicals.ids, dtype=object)[chemical_codes],
+            }
+        ).drop_duplicates(ignore_index=True)
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        """Get the map as a dictionary of lists, e.g. to write it as JSON."""
+        return dict(self.items())
+
+
+def as_gene_chemical_map(
+    gene_chemical_dict: Mapping[str, List[str]]
+) -> GeneChemicalMap:
+    """Get a mapping of genes to their chemicals as a :class:`GeneChemicalMap`, converting it if needed.
+
+    :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals.
+    """
+    if isinstance(gene_chemical_dict, GeneChemicalMap):
+        return gene_chemical_dict
+    return GeneChemicalMap(gene_chemical_dict)
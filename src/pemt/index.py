@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+"""Persistent index over the results of an analysis for fast lookups.
+
+The index is a SQLite file under data/indexes, built from the gene to chemical mapping and the patent store of
+an analysis, in whichever format they were written. Genes, chemicals and patents are numbered, and the
+gene-chemical and chemical-patent links are stored in both directions, together with postings of the patents by
+assignee, year and IPC code. A lookup, e.g. the patents of a gene or the patents of an assignee since a year,
+only reads the matching rows instead of the whole result set.
+
+The index remembers the files (or the workspace revision) it was built from and is rebuilt by :func:`get_index`
+when they change.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+from typing import Dict, List, Optional
+
+from pemt.constants import INDEX_DIR, PATENT_DIR, WORKSPACE_FORMAT
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE genes (
+    id INTEGER PRIMARY KEY,
+    gene TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE chemicals (
+    id INTEGER PRIMARY KEY,
+    chembl TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE patents (
+    id INTEGER PRIMARY KEY,
+    patent_id TEXT NOT NULL UNIQUE,
+    date TEXT,
+    year INTEGER,
+    ipc TEXT,
+    assignee TEXT
+);
+
+CREATE TABLE gene_chemicals (
+    gene INTEGER NOT NULL,
+    chemical INTEGER NOT NULL,
+    PRIMARY KEY (gene, chemical)
+) WITHOUT ROWID;
+
+CREATE TABLE chemical_patents (
+    chemical INTEGER NOT NULL,
+    patent INTEGER NOT NULL,
+    PRIMARY KEY (chemical, patent)
+) WITHOUT ROWID;
+
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Created once the rows are inserted, which is faster than updating them row by row
+INDEXES = """
+CREATE INDEX chemical_genes ON gene_chemicals (chemical, gene);
+CREATE INDEX patent_chemicals ON chemical_patents (patent, chemical);
+CREATE INDEX patents_assignee ON patents (assignee COLLATE NOCASE, year);
+CREATE INDEX patents_year ON patents (year);
+CREATE INDEX patents_ipc ON patents (ipc, year);
+ANALYZE;
+"""
+
+"""Columns of the rows returned by :meth:`ResultIndex.find` for each kind of result."""
+RESULT_COLUMNS = {
+    "genes": ["gene"],
+    "chemicals": ["chembl"],
+    "patents": ["patent_id", "date", "ipc", "assignee"],
+}
+
+# The tables linking genes to patents, in order, with the condition joining each to the previous one
+_CHAIN = [
+    ("genes", "g", None),
+    ("gene_chemicals", "gc", "gc.gene = g.id"),
+    ("chemicals", "c", "c.id = gc.chemical"),
+    ("chemical_patents", "cp", "cp.chemical = c.id"),
+    ("patents", "p", "p.id = cp.patent"),
+]
+_POSITIONS = {"genes": 0, "chemicals": 2, "patents": 4}
+_SELECT = {
+    "genes": "g.gene",
+    "chemicals": "c.chembl",
+    "patents": "p.patent_id, p.date, p.ipc, p.assignee",
+}
+
+
+def index_path(analysis_name: str) -> str:
+    """Get the path of the index of an analysis.
+
+    :param analysis_name: Name of the analysis.
+    """
+    return f"{INDEX_DIR}/{analysis_name}.sqlite"
+
+
+def _year(date: Optional[str]) -> Optional[int]:
+    """Get the year of an ISO date, or None if it has none."""
+    if date and date[:4].isdigit():
+        return int(date[:4])
+    return None
+
+
+def _source_signature(analysis_name: str, table_format: str = "tsv") -> list:
+    """Get the size and modification time of the files the index of an analysis is built from.
+
+    For an analysis kept in a workspace, the revision of the workspace is used instead.
+    """
+    from pemt.chemical_extractor.experimental_data_extraction import (
+        gene_chemicals_path,
+    )
+    from pemt.tables import find_table
+    from pemt.workspace import get_workspace, workspace_exists, workspace_path
+
+    if table_format == WORKSPACE_FORMAT:
+        if not workspace_exists(analysis_name):
+            return []
+        return [[workspace_path(analysis_name), get_workspace(analysis_name).revision]]
+
+    source_files = [
+        gene_chemicals_path(analysis_name),
+        f"{PATENT_DIR}/{analysis_name}_patent_edges.npz",
+    ] + [
+        find_table(f"{PATENT_DIR}/{analysis_name}_{table}", table_format)
+        for table in ("patents", "patent_chemicals", "patent_data")
+    ]
+
+    signature = []
+    for file_path in source_files:
+        if file_path and os.path.exists(file_path):
+            stat = os.stat(file_path)
+            signature.append([file_path, stat.st_size, stat.st_mtime_ns])
+    return signature
+
+
+def build_index(analysis_name: str, table_format: str = "tsv") -> str:
+    """Build the index of the results of an analysis, replacing the previous one.
+
+    :param analysis_name: Name of the analysis.
+    :param table_format: Format the results of the analysis were written in.
+    :returns: The path of the index.
+    :raises FileNotFoundError: If the analysis has no results.
+    """
+    from pemt.chemical_extractor.experimental_data_extraction import (
+        load_gene_chemicals,
+    )
+    from pemt.patent_extractor.patent_store import PatentStore
+
+    # Taken first, so that results written while building make the index stale
+    signature = _source_signature(analysis_name, table_format)
+    if not signature:
+        raise FileNotFoundError(f"There are no results for {analysis_name}")
+
+    gene_chemical_dict = load_gene_chemicals(analysis_name, table_format)
+    store = PatentStore.load(analysis_name, table_format)
+
+    # The genes and chemicals keep the numbers of the mapping
+    genes = gene_chemical_dict.genes.codes
+    chemicals: Dict[str, int] = dict(gene_chemical_dict.chemicals.codes)
+    # A chemical can be in the patent store once for each of its SureChEMBL ids
+    store_chemicals = [
+        chemicals.setdefault(chembl_id, len(chemicals))
+        for chembl_id, _ in store.chemicals
+    ]
+
+    file_path = index_path(analysis_name)
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    if os.path.exists(f"{file_path}.tmp"):
+        os.remove(f"{file_path}.tmp")
+
+    connection = sqlite3.connect(f"{file_path}.tmp")
+    try:
+        # The file is only used once complete, so it needs no journal
+        connection.execute("PRAGMA journal_mode=OFF")
+        connection.execute("PRAGMA synchronous=OFF")
+        connection.executescript(SCHEMA)
+
+        connection.executemany(
+            "INSERT INTO genes VALUES (?, ?)",
+            ((idx, gene) for gene, idx in genes.items()),
+        )
+        connection.executemany(
+            "INSERT INTO chemicals VALUES (?, ?)",
+            ((idx, chembl_id) for chembl_id, idx in chemicals.items()),
+        )
+        connection.executemany(
+            "INSERT INTO patents VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (idx, patent_id, date, _year(date), ipc, assignee)
+                for idx, (patent_id, (date, ipc, assignee)) in enumerate(
+                    store.patents.items()
+                )
+            ),
+        )
+        connection.executemany(
+            "INSERT OR IGNORE INTO gene_chemicals VALUES (?, ?)",
+            zip(*(codes.tolist() for codes in gene_chemical_dict.pairs())),
+        )
+        connection.executemany(
+            "INSERT OR IGNORE INTO chemical_patents VALUES (?, ?)",
+            (
+                (store_chemicals[chemical_idx], patent_idx)
+                for chemical_idx, patent_idx in store.edges.tolist()
+            ),
+        )
+        connection.executescript(INDEXES)
+        connection.execute(
+            "INSERT INTO meta VALUES ('sources', ?)", (json.dumps(signature),)
+        )
+        connection.commit()
+    finally:
+        connection.close()
+
+    os.replace(f"{file_path}.tmp", file_path)
+    logger.info(
+        f"Indexed {len(genes)} genes, {len(chemicals)} chemicals and {len(store.patents)} patents of "
+        f"{analysis_name}"
+    )
+    return file_path
+
+
+class ResultIndex:
+    """Read-only connection to the index of an analysis."""
+
+    def __init__(self, file_path: str):
+        """Open an index.
+
+        :param file_path: Path of the index, see :func:`index_path`.
+        """
+        self.path = file_path
+        self.connection = sqlite3.connect(
+            f"file:{file_path}?mode=ro", uri=True, check_same_thread=False
+        )
+
+    @property
+    def sources(self) -> list:
+        """The signature of the results the index was built from."""
+        (value,) = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'sources'"
+        ).fetchone()
+        return json.loads(value)
+
+    def close(self) -> None:
+        """Close the connection."""
+        self.connection.close()
+
+    def find(
+        self,
+        what: str,
+        gene: Optional[str] = None,
+        chemical: Optional[str] = None,
+        patent: Optional[str] = None,
+        assignee: Optional[str] = None,
+        since: Optional[int] = None,
+        until: Optional[int] = None,
+        ipc: Optional[str] = None,
+    ) -> List[tuple]:
+        """Find the genes, chemicals or patents linked to the given gene, chemical or patent, or matching the
+        given patent filters.
+
+        For example, ``find("patents", gene="P00001")`` gets the patents of the chemicals of a gene,
+        ``find("genes", chemical="CHEMBL25")`` the genes a chemical is active on and
+        ``find("patents", assignee="NOVARTIS AG", since=2015)`` the patents of an assignee since 2015.
+
+        :param what: Kind of the results, i.e. "genes", "chemicals" or "patents".
+        :param gene: Gene identifier, as in the gene file of the analysis.
+        :param chemical: ChEMBL identifier of a chemical.
+        :param patent: Patent identifier.
+        :param assignee: Assignee of the patents, compared case insensitively.
+        :param since: First publication year of the patents.
+        :param until: Last publication year of the patents.
+        :param ipc: IPC code, or beginning of one, e.g. "A61P", of the patents.
+        :returns: The rows of the results, sorted, with the columns of :data:`RESULT_COLUMNS`.
+        """
+        if what not in RESULT_COLUMNS:
+            raise ValueError(
+                f"Unknown kind of results {what}, use one of {', '.join(RESULT_COLUMNS)}"
+            )
+
+        conditions = []
+        params: list = []
+        involved = {_POSITIONS[what]}
+
+        for value, position, condition in (
+            (gene, 0, "g.gene = ?"),
+            (chemical, 2, "c.chembl = ?"),
+            (patent, 4, "p.patent_id = ?"),
+            (assignee, 4, "p.assignee = ? COLLATE NOCASE"),
+            (since, 4, "p.year >= ?"),
+            (until, 4, "p.year <= ?"),
+        ):
+            if value is not None:
+                involved.add(position)
+                conditions.append(condition)
+                params.append(value)
+
+        if ipc is not None:
+            # A range over the IPC index, as LIKE would not use it
+            involved.add(4)
+            conditions.append("p.ipc >= ? AND p.ipc < ?")
+            params += [ipc, ipc + "\uffff"]
+
+        # Join the tables from the first to the last kind involved in the query
+        first, last = min(involved), max(involved)
+        table, alias, _ = _CHAIN[first]
+        sql = f"SELECT DISTINCT {_SELECT[what]} FROM {table} {alias}"
+        for table, alias, join in _CHAIN[first + 1 : last + 1]:
+            sql += f" JOIN {table} {alias} ON {join}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY 1"
+
+        return self.connection.execute(sql, params).fetchall()
+
+
+def get_index(
+    analysis_name: str, table_format: str = "tsv", rebuild: bool = False
+) -> ResultIndex:
+    """Open the index of an analysis, building it first if it is missing or its results have changed.
+
+    :param analysis_name: Name of the analysis.
+    :param table_format: Format the results of the analysis were written in.
+    :param rebuild: Boolean indicating whether the index is rebuilt even if it is up to date.
+    :raises FileNotFoundError: If the analysis has no results.
+    """
+    file_path = index_path(analysis_name)
+
+    if not rebuild and os.path.exists(file_path):
+        index = ResultIndex(file_path)
+        if index.sources == _source_signature(analysis_name, table_format):
+            return index
+        index.close()
+        logger.info(f"The results of {analysis_name} changed since they were indexed")
+
+    return ResultIndex(build_index(analysis_name, table_format))
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+"""Stage manifests recording the inputs and outputs of the last run of each PEMT stage.
+
+A manifest stores a hash of the files and parameters a stage was run with, together with a hash of every file
+it produced. A stage is up to date when the hash of its current inputs matches and its outputs are unchanged.
+Since the outputs of a stage are inputs of the next one, a change only invalidates the stages downstream of it.
+
+Files are only hashed again when their size or modification time changed. The manifests keep these signatures
+next to the hashes of the outputs, and a digest cache keeps them for the inputs.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, Iterable, Optional
+
+from pemt.constants import MANIFEST_DIR
+from pemt.workspace import TABLE_SEPARATOR
+
+logger = logging.getLogger(__name__)
+
+
+def file_digest(file_path: str) -> Optional[str]:
+    """Get the SHA-256 hash of a file, or None if it does not exist.
+
+    :param file_path: Path of the file, or address of a table of a workspace, see
+        :func:`pemt.workspace.workspace_table`.
+    """
+    if TABLE_SEPARATOR in file_path:
+        from pemt.workspace import table_digest
+
+        return table_digest(file_path)
+
+    if not os.path.exists(file_path):
+        return None
+
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(file_path: str) -> Optional[list]:
+    """Get the size and modification time of a file, or None if it does not exist.
+
+    :param file_path: Path of the file, or address of a table of a workspace, whose signature is that of the
+        workspace, see :func:`pemt.workspace.table_signature`.
+    """
+    if TABLE_SEPARATOR in file_path:
+        from pemt.workspace import table_signature
+
+        return table_signature(file_path)
+
+    if not os.path.exists(file_path):
+        return None
+
+    stat = os.stat(file_path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _file_record(file_path: str, known: Optional[dict] = None) -> dict:
+    """Get the "digest" and "signature" of a file, re-using the known digest if the signature did not change."""
+    signature = file_signature(file_path)
+    if signature is not None and known is not None and known["signature"] == signature:
+        return known
+
+    return {"digest": file_digest(file_path), "signature": signature}
+
+
+def _digest_cache_path() -> str:
+    """Get the path of the digest cache of the input files."""
+    return f"{MANIFEST_DIR}/digests.json"
+
+
+def _load_digest_cache() -> Dict[str, dict]:
+    """Load the digests and signatures of the input files hashed before."""
+    if not os.path.exists(_digest_cache_path()):
+        return {}
+
+    try:
+        with open(_digest_cache_path()) as f:
+            return json.load(f)
+    except ValueError:  # written by another process at the same time
+        return {}
+
+
+def _save_digest_cache(cache: Dict[str, dict]) -> None:
+    """Store the digests and signatures of the input files that still exist."""
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    cache = {
+        file_path: record
+        for file_path, record in cache.items()
+        if os.path.exists(file_path.partition(TABLE_SEPARATOR)[0])
+    }
+
+    # Several processes, e.g. shards, can write the cache at once
+    tmp_path = f"{_digest_cache_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, _digest_cache_path())
+
+
+def input_hash(input_files: Iterable[str], params: dict) -> str:
+    """Get the hash of the input files and parameters of a stage.
+
+    :param input_files: Paths of the files read by the stage.
+    :param params: Parameters the stage is run with. The values must be JSON serializable.
+    """
+    cache = _load_digest_cache()
+    changed = False
+
+    digest = hashlib.sha256()
+    for file_path in input_files:
+        key = os.path.abspath(file_path)
+        record = _file_record(file_path, cache.get(key))
+        if record is not cache.get(key):
+            cache[key] = record
+            changed = True
+
+        digest.update(f"{os.path.basename(file_path)}:{record['digest']}".encode())
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+
+    if changed:
+        _save_digest_cache(cache)
+
+    return digest.hexdigest()
+
+
+def _manifest_path(analysis_name: str, stage: str) -> str:
+    """Get the path of the manifest of a stage."""
+    return f"{MANIFEST_DIR}/{analysis_name}_{stage}.json"
+
+
+def is_fresh(analysis_name: str, stage: str, inputs: str) -> bool:
+    """Check whether a stage has already been run with the same inputs and its outputs are unchanged.
+
+    :param analysis_name: Name of the analysis.
+    :param stage: Name of the stage.
+    :param inputs: Hash of the current inputs of the stage, see :func:`input_hash`.
+    """
+    if not os.path.exists(_manifest_path(analysis_name, stage)):
+        return False
+
+    with open(_manifest_path(analysis_name, stage)) as f:
+        manifest = json.load(f)
+
+    if manifest["inputs"] != inputs:
+        return False
+
+    changed = False
+    for file_path, known in manifest["outputs"].items():
+        # Manifests written before the signatures were recorded only have the digests
+        if not isinstance(known, dict):
+            known = {"digest": known, "signature": None}
+
+        record = _file_record(file_path, known)
+        if record["digest"] != known["digest"]:
+            return False
+
+        # Outputs written again with the same content are not hashed again
+        if record is not known:
+            manifest["outputs"][file_path] = record
+            changed = True
+
+    if changed:
+        with open(_manifest_path(analysis_name, stage), "w") as f:
+            json.dump(manifest, f, indent=2)
+
+    return True
+
+
+def write_manifest(
+    analysis_name: str, stage: str, inputs: str, output_files: Iterable[str]
+) -> None:
+    """Record the inputs and outputs of a completed stage.
+
+    :param analysis_name: Name of the analysis.
+    :param stage: Name of the stage.
+    :param inputs: Hash of the inputs of the stage, see :func:`input_hash`.
+    :param output_files: Paths of the files written by the stage.
+    """
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+
+    manifest = {
+        "inputs": inputs,
+        "outputs": {file_path: _file_record(file_path) for file_path in output_files},
+    }
+    with open(_manifest_path(analysis_name, stage), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def clear_manifest(analysis_name: str, stage: str) -> None:
+    """Remove the manifest of a stage, so that it is run again.
+
+    :param analysis_name: Name of the analysis.
+    :param stage: Name of the stage.
+    """
+    if os.path.exists(_manifest_path(analysis_name, stage)):
+        os.remove(_manifest_path(analysis_name, stage))
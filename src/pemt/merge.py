@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+"""Combining the files of the shards of an analysis into the files of the analysis.
+
+Shards are merged in the order of their index, so the merged files only depend on the shard outputs and not on
+the order in which the shards finished. Genes, chemicals and patent links processed by several shards are kept
+once.
+"""
+
+import logging
+import os
+from typing import List
+
+from pemt import metrics
+from pemt.chemical_extractor.experimental_data_extraction import (
+    has_gene_chemicals,
+    load_gene_chemicals,
+    save_gene_chemicals,
+)
+from pemt.constants import PATENT_DIR, WORKSPACE_FORMAT
+from pemt.patent_extractor.patent_chemical_harmonizer import (
+    ChemicalHarmonizer,
+    has_chemicals,
+)
+from pemt.patent_extractor.patent_enrichment import (
+    _load_progress,
+    _save_progress,
+    export_patent_data,
+)
+from pemt.patent_extractor.patent_store import PatentStore
+from pemt.sharding import shard_name
+from pemt.workspace import get_workspace, workspace_exists
+
+logger = logging.getLogger(__name__)
+
+
+def _completed_shards(
+    analysis_name: str, num_shards: int, stage: str, exists
+) -> List[str]:
+    """Get the names of the shards that ran a stage, checking that either none or all of them did."""
+    names = [
+        shard_name(analysis_name, (index, num_shards)) for index in range(num_shards)
+    ]
+    done = [name for name in names if exists(name)]
+
+    if done and len(done) < num_shards:
+        missing = [name for name in names if name not in done]
+        raise ValueError(
+            f"Cannot merge the {stage} stage, the following shards have not run it: {', '.join(missing)}"
+        )
+
+    return done
+
+
+@metrics.stage("merge")
+def merge_shards(
+    analysis_name: str, num_shards: int, table_format: str = "tsv"
+) -> List[str]:
+    """Merge the files of all shards of an analysis.
+
+    Each stage is merged if all shards have run it. The patents are exported as by the patent extractor.
+
+    :param analysis_name: Name of the analysis.
+    :param num_shards: Number of shards the analysis was split into.
+    :param table_format: Format of the merged chemical and patent tables. It can be either of these: tsv, parquet,
+        feather, or sqlite if the shards kept their state in workspaces.
+    :returns: The stages that were merged, i.e. "chemicals", "harmonizer" and "patents".
+    """
+    merged = []
+
+    # Gene to chemical mapping
+    shards = _completed_shards(
+        analysis_name,
+        num_shards,
+        "chemicals",
+        lambda name: has_gene_chemicals(name, table_format),
+    )
+    if shards:
+        gene_chemical_dict = {}
+        for name in shards:
+            for gene, chemicals in load_gene_chemicals(name, table_format).items():
+                gene_chemical_dict.setdefault(gene, chemicals)
+
+        save_gene_chemicals(analysis_name, gene_chemical_dict, table_format)
+        merged.append("chemicals")
+
+    # Harmonized chemicals and their names
+    shards = _completed_shards(
+        analysis_name,
+        num_shards,
+        "harmonizer",
+        lambda name: has_chemicals(name, table_format),
+    )
+    if shards:
+        harmonizer = ChemicalHarmonizer(analysis_name, table_format=table_format)
+        harmonizer.chemicals = {}
+        harmonizer.chemical_names = {}
+
+        for name in shards:
+            shard_harmonizer = ChemicalHarmonizer(name, table_format=table_format)
+            for chembl_id, row in shard_harmonizer.chemicals.items():
+                harmonizer.chemicals.setdefault(chembl_id, row)
+            for chembl_id, chemical_name in shard_harmonizer.chemical_names.items():
+                harmonizer.chemical_names.setdefault(chembl_id, chemical_name)
+
+        harmonizer.save(drop_unmapped=True)
+        merged.append("harmonizer")
+
+    # Patent store and page-level progress
+    shards = _completed_shards(
+        analysis_name,
+        num_shards,
+        "patents",
+        lambda name: (
+            workspace_exists(name) and get_workspace(name).has_stage("patents")
+            if table_format == WORKSPACE_FORMAT
+            else os.path.exists(f"{PATENT_DIR}/{name}_patent_edges.npz")
+        ),
+    )
+    if shards:
+        store = PatentStore(analysis_name, table_format)
+        progress = {}
+
+        for name in shards:
+            shard_store = PatentStore.load(name, table_format)
+            if store.filters is not None and shard_store.filters != store.filters:
+                raise ValueError(
+                    f"The shards of {analysis_name} were run with different patent filters"
+                )
+
+            store.filters = shard_store.filters
+            store.update(shard_store)
+
+            progress_file = f"{PATENT_DIR}/{name}_patent_progress.json"
+            if table_format == WORKSPACE_FORMAT:
+                progress.update(get_workspace(name).load_progress())
+            elif os.path.exists(progress_file):
+                progress.update(_load_progress(progress_file))
+
+        store.save()
+        if progress and table_format == WORKSPACE_FORMAT:
+            for schembl_id, state in progress.items():
+                get_workspace(analysis_name).save_progress(schembl_id, state)
+        elif progress:
+            _save_progress(
+                f"{PATENT_DIR}/{analysis_name}_patent_progress.json", progress
+            )
+
+        patent_df = store.to_wide()
+        if patent_df.empty:
+            logger.warning(f"No patents found for {analysis_name}")
+        else:
+            export_patent_data(
+                analysis_name=analysis_name,
+                patent_df=patent_df,
+                gene_chemical_dict=(
+                    load_gene_chemicals(analysis_name, table_format)
+                    if has_gene_chemicals(analysis_name, table_format)
+                    else None
+                ),
+                table_format=table_format,
+            )
+
+        merged.append("patents")
+
+    return merged
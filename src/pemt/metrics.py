@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+
+"""Lightweight instrumentation of PEMT runs.
+
+The stages record their wall time, the backends (ChEMBL, PubChem, SureChEMBL) the number, errors, hedges and
+latency of their requests, with its percentiles over the most recent requests, as well as their current limit of
+requests in flight, and the caches their hits and misses. The metrics of a run are kept in a process-wide
+registry, which is safe to use from the threads of the streaming pipeline, and can be written as JSON or as a
+Prometheus textfile for the node exporter.
+
+Each thread also keeps the time it spent waiting on the network, counting overlapping requests once, which the
+profiler of :mod:`pemt.profiling` attaches to the stages through :func:`add_stage_hook`.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import ExitStack, contextmanager
+from typing import Callable, ContextManager, Deque, Dict, List, Optional, Tuple
+
+from pemt.constants import METRICS_DIR
+
+_lock = threading.Lock()
+_stages: Dict[str, float] = defaultdict(float)
+_requests: Dict[str, dict] = {}
+_retries: Dict[str, int] = defaultdict(int)
+_caches: Dict[str, Dict[str, int]] = {}
+_latencies: Dict[str, Deque[float]] = {}
+# Current limits of requests in flight, which outlive the runs like the services they belong to
+_concurrency_limits: Dict[str, float] = {}
+# Context managers entered around every stage, with the name of the stage
+_stage_hooks: List[Callable[[str], ContextManager]] = []
+# Network wait of the current thread: requests in flight, since when, seconds and CPU seconds in total
+_network = threading.local()
+
+"""Number of the most recent requests to a backend whose latencies make its percentiles."""
+LATENCY_WINDOW = 1000
+
+"""Latency percentiles reported for each backend."""
+PERCENTILES = (50, 95, 99)
+
+
+def reset() -> None:
+    """Forget all metrics recorded so far, e.g. at the start of a run. The current limits of requests in flight
+    are kept, as they are those of the services of the process."""
+    with _lock:
+        _stages.clear()
+        _requests.clear()
+        _retries.clear()
+        _caches.clear()
+        _latencies.clear()
+
+
+@contextmanager
+def stage(name: str):
+    """Record the wall time of a stage. It can also be used as a decorator.
+
+    :param name: Name of the stage, e.g. "chemicals", "harmonizer" or "patents".
+    """
+    start = time.perf_counter()
+    try:
+        with ExitStack() as hooks:
+            for hook in list(_stage_hooks):
+                hooks.enter_context(hook(name))
+            yield
+    finally:
+        with _lock:
+            _stages[name] += time.perf_counter() - start
+
+
+def add_stage_hook(hook: Callable[[str], ContextManager]) -> None:
+    """Enter a context manager around every stage, e.g. to profile it.
+
+    :param hook: Function getting the context manager from the name of the stage.
+    """
+    _stage_hooks.append(hook)
+
+
+def remove_stage_hook(hook: Callable[[str], ContextManager]) -> None:
+    """Stop entering a context manager around every stage.
+
+    :param hook: A function given to :func:`add_stage_hook`.
+    """
+    _stage_hooks.remove(hook)
+
+
+@contextmanager
+def network_wait():
+    """Mark the current thread as waiting on the network, e.g. for a request or for the first of hedged requests.
+
+    Waits of the thread that overlap, e.g. the concurrent requests of an event loop, are counted once.
+    """
+    depth = getattr(_network, "depth", 0)
+    if depth == 0:
+        _network.since = time.monotonic()
+        _network.cpu_since = time.thread_time()
+    _network.depth = depth + 1
+    try:
+        yield
+    finally:
+        _network.depth -= 1
+        if _network.depth == 0:
+            _network.seconds = (
+                getattr(_network, "seconds", 0.0) + time.monotonic() - _network.since
+            )
+            _network.cpu_seconds = (
+                getattr(_network, "cpu_seconds", 0.0)
+                + time.thread_time()
+                - _network.cpu_since
+            )
+
+
+def network_seconds() -> Tuple[float, float]:
+    """Get the time the current thread spent waiting on the network so far.
+
+    :returns: The seconds of wall time and of CPU time of the thread, e.g. parsing the answers, during the waits.
+    """
+    seconds = getattr(_network, "seconds", 0.0)
+    cpu_seconds = getattr(_network, "cpu_seconds", 0.0)
+    if getattr(_network, "depth", 0):
+        seconds += time.monotonic() - _network.since
+        cpu_seconds += time.thread_time() - _network.cpu_since
+    return seconds, cpu_seconds
+
+
+@contextmanager
+def request(backend: str):
+    """Record a request to a backend, its latency and whether it failed.
+
+    :param backend: Name of the backend, e.g. "chembl", "pubchem" or "surechembl".
+    """
+    start = time.perf_counter()
+    failed = False
+    try:
+        with network_wait():
+            yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            stats = _request_stats(backend)
+            stats["count"] += 1
+            stats["errors"] += failed
+            stats["seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+            _latencies.setdefault(backend, deque(maxlen=LATENCY_WINDOW)).append(elapsed)
+
+
+def _request_stats(backend: str) -> dict:
+    """Get the request statistics of a backend, creating them on first use. The caller holds the lock."""
+    return _requests.setdefault(
+        backend,
+        {
+            "count": 0,
+            "errors": 0,
+            "seconds": 0.0,
+            "max_seconds": 0.0,
+            "hedges": 0,
+            "hedges_won": 0,
+        },
+    )
+
+
+def hedge(backend: str, won: bool) -> None:
+    """Record a duplicate request sent to a backend because the first one was slow.
+
+    :param backend: Name of the backend.
+    :param won: Boolean indicating whether the duplicate answered first.
+    """
+    with _lock:
+        stats = _request_stats(backend)
+        stats["hedges"] += 1
+        stats["hedges_won"] += won
+
+
+def concurrency_limit(backend: str, limit: float) -> None:
+    """Record the current limit of requests in flight to a backend.
+
+    :param backend: Name of the backend.
+    :param limit: The limit, which adapts to the latency and throttling of the backend.
+    """
+    with _lock:
+        _concurrency_limits[backend] = limit
+
+
+def _percentile(latencies: list, percent: float) -> float:
+    """Get a percentile of sorted latencies by the nearest rank."""
+    rank = max(
+        0, min(len(latencies) - 1, int(percent / 100 * len(latencies) + 0.5) - 1)
+    )
+    return latencies[rank]
+
+
+def latency_percentile(backend: str, percent: float) -> Optional[float]:
+    """Get a percentile of the latency of the recent requests to a backend.
+
+    :param backend: Name of the backend.
+    :param percent: The percentile, between 0 and 100.
+    :returns: The latency in seconds, or None if the backend was not called yet.
+    """
+    with _lock:
+        latencies = sorted(_latencies.get(backend, ()))
+    return _percentile(latencies, percent) if latencies else None
+
+
+def num_latencies(backend: str) -> int:
+    """Get the number of recent requests to a backend whose latency is known.
+
+    :param backend: Name of the backend.
+    """
+    with _lock:
+        return len(_latencies.get(backend, ()))
+
+
+def retry(backend: str) -> None:
+    """Record that a request to a backend is retried.
+
+    :param backend: Name of the backend.
+    """
+    with _lock:
+        _retries[backend] += 1
+
+
+def cache(name: str, hit: bool) -> None:
+    """Record a lookup in a cache.
+
+    :param name: Name of the cache, e.g. "genes" or "patent_archive".
+    :param hit: Boolean indicating whether the item was found in the cache.
+    """
+    with _lock:
+        stats = _caches.setdefault(name, {"hits": 0, "misses": 0})
+        stats["hits" if hit else "misses"] += 1
+
+
+def snapshot() -> dict:
+    """Get the metrics recorded so far."""
+    with _lock:
+        return {
+            "stages": dict(_stages),
+            "requests": {
+                backend: dict(
+                    stats,
+                    mean_seconds=stats["seconds"] / stats["count"]
+                    if stats["count"]
+                    else 0.0,
+                    **_latency_percentiles(backend),
+                    **(
+                        {"concurrency_limit": _concurrency_limits[backend]}
+                        if backend in _concurrency_limits
+                        else {}
+                    ),
+                )
+                for backend, stats in _requests.items()
+            },
+            "retries": dict(_retries),
+            "caches": {
+                name: dict(
+                    stats,
+                    hit_rate=stats["hits"] / (stats["hits"] + stats["misses"])
+                    if stats["hits"] + stats["misses"]
+                    else 0.0,
+                )
+                for name, stats in _caches.items()
+            },
+        }
+
+
+def _latency_percentiles(backend: str) -> Dict[str, float]:
+    """Get the reported percentiles of the latency of a backend. The caller holds the lock."""
+    latencies = sorted(_latencies.get(backend, ()))
+    return {
+        f"p{percent}_seconds": _percentile(latencies, percent) if latencies else 0.0
+        for percent in PERCENTILES
+    }
+
+
+def _escape(value: str) -> str:
+    """Escape a Prometheus label value."""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def to_prometheus(metrics: dict, labels: Optional[Dict[str, str]] = None) -> str:
+    """Format metrics in the Prometheus text exposition format.
+
+    :param metrics: Metrics as returned by :func:`snapshot`.
+    :param labels: Labels added to every sample, e.g. the analysis name.
+    """
+    labels = labels or {}
+    lines = []
+
+    def add(name: str, kind: str, description: str, samples: list) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample_labels, value, *suffix in samples:
+            label_text = ",".join(
+                f'{key}="{_escape(str(label))}"'
+                for key, label in {**labels, **sample_labels}.items()
+            )
+            lines.append(f"{name}{''.join(suffix)}{{{label_text}}} {value}")
+
+    requests = metrics["requests"].items()
+    caches = metrics["caches"].items()
+
+    add(
+        "pemt_stage_seconds",
+        "gauge",
+        "Wall time of the PEMT stages.",
+        [({"stage": name}, value) for name, value in metrics["stages"].items()],
+    )
+    add(
+        "pemt_requests_total",
+        "counter",
+        "Number of requests to the backends.",
+        [({"backend": name}, stats["count"]) for name, stats in requests],
+    )
+    add(
+        "pemt_request_errors_total",
+        "counter",
+        "Number of failed requests to the backends.",
+        [({"backend": name}, stats["errors"]) for name, stats in requests],
+    )
+    add(
+        "pemt_request_seconds",
+        "summary",
+        "Latency of the requests to the backends.",
+        [
+            sample
+            for name, stats in requests
+            for sample in (
+                *(
+                    (
+                        {"backend": name, "quantile": percent / 100},
+                        stats.get(f"p{percent}_seconds", 0.0),
+                    )
+                    for percent in PERCENTILES
+                ),
+                ({"backend": name}, stats["seconds"], "_sum"),
+                ({"backend": name}, stats["count"], "_count"),
+            )
+        ],
+    )
+    add(
+        "pemt_request_seconds_max",
+        "gauge",
+        "Highest latency of a request to the backends.",
+        [({"backend": name}, stats["max_seconds"]) for name, stats in requests],
+    )
+    add(
+        "pemt_hedged_requests_total",
+        "counter",
+        "Number of duplicate requests sent to the backends after a slow request.",
+        [({"backend": name}, stats.get("hedges", 0)) for name, stats in requests],
+    )
+    add(
+        "pemt_hedged_requests_won_total",
+        "counter",
+        "Number of duplicate requests that answered before the slow request.",
+        [({"backend": name}, stats.get("hedges_won", 0)) for name, stats in requests],
+    )
+    add(
+        "pemt_concurrency_limit",
+        "gauge",
+        "Current limit of requests in flight to the backends.",
+        [
+            ({"backend": name}, stats["concurrency_limit"])
+            for name, stats in requests
+            if "concurrency_limit" in stats
+        ],
+    )
+    add(
+        "pemt_retries_total",
+        "counter",
+        "Number of retried requests to the backends.",
+        [({"backend": name}, value) for name, value in metrics["retries"].items()],
+    )
+    add(
+        "pemt_cache_hits_total",
+        "counter",
+        "Number of lookups found in the caches.",
+        [({"cache": name}, stats["hits"]) for name, stats in caches],
+    )
+    add(
+        "pemt_cache_misses_total",
+        "counter",
+        "Number of lookups not found in the caches.",
+        [({"cache": name}, stats["misses"]) for name, stats in caches],
+    )
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(run_name: str, labels: Optional[Dict[str, str]] = None) -> dict:
+    """Write the metrics recorded so far as "<run name>_metrics.json" and "<run name>.prom" files.
+
+    :param run_name: Name of the run, used for the file names.
+    :param labels: Labels of the run, e.g. the analysis name and command. They are added to the JSON file and to
+        every Prometheus sample.
+    :returns: The written metrics.
+    """
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    metrics = snapshot()
+
+    with open(f"{METRICS_DIR}/{run_name}_metrics.json", "w") as f:
+        json.dump({**(labels or {}), **metrics}, f, indent=2)
+
+    # The node exporter may read the textfile at any time, so it is replaced atomically
+    with open(f"{METRICS_DIR}/{run_name}.prom.tmp", "w") as f:
+        f.write(to_prometheus(metrics, labels))
+    os.replace(f"{METRICS_DIR}/{run_name}.prom.tmp", f"{METRICS_DIR}/{run_name}.prom")
+
+    return metrics
+
+
+def format_summary(metrics: dict) -> str:
+    """Summarize metrics in a few lines for the command line.
+
+    :param metrics: Metrics as returned by :func:`snapshot`.
+    """
+    lines = []
+
+    for name, seconds in metrics["stages"].items():
+        lines.append(f"Stage {name}: {seconds:.1f}s")
+
+    for name, stats in metrics["requests"].items():
+        retries = metrics["retries"].get(name, 0)
+        lines.append(
+            f"{name}: {stats['count']} requests, {stats['errors']} errors, {retries} retries, "
+            f"{stats['mean_seconds'] * 1000:.0f}ms mean latency"
+        )
+
+    for name, stats in metrics["caches"].items():
+        lines.append(
+            f"Cache {name}: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%})"
+        )
+
+    return "\n".join(lines)
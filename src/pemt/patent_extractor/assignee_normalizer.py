@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+
+"""Canonical names and types of patent assignees.
+
+SureChEMBL reports assignees as free text, so that one organisation appears under several spellings, e.g.
+"EISAI R&D MAN CO LTD" and "ESAI R & D MAN CO LTD", or "SQUIBB BRISTOL MYERS CO" and "BRISTOL-MYERS SQUIBB
+COMPANY". Every name is reduced to a key of its sorted, abbreviated words without legal forms, so that word order,
+punctuation and legal forms do not matter. Keys that differ by a typo in one word are then merged. The candidates
+are found through a blocking index of the keys with one word left out, and within a block through the left out
+words with one character deleted, so that names are only compared with the few that can be a misspelling of them
+rather than pairwise.
+
+Each entity is classified as Industry, Academia or Private from the words of its name. The decisions are cached in
+data/mapper/assignees.json, where they can be corrected, and new spellings of a cached entity join it.
+"""
+
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from difflib import SequenceMatcher
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+
+from pemt.constants import ASSIGNEE_FILE
+
+logger = logging.getLogger(__name__)
+
+ABBREVIATIONS = {
+    "UNIVERSITY": "UNIV",
+    "UNIVERSITE": "UNIV",
+    "UNIVERSIDAD": "UNIV",
+    "UNIVERSITAET": "UNIV",
+    "UNIVERSITAT": "UNIV",
+    "UNIVERSITA": "UNIV",
+    "COLLEGE": "COLL",
+    "INSTITUTE": "INST",
+    "INSTITUT": "INST",
+    "INSTITUTO": "INST",
+    "ACADEMY": "ACAD",
+    "FOUNDATION": "FOUND",
+    "HOSPITAL": "HOSP",
+    "CENTRE": "CENTER",
+    "RESEARCH": "RES",
+    "MEDICAL": "MED",
+    "MEDICINE": "MED",
+    "COMPANY": "CO",
+    "CORPORATION": "CORP",
+    "INCORPORATED": "INC",
+    "LIMITED": "LTD",
+    "LABORATORIES": "LAB",
+    "LABORATORY": "LAB",
+    "LABS": "LAB",
+    "PHARMACEUTICALS": "PHARM",
+    "PHARMACEUTICAL": "PHARM",
+    "PHARMA": "PHARM",
+    "MANUFACTURING": "MAN",
+    "INTERNATIONAL": "INT",
+    "INDUSTRIES": "IND",
+    "INDUSTRY": "IND",
+    "TECHNOLOGIES": "TECH",
+    "TECHNOLOGY": "TECH",
+    "AKTIENGESELLSCHAFT": "AG",
+}
+
+# Words left out of the keys
+LEGAL_FORMS = {
+    "AB",
+    "AG",
+    "AS",
+    "BV",
+    "CO",
+    "CORP",
+    "GMBH",
+    "INC",
+    "KG",
+    "KK",
+    "LLC",
+    "LLP",
+    "LP",
+    "LTD",
+    "NV",
+    "OY",
+    "PLC",
+    "PTE",
+    "PTY",
+    "SA",
+    "SAS",
+    "SARL",
+    "SPA",
+    "SRL",
+}
+STOPWORDS = {"&", "AND", "DE", "DER", "DES", "DU", "ET", "FOR", "LA", "OF", "THE"}
+_IGNORED_WORDS = LEGAL_FORMS | STOPWORDS
+
+ACADEMIA_WORDS = {
+    "ACAD",
+    "ACADEMIA",
+    "CENTER",
+    "CNRS",
+    "COLL",
+    "FONDATION",
+    "FOUND",
+    "FUNDACIO",
+    "FUNDACION",
+    "HOSP",
+    "INSERM",
+    "INST",
+    "SCHOOL",
+    "STIFTUNG",
+    "UNISERVICES",
+    "UNIV",
+}
+INDUSTRY_WORDS = LEGAL_FORMS | {
+    "BIOPHARMA",
+    "BIOSCIENCE",
+    "BIOSCIENCES",
+    "BIOTECH",
+    "BIOTECHNOLOGY",
+    "CHEMICAL",
+    "CHEMICALS",
+    "DIAGNOSTICS",
+    "DISCOVERY",
+    "GROUP",
+    "HOLDINGS",
+    "IND",
+    "LAB",
+    "MEDICINES",
+    "OPERATIONS",
+    "PHARM",
+    "SYSTEMS",
+    "TECH",
+    "THERAPEUTICS",
+}
+
+"""Shortest word in which a typo is looked for. Words must be one character longer to lose one."""
+MIN_FUZZY_LENGTH = 4
+
+Key = Tuple[str, ...]
+
+_AMPERSAND = re.compile(r"\s*&\s*")
+_SEPARATORS = re.compile(r"[^A-Z0-9&]+")
+
+
+def name_tokens(name: str) -> List[str]:
+    """Split an assignee name into upper case ASCII words, with common words abbreviated.
+
+    :param name: The assignee name.
+    """
+    if not name.isascii():
+        name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    # "R & D" and "R&D" are the same word
+    name = _AMPERSAND.sub("&", name.upper())
+    return [
+        ABBREVIATIONS.get(token, token) for token in _SEPARATORS.split(name) if token
+    ]
+
+
+def assignee_key(name: str) -> Key:
+    """Get the key under which the spellings of an assignee name are merged.
+
+    :param name: The assignee name.
+    :returns: The sorted distinct words of the name without legal forms and stopwords.
+    """
+    tokens = name_tokens(name)
+    key = sorted({token for token in tokens if token not in _IGNORED_WORDS})
+    return tuple(key or sorted(set(tokens)))
+
+
+def assignee_type(name: str) -> str:
+    """Classify an assignee by the words of its name.
+
+    Names with academic words (university, institute, hospital...) are Academia, other names with a legal form or
+    industry words (pharmaceuticals, therapeutics...) are Industry, and the others, mostly inventors, are Private.
+
+    :param name: The assignee name.
+    """
+    tokens = set(name_tokens(name))
+    if tokens & ACADEMIA_WORDS:
+        return "Academia"
+    if tokens & INDUSTRY_WORDS:
+        return "Industry"
+    return "Private"
+
+
+def _variants(token: str) -> Iterator[str]:
+    """Get a word as spelled and, if it is long enough, with each of its characters deleted."""
+    yield token
+    if len(token) > MIN_FUZZY_LENGTH:
+        for position in range(len(token)):
+            yield token[:position] + token[position + 1 :]
+
+
+class AssigneeNormalizer:
+    """Map assignee names to the canonical name and type of their entity, caching the decisions."""
+
+    def __init__(
+        self, cache_file: Optional[str] = ASSIGNEE_FILE, threshold: float = 0.8
+    ):
+        """Load the cached decisions.
+
+        :param cache_file: Path of the JSON file caching the decisions, None to not cache them.
+        :param threshold: Minimum similarity of the differing words of two keys to merge them, between 0 and 1.
+        """
+        self.cache_file = cache_file
+        self.threshold = threshold
+        # assignee name -> (canonical name, type)
+        self.decisions: Dict[str, Tuple[str, str]] = {}
+        # Key of the cached names -> decision, built on first use
+        self._known_keys: Optional[Dict[Key, Tuple[str, str]]] = None
+
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file) as f:
+                self.decisions = {
+                    name: tuple(decision) for name, decision in json.load(f).items()
+                }
+
+    def _similar(self, token: str, other: str) -> bool:
+        """Check whether two words are spellings of the same word."""
+        return SequenceMatcher(None, token, other).ratio() >= self.threshold
+
+    def _merge_keys(self, keys: Iterable[Key]) -> Dict[Key, Key]:
+        """Group keys that differ by a typo in one word.
+
+        :returns: Dictionary mapping each key to the representative of its group.
+        """
+        parents: Dict[Key, Key] = {}
+
+        def find(key: Key) -> Key:
+            while parents[key] != key:
+                parents[key] = parents[parents[key]]
+                key = parents[key]
+            return key
+
+        # Keys that can differ in one word have the same rest without that word
+        blocks = defaultdict(list)
+        for key in keys:
+            parents[key] = key
+            for idx, token in enumerate(key):
+                if len(token) >= MIN_FUZZY_LENGTH and token.isalpha():
+                    blocks[key[:idx] + key[idx + 1 :]].append((key, token))
+
+        for members in blocks.values():
+            if len(members) < 2:
+                continue
+
+            # Two spellings of a word with a typo have a variant in common
+            variants = defaultdict(list)
+            for key, token in members:
+                for variant in _variants(token):
+                    variants[variant].append((key, token))
+
+            for candidates in variants.values():
+                if len(candidates) < 2:
+                    continue
+                for idx, (key, token) in enumerate(candidates):
+                    for other_key, other_token in candidates[idx + 1 :]:
+                        if find(key) != find(other_key) and self._similar(
+                            token, other_token
+                        ):
+                            parents[find(other_key)] = find(key)
+
+        return {key: find(key) for key in parents}
+
+    def normalize(self, assignees: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+        """Get the canonical name and type of assignees.
+
+        Names that are not cached are grouped with each other and with the cached names. A group with a cached name
+        takes its decision, the others are named after their most frequent spelling.
+
+        :param assignees: Assignee names, with repetitions. Empty and missing names are skipped.
+        :returns: Dictionary mapping every distinct name to its canonical name and type.
+        """
+        counts = Counter(name for name in assignees if isinstance(name, str) and name)
+        new_names = [name for name in counts if name not in self.decisions]
+
+        if new_names:
+            if self._known_keys is None:
+                self._known_keys = {}
+                for name, decision in self.decisions.items():
+                    self._known_keys.setdefault(assignee_key(name), decision)
+
+            new_keys = {name: assignee_key(name) for name in new_names}
+            groups = self._merge_keys(set(self._known_keys) | set(new_keys.values()))
+
+            group_decisions = {
+                groups[key]: decision for key, decision in self._known_keys.items()
+            }
+            group_names = defaultdict(list)
+            for name in new_names:
+                group_names[groups[new_keys[name]]].append(name)
+
+            for group, names in group_names.items():
+                if group not in group_decisions:
+                    canonical = max(names, key=counts.get)
+                    group_decisions[group] = (canonical, assignee_type(canonical))
+                for name in names:
+                    self.decisions[name] = group_decisions[group]
+                    self._known_keys.setdefault(new_keys[name], group_decisions[group])
+
+            logger.debug(
+                f"Normalized {len(new_names)} new assignee names into {len(group_names)} entities"
+            )
+
+        return {name: self.decisions[name] for name in counts}
+
+    def save(self) -> None:
+        """Write the decisions to the cache file."""
+        if not self.cache_file:
+            return
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        with open(f"{self.cache_file}.tmp", "w") as f:
+            json.dump(self.decisions, f, ensure_ascii=False, indent=2)
+        os.replace(f"{self.cache_file}.tmp", self.cache_file)
+
+
+def normalize_assignees(
+    patent_df: pd.DataFrame,
+    column: str = "assignee",
+    cache_file: Optional[str] = ASSIGNEE_FILE,
+) -> pd.DataFrame:
+    """Add the canonical name and type of the assignees to patent data.
+
+    :param patent_df: Dataframe with a column of assignee names, e.g. the patent data of an analysis.
+    :param column: Name of the assignee column.
+    :param cache_file: Path of the JSON file caching the decisions, None to not cache them.
+    :returns: A copy of the dataframe with an "assignee_name" and an "assignee_type" column.
+    """
+    normalizer = AssigneeNormalizer(cache_file)
+    decisions = normalizer.normalize(patent_df[column])
+    normalizer.save()
+
+    patent_df = patent_df.copy()
+    patent_df["assignee_name"] = patent_df[column].map(
+        lambda name: decisions.get(name, (None, None))[0]
+    )
+    patent_df["assignee_type"] = patent_df[column].map(
+        lambda name: decisions.get(name, (None, None))[1]
+    )
+    return patent_df
@@ -5,20 +5,33 @@
 import json
 import logging
 import os
-from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
 
 import pandas as pd
-from pubchempy import get_synonyms
 from tqdm import tqdm
 
-from pemt.constants import MAPPER_DIR, PATENT_DIR
-from pemt.utils import get_chemical_names
+from pemt import client, init, metrics
+from pemt.chemical_extractor.experimental_data_extraction import (
+    has_gene_chemicals,
+    load_gene_chemicals,
+)
+from pemt.constants import MAPPER_DIR, PATENT_DIR, WORKSPACE_FORMAT
+from pemt.id_store import as_gene_chemical_map
+from pemt.sharding import Shard, in_shard, shard_name
+from pemt.tables import find_table, read_table, table_path, write_table
+from pemt.utils import (
+    get_chemical_names,
+    get_chemical_names_async,
+    get_synonyms,
+    get_synonyms_async,
+)
+from pemt.workspace import get_workspace, workspace_exists
+
+CHEMICAL_COLUMNS = ["chembl", "schembl_id", "name"]
 
 logger = logging.getLogger(__name__)
 
-os.makedirs(MAPPER_DIR, exist_ok=True)
-os.makedirs(PATENT_DIR, exist_ok=True)
-
 
 def get_surechembl_id(
     chemical_id: str, chemical_name: str, chemical_mapper: dict
@@ -34,180 +47,423 @@ def get_surechembl_id(
     if surechembl_id:
         return surechembl_id
 
-    try:
-        synm_dict = get_synonyms(chemical_name, namespace="name")[0]
-    except IndexError:
-        return None
+    return _surechembl_synonym(get_synonyms(chemical_name))
 
+
+async def get_surechembl_id_async(
+    chemical_id: str, chemical_name: str, chemical_mapper: dict
+) -> str:
+    """Get the SureChEMBL identifier of a chemical from an event loop, see :func:`get_surechembl_id`.
+
+    :param chemical_id: ChEMBL identifier of the chemical
+    :param chemical_name: Name of the chemical
+    :param chemical_mapper: Dictionary of identifier mapping between ChEMBL and SureChEMBL
+    """
+    surechembl_id = chemical_mapper.get(chemical_id)
+
+    if surechembl_id:
+        return surechembl_id
+
+    return _surechembl_synonym(await get_synonyms_async(chemical_name))
+
+
+def _surechembl_synonym(synonyms: List[str]) -> Optional[str]:
+    """Get the first SureChEMBL identifier among the synonyms of a chemical."""
     try:
-        surechembl_id = [
-            synonym for synonym in synm_dict["Synonym"] if synonym.startswith("SCHEMBL")
-        ][0]
+        return [synonym for synonym in synonyms if synonym.startswith("SCHEMBL")][0]
     except IndexError:
         return None
 
-    return surechembl_id
 
+def has_chemicals(analysis_name: str, table_format: str = "tsv") -> bool:
+    """Check whether the chemicals of an analysis have been harmonized before.
 
-def harmonize_chemicals(analysis_name: str, from_genes: bool = True) -> None:
-    """Method that allows mapping from ChEMBL to SureChEMBL identifiers.
+    :param analysis_name: The name of the analysis.
+    :param table_format: Preferred format of the chemicals file. With "sqlite", they are looked up in the workspace.
+    """
+    if table_format == WORKSPACE_FORMAT:
+        return workspace_exists(analysis_name) and get_workspace(
+            analysis_name
+        ).has_stage("harmonizer")
 
-    :param analysis_name: The name of the analysis you want to run. This name would be used to save the resultant file.
-    :param from_genes: Boolean indicating where the process needs to get chemicals based on genes or not.
+    return (
+        find_table(f"{PATENT_DIR}/{analysis_name}_chemicals", table_format) is not None
+    )
+
+
+def read_chemical_table(analysis_name: str, table_format: str = "tsv") -> pd.DataFrame:
+    """Read the harmonized chemicals of an analysis as strings.
+
+    :param analysis_name: The name of the analysis.
+    :param table_format: Preferred format of the chemicals file. Other formats are read if it does not exist. With
+        "sqlite", they are read from the workspace.
+    :raises FileNotFoundError: If the chemicals have not been harmonized.
     """
+    if not has_chemicals(analysis_name, table_format):
+        raise FileNotFoundError(
+            f"Please ensure that you run the chemical harmonizer first."
+        )
 
-    # Load cached data if it exists
-    if os.path.exists(f"{PATENT_DIR}/{analysis_name}_chemicals.tsv"):
-        chemical_df = pd.read_csv(
-            f"{PATENT_DIR}/{analysis_name}_chemicals.tsv",
-            sep="\t",
-            dtype=str,
+    if table_format == WORKSPACE_FORMAT:
+        return pd.DataFrame(
+            get_workspace(analysis_name).load_chemicals(), columns=CHEMICAL_COLUMNS
         )
 
-        cache_dict = pd.read_csv(
-            f"{PATENT_DIR}/{analysis_name}_chemicals.tsv",
-            sep="\t",
-            dtype=str,
-            index_col="chembl",
-        ).to_dict()["schembl_id"]
+    return read_table(
+        find_table(f"{PATENT_DIR}/{analysis_name}_chemicals", table_format),
+        typed=False,
+    )
 
-    else:
-        chemical_df = pd.DataFrame(columns=["chembl", "schembl_id", "name"])
-        cache_dict = {}
 
-    # Load chembl - schembl mapper
+def write_chemical_table(
+    chemical_df: pd.DataFrame, analysis_name: str, table_format: str = "tsv"
+) -> None:
+    """Write chemicals to be harmonized, e.g. given by the user, as the chemicals of an analysis.
+
+    :param chemical_df: Dataframe with a "chembl" column and optionally "schembl_id" and "name" columns.
+    :param analysis_name: The name of the analysis.
+    :param table_format: Format of the chemicals file. With "sqlite", they are written to the workspace.
+    """
+    if table_format == WORKSPACE_FORMAT:
+        chemical_df = chemical_df.reindex(columns=CHEMICAL_COLUMNS)
+        get_workspace(analysis_name).save_chemicals(
+            chemical_df.astype(object)
+            .where(chemical_df.notna(), None)
+            .itertuples(index=False, name=None)
+        )
+        return
+
+    write_table(chemical_df, f"{PATENT_DIR}/{analysis_name}_chemicals", table_format)
+
+
+@lru_cache(maxsize=None)
+def load_chemical_mapper() -> Dict[str, str]:
+    """Load the ChEMBL to SureChEMBL mapper. It is read once and shared by all analyses of a process."""
+    if not os.path.exists(f"{MAPPER_DIR}/chemical_mapper.json"):
+        return {}
+
     with open(f"{MAPPER_DIR}/chemical_mapper.json") as f:
-        chemical_mapper = json.load(f)
+        return json.load(f)
+
+
+class ChemicalHarmonizer:
+    """Cached mapping of ChEMBL chemicals to SureChEMBL, checkpointed to the files of an analysis."""
+
+    def __init__(
+        self, analysis_name: str, checkpoint_every: int = 10, table_format: str = "tsv"
+    ):
+        """Load the cached chemicals and names of an analysis.
+
+        :param analysis_name: The name of the analysis. This name would be used to save the resultant file.
+        :param checkpoint_every: Number of newly mapped chemicals after which the files are written.
+        :param table_format: Format of the chemicals file. It can be either of these: tsv, parquet, feather, or
+            sqlite to keep the chemicals and names in the workspace of the analysis.
+        """
+        init()
+
+        self.analysis_name = analysis_name
+        self.checkpoint_every = checkpoint_every
+        self.table_format = table_format
+        self._pending = 0
+
+        # Load cached data if it exists, in whichever format it was written
+        if table_format == WORKSPACE_FORMAT:
+            workspace = get_workspace(analysis_name)
+            chemical_df = pd.DataFrame(
+                workspace.load_chemicals(), columns=CHEMICAL_COLUMNS
+            )
+            self.chemical_names = workspace.load_chemical_names()
+        else:
+            cached_file = find_table(
+                f"{PATENT_DIR}/{self.analysis_name}_chemicals", table_format
+            )
+            if cached_file:
+                chemical_df = read_table(cached_file, typed=False)
+            else:
+                chemical_df = pd.DataFrame(columns=CHEMICAL_COLUMNS)
+
+            if os.path.exists(self.name_file):
+                with open(self.name_file) as f:
+                    self.chemical_names = json.load(f)
+            else:
+                self.chemical_names = {}
+
+        chemical_df = chemical_df.reindex(columns=CHEMICAL_COLUMNS)
+        self.chemicals = {row["chembl"]: row for row in chemical_df.to_dict("records")}
+
+        self.chemical_mapper = load_chemical_mapper()
+
+    @property
+    def chemical_file(self) -> str:
+        """Path of the file with the harmonized chemicals."""
+        return table_path(
+            f"{PATENT_DIR}/{self.analysis_name}_chemicals", self.table_format
+        )
+
+    @property
+    def name_file(self) -> str:
+        """Path of the file with the chemical names."""
+        return f"{MAPPER_DIR}/{self.analysis_name}_chemical_names.json"
+
+    @property
+    def chemical_df(self) -> pd.DataFrame:
+        """The chemicals of the analysis with their SureChEMBL identifier and name."""
+        return pd.DataFrame(list(self.chemicals.values()), columns=CHEMICAL_COLUMNS)
+
+    def harmonize(self, chembl_id: str) -> Optional[str]:
+        """Get the SureChEMBL identifier of a chemical, from the cache if it was mapped before.
+
+        :param chembl_id: ChEMBL identifier of the chemical
+        """
+        cached = self.chemicals.get(chembl_id)
+        if cached is not None and not pd.isna(cached["schembl_id"]):
+            metrics.cache("chemicals", hit=True)
+            return cached["schembl_id"]
+
+        metrics.cache("chemicals", hit=False)
+
+        # Get name for chemical and store in dict
+        metrics.cache("chemical_names", hit=chembl_id in self.chemical_names)
+        if chembl_id not in self.chemical_names:
+            self.chemical_names[chembl_id] = get_chemical_names(chembl_id)
+
+        surechembl_id = get_surechembl_id(
+            chemical_id=chembl_id,
+            chemical_name=self.chemical_names[chembl_id],
+            chemical_mapper=self.chemical_mapper,
+        )
+
+        if not surechembl_id:
+            return None
 
-    # Add caching system
-    cache = 0
-    genes_skipped = 0
+        self.add(chembl_id, surechembl_id, self.chemical_names[chembl_id])
+        return surechembl_id
+
+    async def harmonize_async(self, chembl_id: str) -> Optional[str]:
+        """Get the SureChEMBL identifier of a chemical from an event loop, see :meth:`harmonize`.
+
+        :param chembl_id: ChEMBL identifier of the chemical
+        """
+        cached = self.chemicals.get(chembl_id)
+        if cached is not None and not pd.isna(cached["schembl_id"]):
+            metrics.cache("chemicals", hit=True)
+            return cached["schembl_id"]
 
-    if os.path.exists(f"{MAPPER_DIR}/{analysis_name}_chemical_names.json"):
-        chemical_names = json.load(
-            open(f"{MAPPER_DIR}/{analysis_name}_chemical_names.json")
+        metrics.cache("chemicals", hit=False)
+
+        metrics.cache("chemical_names", hit=chembl_id in self.chemical_names)
+        if chembl_id not in self.chemical_names:
+            self.chemical_names[chembl_id] = await get_chemical_names_async(chembl_id)
+
+        surechembl_id = await get_surechembl_id_async(
+            chemical_id=chembl_id,
+            chemical_name=self.chemical_names[chembl_id],
+            chemical_mapper=self.chemical_mapper,
         )
-    else:
-        chemical_names = defaultdict(str)
 
-    if from_genes:
-        if os.path.exists(f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json"):
-            gene_chemical_dict = json.load(
-                open(f"{MAPPER_DIR}/{analysis_name}_gene_to_chemicals.json")
+        if not surechembl_id:
+            return None
+
+        self.add(chembl_id, surechembl_id, self.chemical_names[chembl_id])
+        return surechembl_id
+
+    def add(self, chembl_id: str, surechembl_id: str, chemical_name: str) -> None:
+        """Record the SureChEMBL identifier of a chemical, e.g. one harmonized for another analysis.
+
+        :param chembl_id: ChEMBL identifier of the chemical
+        :param surechembl_id: SureChEMBL identifier of the chemical
+        :param chemical_name: Name of the chemical
+        """
+        self.chemical_names[chembl_id] = chemical_name
+        self.chemicals[chembl_id] = {
+            "chembl": chembl_id,
+            "schembl_id": surechembl_id,
+            "name": chemical_name,
+        }
+
+        self._pending += 1  # add new data only
+        if self._pending == self.checkpoint_every:
+            self.save()
+
+    def save(self, drop_unmapped: bool = False) -> pd.DataFrame:
+        """Write the chemicals and their names to disk.
+
+        :param drop_unmapped: Boolean indicating whether chemicals without SureChEMBL identifier are left out.
+        """
+        chemical_df = self.chemical_df
+        if drop_unmapped:
+            chemical_df.dropna(subset=["schembl_id"], inplace=True)
+
+        if self.table_format == WORKSPACE_FORMAT:
+            get_workspace(self.analysis_name).save_chemicals(
+                chemical_df.astype(object)
+                .where(chemical_df.notna(), None)
+                .itertuples(index=False, name=None),
+                self.chemical_names,
             )
+            self._pending = 0
+            return chemical_df
+
+        write_table(
+            chemical_df,
+            f"{PATENT_DIR}/{self.analysis_name}_chemicals",
+            self.table_format,
+        )
+
+        # Save chemical mapping dict for re-use
+        with open(self.name_file, "w") as f:
+            json.dump(self.chemical_names, f, ensure_ascii=False, indent=2)
+
+        self._pending = 0
+        return chemical_df
+
+
+def _iterate_gene_chemicals(
+    gene_chemical_dict: Mapping[str, List[str]]
+) -> Iterable[str]:
+    """Iterate over the chemicals of all genes, each once, skipping genes without chemicals."""
+    gene_chemical_dict = as_gene_chemical_map(gene_chemical_dict)
+    logger.debug(
+        f"Skipped {int((gene_chemical_dict.sizes() == 0).sum())} genes without chemicals"
+    )
+
+    yield from tqdm(
+        gene_chemical_dict.distinct_chemicals(),
+        desc="Harmonizing chemicals for patent retrieval",
+    )
+
+
+def _harmonizer_inputs(
+    analysis_name: str,
+    from_genes: bool,
+    table_format: str,
+    shard: Optional[Shard],
+) -> Tuple[ChemicalHarmonizer, Iterable[str], Optional[Shard]]:
+    """Get the harmonizer of an analysis or of its shard, the chemicals to harmonize and the shard they are
+    filtered by."""
+    harmonizer = ChemicalHarmonizer(
+        shard_name(analysis_name, shard), table_format=table_format
+    )
+
+    if from_genes:
+        gene_analysis = analysis_name
+        if shard is not None and has_gene_chemicals(
+            shard_name(analysis_name, shard), table_format
+        ):
+            # The chemicals of the genes of the shard are all harmonized by the shard
+            gene_analysis, shard = shard_name(analysis_name, shard), None
+
+        if has_gene_chemicals(gene_analysis, table_format):
+            gene_chemical_dict = load_gene_chemicals(gene_analysis, table_format)
         else:
             raise FileNotFoundError(
                 f"Please ensure that you run the experimental data extractor file first."
             )
 
-        for genes in tqdm(
-            gene_chemical_dict, desc="Harmonizing chemicals for patent retrieval"
-        ):
-            # Extract chemical-target data from ChEMBL
-            chemical_list = gene_chemical_dict[genes]
-
-            if len(chemical_list) < 1:
-                genes_skipped += 1
-                continue
-
-            for chembl_id in chemical_list:
-                # Get name for chemical and store in dict
-                if chembl_id not in chemical_names:
-                    chemical_names[chembl_id] = get_chemical_names(chembl_id)
-
-                # Store chembl to surechembl mapping in separate file
-                if chembl_id not in cache_dict:
-                    surechembl_id = get_surechembl_id(
-                        chemical_id=chembl_id,
-                        chemical_name=chemical_names[chembl_id],
-                        chemical_mapper=chemical_mapper,
-                    )
-
-                    if not surechembl_id:
-                        continue
-
-                    cache += 1  # add new data only
-                    cache_dict[chembl_id] = surechembl_id
-
-                    tmp_df = pd.DataFrame(
-                        {
-                            "chembl": chembl_id,
-                            "schembl_id": surechembl_id,
-                            "name": chemical_names[chembl_id],
-                        },
-                        index=[0],
-                    )
-
-                    chemical_df = pd.concat([chemical_df, tmp_df], ignore_index=True)
-
-                    if cache == 10:
-                        chemical_df.to_csv(
-                            f"{PATENT_DIR}/{analysis_name}_chemicals.tsv",
-                            sep="\t",
-                            index=False,
-                        )
-                        cache = 0
-
-                        # Save chemical mapping dict for re-use
-                        with open(
-                            f"{MAPPER_DIR}/{analysis_name}_chemical_names.json", "w"
-                        ) as f:
-                            json.dump(chemical_names, f, ensure_ascii=False, indent=2)
+        chemicals = _iterate_gene_chemicals(gene_chemical_dict)
     else:
-        for _, row in tqdm(
-            chemical_df.iterrows(),
-            total=chemical_df.shape[0],
+        if shard is not None and not harmonizer.chemicals:
+            harmonizer.chemicals = dict(
+                ChemicalHarmonizer(analysis_name, table_format=table_format).chemicals
+            )
+
+        chemicals = tqdm(
+            list(harmonizer.chemicals),
             desc="Harmonzing chemicals for patent retrival",
-        ):
-            chembl_id = row["chembl"]
-            # Get name for chemical and store in dict
-            if chembl_id not in chemical_names:
-                chemical_names[chembl_id] = get_chemical_names(chembl_id)
-
-            # Store chembl to surechembl mapping in separate file
-            if chembl_id not in cache_dict:
-                surechembl_id = get_surechembl_id(
-                    chemical_id=chembl_id,
-                    chemical_name=chemical_names[chembl_id],
-                    chemical_mapper=chemical_mapper,
-                )
-
-                if not surechembl_id:
-                    continue
-
-                cache += 1  # add new data only
-                cache_dict[chembl_id] = surechembl_id
-
-                tmp_df = pd.DataFrame(
-                    {
-                        "chembl": chembl_id,
-                        "schembl_id": surechembl_id,
-                        "name": chemical_names[chembl_id],
-                    },
-                    index=[0],
-                )
-
-                chemical_df = pd.concat([chemical_df, tmp_df], ignore_index=True)
-
-                if cache == 10:
-                    chemical_df.to_csv(
-                        f"{PATENT_DIR}/{analysis_name}_chemicals.tsv",
-                        sep="\t",
-                        index=False,
-                    )
-                    cache = 0
-
-                    # Save chemical mapping dict for re-use
-                    with open(
-                        f"{MAPPER_DIR}/{analysis_name}_chemical_names.json", "w"
-                    ) as f:
-                        json.dump(chemical_names, f, ensure_ascii=False, indent=2)
-
-    chemical_df.dropna(subset=["schembl_id"], inplace=True)
-
-    chemical_df.to_csv(
-        f"{PATENT_DIR}/{analysis_name}_chemicals.tsv", sep="\t", index=False
+        )
+
+    return harmonizer, chemicals, shard
+
+
+@metrics.stage("harmonizer")
+def harmonize_chemicals(
+    analysis_name: str,
+    from_genes: bool = True,
+    table_format: str = "tsv",
+    shard: Optional[Shard] = None,
+    use_async: bool = False,
+) -> None:
+    """Method that allows mapping from ChEMBL to SureChEMBL identifiers.
+
+    :param analysis_name: The name of the analysis you want to run. This name would be used to save the resultant file.
+    :param from_genes: Boolean indicating where the process needs to get chemicals based on genes or not.
+    :param table_format: Format of the chemicals file. It can be either of these: tsv, parquet, feather.
+    :param shard: The (index, count) of the shard to run, see :mod:`pemt.sharding`. The shard harmonizes all
+        chemicals of the same shard of the chemical extractor or, if there is none, its share of the chemicals of
+        the analysis. The results are saved under the name of the shard.
+    :param use_async: Boolean indicating whether the chemicals are harmonized concurrently by
+        :func:`harmonize_chemicals_async` in an event loop of its own.
+    """
+    if use_async:
+        client.run_async(
+            _harmonize_chemicals_async(analysis_name, from_genes, table_format, shard)
+        )
+        return
+
+    harmonizer, chemicals, shard = _harmonizer_inputs(
+        analysis_name, from_genes, table_format, shard
     )
 
-    with open(f"{MAPPER_DIR}/{analysis_name}_chemical_names.json", "w") as f:
-        json.dump(chemical_names, f, ensure_ascii=False, indent=2)
+    for chembl_id in chemicals:
+        if not in_shard(chembl_id, shard):
+            harmonizer.chemicals.pop(chembl_id, None)
+            continue
+
+        harmonizer.harmonize(chembl_id)
+
+    harmonizer.save(drop_unmapped=True)
+
+
+async def _harmonize_chemicals_async(
+    analysis_name: str,
+    from_genes: bool,
+    table_format: str,
+    shard: Optional[Shard],
+) -> None:
+    """Harmonize the chemicals of an analysis concurrently, see :func:`harmonize_chemicals_async`."""
+    harmonizer, chemicals, shard = _harmonizer_inputs(
+        analysis_name, from_genes, table_format, shard
+    )
+
+    def shard_chemicals() -> Iterator[str]:
+        for chembl_id in chemicals:
+            if in_shard(chembl_id, shard):
+                yield chembl_id
+            else:
+                harmonizer.chemicals.pop(chembl_id, None)
+
+    # A window of chemicals is looked up at once, within the limits of the PubChem client. The harmonizer saves
+    # its checkpoints as the chemicals are mapped.
+    results = client.map_async(
+        harmonizer.harmonize_async, shard_chemicals(), client.task_window("pubchem")
+    )
+    try:
+        async for _ in results:
+            pass
+    finally:
+        # Stop the requests of the other chemicals if one failed
+        await results.aclose()
+
+    harmonizer.save(drop_unmapped=True)
+
+
+async def harmonize_chemicals_async(
+    analysis_name: str,
+    from_genes: bool = True,
+    table_format: str = "tsv",
+    shard: Optional[Shard] = None,
+) -> None:
+    """Map ChEMBL to SureChEMBL identifiers from an event loop.
+
+    The chemicals are looked up concurrently, a window of twice the concurrency limit of PubChem at a time, see
+    :func:`pemt.client.map_async`, with at most as many requests in flight as the limit allows. They share the
+    cache and checkpoints of :func:`harmonize_chemicals`. The aiohttp sessions are left open for the other stages
+    of the loop and closed by :func:`pemt.client.close_async_sessions`.
+
+    :param analysis_name: The name of the analysis. This name would be used to save the resultant file.
+    :param from_genes: Boolean indicating where the process needs to get chemicals based on genes or not.
+    :param table_format: Format of the chemicals file. It can be either of these: tsv, parquet, feather, sqlite.
+    :param shard: The (index, count) of the shard to run, see :mod:`pemt.sharding`.
+    """
+    with metrics.stage("harmonizer"):
+        await _harmonize_chemicals_async(analysis_name, from_genes, table_format, shard)
@@ -2,72 +2,208 @@
 
 """Script for extracting patent literature from SureChEMBL."""
 
+import json
 import logging
+import math
 import os
 import time
-from typing import Tuple
+from functools import lru_cache
+from typing import Callable, Dict, Iterable, List, Mapping, Optional, Tuple
 
 import pandas as pd
 from tqdm import tqdm
 
-from pemt.constants import DATA_DIR, PATENT_DIR, VALID_CODES
-
-# Selenium specific settings
-try:
-    from selenium import webdriver
-except ImportError:
-    raise ValueError("please install selenium before running this script")
-
-from selenium.common.exceptions import NoSuchElementException, TimeoutException
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.support.ui import WebDriverWait
-
-chrome_options = Options()
-chrome_options.add_argument("--headless")
-chrome_options.add_argument("--window-size=1920x1080")
-chrome_options.add_argument("--disable-notifications")
-chrome_options.add_argument("--no-sandbox")
-chrome_options.add_argument("--verbose")
-chrome_options.add_experimental_option(
-    "prefs",
-    {
-        "download.prompt_for_download": False,
-        "download.directory_upgrade": True,
-        "safebrowsing_for_trusted_sources_enabled": False,
-        "safebrowsing.enabled": False,
-    },
+from pemt import client, init, metrics
+from pemt.constants import (
+    ARCHIVE_DIR,
+    DATA_DIR,
+    PATENT_DIR,
+    SURECHEMBL_URL,
+    VALID_CODES,
+    WORKSPACE_FORMAT,
 )
-chrome_options.add_argument("--disable-gpu")
-chrome_options.add_argument("--disable-software-rasterizer")
+from pemt.patent_extractor.patent_chemical_harmonizer import (
+    has_chemicals,
+    read_chemical_table,
+)
+from pemt.patent_extractor.patent_store import PatentStore
+from pemt.sharding import Shard, in_shard, shard_name
+from pemt.tables import file_format, write_table
+from pemt.utils import attach_genes
+from pemt.workspace import get_workspace
 
-logger = logging.getLogger("__name__")
-logger.setLevel(logging.INFO)
+logger = logging.getLogger(__name__)
 
 """Constant factors related to scraping"""
+PAGE_SIZE = 50
+HIT_COLUMNS = ["patent_id", "date", "ipc", "assignee"]
 
-os.makedirs(f"{PATENT_DIR}", exist_ok=True)
-os.makedirs(f"{DATA_DIR}", exist_ok=True)
 
+def _import_webdriver():
+    """Import the Selenium webdriver, which is only needed when scraping SureChEMBL."""
+    try:
+        from selenium import webdriver
+    except ImportError:
+        raise ValueError("please install selenium before running this script")
+
+    return webdriver
+
+
+@lru_cache(maxsize=None)
+def get_chrome_options():
+    """Get the options of the headless Chrome browser used for scraping."""
+    from selenium.webdriver.chrome.options import Options
+
+    chrome_options = Options()
+    chrome_options.add_argument("--headless")
+    chrome_options.add_argument("--window-size=1920x1080")
+    chrome_options.add_argument("--disable-notifications")
+    chrome_options.add_argument("--no-sandbox")
+    chrome_options.add_argument("--verbose")
+    chrome_options.add_experimental_option(
+        "prefs",
+        {
+            "download.prompt_for_download": False,
+            "download.directory_upgrade": True,
+            "safebrowsing_for_trusted_sources_enabled": False,
+            "safebrowsing.enabled": False,
+        },
+    )
+    chrome_options.add_argument("--disable-gpu")
+    chrome_options.add_argument("--disable-software-rasterizer")
+    return chrome_options
 
-def get_valid_patent_list(
-    schembl_id: str, system: str, chrome_driver_path: str, year: int
-) -> Tuple[set, int]:
-    """Get valid patents from SureChEMBL based on their IPC criteria and time period.
+
+def _save_progress(progress_file: str, progress: dict) -> None:
+    """Persist the page-level scraping progress of all unfinished compounds.
+
+    The file has a JSON line with the SureChEMBL id and the progress of each compound. The rows scraped later are
+    added with :func:`_append_progress`.
+
+    :param progress_file: Path of the file storing the progress.
+    :param progress: Dictionary mapping SureChEMBL ids to their scraping progress.
+    """
+    with open(f"{progress_file}.tmp", "w") as f:
+        for schembl_id, state in progress.items():
+            f.write(json.dumps([schembl_id, state], ensure_ascii=False) + "\n")
+    os.replace(f"{progress_file}.tmp", progress_file)
+
+
+def _append_progress(
+    progress_file: str, schembl_id: str, state: dict, rows: Iterable[tuple]
+) -> None:
+    """Add the rows scraped since the previous checkpoint of a compound to its persisted progress.
+
+    :param progress_file: Path of the file storing the progress, written by :func:`_save_progress`.
+    :param schembl_id: The SureChEMBL id of the compound.
+    :param state: The progress of the compound. Its "rows" are not written again.
+    :param rows: The rows scraped since the previous checkpoint.
+    """
+    state = {key: value for key, value in state.items() if key != "rows"}
+    with open(progress_file, "a") as f:
+        f.write(json.dumps([schembl_id, state, list(rows)], ensure_ascii=False) + "\n")
+
+
+def _load_progress(progress_file: str) -> dict:
+    """Read the page-level scraping progress of the unfinished compounds.
+
+    :param progress_file: Path of the file storing the progress, written by :func:`_save_progress` and
+        :func:`_append_progress`, or by earlier versions as one JSON document.
+    :returns: Dictionary mapping SureChEMBL ids to their scraping progress.
+    """
+    with open(progress_file) as f:
+        if f.read(1) == "{":
+            f.seek(0)
+            return json.load(f)
+
+        f.seek(0)
+        progress = {}
+        for line in f:
+            try:
+                schembl_id, state, *rows = json.loads(line)
+            except ValueError:  # last line cut short by an interruption
+                logger.warning(f"Ignoring an incomplete line of {progress_file}")
+                break
+
+            if rows:
+                progress[schembl_id].update(state)
+                progress[schembl_id]["rows"].extend(rows[0])
+            else:
+                progress[schembl_id] = state
+
+    return progress
+
+
+def get_patent_hits(
+    schembl_id: str,
+    system: str,
+    chrome_driver_path: str,
+    progress: Optional[dict] = None,
+    checkpoint: Optional[Callable[[dict], None]] = None,
+    known_patents: Optional[Mapping[str, tuple]] = None,
+) -> Tuple[set, Optional[int], bool]:
+    """Get all patents of a compound from SureChEMBL without any filtering.
 
     :param schembl_id: The SureChEMBL id of the compound.
     :param system: The OS on which the code is running. It can be either of these: linux, mac, window.
     :param chrome_driver_path: The path of the chrome driver is located.
-    :param year: The cutt-off year for searching the patent documents
+    :param progress: Progress of an earlier, interrupted run for this compound. It holds the last scraped "page",
+    the "url" of the next page, the "total" number of hits, the "rows" collected so far and whether the scrape is
+    "complete". The dictionary is updated in place after every page, and the rows of a page are added at the end of
+    the "rows".
+    :param checkpoint: Function called with the progress dictionary after every scraped page.
+    :param known_patents: Dictionary mapping patent ids to their (date, IPC, assignee). The metadata of these
+    patents is taken from here instead of being parsed from the page again.
+    :returns: The set of (patent id, date, IPC, assignee) hits, the total number of hits reported by SureChEMBL,
+        or None if the page of the compound did not show it, e.g. because it did not load, and whether all pages
+        were scraped. SureChEMBL may report more hits than its pages list, so only the last page makes a scrape
+        complete.
     """
+    if progress is None:
+        progress = {}
+
+    # All pages were scraped before the interruption
+    if progress.get("page") and not progress.get("url"):
+        return (
+            set(tuple(row) for row in progress["rows"]),
+            progress["total"],
+            progress.get("complete", False),
+        )
 
     # Replace path to chrome driver (https://sites.google.com/a/chromium.org/chromedriver/home)
+    webdriver = _import_webdriver()
     driver = webdriver.Chrome(
-        options=chrome_options,
+        options=get_chrome_options(),
         executable_path=chrome_driver_path,
     )
 
+    try:
+        return _scrape_patent_pages(
+            driver=driver,
+            schembl_id=schembl_id,
+            system=system.lower(),
+            progress=progress,
+            checkpoint=checkpoint,
+            known_patents=known_patents or {},
+        )
+    finally:
+        driver.quit()
+
+
+def _scrape_patent_pages(
+    driver,
+    schembl_id: str,
+    system: str,
+    progress: dict,
+    checkpoint: Optional[Callable[[dict], None]],
+    known_patents: Mapping[str, tuple],
+) -> Tuple[set, Optional[int], bool]:
+    """Walk the patent result pages of a compound starting from the last checkpointed page."""
+    from selenium.common.exceptions import NoSuchElementException, TimeoutException
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     # function to take care of downloading file
     driver.command_executor._commands["send_command"] = (
         "POST",
@@ -79,141 +215,543 @@ def get_valid_patent_list(
     }
     driver.execute("send_command", params)
 
-    system = system.lower()
+    if progress.get("url"):
+        range_val = progress["total"]
+        logger.info(f"Resuming {schembl_id} from page {progress['page'] + 1}")
+        client.call("surechembl", driver.get, progress["url"])
+        time.sleep(8)
+    else:
+        logger.debug("Getting page")
+        client.call("surechembl", driver.get, f"{SURECHEMBL_URL}/chemical/{schembl_id}")
+        logger.debug("Page done")
 
-    logger.debug("Getting page")
-    driver.get(f"https://www.surechembl.org/chemical/{schembl_id}")
-    logger.debug("Page done")
+        time.sleep(8)
 
-    time.sleep(8)
+        # Go to patent tab
+        try:
+            patent_button = driver.find_element_by_xpath(
+                "/html/body/div/div/div[2]/div/div/div[3]/div[2]/ul/li[3]"
+            )
+            patent_button.click()
+        except NoSuchElementException:  # page not loaded, the number of patents is unknown
+            return set(), None, False
 
-    # Go to patent tab
-    try:
-        patent_button = driver.find_element_by_xpath(
-            "/html/body/div/div/div[2]/div/div/div[3]/div[2]/ul/li[3]"
-        )
-        patent_button.click()
-    except NoSuchElementException:  # no patents found
-        return set(), 0
+        time.sleep(15)
 
-    time.sleep(15)
+        try:
+            element_present = EC.presence_of_element_located(
+                (By.ID, "patent-hits-container")
+            )
+            WebDriverWait(driver, 30).until(element_present)
+        except TimeoutException:
+            logger.info("Timed out waiting for page to load")
 
-    try:
-        element_present = EC.presence_of_element_located(
-            (By.ID, "patent-hits-container")
+        # Get the link for opening patent table
+        try:
+            new_link = driver.find_element_by_xpath(
+                "/html/body/div/div/div[2]/div/div/div[3]/div[2]/div[3]/div[3]/a"
+            ).get_attribute("href")
+        except NoSuchElementException:  # no patents found, unless the table did not load
+            range_val = _total_hits(driver)
+            return set(), range_val, range_val is not None
+
+        # Get total number of patents
+        range_val = _total_hits(driver)
+        if range_val is None:
+            return set(), None, False
+
+        client.call("surechembl", driver.get, new_link)
+        time.sleep(2)
+
+        progress.update(
+            {
+                "page": 0,
+                "url": new_link,
+                "total": range_val,
+                "rows": [],
+                "complete": False,
+            }
         )
-        WebDriverWait(driver, 30).until(element_present)
-    except TimeoutException:
-        logger.info("Timed out waiting for page to load")
 
-    # Get the link for opening patent table
-    try:
-        new_link = driver.find_element_by_xpath(
-            "/html/body/div/div/div[2]/div/div/div[3]/div[2]/div[3]/div[3]/a"
-        ).get_attribute("href")
-    except NoSuchElementException:  # no patents found
-        return set(), 0
-
-    # Get total number of patents
-    range_val = int(
-        driver.find_element_by_xpath("//span[@class='total_hits_data']").text.replace(
-            ",", ""
-        )
-    )
+    rows = progress["rows"]
+    patent_info = set(tuple(row) for row in rows)
 
-    driver.get(new_link)
-    time.sleep(2)
+    # Windows drivers render the page with an explicit index on the outer div
+    body = "/html/body/div[1]" if system not in ["linux", "mac"] else "/html/body/div"
+    table = f"{body}/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody"
 
-    patent_info = set()
+    total_pages = max(1, math.ceil(range_val / PAGE_SIZE))
 
     logger.info(f"Looking into {range_val} patents for {schembl_id}")
 
-    for patent_count in range(1, range_val + 1):
-        for i in range(2, 52):  # max number of elements in each page
+    for page in range(progress["page"] + 1, total_pages + 1):
+        for i in range(2, PAGE_SIZE + 2):  # max number of elements in each page
             try:
-                if system not in ["linux", "mac"]:
-                    ipc_num = driver.find_element_by_xpath(
-                        f"/html/body/div[1]/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[4]/div[1]/table/tbody/tr/td[1]"
-                    ).text
-                else:
-                    ipc_num = driver.find_element_by_xpath(
-                        f"/html/body/div/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[4]/div[1]/table/tbody/tr/td[1]"
-                    ).text
-            except NoSuchElementException:  # No IPC code found
-                continue
-
-            if not ipc_num:  # cases where IPC number is missing are skipped
+                patent_number = driver.find_element_by_xpath(
+                    f"{table}/tr[{i}]/td[2]"
+                ).text.split("\n")[1]
+            except NoSuchElementException:  # Row not present on the page
                 continue
 
-            # Filter based on codes
-            code = ipc_num.split()[0]
-            if code not in VALID_CODES:
+            # Patent already parsed for another compound
+            if patent_number in known_patents:
+                row = (patent_number, *known_patents[patent_number])
+                if row not in patent_info:
+                    patent_info.add(row)
+                    rows.append(row)
                 continue
 
-            if system not in ["linux", "mac"]:
-                patent_date = driver.find_element_by_xpath(
-                    f"/html/body/div[1]/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[3]"
-                ).text
-            else:
-                patent_date = driver.find_element_by_xpath(
-                    f"/html/body/div/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[3]"
+            try:
+                ipc_num = driver.find_element_by_xpath(
+                    f"{table}/tr[{i}]/td[4]/div[1]/table/tbody/tr/td[1]"
                 ).text
-            patent_year = int(patent_date.split("-")[0])
-
-            # Filter based on patent year
-            if patent_year < year:
-                continue
+            except NoSuchElementException:  # No IPC code found
+                ipc_num = ""
 
-            if system not in ["linux", "mac"]:
-                patent_number = driver.find_element_by_xpath(
-                    f"/html/body/div[1]/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[2]"
-                ).text.split("\n")[1]
-            else:
-                patent_number = driver.find_element_by_xpath(
-                    f"/html/body/div/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[2]"
-                ).text.split("\n")[1]
+            patent_date = driver.find_element_by_xpath(f"{table}/tr[{i}]/td[3]").text
 
             # Get assignee information
-            if system not in ["linux", "mac"]:
-                assignee = driver.find_element_by_xpath(
-                    f"/html/body/div[1]/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[4]/div[1]/table/tbody/tr/td[2]/a"
-                ).text
-            else:
+            try:
                 assignee = driver.find_element_by_xpath(
-                    f"/html/body/div/div/div[2]/div[1]/div[2]/div/div[2]/table/tbody/tr[{i}]/td[4]/div[1]/table/tbody/tr/td[2]/a"
+                    f"{table}/tr[{i}]/td[4]/div[1]/table/tbody/tr/td[2]/a"
                 ).text
-            patent_info.add((patent_number, patent_date, ipc_num, assignee))
+            except NoSuchElementException:
+                assignee = ""
 
-        if range_val < 50:  # entry fits in 1 page
-            break
+            row = (patent_number, patent_date, ipc_num, assignee)
+            if row not in patent_info:
+                patent_info.add(row)
+                rows.append(row)
 
-        # Go to next page
-        try:
-            if patent_count == 1:
-                nx_button_num = 2
-            else:
-                nx_button_num = 4
-            if system not in ["linux", "mac"]:
-                next_page = driver.find_element_by_xpath(
-                    f"/html/body/div[1]/div/div[2]/div[1]/div[2]/div[1]/div[3]/div[2]/ul/li[{nx_button_num}]/a"
-                ).get_attribute("href")
-            else:
+        next_page = None
+
+        if page < total_pages:
+            # Go to next page
+            nx_button_num = 2 if page == 1 else 4
+            try:
                 next_page = driver.find_element_by_xpath(
-                    f"/html/body/div/div/div[2]/div[1]/div[2]/div[1]/div[3]/div[2]/ul/li[{nx_button_num}]/a"
+                    f"{body}/div/div[2]/div[1]/div[2]/div[1]/div[3]/div[2]/ul/li[{nx_button_num}]/a"
                 ).get_attribute("href")
-            driver.get(next_page)
-            time.sleep(8)
-        except NoSuchElementException:
+            except NoSuchElementException:
+                logger.warning(f"No link to page {page + 1} found for {schembl_id}")
+
+        # The scrape is complete once the last page is reached, not when a link to the next page is missing
+        progress.update(
+            {"page": page, "url": next_page, "complete": page == total_pages}
+        )
+        if checkpoint is not None:
+            checkpoint(progress)
+
+        if next_page is None:
+            break
+
+        client.call("surechembl", driver.get, next_page)
+        time.sleep(8)
+
+    return patent_info, range_val, progress["complete"]
+
+
+def _total_hits(driver) -> Optional[int]:
+    """Get the total number of patent hits shown on the page of a compound, or None if it is not shown."""
+    from selenium.common.exceptions import NoSuchElementException
+
+    try:
+        total_hits = driver.find_element_by_xpath("//span[@class='total_hits_data']")
+    except NoSuchElementException:
+        return None
+
+    return int(total_hits.text.replace(",", ""))
+
+
+def get_valid_patent_list(
+    schembl_id: str,
+    system: str,
+    chrome_driver_path: str,
+    year: int,
+    progress: Optional[dict] = None,
+    checkpoint: Optional[Callable[[dict], None]] = None,
+) -> Tuple[set, Optional[int]]:
+    """Get valid patents from SureChEMBL based on their IPC criteria and time period.
+
+    :param schembl_id: The SureChEMBL id of the compound.
+    :param system: The OS on which the code is running. It can be either of these: linux, mac, window.
+    :param chrome_driver_path: The path of the chrome driver is located.
+    :param year: The cutt-off year for searching the patent documents
+    :param progress: Progress of an earlier, interrupted run for this compound. See :func:`get_patent_hits`.
+    :param checkpoint: Function called with the progress dictionary after every scraped page.
+    """
+    patent_hits, range_val, _ = get_patent_hits(
+        schembl_id=schembl_id,
+        system=system,
+        chrome_driver_path=chrome_driver_path,
+        progress=progress,
+        checkpoint=checkpoint,
+    )
+    hit_df = filter_patents(
+        pd.DataFrame(sorted(patent_hits), columns=HIT_COLUMNS), year=year
+    )
+    return set(hit_df.itertuples(index=False, name=None)), range_val
+
+
+def filter_patents(
+    hit_df: pd.DataFrame, year: int, valid_codes: Iterable[str] = VALID_CODES
+) -> pd.DataFrame:
+    """Keep the patents published in or after the given year with a valid main IPC code.
+
+    :param hit_df: Dataframe with the "date" and "ipc" columns of patent hits.
+    :param year: The cutt-off year for the patent documents
+    :param valid_codes: IPC classes that are considered relevant for drug discovery.
+    """
+    ipc = hit_df["ipc"].fillna("").astype(str)
+    code = ipc.str.split(n=1).str[0]
+    patent_year = pd.to_numeric(
+        hit_df["date"].astype(str).str.split("-", n=1).str[0], errors="coerce"
+    )
+    mask = code.isin(set(valid_codes)) & (patent_year >= year)
+    return hit_df[mask.to_numpy()]
+
+
+def _archive_path(schembl_id: str) -> str:
+    """Get the path of the compressed hit archive of a compound."""
+    return f"{ARCHIVE_DIR}/{schembl_id}.tsv.gz"
+
+
+def _archive_info_path(schembl_id: str) -> str:
+    """Get the path of the JSON file describing the hit archive of a compound."""
+    return f"{ARCHIVE_DIR}/{schembl_id}.json"
+
+
+def load_archive_info(schembl_id: str) -> Optional[dict]:
+    """Load how many patent hits of a compound were archived.
+
+    :param schembl_id: The SureChEMBL id of the compound.
+    :returns: The "total" number of hits reported by SureChEMBL, None if unknown, the number of archived "rows" and
+        whether the archive is "complete", or None if the compound has not been scraped yet. Archives written before
+        this was recorded count as complete.
+    """
+    if not os.path.exists(_archive_path(schembl_id)):
+        return None
+
+    if not os.path.exists(_archive_info_path(schembl_id)):
+        return {"total": None, "rows": None, "complete": True}
+
+    with open(_archive_info_path(schembl_id)) as f:
+        return json.load(f)
+
+
+def incomplete_archives(schembl_ids: Iterable[str]) -> List[str]:
+    """Get the compounds whose archive misses some of their patent hits.
+
+    :param schembl_ids: The SureChEMBL ids of the compounds.
+    """
+    incomplete = []
+
+    for schembl_id in schembl_ids:
+        info = load_archive_info(schembl_id)
+        if info is not None and not info["complete"]:
+            incomplete.append(schembl_id)
+
+    return incomplete
+
+
+def load_patent_archive(schembl_id: str) -> Optional[pd.DataFrame]:
+    """Load the unfiltered patent hits of a compound from the local archive.
+
+    :param schembl_id: The SureChEMBL id of the compound.
+    :returns: The archived hits or None if the compound has not been scraped yet. See :func:`load_archive_info` for
+        whether they are complete.
+    """
+    if not os.path.exists(_archive_path(schembl_id)):
+        return None
+
+    return pd.read_csv(
+        _archive_path(schembl_id), sep="\t", dtype=str, keep_default_na=False
+    )
+
+
+def save_patent_archive(
+    schembl_id: str,
+    patent_hits: Iterable[tuple],
+    total: Optional[int],
+    complete: bool,
+) -> pd.DataFrame:
+    """Store the unfiltered patent hits of a compound in the local archive.
+
+    Incomplete archives, e.g. of pages that did not load or whose link to the next page was missing, are scraped
+    again by :class:`PatentExtractor`.
+
+    :param schembl_id: The SureChEMBL id of the compound.
+    :param patent_hits: The (patent id, date, IPC, assignee) hits of the compound.
+    :param total: The total number of hits reported by SureChEMBL, None if unknown.
+    :param complete: Whether all pages of hits were scraped. They may hold fewer hits than the reported total.
+    """
+    hit_df = pd.DataFrame(sorted(patent_hits), columns=HIT_COLUMNS)
+    info = {"total": total, "rows": len(hit_df), "complete": complete}
+
+    # The description is written first, an archive without one would count as complete
+    with open(f"{_archive_info_path(schembl_id)}.tmp", "w") as f:
+        json.dump(info, f)
+    os.replace(f"{_archive_info_path(schembl_id)}.tmp", _archive_info_path(schembl_id))
+
+    hit_df.to_csv(
+        f"{_archive_path(schembl_id)}.tmp",
+        sep="\t",
+        index=False,
+        compression="gzip",
+    )
+    os.replace(f"{_archive_path(schembl_id)}.tmp", _archive_path(schembl_id))
+    return hit_df
+
+
+def read_chemicals(analysis_name: str, table_format: str = "tsv") -> pd.DataFrame:
+    """Read the ChEMBL and SureChEMBL identifiers of the harmonized chemicals of an analysis.
+
+    :param analysis_name: Name of the analysis.
+    :param table_format: Preferred format of the chemicals file. Other formats are read if it does not exist.
+    """
+    return read_chemical_table(analysis_name, table_format)[["chembl", "schembl_id"]]
+
+
+@metrics.stage("refilter")
+def refilter_patents(
+    analysis_name: str,
+    patent_year: int = 2000,
+    valid_codes: Iterable[str] = VALID_CODES,
+    table_format: str = "tsv",
+) -> pd.DataFrame:
+    """Rebuild the patent store of an analysis from the archived hits without scraping SureChEMBL.
+
+    :param analysis_name: Name of the analysis.
+    :param patent_year: The cutt-off year for the patent documents
+    :param valid_codes: IPC classes that are considered relevant for drug discovery.
+    :param table_format: Format of the patent store tables. It can be either of these: tsv, parquet, feather.
+    """
+    df = read_chemicals(analysis_name, table_format).dropna(subset=["schembl_id"])
+
+    hit_dfs = []
+    archived = []
+
+    for chembl_id, surechembl_idx in df.values:
+        hit_df = load_patent_archive(surechembl_idx)
+        if hit_df is None:
             continue
 
-    return patent_info, range_val
+        archived.append((chembl_id, surechembl_idx))
+        hit_df.insert(0, "chembl", chembl_id)
+        hit_df.insert(1, "surechembl", surechembl_idx)
+        hit_dfs.append(hit_df)
+
+    if len(archived) < df.shape[0]:
+        logger.warning(
+            f"{df.shape[0] - len(archived)} chemicals have no archived patents. "
+            f"Run the patent extractor to retrieve them."
+        )
+
+    incomplete = incomplete_archives({schembl_id for _, schembl_id in archived})
+    if incomplete:
+        logger.warning(
+            f"{len(incomplete)} compounds have incomplete archived patents. "
+            f"Run the patent extractor to scrape them again."
+        )
+
+    if not archived:
+        return pd.DataFrame()
+
+    hit_df = pd.concat(hit_dfs, ignore_index=True)
+    valid_df = filter_patents(hit_df, year=patent_year, valid_codes=valid_codes)
+
+    # Links are rebuilt from scratch, all archived patent metadata is kept
+    store = PatentStore(analysis_name, table_format)
+    store.filters = {"year": patent_year, "ipc_codes": sorted(valid_codes)}
+    store.add_patents(hit_df)
+
+    valid_ids = valid_df.groupby(["chembl", "surechembl"], sort=False)["patent_id"]
+    valid_ids = valid_ids.agg(list).to_dict()
+    for chemical in archived:
+        store.link(*chemical, valid_ids.get(chemical, []))
+
+    store.save()
+    return store.to_wide()
+
+
+class PatentExtractor:
+    """Extraction of the valid patents of compounds into the patent store of an analysis.
+
+    Compounds are scraped from SureChEMBL only when they are not archived yet or their archive is incomplete.
+    The store is written after every few scraped compounds and the page-level progress after every scraped page.
+    """
+
+    def __init__(
+        self,
+        analysis_name: str,
+        chrome_driver_path: str,
+        os_system: str = "linux",
+        patent_year: int = 2000,
+        checkpoint_every: int = 5,
+        table_format: str = "tsv",
+        rescrape: bool = False,
+    ):
+        """Load the patent store and scraping progress of an analysis.
+
+        :param analysis_name: Name of the analysis.
+        :param chrome_driver_path: The path of the chrome driver is located.
+        :param os_system: The OS on which the code is running. It can be either of these: linux, mac, window.
+        :param patent_year: The cutt-off year for searching the patent documents
+        :param checkpoint_every: Number of scraped compounds after which the store is written.
+        :param table_format: Format of the patent store tables. It can be either of these: tsv, parquet, feather.
+        :param rescrape: Scrape all compounds again, even those with a complete archive, e.g. to get patents
+            published since they were archived.
+        """
+        init()
+
+        self.chrome_driver_path = chrome_driver_path
+        self.os_system = os_system.lower()
+        assert self.os_system in ["linux", "mac", "windows"]
+        self.patent_year = patent_year
+        self.checkpoint_every = checkpoint_every
+        self.rescrape = rescrape
+        self._scraped = 0
+        # Compounds scraped by this extractor, they are not scraped again for other ChEMBL ids
+        self._scraped_ids = set()
+
+        # Check for existing patent store
+        self.store = PatentStore.load(analysis_name, table_format)
+
+        # Chemicals linked with other filters are linked again from their archived hits
+        filters = {"year": patent_year, "ipc_codes": sorted(VALID_CODES)}
+        if self.store.filters is not None and self.store.filters != filters:
+            logger.info(f"Patent filters changed, re-linking chemicals to patents")
+            self.store.clear_links()
+        self.store.filters = filters
+
+        # Page-level progress of compounds whose scraping was interrupted
+        self.progress_file = f"{PATENT_DIR}/{analysis_name}_patent_progress.json"
+        self.workspace = None
+        if table_format == WORKSPACE_FORMAT:
+            self.workspace = get_workspace(analysis_name)
+            self.progress = self.workspace.load_progress()
+        elif os.path.exists(self.progress_file):
+            self.progress = _load_progress(self.progress_file)
+        else:
+            self.progress = {}
+        # SureChEMBL id -> number of its rows persisted by this extractor
+        self._checkpointed: Dict[str, int] = {}
+
+    def _save_progress(self, schembl_id: str) -> None:
+        """Persist the scraping progress of a compound, or forget it once the compound is archived."""
+        if self.workspace is not None:
+            self.workspace.save_progress(schembl_id, self.progress.get(schembl_id))
+        else:
+            _save_progress(self.progress_file, self.progress)
+
+        if schembl_id in self.progress:
+            self._checkpointed[schembl_id] = len(self.progress[schembl_id]["rows"])
+        else:
+            self._checkpointed.pop(schembl_id, None)
+
+    def _checkpoint(self, schembl_id: str) -> None:
+        """Persist the rows of a compound scraped since its previous checkpoint."""
+        state = self.progress[schembl_id]
+
+        # The first checkpoint of a compound writes all its progress
+        if schembl_id not in self._checkpointed:
+            self._save_progress(schembl_id)
+            return
+
+        rows = state["rows"][self._checkpointed[schembl_id] :]
+        if self.workspace is not None:
+            self.workspace.append_progress(schembl_id, state, rows)
+        else:
+            _append_progress(self.progress_file, schembl_id, state, rows)
+        self._checkpointed[schembl_id] = len(state["rows"])
+
+    def extract(
+        self,
+        chembl_id: str,
+        surechembl_idx: str,
+        hit_df: Optional[pd.DataFrame] = None,
+    ) -> Optional[pd.DataFrame]:
+        """Add the valid patents of a compound to the store.
+
+        :param chembl_id: ChEMBL identifier of the compound
+        :param surechembl_idx: SureChEMBL identifier of the compound
+        :param hit_df: Unfiltered hits of the compound, if they have already been loaded, e.g. for another analysis.
+        :returns: The unfiltered hits of the compound, or the given hits if the compound was already in the store.
+        """
+        # Archives that are incomplete, or all of them when re-scraping, are replaced by a new scrape
+        outdated = False
+        if hit_df is None and surechembl_idx not in self._scraped_ids:
+            info = load_archive_info(surechembl_idx)
+            outdated = info is not None and (self.rescrape or not info["complete"])
+
+        if (chembl_id, surechembl_idx) in self.store and not outdated:
+            metrics.cache("patent_store", hit=True)
+            return hit_df
+
+        metrics.cache("patent_store", hit=False)
+
+        # Re-use the unfiltered hits of compounds scraped earlier
+        if hit_df is None and not outdated:
+            hit_df = load_patent_archive(surechembl_idx)
+            metrics.cache("patent_archive", hit=hit_df is not None)
+
+        if hit_df is None:
+            patent_hits, total, complete = get_patent_hits(
+                schembl_id=surechembl_idx,
+                system=self.os_system,
+                chrome_driver_path=self.chrome_driver_path,
+                progress=self.progress.setdefault(surechembl_idx, {}),
+                checkpoint=lambda _: self._checkpoint(surechembl_idx),
+                known_patents=self.store.patents,
+            )
+            hit_df = save_patent_archive(surechembl_idx, patent_hits, total, complete)
+            if not complete:
+                logger.warning(
+                    f"Only {len(hit_df)} of {total if total is not None else 'an unknown number of'} patents of "
+                    f"{surechembl_idx} were scraped, they are scraped again on the next run"
+                )
+
+            # The archive now holds all pages of the compound that could be scraped
+            self.progress.pop(surechembl_idx, None)
+            self._save_progress(surechembl_idx)
+            self._scraped_ids.add(surechembl_idx)
+            self._scraped += 1
+
+        self.store.add_patents(hit_df)
+        self.store.link(
+            chembl_id,
+            surechembl_idx,
+            filter_patents(hit_df, year=self.patent_year)["patent_id"],
+        )
+
+        if self._scraped == self.checkpoint_every:  # in case of internet issues
+            self.store.save()
+            self._scraped = 0
+
+        return hit_df
+
+    def close(self) -> pd.DataFrame:
+        """Write the store, clear the scraping progress and return the wide patent data."""
+        self.store.save()
+        self._scraped = 0
 
+        if self.workspace is not None:
+            self.workspace.clear_progress()
+        elif os.path.exists(self.progress_file):
+            os.remove(self.progress_file)
 
+        return self.store.to_wide()
+
+
+@metrics.stage("patents")
 def extract_patent(
     analysis_name: str,
     chrome_driver_path: str,
     os_system: str = "linux",
     patent_year: int = 2000,
+    table_format: str = "tsv",
+    shard: Optional[Shard] = None,
+    rescrape: bool = False,
 ) -> pd.DataFrame:
     """Extract and store all valid patent document metadata.
 
@@ -221,103 +759,80 @@ def extract_patent(
     :param os_system: The OS on which the code is running. It can be either of these: linux, mac, window.
     :param chrome_driver_path: The path of the chrome driver is located.
     :param patent_year: The cutt-off year for searching the patent documents
+    :param table_format: Format of the patent store tables. It can be either of these: tsv, parquet, feather.
+    :param shard: The (index, count) of the shard to run, see :mod:`pemt.sharding`. The shard extracts the patents
+        of all chemicals of the same shard of the chemical harmonizer or, if there is none, of the compounds of the
+        analysis in its share. The patents are stored under the name of the shard.
+    :param rescrape: Scrape all compounds again, even those with a complete archive.
     """
-    df = pd.read_csv(
-        f"{PATENT_DIR}/{analysis_name}_chemicals.tsv",
-        sep="\t",
-        dtype=str,
-        usecols=["chembl", "schembl_id"],
-    )
+    if shard is not None and has_chemicals(
+        shard_name(analysis_name, shard), table_format
+    ):
+        # The compounds harmonized by the shard are all extracted by the shard
+        df = read_chemicals(shard_name(analysis_name, shard), table_format)
+    else:
+        df = read_chemicals(analysis_name, table_format)
+        df = df[df["schembl_id"].map(lambda idx: in_shard(idx, shard))]
 
-    if df.empty:
+    # A shard without compounds still writes its empty store, so that it can be merged
+    if df.empty and shard is None:
         return pd.DataFrame()
 
-    os_system = os_system.lower()
-    assert os_system in ["linux", "mac", "windows"]
+    extractor = PatentExtractor(
+        analysis_name=shard_name(analysis_name, shard),
+        chrome_driver_path=chrome_driver_path,
+        os_system=os_system,
+        patent_year=patent_year,
+        table_format=table_format,
+        rescrape=rescrape,
+    )
     logger.warning(
-        f"Currently running on {os_system} OS. Please change if this is not the case."
+        f"Currently running on {extractor.os_system} OS. Please change if this is not the case."
     )
 
-    # Check for existing cache file
-    if os.path.exists(f"{PATENT_DIR}/{analysis_name}_patent_data.tsv"):
-        patent_df = pd.read_csv(
-            f"{PATENT_DIR}/{analysis_name}_patent_data.tsv", sep="\t"
-        )
-    else:
-        patent_df = pd.DataFrame(columns=["chembl", "surechembl"])
-
-    cache_count = 0
-
     for chembl_id, surechembl_idx in tqdm(df.values, total=df.shape[0]):
         if pd.isna(surechembl_idx):
             continue
 
-        _info_df = patent_df[
-            (patent_df["chembl"] == chembl_id)
-            & (patent_df["surechembl"] == surechembl_idx)
-        ]
+        extractor.extract(chembl_id, surechembl_idx)
 
-        if not _info_df.empty:
-            continue
+    return extractor.close()
 
-        cache_count += 1
 
-        patent_info, total = get_valid_patent_list(
-            schembl_id=surechembl_idx,
-            system=os_system,
-            chrome_driver_path=chrome_driver_path,
-            year=patent_year,
-        )
+def export_patent_data(
+    analysis_name: str,
+    patent_df: pd.DataFrame,
+    gene_chemical_dict: Optional[Mapping[str, list]] = None,
+    table_format: str = "tsv",
+) -> List[str]:
+    """Write the patents of an analysis without the chemicals that have none, optionally annotated with genes.
 
-        if len(patent_info) == 0:
-            patent_df = pd.concat(
-                [
-                    patent_df,
-                    pd.DataFrame(
-                        {
-                            "chembl": chembl_id,
-                            "surechembl": surechembl_idx,
-                            "patent_id": "",
-                            "date": "",
-                            "ipc": "",
-                            "assignee": "",
-                        },
-                        index=[0],
-                    ),
-                ],
-                ignore_index=True,
-            )
-        else:
-            for patent in patent_info:
-                (pid, date, ipc_code, assignee) = patent
-                patent_df = pd.concat(
-                    [
-                        patent_df,
-                        pd.DataFrame(
-                            {
-                                "chembl": chembl_id,
-                                "surechembl": surechembl_idx,
-                                "patent_id": pid,
-                                "date": date,
-                                "ipc": ipc_code,
-                                "assignee": assignee,
-                            },
-                            index=[0],
-                        ),
-                    ],
-                    ignore_index=True,
-                )
+    :param analysis_name: Name of the analysis.
+    :param patent_df: The wide patent data, see :meth:`PatentStore.to_wide`.
+    :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals. If given, the patents are also
+        written with a column of the genes of their chemical.
+    :param table_format: Format of the files. It can be either of these: tsv, parquet, feather. The files of
+        analyses kept in a workspace are written as TSV.
+    :returns: The paths of the written files.
+    """
+    table_format = file_format(table_format)
 
-        if cache_count == 5:  # in case of internet issues
-            patent_df.drop_duplicates(inplace=True)
-            patent_df.to_csv(
-                f"{PATENT_DIR}/{analysis_name}_patent_data.tsv", sep="\t", index=False
+    # Since the original patent data has chemical with no patents, we remove those entries from the data
+    patent_df = patent_df[~patent_df["patent_id"].isna()]
+    output_files = [
+        write_table(
+            patent_df, f"{PATENT_DIR}/cleaned_{analysis_name}_patent_data", table_format
+        )
+    ]
+
+    if gene_chemical_dict is not None:
+        patent_df = attach_genes(patent_df, gene_chemical_dict)
+        output_files.append(
+            write_table(
+                patent_df,
+                f"{PATENT_DIR}/{analysis_name}_gene_patent_data",
+                table_format,
             )
-            cache_count = 0
+        )
 
-    patent_df.drop_duplicates(inplace=True)
-    patent_df.dropna(subset=["patent_id", "date", "ipc"], inplace=True)
-    patent_df.to_csv(
-        f"{PATENT_DIR}/{analysis_name}_patent_data.tsv", sep="\t", index=False
-    )
-    return patent_df
+    return output_files
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+"""Normalized storage of the patents retrieved for the chemicals of an analysis."""
+
+import json
+import logging
+import os
+from collections import defaultdict
+from itertools import islice
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from pemt.constants import PATENT_DIR, WORKSPACE_FORMAT
+from pemt.tables import file_format, find_table, read_table, table_path, write_table
+from pemt.workspace import get_workspace
+
+logger = logging.getLogger(__name__)
+
+PATENT_COLUMNS = ["patent_id", "date", "ipc", "assignee"]
+WIDE_COLUMNS = ["chembl", "surechembl"] + PATENT_COLUMNS
+
+
+class PatentStore:
+    """Patents table keyed by patent id and an integer-encoded chemical-patent edge list.
+
+    Every patent is stored once, no matter how many chemicals it is linked to. The edge list refers to chemicals
+    and patents by their row in the respective table and is kept as two int32 arrays.
+
+    In the workspace of an analysis ("sqlite" format), the patents, chemicals and edges are tables indexed by their
+    row, and a save only adds the rows added since the previous one.
+    """
+
+    def __init__(self, analysis_name: str, table_format: str = "tsv"):
+        """Create an empty store.
+
+        :param analysis_name: Name of the analysis. This name is used for the files of the store.
+        :param table_format: Format of the patent and chemical tables. It can be either of these: tsv, parquet,
+            feather, or sqlite to keep the store in the workspace of the analysis.
+        """
+        self.analysis_name = analysis_name
+        self.table_format = table_format
+        # patent id -> (date, ipc, assignee), in the order of the patent index
+        self.patents: Dict[str, Tuple[str, str, str]] = {}
+        self._patent_index: Dict[str, int] = {}
+        # (chembl, surechembl) -> chemical index
+        self._chemical_index: Dict[Tuple[str, str], int] = {}
+        self._edges: List[Tuple[int, int]] = []
+        self._edge_set = set()
+        # Year and IPC filters the links were made with, None if unknown
+        self.filters: Optional[dict] = None
+        # Number of patents, chemicals and edges in the workspace, None if it has to be rewritten
+        self._saved: Optional[Tuple[int, int, int]] = None
+
+    @property
+    def patent_file(self) -> str:
+        """Path of the patents table."""
+        return table_path(
+            f"{PATENT_DIR}/{self.analysis_name}_patents", self.table_format
+        )
+
+    @property
+    def chemical_file(self) -> str:
+        """Path of the chemicals table."""
+        return table_path(
+            f"{PATENT_DIR}/{self.analysis_name}_patent_chemicals", self.table_format
+        )
+
+    @property
+    def edge_file(self) -> str:
+        """Path of the chemical-patent edge list."""
+        return f"{PATENT_DIR}/{self.analysis_name}_patent_edges.npz"
+
+    @property
+    def legacy_file(self) -> str:
+        """Path of the wide patent data file."""
+        return table_path(
+            f"{PATENT_DIR}/{self.analysis_name}_patent_data", self.table_format
+        )
+
+    @property
+    def chemicals(self) -> List[Tuple[str, str]]:
+        """The (ChEMBL id, SureChEMBL id) pairs processed so far."""
+        return list(self._chemical_index)
+
+    @property
+    def edges(self) -> np.ndarray:
+        """Chemical-patent edges as an (n, 2) array of chemical and patent indices."""
+        return np.array(self._edges, dtype=np.int32).reshape(-1, 2)
+
+    def __contains__(self, chemical: Tuple[str, str]) -> bool:
+        """Check whether a (ChEMBL id, SureChEMBL id) pair has been processed."""
+        return chemical in self._chemical_index
+
+    def add_patents(self, hit_df: pd.DataFrame) -> None:
+        """Register the metadata of patents that are not in the store yet.
+
+        :param hit_df: Dataframe with the patent id, date, IPC and assignee of patents.
+        """
+        for patent_id, date, ipc, assignee in hit_df[PATENT_COLUMNS].itertuples(
+            index=False, name=None
+        ):
+            if patent_id in self._patent_index:
+                continue
+            self._patent_index[patent_id] = len(self.patents)
+            self.patents[patent_id] = (date, ipc, assignee)
+
+    def link(
+        self, chembl_id: str, surechembl_id: str, patent_ids: Iterable[str]
+    ) -> None:
+        """Mark a chemical as processed and link it to its patents.
+
+        :param chembl_id: ChEMBL identifier of the chemical
+        :param surechembl_id: SureChEMBL identifier of the chemical
+        :param patent_ids: Identifiers of patents already registered with :meth:`add_patents`.
+        """
+        chemical_idx = self._chemical_index.setdefault(
+            (chembl_id, surechembl_id), len(self._chemical_index)
+        )
+        for patent_id in patent_ids:
+            edge = (chemical_idx, self._patent_index[patent_id])
+            if edge in self._edge_set:
+                continue
+            self._edge_set.add(edge)
+            self._edges.append(edge)
+
+    def add(self, chembl_id: str, surechembl_id: str, hit_df: pd.DataFrame) -> None:
+        """Register the patents of a chemical and link them to it.
+
+        :param chembl_id: ChEMBL identifier of the chemical
+        :param surechembl_id: SureChEMBL identifier of the chemical
+        :param hit_df: Dataframe with the patent id, date, IPC and assignee of the chemical's patents.
+        """
+        self.add_patents(hit_df)
+        self.link(chembl_id, surechembl_id, hit_df["patent_id"])
+
+    def update(self, other: "PatentStore") -> None:
+        """Add the patents, chemicals and links of another store, e.g. of a shard of the analysis.
+
+        :param other: The store to add.
+        """
+        patent_ids = list(other.patents)
+        self.add_patents(
+            pd.DataFrame(
+                [(patent_id, *meta) for patent_id, meta in other.patents.items()],
+                columns=PATENT_COLUMNS,
+            )
+        )
+
+        links = defaultdict(list)
+        for chemical_idx, patent_idx in other.edges.tolist():
+            links[chemical_idx].append(patent_ids[patent_idx])
+
+        for chemical_idx, chemical in enumerate(other.chemicals):
+            self.link(*chemical, links[chemical_idx])
+
+    def clear_links(self) -> None:
+        """Forget the processed chemicals and their links while keeping the patent metadata."""
+        self._chemical_index = {}
+        self._edges = []
+        self._edge_set = set()
+        self._saved = None
+
+    def to_wide(self) -> pd.DataFrame:
+        """Generate the wide patent data with one row per chemical and patent.
+
+        Chemicals without patents are kept as a single row with empty patent columns.
+        """
+        chemical_df = pd.DataFrame(self.chemicals, columns=["chembl", "surechembl"])
+        patent_df = pd.DataFrame(
+            [(patent_id, *meta) for patent_id, meta in self.patents.items()],
+            columns=PATENT_COLUMNS,
+        )
+        edges = self.edges
+
+        wide_df = pd.concat(
+            [
+                chemical_df.iloc[edges[:, 0]].reset_index(drop=True),
+                patent_df.iloc[edges[:, 1]].reset_index(drop=True),
+            ],
+            axis=1,
+        )
+
+        no_patents = np.setdiff1d(np.arange(chemical_df.shape[0]), edges[:, 0])
+        wide_df = pd.concat([wide_df, chemical_df.iloc[no_patents]], ignore_index=True)
+        return wide_df[WIDE_COLUMNS]
+
+    def _save_workspace(self) -> None:
+        """Add the patents, chemicals and edges that are new since the last save to the workspace."""
+        num_patents, num_chemicals, num_edges = self._saved or (0, 0, 0)
+
+        get_workspace(self.analysis_name).save_patent_store(
+            # Patents and chemicals are indexed in the order they were added
+            patents=(
+                (idx, patent_id, *self.patents[patent_id])
+                for patent_id, idx in islice(
+                    self._patent_index.items(), num_patents, None
+                )
+            ),
+            chemicals=(
+                (idx, *chemical)
+                for chemical, idx in islice(
+                    self._chemical_index.items(), num_chemicals, None
+                )
+            ),
+            edges=self._edges[num_edges:],
+            filters=self.filters,
+            replace=self._saved is None,
+        )
+        self._saved = (len(self.patents), len(self._chemical_index), len(self._edges))
+
+    def save(self) -> None:
+        """Write the patents, chemicals and edges of the store to disk."""
+        if self.table_format == WORKSPACE_FORMAT:
+            self._save_workspace()
+            return
+
+        write_table(
+            pd.DataFrame(
+                [(patent_id, *meta) for patent_id, meta in self.patents.items()],
+                columns=PATENT_COLUMNS,
+            ),
+            f"{PATENT_DIR}/{self.analysis_name}_patents",
+            self.table_format,
+        )
+        write_table(
+            pd.DataFrame(self.chemicals, columns=["chembl", "surechembl"]),
+            f"{PATENT_DIR}/{self.analysis_name}_patent_chemicals",
+            self.table_format,
+        )
+        with open(f"{self.edge_file}.tmp", "wb") as f:
+            np.savez_compressed(
+                f,
+                chemical=self.edges[:, 0],
+                patent=self.edges[:, 1],
+                filters=np.array(json.dumps(self.filters)),
+            )
+
+        # The edge list is replaced last as it refers to rows of the other tables
+        os.replace(f"{self.edge_file}.tmp", self.edge_file)
+
+    def export(self, file_path: Optional[str] = None) -> pd.DataFrame:
+        """Write the wide patent data in the format of the store.
+
+        :param file_path: Path of the file without extension. By default, the "<name>_patent_data" file is written.
+        """
+        wide_df = self.to_wide()
+        write_table(
+            wide_df,
+            file_path or f"{PATENT_DIR}/{self.analysis_name}_patent_data",
+            file_format(self.table_format),
+        )
+        return wide_df
+
+    @classmethod
+    def load(cls, analysis_name: str, table_format: str = "tsv") -> "PatentStore":
+        """Load the store of an analysis.
+
+        The tables are read in whichever format they were written and saved in the given format from then on.
+        If only a wide "<name>_patent_data.tsv" file from an earlier version exists, it is converted.
+
+        :param analysis_name: Name of the analysis.
+        :param table_format: Format the tables of the store are written in.
+        """
+        store = cls(analysis_name, table_format)
+
+        if table_format == WORKSPACE_FORMAT:
+            workspace = get_workspace(analysis_name)
+            for idx, (patent_id, *meta) in enumerate(workspace.load_patents()):
+                store._patent_index[patent_id] = idx
+                store.patents[patent_id] = tuple(meta)
+            store._chemical_index = {
+                chemical: idx
+                for idx, chemical in enumerate(workspace.load_patent_chemicals())
+            }
+            store._edges = workspace.load_edges()
+            store._edge_set = set(store._edges)
+            store.filters = workspace.get_meta("filters")
+            store._saved = (
+                len(store.patents),
+                len(store._chemical_index),
+                len(store._edges),
+            )
+            return store
+
+        patent_file = find_table(f"{PATENT_DIR}/{analysis_name}_patents", table_format)
+        chemical_file = find_table(
+            f"{PATENT_DIR}/{analysis_name}_patent_chemicals", table_format
+        )
+        legacy_file = find_table(
+            f"{PATENT_DIR}/{analysis_name}_patent_data", table_format
+        )
+
+        if os.path.exists(store.edge_file) and patent_file and chemical_file:
+            patent_df = read_table(patent_file, typed=False, keep_default_na=False)
+            chemical_df = read_table(chemical_file, typed=False)
+            edges = np.load(store.edge_file)
+
+            store.add_patents(patent_df.fillna(""))
+            store._chemical_index = {
+                chemical: idx
+                for idx, chemical in enumerate(
+                    chemical_df.itertuples(index=False, name=None)
+                )
+            }
+            store._edges = list(
+                zip(edges["chemical"].tolist(), edges["patent"].tolist())
+            )
+            store._edge_set = set(store._edges)
+            if "filters" in edges:
+                store.filters = json.loads(str(edges["filters"]))
+
+        elif legacy_file:
+            logger.info(f"Converting {legacy_file} to the patent store")
+            wide_df = read_table(legacy_file, typed=False)
+            has_patent = wide_df["patent_id"].notna() & (wide_df["patent_id"] != "")
+            store.add_patents(wide_df[has_patent].fillna(""))
+
+            for (chembl_id, surechembl_id), group in wide_df.groupby(
+                ["chembl", "surechembl"], sort=False
+            ):
+                store.link(
+                    chembl_id,
+                    surechembl_id,
+                    group.loc[has_patent[group.index], "patent_id"],
+                )
+
+        return store
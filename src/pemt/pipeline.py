@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+"""Streaming execution of the chemical extraction, harmonization and patent extraction stages.
+
+Each stage runs in its own thread and hands its results to the next stage through a bounded queue as soon as
+they are produced. The stages still write their usual files, so an interrupted run can be resumed by any of
+the regular commands.
+"""
+
+import logging
+import queue
+import threading
+from typing import Callable, Iterable, Optional, Tuple
+
+import pandas as pd
+from tqdm import tqdm
+
+from pemt import init, metrics
+from pemt.chemical_extractor.experimental_data_extraction import (
+    CHECKPOINT_GENES,
+    get_target,
+    load_gene_chemicals,
+    load_target_mappers,
+    read_proteins,
+    save_gene_chemicals,
+    target_to_chemical,
+)
+from pemt.patent_extractor.patent_chemical_harmonizer import ChemicalHarmonizer
+from pemt.patent_extractor.patent_enrichment import PatentExtractor
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the items of a stage
+_DONE = object()
+
+
+class _Stage(threading.Thread):
+    """Thread running a stage that puts its results into the queue of the next stage."""
+
+    def __init__(
+        self,
+        name: str,
+        target: Callable[[Callable], None],
+        output: queue.Queue,
+        stop: threading.Event,
+    ):
+        """Create the stage thread.
+
+        :param name: Name of the stage.
+        :param target: Function running the stage. It is called with the function emitting its results.
+        :param output: Queue of the next stage.
+        :param stop: Event set when any stage fails.
+        """
+        super().__init__(name=name, daemon=True)
+        self._target_stage = target
+        self.output = output
+        self.stop = stop
+        self.error: Optional[BaseException] = None
+
+    def emit(self, item) -> None:
+        """Hand an item to the next stage, waiting while its queue is full."""
+        while not self.stop.is_set():
+            try:
+                self.output.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def run(self) -> None:
+        """Run the stage and signal the next stage when it is done or has failed."""
+        try:
+            self._target_stage(self.emit)
+        except BaseException as error:
+            self.error = error
+            self.stop.set()
+        finally:
+            self.emit(_DONE)
+
+
+def _consume(items: queue.Queue, stop: threading.Event) -> Iterable:
+    """Iterate over the items of a queue until the upstream stage is done."""
+    while not stop.is_set():
+        try:
+            item = items.get(timeout=0.5)
+        except queue.Empty:
+            continue
+
+        if item is _DONE:
+            return
+
+        yield item
+
+
+def run_pipeline(
+    analysis_name: str,
+    chrome_driver_path: str,
+    os_system: str = "linux",
+    patent_year: int = 2000,
+    gene_list: list = None,
+    gene_file_path: str = None,
+    file_separator: str = "comma",
+    is_uniprot: bool = False,
+    queue_size: int = 100,
+    table_format: str = "tsv",
+    rescrape: bool = False,
+) -> Tuple[dict, pd.DataFrame]:
+    """Run the three PEMT stages concurrently for the genes of an analysis.
+
+    :param analysis_name: The name of the analysis you want to run. This name would be used to save the resultant file
+    :param chrome_driver_path: The path of the chrome driver is located.
+    :param os_system: The OS on which the code is running. It can be either of these: linux, mac, window.
+    :param patent_year: The cutt-off year for searching the patent documents
+    :param gene_list: The list of gene you want to extract chemicals for.
+    :param gene_file_path: The path of the gene file
+    :param file_separator: The separator used within the file. This can be 'comma', 'tab', or 'semicolon'.
+    :param is_uniprot: A boolean value indicating whether the genes are UniProt ids or HGNC symbols.
+    :param queue_size: Maximum number of items waiting between two stages.
+    :param table_format: Format of the chemical and patent tables. It can be either of these: tsv, parquet, feather,
+        or sqlite to keep the whole analysis in its workspace.
+    :param rescrape: Scrape all compounds again, even those with a complete patent archive.
+    :returns: The gene to chemical mapping and the wide patent data.
+    """
+    init()
+
+    stop = threading.Event()
+    chemical_queue = queue.Queue(maxsize=queue_size)
+    patent_queue = queue.Queue(maxsize=queue_size)
+
+    proteins = read_proteins(
+        gene_list=gene_list,
+        gene_file_path=gene_file_path,
+        file_separator=file_separator,
+        is_uniprot=is_uniprot,
+    )
+    gene_chemical_dict = load_gene_chemicals(analysis_name, table_format)
+
+    @metrics.stage("chemicals")
+    def extract_chemicals(emit: Callable) -> None:
+        chembl_mapper, hgnc_mapper = load_target_mappers()
+        seen = set()
+        targets = {}
+        new_count = 0
+
+        for identifier in tqdm(proteins, desc="Extracting chemicals for targets"):
+            if stop.is_set():
+                break
+
+            metrics.cache("genes", hit=identifier in gene_chemical_dict)
+            if identifier not in gene_chemical_dict:
+                new_count += 1
+                gene_chemical_dict[identifier] = target_to_chemical(
+                    protein=identifier,
+                    protein_mapping=hgnc_mapper,
+                    chemical_mapping=chembl_mapper,
+                    is_uniprot=is_uniprot,
+                )
+                targets[identifier] = get_target(
+                    protein=identifier,
+                    protein_mapping=hgnc_mapper,
+                    chemical_mapping=chembl_mapper,
+                    is_uniprot=is_uniprot,
+                )
+
+                if new_count == CHECKPOINT_GENES:
+                    save_gene_chemicals(
+                        analysis_name, gene_chemical_dict, table_format, targets
+                    )
+                    new_count = 0
+
+            for chembl_id in gene_chemical_dict[identifier]:
+                if chembl_id not in seen:
+                    seen.add(chembl_id)
+                    emit(chembl_id)
+
+        save_gene_chemicals(analysis_name, gene_chemical_dict, table_format, targets)
+
+    @metrics.stage("harmonizer")
+    def harmonize_chemicals(emit: Callable) -> None:
+        harmonizer = ChemicalHarmonizer(analysis_name, table_format=table_format)
+
+        for chembl_id in _consume(chemical_queue, stop):
+            surechembl_id = harmonizer.harmonize(chembl_id)
+            if surechembl_id:
+                emit((chembl_id, surechembl_id))
+
+        harmonizer.save(drop_unmapped=True)
+
+    # Created before the stages start, so that they are not left running if it fails
+    extractor = PatentExtractor(
+        analysis_name=analysis_name,
+        chrome_driver_path=chrome_driver_path,
+        os_system=os_system,
+        patent_year=patent_year,
+        table_format=table_format,
+        rescrape=rescrape,
+    )
+
+    stages = [
+        _Stage("chemical-extractor", extract_chemicals, chemical_queue, stop),
+        _Stage("chemical-harmonizer", harmonize_chemicals, patent_queue, stop),
+    ]
+    for stage in stages:
+        stage.start()
+
+    try:
+        with metrics.stage("patents"):
+            for chembl_id, surechembl_id in _consume(patent_queue, stop):
+                extractor.extract(chembl_id, surechembl_id)
+    except BaseException:
+        extractor.store.save()
+        raise
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+
+    for stage in stages:
+        if stage.error is not None:
+            extractor.store.save()
+            raise RuntimeError(f"The {stage.name} stage failed") from stage.error
+
+    return gene_chemical_dict, extractor.close()
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+
+"""Profiling of the stages of a PEMT run.
+
+While a :class:`Profiler` is active, every stage recorded with :func:`pemt.metrics.stage` is profiled with
+cProfile and tracemalloc in the thread that runs it. For each stage, the profiler keeps
+
+- its CPU profile, written as a pstats dump that can be opened with :mod:`pstats` or snakeviz,
+- its wall time, split into network wait (requests in flight), local compute (CPU time outside the requests) and
+  the rest, e.g. waiting for the rate limiters, retries or disk,
+- the peak of the traced memory during the stage and the sites that allocated the memory it kept.
+
+A stage started while another one is profiled in the same thread is part of the outer one. tracemalloc traces the
+whole process, so the memory of stages running at once, e.g. with ``--pipeline``, is counted in each of them.
+"""
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from pemt import metrics
+from pemt.constants import PROFILE_DIR
+
+logger = logging.getLogger(__name__)
+
+"""Number of hot spots and allocation sites kept for each stage."""
+TOP_SITES = 10
+
+_MB = 1024 * 1024
+
+
+def _function_name(key: tuple) -> str:
+    """Format a function of a pstats table as "file:line(function)"."""
+    file_name, line, function = key
+    if file_name == "~":
+        return function
+    return f"{os.path.basename(file_name)}:{line}({function})"
+
+
+class Profiler:
+    """Profile the stages of a run, e.g. of a command run with ``--profile``."""
+
+    def __init__(self, top: int = TOP_SITES):
+        """Create an inactive profiler.
+
+        :param top: Number of hot spots and allocation sites kept for each stage.
+        """
+        self.top = top
+        # Stage -> profiles of its runs, and their times and memory
+        self.profiles: Dict[str, List[cProfile.Profile]] = defaultdict(list)
+        self.stages: Dict[str, dict] = {}
+        self._allocations: Dict[str, Dict[str, List[int]]] = defaultdict(
+            lambda: defaultdict(lambda: [0, 0])
+        )
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_tracemalloc = False
+
+    def __enter__(self) -> "Profiler":
+        """Start profiling the stages."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        metrics.add_stage_hook(self.stage)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        """Stop profiling the stages."""
+        metrics.remove_stage_hook(self.stage)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _snapshot(self) -> tracemalloc.Snapshot:
+        """Take a snapshot of the traced memory, without the memory of tracemalloc and of the imports."""
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+
+    @contextmanager
+    def stage(self, name: str):
+        """Profile a stage run in the current thread.
+
+        :param name: Name of the stage, e.g. "chemicals", "harmonizer" or "patents".
+        """
+        if getattr(self._local, "active", False):
+            yield
+            return
+
+        self._local.active = True
+        start_snapshot = self._snapshot()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        # Before Python 3.9, the peak is that of the whole run
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        network_start, network_cpu_start = metrics.network_seconds()
+        cpu_start = time.thread_time()
+        start = time.perf_counter()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # From Python 3.12, one profiler runs at a time in a process and sees all its threads
+            profile = None
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall = time.perf_counter() - start
+            cpu = time.thread_time() - cpu_start
+            network, network_cpu = metrics.network_seconds()
+            peak = tracemalloc.get_traced_memory()[1] - start_memory
+            allocations = self._snapshot().compare_to(start_snapshot, "lineno")
+            self._local.active = False
+            self._record(
+                name,
+                profile,
+                wall=wall,
+                network=network - network_start,
+                compute=cpu - (network_cpu - network_cpu_start),
+                peak=peak,
+                allocations=allocations,
+            )
+
+    def _record(
+        self,
+        name: str,
+        profile: Optional[cProfile.Profile],
+        wall: float,
+        network: float,
+        compute: float,
+        peak: int,
+        allocations: List[tracemalloc.StatisticDiff],
+    ) -> None:
+        """Add a run of a stage to its totals."""
+        with self._lock:
+            if profile is not None:
+                self.profiles[name].append(profile)
+            stats = self.stages.setdefault(
+                name,
+                {
+                    "runs": 0,
+                    "wall_seconds": 0.0,
+                    "network_seconds": 0.0,
+                    "compute_seconds": 0.0,
+                    "peak_memory_mb": 0.0,
+                },
+            )
+            stats["runs"] += 1
+            stats["wall_seconds"] += wall
+            stats["network_seconds"] += network
+            stats["compute_seconds"] += max(0.0, compute)
+            stats["peak_memory_mb"] = max(stats["peak_memory_mb"], peak / _MB)
+
+            sites = self._allocations[name]
+            for allocation in allocations:
+                if allocation.size_diff > 0:
+                    frame = allocation.traceback[0]
+                    site = sites[f"{frame.filename}:{frame.lineno}"]
+                    site[0] += allocation.size_diff
+                    site[1] += allocation.count_diff
+
+    def stats(self, name: str) -> Optional[pstats.Stats]:
+        """Get the CPU profile of all the runs of a stage.
+
+        :param name: Name of the stage.
+        :returns: The profile, or None if the stage was not profiled by cProfile.
+        """
+        profiles = self.profiles.get(name)
+        if not profiles:
+            return None
+
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+    def hot_spots(self, name: str) -> List[dict]:
+        """Get the functions of a stage that took the most CPU time themselves.
+
+        :param name: Name of the stage.
+        :returns: The "function", its number of "calls", its "self_seconds" without the functions it called and
+            its "cumulative_seconds" with them, by decreasing self time.
+        """
+        stats = self.stats(name)
+        if stats is None:
+            return []
+
+        functions = sorted(
+            stats.stats.items(), key=lambda item: item[1][2], reverse=True
+        )
+        return [
+            {
+                "function": _function_name(key),
+                "calls": calls,
+                "self_seconds": self_seconds,
+                "cumulative_seconds": cumulative_seconds,
+            }
+            for key, (_, calls, self_seconds, cumulative_seconds, _) in functions[
+                : self.top
+            ]
+        ]
+
+    def top_allocations(self, name: str) -> List[dict]:
+        """Get the sites that allocated the most memory kept after a stage.
+
+        :param name: Name of the stage.
+        :returns: The "site" as "file:line", the "size_mb" and the number of "blocks", by decreasing size.
+        """
+        sites = sorted(
+            self._allocations[name].items(), key=lambda item: item[1][0], reverse=True
+        )
+        return [
+            {"site": site, "size_mb": size / _MB, "blocks": blocks}
+            for site, (size, blocks) in sites[: self.top]
+        ]
+
+    def summary(self) -> dict:
+        """Get the times, memory, hot spots and allocation sites of the profiled stages."""
+        with self._lock:
+            stages = {name: dict(stats) for name, stats in self.stages.items()}
+
+        for name, stats in stages.items():
+            stats["other_seconds"] = max(
+                0.0,
+                stats["wall_seconds"]
+                - stats["network_seconds"]
+                - stats["compute_seconds"],
+            )
+            stats["hot_spots"] = self.hot_spots(name)
+            stats["top_allocations"] = self.top_allocations(name)
+
+        return stages
+
+    def write(self, run_name: str, labels: Optional[Dict[str, str]] = None) -> dict:
+        """Write the profiles as "<run name>_<stage>.prof" pstats dumps and their summary as
+        "<run name>_profile.json".
+
+        :param run_name: Name of the run, used for the file names.
+        :param labels: Labels of the run, e.g. the analysis name and command, added to the JSON file.
+        :returns: The summary, see :meth:`summary`.
+        """
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        summary = self.summary()
+
+        for name in summary:
+            stats = self.stats(name)
+            if stats is not None:
+                stats.dump_stats(f"{PROFILE_DIR}/{run_name}_{name}.prof")
+
+        with open(f"{PROFILE_DIR}/{run_name}_profile.json", "w") as f:
+            json.dump({**(labels or {}), "stages": summary}, f, indent=2)
+
+        logger.info(f"Profiles written to {PROFILE_DIR}")
+        return summary
+
+
+def format_summary(summary: dict, top: int = 3) -> str:
+    """Summarize the profiles of a run in a few lines for the command line.
+
+    :param summary: The summary of the profiles, see :meth:`Profiler.summary`.
+    :param top: Number of hot spots and allocation sites shown for each stage.
+    """
+    lines = []
+
+    for name, stats in summary.items():
+        lines.append(
+            f"Profile {name}: {stats['wall_seconds']:.1f}s = {stats['network_seconds']:.1f}s network + "
+            f"{stats['compute_seconds']:.1f}s compute + {stats['other_seconds']:.1f}s other, "
+            f"{stats['peak_memory_mb']:.1f}MB peak memory"
+        )
+        for hot_spot in stats["hot_spots"][:top]:
+            lines.append(
+                f"  {hot_spot['self_seconds']:.2f}s in {hot_spot['function']} "
+                f"({hot_spot['calls']} calls, {hot_spot['cumulative_seconds']:.2f}s with callees)"
+            )
+        for allocation in stats["top_allocations"][:top]:
+            lines.append(
+                f"  {allocation['size_mb']:.1f}MB kept from {allocation['site']}"
+            )
+
+    return "\n".join(lines)
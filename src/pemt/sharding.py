@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""Deterministic partitioning of the work of a stage into shards.
+
+A shard "i/N" processes the genes, chemicals or compounds whose identifier hashes to i modulo N, and writes its
+results to the files of its own analysis name, so that every file still has a single writer. The shards of an
+analysis are combined with :func:`pemt.merge.merge_shards`.
+"""
+
+import zlib
+from typing import Optional, Tuple
+
+Shard = Tuple[int, int]
+
+
+def parse_shard(value: str) -> Shard:
+    """Parse a shard given as "i/N", with i from 0 to N - 1.
+
+    :param value: The shard, e.g. "0/4".
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard {value} is not of the form i/N, e.g. 0/4")
+
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be between 0 and {count - 1}, got {value}")
+
+    return index, count
+
+
+def shard_name(analysis_name: str, shard: Optional[Shard] = None) -> str:
+    """Get the name under which a shard of an analysis writes its files.
+
+    :param analysis_name: Name of the analysis.
+    :param shard: The (index, count) of the shard. If None, the name of the analysis is returned.
+    """
+    if shard is None:
+        return analysis_name
+
+    index, count = shard
+    return f"{analysis_name}_shard{index}of{count}"
+
+
+def in_shard(identifier: str, shard: Optional[Shard] = None) -> bool:
+    """Check whether an identifier belongs to a shard.
+
+    The CRC-32 of the identifier is used, which is the same for every process and platform, unlike :func:`hash`.
+
+    :param identifier: A gene, ChEMBL or SureChEMBL identifier.
+    :param shard: The (index, count) of the shard. If None, every identifier belongs to it.
+    """
+    if shard is None:
+        return True
+
+    index, count = shard
+    return zlib.crc32(str(identifier).encode()) % count == index
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""Reading and writing of the PEMT tables as TSV, Parquet or Feather files.
+
+Tables are addressed by their path without extension. Parquet and Feather files keep the column types: patent
+dates are stored as dates and the IPC and assignee columns as categoricals. Both formats require pyarrow.
+"""
+
+import logging
+import os
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from pemt.constants import TABLE_FORMATS, WORKSPACE_FORMAT
+
+logger = logging.getLogger(__name__)
+
+DATE_COLUMNS = ["date"]
+CATEGORY_COLUMNS = ["ipc", "assignee"]
+
+
+def _check_format(table_format: str) -> None:
+    """Check that a table format is known and its backend is installed."""
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(
+            f"Unknown table format {table_format}. Please use one of {', '.join(TABLE_FORMATS)}"
+        )
+
+    if table_format != "tsv":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError(
+                f"Writing {table_format} files requires pyarrow. Please install it with `pip install pyarrow`"
+            )
+
+
+def file_format(table_format: str) -> str:
+    """Get the format of the files written for an analysis. Analyses kept in a workspace write TSV files.
+
+    :param table_format: Format of the analysis.
+    """
+    return "tsv" if table_format == WORKSPACE_FORMAT else table_format
+
+
+def table_path(stem: str, table_format: str = "tsv") -> str:
+    """Get the path of a table in the given format.
+
+    :param stem: Path of the table without extension.
+    :param table_format: Format of the table. It can be either of these: tsv, parquet, feather.
+    """
+    return f"{stem}.{table_format}"
+
+
+def find_table(stem: str, table_format: str = "tsv") -> Optional[str]:
+    """Get the path of an existing table, preferring the given format.
+
+    :param stem: Path of the table without extension.
+    :param table_format: Preferred format of the table.
+    :returns: The path of the table or None if it does not exist in any format.
+    """
+    for fmt in (table_format,) + TABLE_FORMATS:
+        if os.path.exists(table_path(stem, fmt)):
+            return table_path(stem, fmt)
+    return None
+
+
+def _typed(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the date and categorical columns of a table."""
+    df = df.copy()
+    for column in DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors="coerce")
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns:
+            df[column] = df[column].astype("category")
+    return df.reset_index(drop=True)
+
+
+def _as_text(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the typed columns of a table back to strings, as they are read from a TSV file."""
+    for column in DATE_COLUMNS:
+        if column in df.columns and pd.api.types.is_datetime64_any_dtype(df[column]):
+            df[column] = df[column].dt.strftime("%Y-%m-%d")
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+    return df
+
+
+def write_table(df: pd.DataFrame, stem: str, table_format: str = "tsv") -> str:
+    """Write a table, replacing it in any other format.
+
+    The file is written atomically, so an interrupted run never leaves a partial table behind.
+
+    :param df: The table.
+    :param stem: Path of the table without extension.
+    :param table_format: Format of the table. It can be either of these: tsv, parquet, feather.
+    :returns: The path of the written file.
+    """
+    _check_format(table_format)
+    file_path = table_path(stem, table_format)
+
+    if table_format == "tsv":
+        df.to_csv(f"{file_path}.tmp", sep="\t", index=False)
+    elif table_format == "parquet":
+        _typed(df).to_parquet(f"{file_path}.tmp", index=False)
+    else:
+        _typed(df).to_feather(f"{file_path}.tmp")
+
+    os.replace(f"{file_path}.tmp", file_path)
+
+    # Remove the table in other formats so that it is never read from a stale file
+    for fmt in TABLE_FORMATS:
+        if fmt != table_format and os.path.exists(table_path(stem, fmt)):
+            os.remove(table_path(stem, fmt))
+
+    return file_path
+
+
+def read_table(file_path: str, typed: bool = True, **kwargs) -> pd.DataFrame:
+    """Read a table written by :func:`write_table`.
+
+    TSV files are read as strings. Parquet and Feather files keep their column types, unless typed is False.
+
+    :param file_path: Path of the table.
+    :param typed: Boolean indicating whether the typed columns are kept or converted to strings.
+    :param kwargs: Additional arguments for reading TSV files, e.g. keep_default_na.
+    """
+    if file_path.endswith(".parquet"):
+        df = pd.read_parquet(file_path)
+    elif file_path.endswith(".feather"):
+        df = pd.read_feather(file_path)
+    else:
+        return pd.read_csv(file_path, sep="\t", dtype=str, **kwargs)
+
+    return df if typed else _as_text(df)
+
+
+def read_table_chunks(
+    file_path: str, chunk_size: int, typed: bool = True
+) -> Iterator[pd.DataFrame]:
+    """Read a table written by :func:`write_table` a number of rows at a time, e.g. when it does not fit in memory.
+
+    Parquet files are read by row batches and Feather files by record batches, which are at most 64k rows when
+    written by :func:`write_table`.
+
+    :param file_path: Path of the table.
+    :param chunk_size: Number of rows per chunk.
+    :param typed: Boolean indicating whether the typed columns are kept or converted to strings.
+    """
+    if file_path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        batches = pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size)
+    elif file_path.endswith(".feather"):
+        import pyarrow as pa
+
+        reader = pa.ipc.open_file(pa.memory_map(file_path))
+        batches = (reader.get_batch(idx) for idx in range(reader.num_record_batches))
+    else:
+        yield from pd.read_csv(file_path, sep="\t", dtype=str, chunksize=chunk_size)
+        return
+
+    for batch in batches:
+        df = batch.to_pandas()
+        yield df if typed else _as_text(df)
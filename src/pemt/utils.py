@@ -1,24 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import logging
-from typing import Dict, Optional
-from urllib.error import URLError
+from typing import Dict, List, Mapping, Optional
 
 import pandas as pd
-from pubchempy import get_compounds
 
-logger = logging.getLogger()
-logging.basicConfig(level=logging.INFO)
-pubchempy_logger = logging.getLogger("pubchempy")
-pubchempy_logger.setLevel(logging.WARNING)
+from pemt import client
+from pemt.constants import HGNC_URL, PUBCHEM_URL
+from pemt.id_store import as_gene_chemical_map
+
+logger = logging.getLogger(__name__)
 
 """Protein mapper functions"""
 
 
 def get_hgnc_id() -> Dict[str, str]:
     """Mapping dictionary for HGNC symbol to HGNC identifiers"""
-    protein_mapping = pd.read_csv(
-        f"https://www.genenames.org/cgi-bin/download/custom?col=gd_hgnc_id&col=gd_status&col=md_prot_id&status=Approved&hgnc_dbtag=on&order_by=gd_app_sym_sort&format=text&submit=submit",
+    protein_mapping = client.call(
+        "genenames",
+        pd.read_csv,
+        f"{HGNC_URL}/cgi-bin/download/custom?col=gd_hgnc_id&col=gd_status&col=md_prot_id&status=Approved&hgnc_dbtag=on&order_by=gd_app_sym_sort&format=text&submit=submit",
         sep="\t",
         index_col="Approved symbol",
     ).to_dict()["HGNC ID"]
@@ -52,13 +53,92 @@ def uniprot_to_chembl(chemical_mapper: dict, uniprot_id: str) -> Optional[str]:
 """Chemical mapper functions"""
 
 
+def _synonyms(results: Optional[dict]) -> List[str]:
+    """Get the synonyms of the first compound of a PubChem synonym lookup."""
+    if not results:
+        return []
+
+    return results["InformationList"]["Information"][0].get("Synonym", [])
+
+
+def get_synonyms(chemical_name: str) -> List[str]:
+    """Get the PubChem synonyms of the first compound with a name, ranked as PubChem does.
+
+    :param chemical_name: Name or identifier of the compound, e.g. a ChEMBL id.
+    :returns: The synonyms, or an empty list if PubChem does not know the name.
+    """
+    # The name is posted rather than put in the URL, so that it can hold any character
+    return _synonyms(
+        client.fetch_json(
+            "pubchem",
+            "POST",
+            f"{PUBCHEM_URL}/compound/name/synonyms/JSON",
+            data={"name": chemical_name},
+        )
+    )
+
+
+async def get_synonyms_async(chemical_name: str) -> List[str]:
+    """Get the PubChem synonyms of the first compound with a name from an event loop, see :func:`get_synonyms`.
+
+    :param chemical_name: Name or identifier of the compound, e.g. a ChEMBL id.
+    """
+    return _synonyms(
+        await client.fetch_json_async(
+            "pubchem",
+            "POST",
+            f"{PUBCHEM_URL}/compound/name/synonyms/JSON",
+            data={"name": chemical_name},
+        )
+    )
+
+
 def get_chemical_names(chembl_id: str) -> str:
     """Method to get chemical name from ChEMBL id.
 
+    The ChEMBL id is used as the name only if PubChem does not know the compound. If PubChem is unavailable, i.e.
+    its circuit is open or it kept failing with transient errors, the error is raised rather than a name made up.
+
     :param chembl_id: ChEMBL identifier of a compound
     """
-    try:
-        chemical_name = get_compounds(chembl_id, "name")[0].synonyms[0]
-    except (IndexError, URLError):
-        chemical_name = chembl_id
-    return chemical_name
+    synonyms = get_synonyms(chembl_id)
+    return synonyms[0] if synonyms else chembl_id
+
+
+async def get_chemical_names_async(chembl_id: str) -> str:
+    """Get the chemical name of a ChEMBL id from an event loop, see :func:`get_chemical_names`.
+
+    :param chembl_id: ChEMBL identifier of a compound
+    """
+    synonyms = await get_synonyms_async(chembl_id)
+    return synonyms[0] if synonyms else chembl_id
+
+
+"""Patent mapper functions"""
+
+
+def attach_genes(
+    patent_df: pd.DataFrame, gene_chemical_dict: Mapping[str, List[str]]
+) -> pd.DataFrame:
+    """Annotate patents with the genes their chemical is linked to.
+
+    The distinct gene-chemical pairs are taken from the integer-encoded mapping, the genes are joined once per
+    chemical and the result is merged onto the patents.
+
+    :param patent_df: Dataframe of patents with a "chembl" column.
+    :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals, or a
+        :class:`pemt.id_store.GeneChemicalMap`.
+    :returns: The patents with a "genes" column of comma-separated genes, in the order of the input rows.
+    """
+    gene_df = (
+        as_gene_chemical_map(gene_chemical_dict)
+        .to_frame()
+        .sort_values(["chembl", "gene"])
+    )
+    chemical_genes = gene_df.groupby("chembl", sort=False)["gene"].agg(", ".join)
+
+    patent_df = patent_df.copy()
+    patent_df["genes"] = (
+        patent_df["chembl"].map(chemical_genes).fillna("").astype(str).to_numpy()
+    )
+    return patent_df
@@ -0,0 +1,588 @@
+# -*- coding: utf-8 -*-
+
+"""Single-file SQLite workspace holding the state of an analysis.
+
+With the "sqlite" format, the stages keep the genes, targets, chemicals, chemical names, patents, chemical-patent
+edges and scraping progress of an analysis in indexed tables of one "<name>.sqlite" file under data/workspaces,
+instead of separate JSON and table files. Every checkpoint is written in one transaction, and the gene, patent
+and edge tables only receive the rows added since the last checkpoint. An interrupted run leaves the workspace as
+of its last checkpoint and resumes from it without parsing any file.
+
+The files of the other formats can still be written from a workspace with :func:`export_workspace`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from pemt.constants import TABLE_FORMATS, WORKSPACE_DIR
+from pemt.id_store import GeneChemicalMap
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS genes (
+    id INTEGER PRIMARY KEY,
+    gene TEXT NOT NULL UNIQUE,
+    target TEXT
+);
+CREATE INDEX IF NOT EXISTS genes_target ON genes (target);
+
+CREATE TABLE IF NOT EXISTS gene_chemicals (
+    gene TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    chembl TEXT NOT NULL,
+    PRIMARY KEY (gene, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS gene_chemicals_chembl ON gene_chemicals (chembl);
+
+CREATE TABLE IF NOT EXISTS chemicals (
+    chembl TEXT PRIMARY KEY,
+    schembl_id TEXT,
+    name TEXT
+);
+CREATE INDEX IF NOT EXISTS chemicals_schembl_id ON chemicals (schembl_id);
+
+CREATE TABLE IF NOT EXISTS chemical_names (
+    chembl TEXT PRIMARY KEY,
+    name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS patents (
+    id INTEGER PRIMARY KEY,
+    patent_id TEXT NOT NULL UNIQUE,
+    date TEXT,
+    ipc TEXT,
+    assignee TEXT
+);
+
+CREATE TABLE IF NOT EXISTS patent_chemicals (
+    id INTEGER PRIMARY KEY,
+    chembl TEXT NOT NULL,
+    surechembl TEXT NOT NULL,
+    UNIQUE (chembl, surechembl)
+);
+CREATE INDEX IF NOT EXISTS patent_chemicals_surechembl ON patent_chemicals (surechembl);
+
+CREATE TABLE IF NOT EXISTS edges (
+    chemical INTEGER NOT NULL,
+    patent INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS edges_chemical ON edges (chemical);
+CREATE INDEX IF NOT EXISTS edges_patent ON edges (patent);
+
+CREATE TABLE IF NOT EXISTS progress (
+    schembl_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS progress_rows (
+    schembl_id TEXT NOT NULL,
+    row TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS progress_rows_schembl_id ON progress_rows (schembl_id);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+"""Separator between the path of a workspace and the name of one of its tables, see :func:`workspace_table`."""
+TABLE_SEPARATOR = "::"
+
+
+def workspace_path(analysis_name: str) -> str:
+    """Get the path of the workspace of an analysis.
+
+    :param analysis_name: Name of the analysis.
+    """
+    return f"{WORKSPACE_DIR}/{analysis_name}.sqlite"
+
+
+class Workspace:
+    """Connection to the workspace of an analysis, shared by the threads of a process."""
+
+    def __init__(self, file_path: str):
+        """Open the workspace, creating its file and tables if needed.
+
+        :param file_path: Path of the SQLite file.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        self.path = file_path
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(file_path, check_same_thread=False)
+        # Readers, e.g. the shards being merged, do not block the writer
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+        self._genes: Optional[set] = None
+
+    @contextmanager
+    def transaction(self):
+        """Run statements in a transaction, committed at the end or rolled back on error."""
+        with self.lock, self.connection:
+            yield self.connection
+
+    def query(self, sql: str, params: Iterable = ()) -> List[tuple]:
+        """Get the rows of a query.
+
+        :param sql: The SQL query.
+        :param params: The parameters of the query.
+        """
+        with self.lock:
+            return self.connection.execute(sql, tuple(params)).fetchall()
+
+    def close(self) -> None:
+        """Close the connection."""
+        with self.lock:
+            self.connection.close()
+
+    def get_meta(self, key: str, default: Any = None) -> Any:
+        """Get a value stored with :meth:`set_meta`.
+
+        :param key: Name of the value.
+        :param default: Value returned if there is none.
+        """
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    def set_meta(self, key: str, value: Any) -> None:
+        """Store a JSON serializable value.
+
+        :param key: Name of the value.
+        :param value: The value.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, json.dumps(value))
+            )
+
+    def has_stage(self, stage: str) -> bool:
+        """Check whether a stage has written its results to the workspace.
+
+        :param stage: Name of the stage, i.e. "chemicals", "harmonizer" or "patents".
+        """
+        return self.get_meta(f"stage:{stage}", False)
+
+    @property
+    def revision(self) -> int:
+        """Number of times a stage has written to the workspace, e.g. to tell whether it changed since a read."""
+        return self.get_meta("revision", 0)
+
+    @staticmethod
+    def _mark_stage(connection: sqlite3.Connection, stage: str) -> None:
+        """Record that a stage has written its results, within the transaction of the write."""
+        connection.execute(
+            "INSERT OR REPLACE INTO meta VALUES (?, 'true')", (f"stage:{stage}",)
+        )
+        connection.execute(
+            "INSERT INTO meta VALUES ('revision', '1') "
+            "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1"
+        )
+
+    # Genes and their chemicals
+
+    def load_gene_chemicals(self) -> GeneChemicalMap:
+        """Get the chemicals of every gene, in the order the genes were added."""
+        gene_chemical_dict = GeneChemicalMap()
+        rows = self.query(
+            "SELECT g.gene, gc.chembl FROM genes g LEFT JOIN gene_chemicals gc ON gc.gene = g.gene "
+            "ORDER BY g.id, gc.position"
+        )
+        for gene, group in groupby(rows, key=itemgetter(0)):
+            gene_chemical_dict[gene] = [
+                chembl_id for _, chembl_id in group if chembl_id is not None
+            ]
+
+        self._genes = set(gene_chemical_dict)
+        return gene_chemical_dict
+
+    def add_gene_chemicals(
+        self,
+        gene_chemical_dict: Mapping[str, List[str]],
+        targets: Optional[Dict[str, Optional[str]]] = None,
+    ) -> int:
+        """Add the genes that are not in the workspace yet, with their chemicals and ChEMBL target.
+
+        :param gene_chemical_dict: Dictionary mapping genes to their ChEMBL chemicals.
+        :param targets: Dictionary mapping genes to their ChEMBL target, if known.
+        :returns: The number of added genes.
+        """
+        targets = targets or {}
+
+        with self.transaction() as connection:
+            if self._genes is None:
+                self._genes = {
+                    gene for (gene,) in connection.execute("SELECT gene FROM genes")
+                }
+
+            new_genes = [gene for gene in gene_chemical_dict if gene not in self._genes]
+            connection.executemany(
+                "INSERT INTO genes (gene, target) VALUES (?, ?)",
+                ((gene, targets.get(gene)) for gene in new_genes),
+            )
+            connection.executemany(
+                "INSERT INTO gene_chemicals VALUES (?, ?, ?)",
+                (
+                    (gene, position, chembl_id)
+                    for gene in new_genes
+                    for position, chembl_id in enumerate(gene_chemical_dict[gene])
+                ),
+            )
+            self._mark_stage(connection, "chemicals")
+
+        self._genes.update(new_genes)
+        return len(new_genes)
+
+    def genes_of(self, chembl_id: str) -> List[str]:
+        """Get the genes a chemical is active on.
+
+        :param chembl_id: ChEMBL identifier of the chemical.
+        """
+        return [
+            gene
+            for (gene,) in self.query(
+                "SELECT DISTINCT gene FROM gene_chemicals WHERE chembl = ? ORDER BY gene",
+                (chembl_id,),
+            )
+        ]
+
+    # Harmonized chemicals and their names
+
+    def load_chemicals(self) -> List[Tuple[str, Optional[str], Optional[str]]]:
+        """Get the ChEMBL id, SureChEMBL id and name of the harmonized chemicals."""
+        return self.query(
+            "SELECT chembl, schembl_id, name FROM chemicals ORDER BY rowid"
+        )
+
+    def load_chemical_names(self) -> Dict[str, Optional[str]]:
+        """Get the names of the chemicals looked up so far."""
+        return dict(
+            self.query("SELECT chembl, name FROM chemical_names ORDER BY rowid")
+        )
+
+    def save_chemicals(
+        self,
+        chemicals: Iterable[Tuple[str, Optional[str], Optional[str]]],
+        chemical_names: Optional[Dict[str, Optional[str]]] = None,
+    ) -> None:
+        """Replace the harmonized chemicals and, if given, the chemical names.
+
+        :param chemicals: The ChEMBL id, SureChEMBL id and name of the chemicals.
+        :param chemical_names: Dictionary mapping ChEMBL ids to their names.
+        """
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM chemicals")
+            connection.executemany("INSERT INTO chemicals VALUES (?, ?, ?)", chemicals)
+
+            if chemical_names is not None:
+                connection.execute("DELETE FROM chemical_names")
+                connection.executemany(
+                    "INSERT INTO chemical_names VALUES (?, ?)", chemical_names.items()
+                )
+
+            self._mark_stage(connection, "harmonizer")
+
+    # Patent store
+
+    def load_patents(self) -> List[Tuple[str, str, str, str]]:
+        """Get the patent id, date, IPC and assignee of the patents, in the order of the patent index."""
+        return self.query(
+            "SELECT patent_id, date, ipc, assignee FROM patents ORDER BY id"
+        )
+
+    def load_patent_chemicals(self) -> List[Tuple[str, str]]:
+        """Get the (ChEMBL id, SureChEMBL id) pairs processed by the patent extractor, in the order of their index."""
+        return self.query("SELECT chembl, surechembl FROM patent_chemicals ORDER BY id")
+
+    def load_edges(self) -> List[Tuple[int, int]]:
+        """Get the chemical-patent edges as chemical and patent indices, in the order they were added."""
+        return self.query("SELECT chemical, patent FROM edges ORDER BY rowid")
+
+    def save_patent_store(
+        self,
+        patents: Iterable[Tuple[int, str, str, str, str]],
+        chemicals: Iterable[Tuple[int, str, str]],
+        edges: Iterable[Tuple[int, int]],
+        filters: Optional[dict],
+        replace: bool = False,
+    ) -> None:
+        """Add patents, chemicals and edges to the patent store.
+
+        :param patents: The index, id, date, IPC and assignee of the patents to add.
+        :param chemicals: The index, ChEMBL id and SureChEMBL id of the chemicals to add.
+        :param edges: The chemical and patent indices of the edges to add.
+        :param filters: Year and IPC filters the edges were made with.
+        :param replace: Boolean indicating whether the store is emptied first.
+        """
+        with self.transaction() as connection:
+            if replace:
+                for table in ("patents", "patent_chemicals", "edges"):
+                    connection.execute(f"DELETE FROM {table}")
+
+            connection.executemany(
+                "INSERT INTO patents VALUES (?, ?, ?, ?, ?)", patents
+            )
+            connection.executemany(
+                "INSERT INTO patent_chemicals VALUES (?, ?, ?)", chemicals
+            )
+            connection.executemany("INSERT INTO edges VALUES (?, ?)", edges)
+            connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('filters', ?)",
+                (json.dumps(filters),),
+            )
+            self._mark_stage(connection, "patents")
+
+    def patents_of(self, chembl_id: str) -> List[str]:
+        """Get the patents linked to a chemical.
+
+        :param chembl_id: ChEMBL identifier of the chemical.
+        """
+        return [
+            patent_id
+            for (patent_id,) in self.query(
+                "SELECT DISTINCT patents.patent_id FROM patent_chemicals "
+                "JOIN edges ON edges.chemical = patent_chemicals.id "
+                "JOIN patents ON patents.id = edges.patent "
+                "WHERE patent_chemicals.chembl = ? ORDER BY patents.patent_id",
+                (chembl_id,),
+            )
+        ]
+
+    # Scraping progress
+
+    def load_progress(self) -> Dict[str, dict]:
+        """Get the page-level scraping progress of the compounds whose scraping was interrupted."""
+        progress = {
+            schembl_id: json.loads(state)
+            for schembl_id, state in self.query(
+                "SELECT schembl_id, state FROM progress"
+            )
+        }
+        for schembl_id, row in self.query(
+            "SELECT schembl_id, row FROM progress_rows ORDER BY rowid"
+        ):
+            progress[schembl_id].setdefault("rows", []).append(json.loads(row))
+        return progress
+
+    def save_progress(self, schembl_id: str, state: Optional[dict]) -> None:
+        """Store the scraping progress of a compound.
+
+        :param schembl_id: The SureChEMBL id of the compound.
+        :param state: The progress of the compound, or None once it is done.
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                "DELETE FROM progress_rows WHERE schembl_id = ?", (schembl_id,)
+            )
+            if state is None:
+                connection.execute(
+                    "DELETE FROM progress WHERE schembl_id = ?", (schembl_id,)
+                )
+            else:
+                self._write_progress(connection, schembl_id, state)
+
+    def append_progress(self, schembl_id: str, state: dict, rows: Iterable) -> None:
+        """Update the scraping progress of a compound with the rows scraped since the previous update.
+
+        :param schembl_id: The SureChEMBL id of the compound.
+        :param state: The progress of the compound. Its "rows" are not written again.
+        :param rows: The rows scraped since the previous update.
+        """
+        with self.transaction() as connection:
+            self._write_progress(connection, schembl_id, state, rows)
+
+    @staticmethod
+    def _write_progress(
+        connection: sqlite3.Connection,
+        schembl_id: str,
+        state: dict,
+        rows: Optional[Iterable] = None,
+    ) -> None:
+        """Write the progress of a compound without its rows, and add rows to it."""
+        if rows is None:
+            rows = state.get("rows", [])
+        connection.execute(
+            "INSERT OR REPLACE INTO progress VALUES (?, ?)",
+            (
+                schembl_id,
+                json.dumps(
+                    {key: value for key, value in state.items() if key != "rows"},
+                    ensure_ascii=False,
+                ),
+            ),
+        )
+        connection.executemany(
+            "INSERT INTO progress_rows VALUES (?, ?)",
+            ((schembl_id, json.dumps(row, ensure_ascii=False)) for row in rows),
+        )
+
+    def clear_progress(self) -> None:
+        """Forget the scraping progress of all compounds."""
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM progress")
+            connection.execute("DELETE FROM progress_rows")
+
+    def digest(self, table: str) -> str:
+        """Get the SHA-256 hash of the rows of a table.
+
+        :param table: Name of the table.
+        """
+        digest = hashlib.sha256()
+        with self.lock:
+            for row in self.connection.execute(f"SELECT * FROM {table} ORDER BY 1, 2"):
+                digest.update(json.dumps(row).encode())
+        return digest.hexdigest()
+
+
+_workspaces: Dict[str, Workspace] = {}
+_workspaces_lock = threading.Lock()
+
+
+def workspace_exists(analysis_name: str) -> bool:
+    """Check whether an analysis has a workspace.
+
+    :param analysis_name: Name of the analysis.
+    """
+    return os.path.exists(workspace_path(analysis_name))
+
+
+def get_workspace(analysis_name: str) -> Workspace:
+    """Get the workspace of an analysis, opening it on first use.
+
+    :param analysis_name: Name of the analysis.
+    """
+    file_path = workspace_path(analysis_name)
+
+    with _workspaces_lock:
+        if file_path in _workspaces and not os.path.exists(file_path):
+            # The file was removed, e.g. to start the analysis over
+            _workspaces.pop(file_path).close()
+
+        if file_path not in _workspaces:
+            _workspaces[file_path] = Workspace(file_path)
+        return _workspaces[file_path]
+
+
+def close_workspaces() -> None:
+    """Close the workspaces opened by this process."""
+    with _workspaces_lock:
+        for workspace in _workspaces.values():
+            workspace.close()
+        _workspaces.clear()
+
+
+def workspace_table(analysis_name: str, table: str) -> str:
+    """Address a table of the workspace of an analysis, e.g. as an input or output of a stage manifest.
+
+    :param analysis_name: Name of the analysis.
+    :param table: Name of the table.
+    """
+    return f"{workspace_path(analysis_name)}{TABLE_SEPARATOR}{table}"
+
+
+def table_digest(address: str) -> Optional[str]:
+    """Get the SHA-256 hash of a workspace table addressed by :func:`workspace_table`, or None if it does not exist.
+
+    :param address: Address of the table.
+    """
+    file_path, _, table = address.partition(TABLE_SEPARATOR)
+    if not os.path.exists(file_path):
+        return None
+
+    analysis_name = os.path.basename(file_path)[: -len(".sqlite")]
+    return get_workspace(analysis_name).digest(table)
+
+
+def table_signature(address: str) -> Optional[list]:
+    """Get the size and modification time of the workspace of a table addressed by :func:`workspace_table`, or None
+    if it does not exist.
+
+    Writes go to the write-ahead log of the workspace first, so the signature covers both files. It changes with
+    any table of the workspace.
+
+    :param address: Address of the table.
+    """
+    file_path, _, table = address.partition(TABLE_SEPARATOR)
+    if not os.path.exists(file_path):
+        return None
+
+    signature = []
+    for path in (file_path, f"{file_path}-wal"):
+        if os.path.exists(path):
+            stat = os.stat(path)
+            signature += [stat.st_size, stat.st_mtime_ns]
+    return signature
+
+
+def export_workspace(analysis_name: str, table_format: str = "tsv") -> List[str]:
+    """Write the state of an analysis from its workspace to the files of another format.
+
+    The gene to chemical mapping and the chemical names are written as JSON, the chemicals and the patent store
+    as tables, together with the wide patent data.
+
+    :param analysis_name: Name of the analysis.
+    :param table_format: Format of the tables. It can be either of these: tsv, parquet, feather.
+    :returns: The paths of the written files.
+    """
+    from pemt.chemical_extractor.experimental_data_extraction import (
+        gene_chemicals_path,
+        load_gene_chemicals,
+        save_gene_chemicals,
+    )
+    from pemt.constants import PATENT_DIR, WORKSPACE_FORMAT
+    from pemt.patent_extractor.patent_chemical_harmonizer import ChemicalHarmonizer
+    from pemt.patent_extractor.patent_enrichment import _save_progress
+    from pemt.patent_extractor.patent_store import PatentStore
+
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(
+            f"Workspaces can be exported as {', '.join(TABLE_FORMATS)} files"
+        )
+    if not workspace_exists(analysis_name):
+        raise FileNotFoundError(f"There is no workspace for {analysis_name}")
+
+    workspace = get_workspace(analysis_name)
+    output_files = []
+
+    if workspace.has_stage("chemicals"):
+        save_gene_chemicals(
+            analysis_name, load_gene_chemicals(analysis_name, WORKSPACE_FORMAT)
+        )
+        output_files.append(gene_chemicals_path(analysis_name))
+
+    if workspace.has_stage("harmonizer"):
+        harmonizer = ChemicalHarmonizer(analysis_name, table_format=WORKSPACE_FORMAT)
+        harmonizer.table_format = table_format
+        harmonizer.save()
+        output_files += [harmonizer.chemical_file, harmonizer.name_file]
+
+    if workspace.has_stage("patents"):
+        store = PatentStore.load(analysis_name, WORKSPACE_FORMAT)
+        store.table_format = table_format
+        store._saved = None
+        store.save()
+        store.export()
+        output_files += [
+            store.patent_file,
+            store.chemical_file,
+            store.edge_file,
+            store.legacy_file,
+        ]
+
+        progress = workspace.load_progress()
+        if progress:
+            progress_file = f"{PATENT_DIR}/{analysis_name}_patent_progress.json"
+            _save_progress(progress_file, progress)
+            output_files.append(progress_file)
+
+    logger.debug(f"Exported {len(output_files)} files from {workspace.path}")
+    return output_files
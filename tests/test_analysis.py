@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the summaries of the patents of an analysis."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+from click.testing import CliRunner
+
+from pemt import analysis
+from pemt.analysis import chemicals_per_gene, summarize_patents
+from pemt.cli import main
+from pemt.constants import PATENT_DIR
+from pemt.patent_extractor.assignee_normalizer import AssigneeNormalizer
+from pemt.tables import write_table
+
+GENE_CHEMICALS = {"P00001": ["CHEMBL1", "CHEMBL2"], "P00002": ["CHEMBL2"], "P00003": []}
+
+PATENTS = pd.DataFrame(
+    [
+        ("CHEMBL1", "SCHEMBL1", "US-1-A", "2010-01-01", "A61P 3/00", "UNIV BOSTON"),
+        ("CHEMBL1", "SCHEMBL1", "EP-2-B1", "2012-05-01", "C07D 401/04", "NOVARTIS AG"),
+        ("CHEMBL2", "SCHEMBL2", "US-1-A", "2010-01-01", "A61P 3/00", "UNIV BOSTON"),
+        ("CHEMBL2", "SCHEMBL2", "EP-3-A1", "2012-02-01", "A61P 35/00", "NOVARTIS AG"),
+        ("CHEMBL3", "SCHEMBL3", None, None, None, None),
+    ],
+    columns=["chembl", "surechembl", "patent_id", "date", "ipc", "assignee"],
+)
+
+
+class TestAnalysis(unittest.TestCase):
+    """Tests for summarizing patent data."""
+
+    def test_summaries(self):
+        """Test every patent is counted once per value of each dimension."""
+        summaries, num_patents = summarize_patents(PATENTS, GENE_CHEMICALS)
+
+        self.assertEqual(num_patents, 3)
+        self.assertEqual(
+            {
+                dimension: frame.values.tolist()
+                for dimension, frame in summaries.items()
+            },
+            {
+                "country": [["EP", 2], ["US", 1]],
+                "kind": [["A", 1], ["A1", 1], ["B1", 1]],
+                "year": [[2010, 1], [2012, 2]],
+                "ipc_class": [["A61P", 2], ["C07D", 1]],
+                "assignee": [["NOVARTIS AG", 2], ["UNIV BOSTON", 1]],
+                "gene": [["P00001", 3], ["P00002", 2]],
+            },
+        )
+
+    def test_chunks(self):
+        """Test summarizing a table in chunks gives the same counts as at once."""
+        summaries, _ = summarize_patents(PATENTS, GENE_CHEMICALS)
+        chunked_summaries, num_patents = summarize_patents(
+            (PATENTS.iloc[idx : idx + 1] for idx in range(PATENTS.shape[0])),
+            GENE_CHEMICALS,
+        )
+
+        self.assertEqual(num_patents, 3)
+        for dimension, frame in summaries.items():
+            pd.testing.assert_frame_equal(chunked_summaries[dimension], frame)
+
+    def test_assignee_types(self):
+        """Test normalized assignees are also counted by type."""
+        # Without the cache of the decisions
+        with mock.patch(
+            "pemt.patent_extractor.assignee_normalizer.AssigneeNormalizer",
+            side_effect=lambda: AssigneeNormalizer(cache_file=None),
+        ):
+            summaries, _ = summarize_patents(PATENTS, normalize_assignees=True)
+
+        self.assertEqual(
+            summaries["assignee_type"].values.tolist(),
+            [["Industry", 2], ["Academia", 1]],
+        )
+
+    def test_chemicals_per_gene(self):
+        """Test the chemicals of the genes are counted."""
+        self.assertEqual(
+            chemicals_per_gene(GENE_CHEMICALS).values.tolist(),
+            [["P00001", 2], ["P00002", 1]],
+        )
+
+    def test_report_command(self):
+        """Test the report of an analysis is written and its top values printed."""
+        stem = f"{PATENT_DIR}/cleaned_test_analysis_patent_data"
+        write_table(PATENTS.dropna(), stem)
+        self.addCleanup(os.remove, f"{stem}.tsv")
+
+        with tempfile.TemporaryDirectory() as directory, mock.patch.object(
+            analysis, "REPORT_DIR", directory
+        ):
+            result = CliRunner().invoke(
+                main, ["report", "--name", "test_analysis", "--chunk-size", "2"]
+            )
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                [
+                    f"test_analysis_{dimension}.tsv"
+                    for dimension in (
+                        "assignee",
+                        "country",
+                        "ipc_class",
+                        "kind",
+                        "year",
+                    )
+                ],
+            )
+
+        self.assertIn("country: EP (2), US (1)", result.output)
+
+        result = CliRunner().invoke(main, ["report", "--name", "test_none"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("There is no patent data for test_none", result.output)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the normalization of patent assignees."""
+
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from pemt.patent_extractor.assignee_normalizer import (
+    AssigneeNormalizer,
+    assignee_key,
+    assignee_type,
+    normalize_assignees,
+)
+
+
+class TestAssigneeNormalizer(unittest.TestCase):
+    """Tests for the assignee normalizer."""
+
+    def test_key(self):
+        """Test word order, punctuation, abbreviations and legal forms do not change the key of a name."""
+        self.assertEqual(
+            assignee_key("SQUIBB BRISTOL MYERS CO"),
+            assignee_key("Bristol-Myers Squibb Company"),
+        )
+        self.assertEqual(
+            assignee_key("EISAI R&D MAN CO LTD"),
+            assignee_key("EISAI R & D MANUFACTURING CO., LIMITED"),
+        )
+        self.assertEqual(
+            assignee_key("BLANCHARD STÉPHANIE"), ("BLANCHARD", "STEPHANIE")
+        )
+        self.assertNotEqual(
+            assignee_key("NOVARTIS AG"), assignee_key("NOVARTIS PHARMA AG")
+        )
+
+    def test_type(self):
+        """Test assignees are classified by the words of their name."""
+        self.assertEqual(assignee_type("UNIV UTAH RES FOUND"), "Academia")
+        self.assertEqual(assignee_type("AUCKLAND UNISERVICES LTD"), "Academia")
+        self.assertEqual(assignee_type("ARVINAS OPERATIONS INC"), "Industry")
+        self.assertEqual(assignee_type("FABIUS BIOTECHNOLOGY"), "Industry")
+        self.assertEqual(assignee_type("WONG ALBERT J"), "Private")
+
+    def test_normalize(self):
+        """Test the spellings of an assignee are merged under the most frequent one."""
+        normalizer = AssigneeNormalizer(cache_file=None)
+        decisions = normalizer.normalize(
+            ["EISAI R&D MAN CO LTD"] * 2
+            + ["ESAI R & D MAN CO LTD", "WONG ALBERT J", "WANG ALBERT J", "", None]
+        )
+
+        self.assertEqual(
+            decisions,
+            {
+                "EISAI R&D MAN CO LTD": ("EISAI R&D MAN CO LTD", "Industry"),
+                "ESAI R & D MAN CO LTD": ("EISAI R&D MAN CO LTD", "Industry"),
+                # Short words are not merged, as they are often different names
+                "WONG ALBERT J": ("WONG ALBERT J", "Private"),
+                "WANG ALBERT J": ("WANG ALBERT J", "Private"),
+            },
+        )
+
+    def test_cache(self):
+        """Test the decisions are cached and new spellings of a cached assignee join it."""
+        with tempfile.TemporaryDirectory() as directory:
+            cache_file = os.path.join(directory, "assignees.json")
+            patent_df = pd.DataFrame(
+                {"patent_id": ["US-1-A", "US-2-A"], "assignee": ["US HEALTH", None]}
+            )
+            normalize_assignees(patent_df, cache_file=cache_file)
+
+            # A correction of the cache is kept
+            with open(cache_file) as f:
+                self.assertEqual(json.load(f), {"US HEALTH": ["US HEALTH", "Private"]})
+            with open(cache_file, "w") as f:
+                json.dump({"US HEALTH": ["US HEALTH", "Academia"]}, f)
+
+            patent_df = normalize_assignees(
+                pd.DataFrame({"assignee": ["US HEALHT", "UNIV BOSTON"]}),
+                cache_file=cache_file,
+            )
+
+        self.assertEqual(
+            patent_df["assignee_name"].tolist(), ["US HEALTH", "UNIV BOSTON"]
+        )
+        self.assertEqual(patent_df["assignee_type"].tolist(), ["Academia", "Academia"])
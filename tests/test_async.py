@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the asynchronous chemical extractor and harmonizer."""
+
+import asyncio
+import glob
+import os
+import threading
+import time
+import unittest
+from unittest import mock
+from urllib.error import URLError
+
+from pemt import client, metrics
+from pemt.chemical_extractor.experimental_data_extraction import (
+    extract_chemicals,
+    extract_chemicals_async,
+    get_activities,
+    get_activities_async,
+    load_gene_chemicals,
+    save_gene_chemicals,
+)
+from pemt.constants import MAPPER_DIR, PATENT_DIR
+from pemt.patent_extractor.patent_chemical_harmonizer import (
+    harmonize_chemicals,
+    read_chemical_table,
+)
+
+TARGETS = {"P00001": "CHEMBLT1", "P00002": "CHEMBLT2", "P00003": None}
+# pChEMBL values of the activities of the targets, as ChEMBL pages them
+ACTIVITIES = {
+    "CHEMBLT1": [
+        ("CHEMBLTEST1", "7.5"),
+        ("CHEMBLTEST2", "5.0"),
+        ("CHEMBLTEST3", None),
+        ("CHEMBLTEST4", "6.0"),
+        ("CHEMBLTEST5", "8.1"),
+    ],
+    "CHEMBLT2": [("CHEMBLTEST1", "6.5")],
+}
+GENE_CHEMICALS = {
+    "P00001": ["CHEMBLTEST1", "CHEMBLTEST4", "CHEMBLTEST5"],
+    "P00002": ["CHEMBLTEST1"],
+    "P00003": [],
+}
+SYNONYMS = {
+    "CHEMBLTEST1": ["aspirin", "CHEMBLTEST1"],
+    "aspirin": ["aspirin", "SCHEMBLTEST1"],
+    "CHEMBLTEST4": ["CHEMBLTEST4", "SCHEMBLTEST4"],
+}
+
+
+def _activity_page(params: dict) -> dict:
+    """Get a page of two activities of a target."""
+    activities = ACTIVITIES[params["target_chembl_id"]]
+    page = activities[params["offset"] : params["offset"] + 2]
+    return {
+        "activities": [
+            {"molecule_chembl_id": chembl_id, "pchembl_value": value}
+            for chembl_id, value in page
+        ],
+        "page_meta": {"total_count": len(activities)},
+    }
+
+
+async def _fetch_json_async(service, method, url, params=None, data=None):
+    """Answer the requests to ChEMBL and PubChem."""
+    await asyncio.sleep(0)
+    if service == "chembl":
+        return _activity_page(params)
+
+    synonyms = SYNONYMS.get(data["name"])
+    return (
+        {"InformationList": {"Information": [{"Synonym": synonyms}]}}
+        if synonyms
+        else None
+    )
+
+
+class TestCallAsync(unittest.TestCase):
+    """Tests for calling web services from an event loop."""
+
+    def setUp(self):
+        """Use fresh services without rate limits and without waiting between retries."""
+        metrics.reset()
+        for patcher in (
+            mock.patch.dict(client._services, clear=True),
+            mock.patch.dict(client.RATE_LIMITS, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Leave an empty registry for the other tests."""
+        metrics.reset()
+
+    def test_retry(self):
+        """Test failed calls are retried without blocking the event loop."""
+        func = mock.AsyncMock(side_effect=[URLError("refused"), "result"])
+
+        with mock.patch("pemt.client.asyncio.sleep", new=mock.AsyncMock()) as sleep:
+            result = asyncio.run(client.call_async("chembl", func, "CHEMBL1"))
+
+        self.assertEqual(result, "result")
+        sleep.assert_awaited_once()
+        self.assertEqual(metrics.snapshot()["retries"], {"chembl": 1})
+
+    def test_concurrency_limit(self):
+        """Test no more calls are in flight at once than the concurrency limit of the service."""
+        client.configure("chembl", concurrency=2)
+        in_flight = []
+
+        async def request(idx: int) -> int:
+            in_flight.append(idx)
+            await asyncio.sleep(0.01)
+            in_flight.remove(idx)
+            return len(in_flight)
+
+        async def run():
+            return await asyncio.gather(
+                *(client.call_async("chembl", request, idx) for idx in range(6))
+            )
+
+        self.assertLessEqual(max(asyncio.run(run())), 1)
+        self.assertEqual(metrics.snapshot()["requests"]["chembl"]["count"], 6)
+
+    def test_many_waiters(self):
+        """Test thousands of calls waiting for a few slots are let through in order, one per released slot."""
+        controller = client.ConcurrencyController(
+            "chembl", max_limit=4, initial_limit=4
+        )
+        order = []
+
+        async def request(idx: int) -> None:
+            await controller.acquire_async()
+            try:
+                order.append(idx)
+                await asyncio.sleep(0)
+            finally:
+                controller.release()
+
+        async def run():
+            tasks = [asyncio.ensure_future(request(idx)) for idx in range(4000)]
+            # Cancelled calls give their turn to the next ones
+            await asyncio.sleep(0)
+            tasks[10].cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        start = time.perf_counter()
+        asyncio.run(run())
+
+        self.assertLess(time.perf_counter() - start, 5)
+        self.assertEqual(order, [idx for idx in range(4000) if idx != 10])
+        self.assertEqual(controller.in_flight, 0)
+        self.assertFalse(controller.waiters)
+
+    def test_slot_released_by_thread(self):
+        """Test a call waiting in an event loop gets the slot released by a thread, or when the limit is raised."""
+        controller = client.ConcurrencyController(
+            "chembl", max_limit=2, initial_limit=1
+        )
+        controller.acquire()
+
+        async def run():
+            waiter = asyncio.ensure_future(controller.acquire_async())
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+
+            threading.Thread(target=controller.release).start()
+            await asyncio.wait_for(waiter, 1)
+
+            # The limit is raised by a request made at the limit
+            waiter = asyncio.ensure_future(controller.acquire_async())
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiter.done())
+            controller.record_success(0.1)
+            await asyncio.wait_for(waiter, 1)
+
+        asyncio.run(run())
+        self.assertEqual(controller.in_flight, 2)
+
+    def test_threads_and_event_loops_in_order(self):
+        """Test the requests of threads and event loops get the released slots in the order they asked for them."""
+        controller = client.ConcurrencyController(
+            "chembl", max_limit=1, initial_limit=1
+        )
+        controller.acquire()
+        order = []
+
+        def thread_request(name: str) -> None:
+            controller.acquire()
+            order.append(name)
+            controller.release()
+
+        async def loop_request() -> None:
+            await controller.acquire_async()
+            order.append("loop")
+            controller.release()
+
+        async def run():
+            first = threading.Thread(target=thread_request, args=("first thread",))
+            first.start()
+            await asyncio.sleep(0.01)
+            waiter = asyncio.ensure_future(loop_request())
+            await asyncio.sleep(0.01)
+            last = threading.Thread(target=thread_request, args=("last thread",))
+            last.start()
+            await asyncio.sleep(0.01)
+            self.assertFalse(controller.try_acquire())
+
+            controller.release()
+            await asyncio.wait_for(waiter, 1)
+            for thread in (first, last):
+                await asyncio.get_running_loop().run_in_executor(None, thread.join, 1)
+
+        asyncio.run(run())
+        self.assertEqual(order, ["first thread", "loop", "last thread"])
+        self.assertEqual(controller.in_flight, 0)
+        self.assertFalse(controller.waiters)
+
+    def test_map_async(self):
+        """Test items are processed a window at a time and their results given in order."""
+        in_progress, most = set(), [0]
+
+        async def work(idx: int) -> int:
+            in_progress.add(idx)
+            most[0] = max(most[0], len(in_progress))
+            try:
+                await asyncio.sleep(0.001 * (idx % 3))
+            finally:
+                in_progress.discard(idx)
+            if idx == 50:
+                raise ValueError(idx)
+            return idx * 2
+
+        async def run(items):
+            return [
+                item_result async for item_result in client.map_async(work, items, 4)
+            ]
+
+        self.assertEqual(asyncio.run(run(range(20))), [(i, i * 2) for i in range(20)])
+        self.assertEqual(most[0], 4)
+
+        # A failure stops the items in progress and does not start the others
+        started = []
+        with self.assertRaises(ValueError):
+            asyncio.run(run(idx for idx in range(100) if not started.append(idx)))
+        self.assertLess(len(started), 60)
+        self.assertFalse(in_progress)
+
+    def test_hedge(self):
+        """Test a slow request is sent again, the first answer is taken and the slow request is cancelled."""
+        client.configure("pubchem", hedge_budget=1.0)
+        for _ in range(client.MIN_HEDGE_SAMPLES):
+            with metrics.request("pubchem"):
+                pass
+        cancelled = []
+
+        async def request(service, method, url, **kwargs):
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+            return "fast"
+
+        with mock.patch("pemt.client._request_json_async", side_effect=request):
+            result = asyncio.run(
+                client.fetch_json_async("pubchem", "POST", "http://localhost")
+            )
+
+        self.assertEqual(result, "fast")
+        self.assertEqual(cancelled, [True])
+        stats = metrics.snapshot()["requests"]["pubchem"]
+        self.assertEqual((stats["hedges"], stats["hedges_won"]), (1, 1))
+
+
+@mock.patch(
+    "pemt.chemical_extractor.experimental_data_extraction.load_target_mappers",
+    return_value=({gene: target for gene, target in TARGETS.items() if target}, {}),
+)
+@mock.patch("pemt.client.fetch_json_async", side_effect=_fetch_json_async)
+class TestAsyncStages(unittest.TestCase):
+    """Tests for the asynchronous stages."""
+
+    def tearDown(self):
+        """Remove the files of the test analysis."""
+        for directory in (MAPPER_DIR, PATENT_DIR):
+            for file_path in glob.glob(f"{directory}/test_async_*"):
+                os.remove(file_path)
+
+    def test_extract_chemicals(self, fetch_json_async, _):
+        """Test all pages of the activities of the genes are read and the genes are saved in order."""
+        gene_chemical_dict = asyncio.run(
+            extract_chemicals_async(
+                analysis_name="test_async", gene_list=list(TARGETS), is_uniprot=True
+            )
+        )
+
+        self.assertEqual(gene_chemical_dict, GENE_CHEMICALS)
+        self.assertEqual(list(load_gene_chemicals("test_async")), list(TARGETS))
+        # Three pages of CHEMBLT1 and one of CHEMBLT2
+        self.assertEqual(fetch_json_async.call_count, 4)
+
+    def test_extract_chemicals_cached(self, fetch_json_async, _):
+        """Test the synchronous stage delegates to the asynchronous one, which skips the genes extracted before."""
+        save_gene_chemicals("test_async", {"P00001": ["CHEMBLTEST9"]})
+
+        gene_chemical_dict = extract_chemicals(
+            analysis_name="test_async",
+            gene_list=list(TARGETS),
+            is_uniprot=True,
+            use_async=True,
+        )
+
+        self.assertEqual(gene_chemical_dict["P00001"], ["CHEMBLTEST9"])
+        self.assertEqual(gene_chemical_dict["P00002"], ["CHEMBLTEST1"])
+        self.assertEqual(fetch_json_async.call_count, 1)
+
+    def test_missing_activities(self, fetch_json_async, _):
+        """Test pages that ChEMBL does not find have no activities."""
+
+        async def missing_page(service, method, url, params=None, data=None):
+            # An unknown target, and the second page of CHEMBLT1
+            if params["target_chembl_id"] not in ACTIVITIES or params["offset"] == 2:
+                return None
+            return await _fetch_json_async(service, method, url, params, data)
+
+        fetch_json_async.side_effect = missing_page
+        self.assertEqual(asyncio.run(get_activities_async("CHEMBLT0")), [])
+        self.assertEqual(
+            [
+                activity["molecule_chembl_id"]
+                for activity in asyncio.run(get_activities_async("CHEMBLT1"))
+            ],
+            ["CHEMBLTEST1", "CHEMBLTEST2", "CHEMBLTEST5"],
+        )
+
+        with mock.patch("pemt.client.fetch_json", return_value=None):
+            self.assertEqual(get_activities("CHEMBLT0"), [])
+
+    def test_harmonize_chemicals(self, *_):
+        """Test the chemicals of the genes are mapped to SureChEMBL through their PubChem names."""
+        save_gene_chemicals("test_async", GENE_CHEMICALS)
+
+        with mock.patch(
+            "pemt.patent_extractor.patent_chemical_harmonizer.load_chemical_mapper",
+            return_value={"CHEMBLTEST5": "SCHEMBLTEST5"},
+        ):
+            harmonize_chemicals("test_async", use_async=True)
+
+        chemical_df = read_chemical_table("test_async")
+        self.assertEqual(
+            sorted(zip(chemical_df["chembl"], chemical_df["schembl_id"])),
+            [
+                ("CHEMBLTEST1", "SCHEMBLTEST1"),
+                ("CHEMBLTEST4", "SCHEMBLTEST4"),
+                ("CHEMBLTEST5", "SCHEMBLTEST5"),
+            ],
+        )
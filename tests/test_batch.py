@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for running several analyses in one process."""
+
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pemt.batch import read_batch_file, run_batch
+from pemt.constants import ARCHIVE_DIR, MAPPER_DIR, PATENT_DIR
+
+from .test_pipeline import GENE_CHEMICALS, PATENTS, SURECHEMBL
+
+
+class TestBatch(unittest.TestCase):
+    """Tests for the batch runner."""
+
+    def setUp(self):
+        """Write a batch of two analyses sharing a gene."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.batch_file = os.path.join(self.directory.name, "batch.tsv")
+
+        with open(os.path.join(self.directory.name, "first.csv"), "w") as f:
+            f.write("uniprot\nP00001\nP00002\n")
+        with open(os.path.join(self.directory.name, "second.tsv"), "w") as f:
+            f.write("uniprot\nP00002\nP00003\n")
+        with open(self.batch_file, "w") as f:
+            f.write("name\tdata\tinput_type\n")
+            f.write("test_batch_first\tfirst.csv\t\n")
+            f.write("test_batch_second\tsecond.tsv\ttab\n")
+
+    def tearDown(self):
+        """Remove the files of the test analyses."""
+        self.directory.cleanup()
+        for directory in (MAPPER_DIR, PATENT_DIR):
+            for file_path in glob.glob(f"{directory}/*test_batch_*"):
+                os.remove(file_path)
+        for file_path in glob.glob(f"{ARCHIVE_DIR}/SCHEMBLTEST*"):
+            os.remove(file_path)
+
+    def test_read_batch_file(self):
+        """Test the defaults of the batch file and the paths relative to it."""
+        analyses = read_batch_file(self.batch_file)
+
+        self.assertEqual(
+            [analysis["input_type"] for analysis in analyses], ["comma", "tab"]
+        )
+        self.assertTrue(all(analysis["uniprot"] for analysis in analyses))
+        self.assertTrue(all(os.path.exists(analysis["data"]) for analysis in analyses))
+
+    @mock.patch(
+        "pemt.patent_extractor.patent_enrichment.get_patent_hits",
+        side_effect=lambda schembl_id, **kwargs: (PATENTS[schembl_id], 1, True),
+    )
+    @mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_surechembl_id",
+        side_effect=lambda chemical_id, **kwargs: SURECHEMBL.get(chemical_id),
+    )
+    @mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_chemical_names",
+        side_effect=lambda chembl_id: chembl_id.lower(),
+    )
+    @mock.patch(
+        "pemt.batch.target_to_chemical",
+        side_effect=lambda protein, **kwargs: GENE_CHEMICALS[protein],
+    )
+    @mock.patch("pemt.batch.load_target_mappers", return_value=({}, {}))
+    def test_run_batch(
+        self, load_mappers, get_chemicals, get_names, get_surechembl, get_patents
+    ):
+        """Test shared genes, chemicals and compounds are looked up once and every analysis gets its files."""
+        patent_files = run_batch(
+            analyses=read_batch_file(self.batch_file),
+            chrome_driver_path="chromedriver",
+        )
+
+        load_mappers.assert_called_once()
+        self.assertEqual(get_chemicals.call_count, 3)
+        self.assertEqual(get_surechembl.call_count, 3)
+        self.assertEqual(get_patents.call_count, 2)
+
+        self.assertEqual(
+            patent_files["test_batch_first"],
+            [
+                f"{PATENT_DIR}/cleaned_test_batch_first_patent_data.tsv",
+                f"{PATENT_DIR}/test_batch_first_gene_patent_data.tsv",
+            ],
+        )
+        for file_path in patent_files["test_batch_second"]:
+            self.assertTrue(os.path.exists(file_path))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the stand-in servers of the benchmarks."""
+
+import unittest
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from benchmarks.fixtures import make_fixtures
+from benchmarks.servers import PAGE_SIZE, StandInServers
+from benchmarks.worker import fetch_patent_hits
+from pemt import client
+from pemt.chemical_extractor.experimental_data_extraction import get_activities
+from pemt.patent_extractor.patent_chemical_harmonizer import get_surechembl_id
+from pemt.utils import get_chemical_names
+
+FIXTURES = make_fixtures(20, seed=1)
+
+
+class TestStandInServers(unittest.TestCase):
+    """Tests for replaying the fixtures of the backends."""
+
+    def test_pubchem(self):
+        """Test chemical names and SureChEMBL ids are looked up in the PubChem stand-in."""
+        cid, synonyms = next(
+            (int(cid), synonyms)
+            for cid, synonyms in FIXTURES["synonyms"].items()
+            if synonyms[-1].startswith("SCHEMBL")
+        )
+
+        with StandInServers(FIXTURES) as servers:
+            with mock.patch("pemt.utils.PUBCHEM_URL", servers.servers["pubchem"].url):
+                self.assertEqual(get_chemical_names(synonyms[1]), synonyms[0])
+                self.assertEqual(get_chemical_names("CHEMBL0"), "CHEMBL0")
+                self.assertEqual(
+                    get_surechembl_id(synonyms[1], synonyms[0], {}), synonyms[-1]
+                )
+
+        self.assertEqual(servers.counts["pubchem"]["requests"], 3)
+        # The requests share a keep-alive connection
+        self.assertEqual(servers.counts["pubchem"]["connections"], 1)
+        self.assertEqual(FIXTURES["names"][synonyms[0]], cid)
+
+    def test_chembl(self):
+        """Test the activities of a target are fetched a page at a time."""
+        target, activities = max(
+            FIXTURES["activities"].items(), key=lambda item: len(item[1])
+        )
+
+        with StandInServers(FIXTURES) as servers:
+            with mock.patch.multiple(
+                "pemt.chemical_extractor.experimental_data_extraction",
+                CHEMBL_URL=servers.servers["chembl"].url,
+                CHEMBL_PAGE_SIZE=10,
+            ):
+                self.assertEqual(get_activities(target), activities)
+                self.assertEqual(get_activities("CHEMBL0"), [])
+
+        self.assertEqual(
+            servers.counts["chembl"]["requests"], -(-len(activities) // 10) + 1
+        )
+
+    def test_surechembl_pages(self):
+        """Test the hits of a compound are fetched a page at a time."""
+        schembl_id, hits = max(
+            FIXTURES["patents"].items(), key=lambda item: len(item[1])
+        )
+        checkpoints = []
+
+        with StandInServers(FIXTURES) as servers, mock.patch.dict(
+            client._services, {"surechembl": client.Service("surechembl")}
+        ):
+            with mock.patch(
+                "pemt.constants.SURECHEMBL_URL", servers.servers["surechembl"].url
+            ):
+                patent_hits, total, complete = fetch_patent_hits(
+                    schembl_id, checkpoint=lambda progress: checkpoints.append(1)
+                )
+
+        self.assertEqual(total, len(hits))
+        self.assertTrue(complete)
+        self.assertEqual(patent_hits, set(tuple(hit) for hit in hits))
+        self.assertEqual(len(checkpoints), -(-len(hits) // PAGE_SIZE))
+
+    def test_rate_limit(self):
+        """Test requests above the rate limit are rejected."""
+        with StandInServers(FIXTURES, rate_limit={"github": 1}) as servers:
+            url = f"{servers.servers['github'].url}/hgnc_mapper.tsv"
+            with urlopen(url) as response:
+                self.assertEqual(response.status, 200)
+
+            with self.assertRaises(HTTPError) as context:
+                urlopen(url)
+
+        self.assertEqual(context.exception.code, 429)
+        self.assertEqual(
+            servers.counts["github"], {"requests": 2, "throttled": 1, "connections": 2}
+        )
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the shared client layer of the web services."""
+
+import threading
+import unittest
+from email.message import Message
+from unittest import mock
+from urllib.error import HTTPError, URLError
+
+from pemt import client, metrics
+
+
+def _http_error(code: int, retry_after: str = None) -> HTTPError:
+    """Create an urllib HTTP error."""
+    headers = Message()
+    if retry_after is not None:
+        headers["Retry-After"] = retry_after
+    return HTTPError("http://localhost", code, "error", headers, None)
+
+
+class TestClient(unittest.TestCase):
+    """Tests for rate limiting, retrying and circuit breaking."""
+
+    def setUp(self):
+        """Use fresh services without rate limits and without waiting between retries."""
+        metrics.reset()
+        patchers = [
+            mock.patch.dict(client._services, clear=True),
+            mock.patch.dict(client.RATE_LIMITS, clear=True),
+            mock.patch("pemt.client.time.sleep"),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Leave an empty registry for the other tests."""
+        metrics.reset()
+
+    def test_retry(self):
+        """Test throttled and failed calls are retried until they succeed."""
+        func = mock.Mock(
+            side_effect=[_http_error(429, "3"), URLError("refused"), "result"]
+        )
+
+        self.assertEqual(
+            client.call("pubchem", func, "CHEMBL1", namespace="name"), "result"
+        )
+        func.assert_called_with("CHEMBL1", namespace="name")
+
+        # The first retry waits as long as the Retry-After header asks
+        self.assertGreaterEqual(client.time.sleep.call_args_list[0][0][0], 3)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["requests"]["pubchem"]["count"], 3)
+        self.assertEqual(snapshot["requests"]["pubchem"]["errors"], 2)
+        self.assertEqual(snapshot["retries"], {"pubchem": 2})
+
+    def test_no_retry(self):
+        """Test errors that are not transient are raised right away."""
+        func = mock.Mock(side_effect=_http_error(404))
+
+        with self.assertRaises(HTTPError):
+            client.call("pubchem", func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_max_retries(self):
+        """Test the last error is raised when all retries failed."""
+        client.configure("chembl", max_retries=2)
+        func = mock.Mock(side_effect=_http_error(503))
+
+        with self.assertRaises(HTTPError):
+            client.call("chembl", func)
+        self.assertEqual(func.call_count, 3)
+
+    def test_circuit_breaker(self):
+        """Test a service failing too often is not called until it had time to recover."""
+        client.configure("chembl", max_retries=0, failure_threshold=2, reset_seconds=60)
+        func = mock.Mock(side_effect=ConnectionError)
+
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                client.call("chembl", func)
+
+        with self.assertRaises(client.CircuitOpenError):
+            client.call("chembl", func)
+        self.assertEqual(func.call_count, 2)
+
+        # After the reset time, a successful call closes the circuit again
+        func.side_effect = None
+        with mock.patch(
+            "pemt.client.time.monotonic", return_value=client.time.monotonic() + 61
+        ):
+            client.call("chembl", func)
+        client.call("chembl", func)
+        self.assertEqual(func.call_count, 4)
+
+    def test_token_bucket(self):
+        """Test calls above the rate wait for their turn."""
+        now = [100.0]
+        with mock.patch("pemt.client.time.monotonic", side_effect=lambda: now[0]):
+            bucket = client.TokenBucket(rate=2)
+            waits = [bucket.acquire() for _ in range(4)]
+            now[0] += 1
+            waits.append(bucket.acquire())
+
+        self.assertEqual(waits, [0.0, 0.0, 0.5, 1.0, 0.5])
+
+    def test_rate_limits_from_environment(self):
+        """Test the rate limits can be changed with an environment variable."""
+        with mock.patch.dict(
+            "os.environ", {"PEMT_RATE_LIMITS": "pubchem=2,chembl=0"}
+        ), mock.patch.dict(client.RATE_LIMITS, {"pubchem": 5, "chembl": 10}):
+            self.assertEqual(client.get_service("pubchem").bucket.rate, 2)
+            self.assertIsNone(client.get_service("chembl").bucket.rate)
+
+    def test_timeout(self):
+        """Test JSON requests are made with the timeout of their service."""
+        client.configure("chembl", timeout=5)
+        session = mock.Mock()
+        session.request.return_value.status_code = 200
+
+        with mock.patch("pemt.client.get_session", return_value=session):
+            client.fetch_json("chembl", "GET", "http://localhost", params={"q": 1})
+
+        session.request.assert_called_once_with(
+            "GET", "http://localhost", params={"q": 1}, timeout=5
+        )
+
+    def test_hedge(self):
+        """Test a JSON request slower than usual is sent again and the first answer is taken."""
+        client.configure("chembl", hedge_budget=1.0)
+        for _ in range(client.MIN_HEDGE_SAMPLES):
+            with metrics.request("chembl"):
+                pass
+
+        release = threading.Event()
+        answers = iter(["slow", "fast"])
+
+        def request(service, method, url, **kwargs):
+            answer = next(answers)
+            if answer == "slow":
+                release.wait(5)
+            return answer
+
+        with mock.patch("pemt.client._request_json", side_effect=request):
+            self.assertEqual(
+                client.fetch_json("chembl", "GET", "http://localhost"), "fast"
+            )
+        release.set()
+
+        stats = metrics.snapshot()["requests"]["chembl"]
+        self.assertEqual((stats["hedges"], stats["hedges_won"]), (1, 1))
+
+    def test_hedge_budget(self):
+        """Test slow requests are not sent again beyond the hedge budget."""
+        policy = client.configure("chembl", hedge_budget=0.1)
+        for _ in range(client.MIN_HEDGE_SAMPLES):
+            with metrics.request("chembl"):
+                pass
+
+        delays = [policy.hedge_delay() for _ in range(20)]
+        self.assertTrue(all(delay is not None for delay in delays))
+        self.assertEqual([policy.take_hedge() for _ in range(3)], [True, True, False])
+        self.assertIsNone(client.configure("chembl").hedge_delay())
+
+    def test_concurrency_controller(self):
+        """Test the limit of requests in flight grows while it is used and shrinks when the service is overloaded."""
+        now = [100.0]
+        with mock.patch("pemt.client.time.monotonic", side_effect=lambda: now[0]):
+            controller = client.ConcurrencyController(
+                "chembl", max_limit=8, initial_limit=2
+            )
+
+            # Slow start: one more slot per successful request made at the limit
+            for _ in range(3):
+                while controller.try_acquire():
+                    pass
+                controller.record_success(0.1)
+            self.assertEqual(controller.limit, 5.0)
+
+            # Overload halves the limit, at most once per round trip
+            controller.record_overload()
+            controller.record_overload()
+            self.assertEqual((controller.limit, controller.slots), (2.5, 2))
+
+            # Additive increase afterwards
+            controller.record_success(0.1)
+            self.assertAlmostEqual(controller.limit, 2.9)
+
+            # Latency well above the lowest one is overload as well
+            now[0] += 1
+            controller.record_success(1.0)
+            controller.record_success(1.0)
+            self.assertAlmostEqual(controller.limit, (2.9 + 1 / 2.9) / 2)
+
+        # The limit is reported with the requests of every run, including runs after the metrics were reset
+        metrics.reset()
+        with metrics.request("chembl"):
+            pass
+        self.assertEqual(
+            metrics.snapshot()["requests"]["chembl"]["concurrency_limit"],
+            controller.limit,
+        )
+
+    def test_concurrency_overload(self):
+        """Test throttled calls lower the limit of requests in flight, unless it is fixed."""
+        func = mock.Mock(side_effect=[_http_error(429), "result"])
+        policy = client.configure("pubchem", concurrency=8)
+        client.call("pubchem", func)
+        self.assertEqual(policy.controller.limit, client.INITIAL_CONCURRENCY / 2)
+
+        func = mock.Mock(side_effect=[_http_error(429), "result"])
+        policy = client.configure("pubchem", concurrency=8, adaptive=False)
+        client.call("pubchem", func)
+        self.assertEqual(policy.controller.limit, 8)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the integer-encoded gene to chemical mapping."""
+
+import os
+import unittest
+
+from pemt.chemical_extractor.experimental_data_extraction import (
+    gene_chemicals_path,
+    load_gene_chemicals,
+    save_gene_chemicals,
+)
+from pemt.id_store import GeneChemicalMap
+
+GENE_CHEMICALS = {
+    "TP53": ["CHEMBL1", "CHEMBL2"],
+    "EGFR": ["CHEMBL2", "CHEMBL3"],
+    "BRCA1": [],
+}
+
+
+class TestGeneChemicalMap(unittest.TestCase):
+    """Tests for the gene to chemical map."""
+
+    def test_mapping(self):
+        """Test the map behaves as the dictionary it was built from, with every chemical stored once."""
+        gene_chemical_map = GeneChemicalMap(GENE_CHEMICALS)
+
+        self.assertEqual(gene_chemical_map, GENE_CHEMICALS)
+        self.assertEqual(list(gene_chemical_map), ["TP53", "EGFR", "BRCA1"])
+        self.assertEqual(
+            gene_chemical_map.chemicals.ids, ["CHEMBL1", "CHEMBL2", "CHEMBL3"]
+        )
+        self.assertEqual(gene_chemical_map.indptr.tolist(), [0, 2, 4, 4])
+        self.assertEqual(gene_chemical_map.indices.tolist(), [0, 1, 1, 2])
+        self.assertEqual(gene_chemical_map.sizes().tolist(), [2, 2, 0])
+        self.assertEqual(
+            gene_chemical_map.distinct_chemicals(), ["CHEMBL1", "CHEMBL2", "CHEMBL3"]
+        )
+        self.assertIs(gene_chemical_map["TP53"][1], gene_chemical_map["EGFR"][0])
+
+    def test_update(self):
+        """Test genes are added, replaced and removed."""
+        gene_chemical_map = GeneChemicalMap(GENE_CHEMICALS)
+
+        gene_chemical_map["TP53"] = ["CHEMBL4"]
+        gene_chemical_map["KRAS"] = ["CHEMBL1"]
+        del gene_chemical_map["EGFR"]
+
+        self.assertEqual(
+            gene_chemical_map.to_dict(),
+            {"TP53": ["CHEMBL4"], "BRCA1": [], "KRAS": ["CHEMBL1"]},
+        )
+        self.assertEqual(gene_chemical_map.distinct_chemicals(), ["CHEMBL1", "CHEMBL4"])
+        with self.assertRaises(KeyError):
+            gene_chemical_map["EGFR"]
+
+    def test_frame(self):
+        """Test the distinct gene-chemical pairs are listed."""
+        gene_chemical_map = GeneChemicalMap(
+            {"EGFR": ["CHEMBL2", "CHEMBL2"], "TP53": ["CHEMBL1"]}
+        )
+
+        gene_codes, chemical_codes = gene_chemical_map.pairs()
+        self.assertEqual(gene_codes.tolist(), [0, 0, 1])
+        self.assertEqual(chemical_codes.tolist(), [0, 0, 1])
+        self.assertEqual(
+            gene_chemical_map.to_frame().values.tolist(),
+            [["EGFR", "CHEMBL2"], ["TP53", "CHEMBL1"]],
+        )
+
+    def test_json(self):
+        """Test the map is saved in and loaded from the JSON file of an analysis."""
+        self.addCleanup(os.remove, gene_chemicals_path("test_id_store"))
+        save_gene_chemicals("test_id_store", GeneChemicalMap(GENE_CHEMICALS))
+
+        gene_chemical_map = load_gene_chemicals("test_id_store")
+
+        self.assertIsInstance(gene_chemical_map, GeneChemicalMap)
+        self.assertEqual(gene_chemical_map.to_dict(), GENE_CHEMICALS)
+        self.assertEqual(len(load_gene_chemicals("test_none")), 0)
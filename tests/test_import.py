@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the import time and import side effects of PEMT."""
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+"""Maximum time in seconds for importing the CLI in a fresh interpreter."""
+IMPORT_TIME_BUDGET = 0.25
+
+HEAVY_MODULES = ["pandas", "selenium", "requests"]
+
+MODULES = [
+    "pemt.batch",
+    "pemt.cli",
+    "pemt.pipeline",
+    "pemt.merge",
+    "pemt.chemical_extractor.experimental_data_extraction",
+    "pemt.patent_extractor.patent_chemical_harmonizer",
+    "pemt.patent_extractor.patent_enrichment",
+]
+
+
+def _run_python(code: str, env: dict = None) -> str:
+    """Run code in a fresh interpreter and return its output."""
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=None if env is None else {**os.environ, **env},
+    ).stdout
+
+
+class TestImport(unittest.TestCase):
+    """Tests for the lazy loading of heavy backends."""
+
+    def test_cli_import_time(self):
+        """Test the CLI imports within budget and without the heavy backends."""
+        output = _run_python(
+            "import json, sys, time\n"
+            "start = time.perf_counter()\n"
+            "import pemt.cli\n"
+            "elapsed = time.perf_counter() - start\n"
+            f"print(json.dumps([elapsed, [m for m in {HEAVY_MODULES!r} if m in sys.modules]]))\n"
+        )
+        elapsed, loaded = json.loads(output)
+
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, IMPORT_TIME_BUDGET)
+
+    def test_help_without_selenium(self):
+        """Test the chemical extractor command works when Selenium is not installed."""
+        output = _run_python(
+            "import sys\n"
+            "sys.modules['selenium'] = None\n"
+            "from pemt.cli import main\n"
+            "main(['run-chemical-extractor', '--help'], standalone_mode=False)\n"
+        )
+        self.assertIn("Extract chemicals for genes of interest", output)
+
+    def test_no_side_effects(self):
+        """Test importing the modules neither creates directories nor configures logging or pandas."""
+        with tempfile.TemporaryDirectory() as directory:
+            data_dir = os.path.join(directory, "data")
+            output = _run_python(
+                "import json, logging\n"
+                f"for module in {MODULES!r}:\n"
+                "    __import__(module)\n"
+                "import pandas as pd\n"
+                "print(json.dumps([\n"
+                "    logging.getLogger().handlers != [],\n"
+                "    logging.getLogger().level,\n"
+                "    hasattr(pd.DataFrame, 'progress_apply'),\n"
+                "]))\n",
+                env={"PEMT_DATA_DIR": data_dir},
+            )
+            self.assertEqual(json.loads(output), [False, 30, False])
+            self.assertFalse(os.path.exists(data_dir))
+
+            # The directories are created by the explicit initialization, once
+            output = _run_python(
+                "import os, pemt\n"
+                "pemt.init()\n"
+                "pemt.init()\n"
+                "print(sorted(os.listdir(os.environ['PEMT_DATA_DIR'])))\n",
+                env={"PEMT_DATA_DIR": data_dir},
+            )
+            self.assertEqual(output.strip(), "['mapper', 'patent_dumps']")
+            self.assertTrue(
+                os.path.isdir(os.path.join(data_dir, "patent_dumps", "archive"))
+            )
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the index over the results of an analysis."""
+
+import os
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import pandas as pd
+from click.testing import CliRunner
+
+from pemt import index, workspace
+from pemt.chemical_extractor.experimental_data_extraction import (
+    gene_chemicals_path,
+    save_gene_chemicals,
+)
+from pemt.cli import main
+from pemt.patent_extractor.patent_store import PATENT_COLUMNS, PatentStore
+
+GENE_CHEMICALS = {"P00001": ["CHEMBL1", "CHEMBL2"], "P00002": ["CHEMBL2"]}
+
+HITS = pd.DataFrame(
+    [
+        ("US-1-A", "2010-01-01", "A61P 3/00", "UNIV BOSTON"),
+        ("EP-2-B1", "2016-05-01", "C07D 401/04", "NOVARTIS AG"),
+        ("WO-3-A1", "2018-02-01", "A61P 35/00", "NOVARTIS AG"),
+    ],
+    columns=PATENT_COLUMNS,
+)
+
+
+class TestIndex(unittest.TestCase):
+    """Tests for looking up results in the index of an analysis."""
+
+    def setUp(self):
+        """Write the results of a test analysis and keep its index in a temporary directory."""
+        self.directory = tempfile.TemporaryDirectory()
+        for patcher in (
+            mock.patch.object(index, "INDEX_DIR", f"{self.directory.name}/indexes"),
+            mock.patch.object(
+                workspace, "WORKSPACE_DIR", f"{self.directory.name}/workspaces"
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        for table_format in ("tsv", "sqlite"):
+            save_gene_chemicals("test_index", GENE_CHEMICALS, table_format)
+            store = PatentStore("test_index", table_format)
+            store.add("CHEMBL1", "SCHEMBL1", HITS.iloc[:2])
+            store.add("CHEMBL2", "SCHEMBL2", HITS.iloc[1:])
+            store.save()
+
+    def tearDown(self):
+        """Remove the results of the test analysis."""
+        workspace.close_workspaces()
+        self.directory.cleanup()
+        store = PatentStore("test_index")
+        for file_path in [
+            gene_chemicals_path("test_index"),
+            store.patent_file,
+            store.chemical_file,
+            store.edge_file,
+        ]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def test_find(self):
+        """Test genes, chemicals and patents are found through their links and the patent postings."""
+        result_index = index.get_index("test_index")
+
+        self.assertEqual(
+            result_index.find("genes", chemical="CHEMBL2"), [("P00001",), ("P00002",)]
+        )
+        self.assertEqual(
+            result_index.find("chemicals", patent="US-1-A"), [("CHEMBL1",)]
+        )
+        self.assertEqual(
+            result_index.find("patents", gene="P00002"),
+            [tuple(row) for row in HITS.iloc[[1, 2]].values.tolist()],
+        )
+        self.assertEqual(
+            result_index.find("genes", assignee="university of boston"), []
+        )
+        self.assertEqual(
+            result_index.find("genes", assignee="univ boston"), [("P00001",)]
+        )
+        self.assertEqual(
+            [row[0] for row in result_index.find("patents", assignee="NOVARTIS AG")],
+            ["EP-2-B1", "WO-3-A1"],
+        )
+        self.assertEqual(
+            result_index.find("patents", assignee="NOVARTIS AG", since=2017)[0][0],
+            "WO-3-A1",
+        )
+        self.assertEqual(
+            [row[0] for row in result_index.find("patents", ipc="A61P", until=2017)],
+            ["US-1-A"],
+        )
+        with self.assertRaises(ValueError):
+            result_index.find("assignees")
+
+        result_index.close()
+
+    def test_rebuild(self):
+        """Test the index is rebuilt when the results change."""
+        index.get_index("test_index").close()
+        with mock.patch.object(index, "build_index") as build:
+            index.get_index("test_index").close()
+        build.assert_not_called()
+
+        # Change the results after a tick of the file modification time
+        time.sleep(0.01)
+        save_gene_chemicals("test_index", {"P00003": ["CHEMBL1"]})
+
+        result_index = index.get_index("test_index")
+        self.assertEqual(result_index.find("genes", chemical="CHEMBL1"), [("P00003",)])
+        result_index.close()
+
+    def test_workspace(self):
+        """Test the index of an analysis kept in a workspace is rebuilt when a stage writes to it."""
+        result_index = index.get_index("test_index", "sqlite")
+        self.assertEqual(result_index.find("genes", patent="US-1-A"), [("P00001",)])
+        result_index.close()
+
+        save_gene_chemicals("test_index", {"P00003": ["CHEMBL1"]}, "sqlite")
+
+        result_index = index.get_index("test_index", "sqlite")
+        self.assertEqual(
+            result_index.find("genes", patent="US-1-A"), [("P00001",), ("P00003",)]
+        )
+        result_index.close()
+
+    def test_query_command(self):
+        """Test the results of a lookup are printed as tab-separated rows."""
+        result = CliRunner().invoke(
+            main,
+            ["query", "--name", "test_index", "patents", "--chemical", "CHEMBL1"],
+        )
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(
+            result.output.splitlines(),
+            [
+                "patent_id\tdate\tipc\tassignee",
+                "EP-2-B1\t2016-05-01\tC07D 401/04\tNOVARTIS AG",
+                "US-1-A\t2010-01-01\tA61P 3/00\tUNIV BOSTON",
+            ],
+        )
+
+        result = CliRunner().invoke(main, ["query", "--name", "test_none", "genes"])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("There are no results for test_none", result.output)
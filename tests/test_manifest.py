@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the stage manifests."""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pemt import manifest
+from pemt.manifest import clear_manifest, input_hash, is_fresh, write_manifest
+
+
+class TestManifest(unittest.TestCase):
+    """Tests for skipping stages with unchanged inputs."""
+
+    def setUp(self):
+        """Create an input and an output file, in the directory that also holds the manifests."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.input_file = os.path.join(self.directory.name, "genes.csv")
+        self.output_file = os.path.join(self.directory.name, "chemicals.json")
+
+        for file_path in (self.input_file, self.output_file):
+            with open(file_path, "w") as f:
+                f.write("content\n")
+
+        patcher = mock.patch.object(manifest, "MANIFEST_DIR", self.directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Remove the manifest and the files."""
+        clear_manifest("test_manifest", "chemicals")
+        self.directory.cleanup()
+
+    def test_fresh_stage(self):
+        """Test a stage is fresh until its inputs, parameters or outputs change."""
+        inputs = input_hash([self.input_file], {"uniprot": True})
+        self.assertFalse(is_fresh("test_manifest", "chemicals", inputs))
+
+        write_manifest("test_manifest", "chemicals", inputs, [self.output_file])
+        self.assertTrue(is_fresh("test_manifest", "chemicals", inputs))
+
+        self.assertFalse(
+            is_fresh(
+                "test_manifest",
+                "chemicals",
+                input_hash([self.input_file], {"uniprot": False}),
+            )
+        )
+
+        with open(self.input_file, "a") as f:
+            f.write("changed\n")
+        self.assertNotEqual(inputs, input_hash([self.input_file], {"uniprot": True}))
+
+        with open(self.output_file, "a") as f:
+            f.write("changed\n")
+        self.assertFalse(is_fresh("test_manifest", "chemicals", inputs))
+
+    def test_unchanged_files_not_hashed(self):
+        """Test files are only hashed again when their size or modification time changed."""
+        with mock.patch.object(
+            manifest, "file_digest", wraps=manifest.file_digest
+        ) as file_digest:
+            inputs = input_hash([self.input_file], {"uniprot": True})
+            write_manifest("test_manifest", "chemicals", inputs, [self.output_file])
+            self.assertEqual(file_digest.call_count, 2)
+
+            self.assertEqual(input_hash([self.input_file], {"uniprot": True}), inputs)
+            self.assertTrue(is_fresh("test_manifest", "chemicals", inputs))
+            self.assertEqual(file_digest.call_count, 2)
+
+            # A file written again with the same content is hashed, but still unchanged
+            stat = os.stat(self.output_file)
+            os.utime(
+                self.output_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9)
+            )
+            self.assertTrue(is_fresh("test_manifest", "chemicals", inputs))
+            self.assertEqual(file_digest.call_count, 3)
+            self.assertTrue(is_fresh("test_manifest", "chemicals", inputs))
+            self.assertEqual(file_digest.call_count, 3)
+
+            with open(self.input_file, "w") as f:
+                f.write("changed\n")
+            self.assertNotEqual(
+                input_hash([self.input_file], {"uniprot": True}), inputs
+            )
+            self.assertEqual(file_digest.call_count, 4)
+
+    @mock.patch(
+        "pemt.chemical_extractor.experimental_data_extraction.extract_chemicals"
+    )
+    def test_chemical_stage_format(self, extract_chemicals):
+        """Test the chemical extractor runs again when the format of its outputs changes."""
+        from pemt.cli import _run_chemical_stage
+
+        extract_chemicals.return_value = {"GENE1": ["CHEMBL1"]}
+
+        for table_format in ("tsv", "sqlite"):
+            _run_chemical_stage(
+                "test_manifest",
+                self.input_file,
+                "csv",
+                False,
+                False,
+                table_format=table_format,
+            )
+            self.assertEqual(
+                extract_chemicals.call_args.kwargs["table_format"], table_format
+            )
+        self.assertEqual(extract_chemicals.call_count, 2)
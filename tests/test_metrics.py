@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the run metrics."""
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pemt import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for recording and exporting metrics."""
+
+    def setUp(self):
+        """Start every test with an empty registry."""
+        metrics.reset()
+
+    def tearDown(self):
+        """Leave an empty registry for the other tests."""
+        metrics.reset()
+
+    def test_record(self):
+        """Test stages, requests, retries and cache lookups are recorded."""
+
+        @metrics.stage("chemicals")
+        def run():
+            with metrics.request("chembl"):
+                pass
+            with self.assertRaises(ValueError):
+                with metrics.request("chembl"):
+                    raise ValueError
+            metrics.retry("chembl")
+            metrics.cache("genes", hit=True)
+            metrics.cache("genes", hit=False)
+            metrics.cache("genes", hit=False)
+
+        run()
+        run()
+        snapshot = metrics.snapshot()
+
+        self.assertEqual(list(snapshot["stages"]), ["chemicals"])
+        self.assertGreater(snapshot["stages"]["chemicals"], 0)
+        self.assertEqual(snapshot["requests"]["chembl"]["count"], 4)
+        self.assertEqual(snapshot["requests"]["chembl"]["errors"], 2)
+        self.assertEqual(snapshot["retries"], {"chembl": 2})
+        self.assertEqual(snapshot["caches"]["genes"]["hits"], 2)
+        self.assertEqual(snapshot["caches"]["genes"]["misses"], 4)
+        self.assertAlmostEqual(snapshot["caches"]["genes"]["hit_rate"], 1 / 3)
+
+        metrics.reset()
+        self.assertEqual(
+            metrics.snapshot(),
+            {"stages": {}, "requests": {}, "retries": {}, "caches": {}},
+        )
+
+    def test_latency_percentiles(self):
+        """Test the latency percentiles and hedges of a backend are reported."""
+        times = [time for latency in range(1, 101) for time in (0.0, float(latency))]
+        with mock.patch("pemt.metrics.time.perf_counter", side_effect=times):
+            for _ in range(100):
+                with metrics.request("pubchem"):
+                    pass
+        metrics.hedge("pubchem", won=True)
+        metrics.hedge("pubchem", won=False)
+
+        stats = metrics.snapshot()["requests"]["pubchem"]
+        self.assertEqual(
+            (stats["p50_seconds"], stats["p95_seconds"], stats["p99_seconds"]),
+            (50.0, 95.0, 99.0),
+        )
+        self.assertEqual((stats["hedges"], stats["hedges_won"]), (2, 1))
+        self.assertEqual(metrics.latency_percentile("pubchem", 95), 95.0)
+        self.assertIsNone(metrics.latency_percentile("chembl", 95))
+
+    def test_prometheus(self):
+        """Test the metrics are formatted as Prometheus samples with the run labels."""
+        with metrics.request("pubchem"):
+            pass
+        metrics.cache("chemical_names", hit=True)
+
+        text = metrics.to_prometheus(
+            metrics.snapshot(), {"analysis": 'a "b"', "command": "run-pemt"}
+        )
+        lines = text.splitlines()
+
+        self.assertIn("# TYPE pemt_request_seconds summary", lines)
+        self.assertIn(
+            'pemt_requests_total{analysis="a \\"b\\"",command="run-pemt",backend="pubchem"} 1',
+            lines,
+        )
+        self.assertIn(
+            'pemt_request_seconds_count{analysis="a \\"b\\"",command="run-pemt",backend="pubchem"} 1',
+            lines,
+        )
+        self.assertIn(
+            'pemt_cache_hits_total{analysis="a \\"b\\"",command="run-pemt",cache="chemical_names"} 1',
+            lines,
+        )
+        self.assertTrue(text.endswith("\n"))
+
+    def test_write_metrics(self):
+        """Test the metrics are written as JSON and Prometheus files."""
+        metrics.cache("genes", hit=True)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch.object(metrics, "METRICS_DIR", directory):
+                written = metrics.write_metrics("test_run", {"analysis": "test"})
+
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ["test_run.prom", "test_run_metrics.json"],
+            )
+            with open(f"{directory}/test_run_metrics.json") as f:
+                data = json.load(f)
+
+        self.assertEqual(data["analysis"], "test")
+        self.assertEqual(data["caches"], written["caches"])
+        self.assertIn(
+            "Cache genes: 1 hits, 0 misses (100%)", metrics.format_summary(written)
+        )
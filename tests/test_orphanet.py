@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for reading the genes of rare diseases from the Orphanet XML dumps."""
+
+import os
+import tempfile
+import tracemalloc
+import unittest
+
+from pemt.chemical_extractor.experimental_data_extraction import read_proteins
+from pemt.chemical_extractor.orphanet import (
+    orphanet_gene_list,
+    read_disorder_genes,
+    read_orphanet_genes,
+    read_prevalences,
+)
+
+TEST_FOLDER = os.path.dirname(os.path.realpath(__file__))
+GENE_DUMP = os.path.join(TEST_FOLDER, "resources", "orphanet_genes.xml")
+PREVALENCE_DUMP = os.path.join(TEST_FOLDER, "resources", "orphanet_prevalences.xml")
+
+DISORDER = """<Disorder id="{idx}">
+  <OrphaCode>{idx}</OrphaCode>
+  <Name lang="en">Disorder {idx}</Name>
+  <DisorderGeneAssociationList count="1">
+    <DisorderGeneAssociation>
+      <Gene id="{idx}"><Name lang="en">Gene {idx}</Name><Symbol>GENE{idx}</Symbol></Gene>
+    </DisorderGeneAssociation>
+  </DisorderGeneAssociationList>
+</Disorder>
+"""
+
+
+class TestOrphanet(unittest.TestCase):
+    """Tests for the Orphanet adapter."""
+
+    def test_disorder_genes(self):
+        """Test every gene of every disorder is read, with its UniProt id."""
+        records = list(read_disorder_genes(GENE_DUMP))
+
+        self.assertEqual(
+            [(r["orphanet id"], r["symbol"], r["uniprot"]) for r in records],
+            [
+                ("166024", "KIF7", "Q2M1P5"),
+                ("166024", "COL9A1", None),
+                ("93", "AGA", "P20933"),
+            ],
+        )
+        self.assertEqual(
+            records[0]["name"], "Multiple epiphyseal dysplasia, Al-Gazali type"
+        )
+        self.assertEqual(records[0]["association status"], "Assessed")
+
+    def test_prevalences(self):
+        """Test the disorders are joined with and filtered by their prevalence."""
+        self.assertEqual(read_prevalences(PREVALENCE_DUMP), {"166024": 12, "93": 3})
+
+        records = list(
+            read_orphanet_genes(GENE_DUMP, PREVALENCE_DUMP, min_prevalence=10)
+        )
+        self.assertEqual([r["symbol"] for r in records], ["KIF7", "COL9A1"])
+        self.assertEqual(records[0]["prevalence count"], 12)
+
+        self.assertEqual(
+            orphanet_gene_list(
+                GENE_DUMP, is_uniprot=True, prevalence_file_path=PREVALENCE_DUMP
+            ),
+            ["Q2M1P5", "P20933"],
+        )
+
+    def test_gene_input(self):
+        """Test the gene dump is accepted as the gene file of an analysis."""
+        self.assertEqual(
+            read_proteins(gene_file_path=GENE_DUMP), ["KIF7", "COL9A1", "AGA"]
+        )
+
+    def test_constant_memory(self):
+        """Test the memory used does not grow with the number of disorders."""
+
+        def peak_memory(num_disorders: int) -> int:
+            with tempfile.TemporaryDirectory() as directory:
+                file_path = os.path.join(directory, "dump.xml")
+                with open(file_path, "w") as f:
+                    f.write("<JDBOR><DisorderList>")
+                    for idx in range(num_disorders):
+                        f.write(DISORDER.format(idx=idx))
+                    f.write("</DisorderList></JDBOR>")
+
+                tracemalloc.start()
+                for _ in read_disorder_genes(file_path):
+                    pass
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            return peak
+
+        self.assertLess(peak_memory(10000), 2 * peak_memory(1000))
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the extraction of patents from SureChEMBL."""
+
+import glob
+import os
+import re
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from pemt import workspace
+from pemt.constants import ARCHIVE_DIR, PATENT_DIR
+from pemt.patent_extractor.patent_chemical_harmonizer import write_chemical_table
+from pemt.patent_extractor.patent_enrichment import (
+    HIT_COLUMNS,
+    PatentExtractor,
+    _load_progress,
+    filter_patents,
+    get_patent_hits,
+    incomplete_archives,
+    load_archive_info,
+    load_patent_archive,
+    refilter_patents,
+    save_patent_archive,
+)
+
+HITS = {
+    ("US-1-A", "2010-01-01", "A61P 3/00", "UNIV BOSTON"),
+    ("US-2-A", "1995-01-01", "A61P 3/00", "NOVARTIS AG"),
+    ("EP-3-B1", "2012-05-01", "G06F 17/00", ""),
+}
+
+
+class FakeElement:
+    """Element of a page of the fake browser."""
+
+    def __init__(self, text: str = "", href: str = ""):
+        """Create an element with a text and a link."""
+        self.text = text
+        self.href = href
+
+    def click(self) -> None:
+        """Click the element."""
+
+    def get_attribute(self, name: str) -> str:
+        """Get the link of the element."""
+        return self.href
+
+
+class FakeDriver:
+    """Browser showing the SureChEMBL pages of a compound with a number of patents."""
+
+    def __init__(
+        self,
+        patents: int,
+        failing_page: int = None,
+        visited: list = None,
+        reported: int = None,
+    ):
+        """Create a browser for a compound.
+
+        :param patents: Number of patents of the compound.
+        :param failing_page: Page whose loading fails once, like an interrupted run.
+        :param visited: List to which the URLs of the loaded pages are added.
+        :param reported: Total number of patents shown, if it differs from the patents listed on the pages.
+        """
+        self.patents = patents
+        self.reported = patents if reported is None else reported
+        self.failing_page = failing_page
+        self.visited = [] if visited is None else visited
+        self.page = None
+        self.command_executor = mock.Mock(_commands={})
+
+    def execute(self, command: str, params: dict) -> None:
+        """Run a command of the browser."""
+
+    def quit(self) -> None:
+        """Close the browser."""
+
+    def get(self, url: str) -> None:
+        """Load a page, whose number is at the end of the URLs of result pages."""
+        match = re.search(r"page=(\d+)$", url)
+        page = int(match.group(1)) if match else 0
+        if page == self.failing_page:
+            self.failing_page = None
+            raise ConnectionError(url)
+        self.visited.append(url)
+        self.page = page
+
+    def find_element(self, by: str, value: str) -> FakeElement:
+        """Find an element by id."""
+        return FakeElement()
+
+    def find_element_by_xpath(self, xpath: str) -> FakeElement:
+        """Find an element of the current page."""
+        from selenium.common.exceptions import NoSuchElementException
+
+        if xpath.endswith("ul/li[3]"):  # patent tab
+            return FakeElement()
+        if xpath.endswith("div[3]/div[3]/a"):  # patent table link
+            return FakeElement(href="https://surechembl.test/results?page=1")
+        if "total_hits_data" in xpath:
+            return FakeElement(text=f"{self.reported:,}")
+
+        match = re.search(r"/tr\[(\d+)\]/td\[(\d)\]", xpath)
+        if match:
+            index = (self.page - 1) * 50 + int(match.group(1)) - 2
+            if index >= self.patents:
+                raise NoSuchElementException(xpath)
+            column = int(match.group(2))
+            if column == 2:
+                return FakeElement(text=f"Patent\nUS-{index}-A")
+            if column == 3:
+                return FakeElement(text="2010-01-01")
+            return FakeElement(text="A61P 3/00" if xpath.endswith("td[1]") else "")
+
+        # Link to the next page
+        return FakeElement(href=f"https://surechembl.test/results?page={self.page + 1}")
+
+
+class TestPatentEnrichment(unittest.TestCase):
+    """Tests for filtering and archiving the patents of compounds."""
+
+    def tearDown(self):
+        """Remove the files of the test analysis and the test archives."""
+        for file_path in glob.glob(f"{PATENT_DIR}/test_enrichment_*"):
+            os.remove(file_path)
+        for file_path in glob.glob(f"{ARCHIVE_DIR}/SCHEMBLTEST*"):
+            os.remove(file_path)
+
+    def test_filter_patents(self):
+        """Test patents are kept from the cut-off year on with a valid main IPC class."""
+        hit_df = pd.DataFrame(
+            [
+                ("US-1-A", "2010-01-01", "A61P 3/00", ""),
+                ("US-2-A", "1995-01-01", "A61P 3/00", ""),
+                ("EP-3-B1", "2012-05-01", "G06F 17/00", ""),
+                ("WO-4-A1", "2000-01-01", None, ""),
+                ("WO-5-A1", "", "C07D 401/04", ""),
+                ("WO-6-A1", "2000-12-31", "C07D", ""),
+            ],
+            columns=HIT_COLUMNS,
+        )
+
+        self.assertEqual(
+            filter_patents(hit_df, year=2000)["patent_id"].tolist(),
+            ["US-1-A", "WO-6-A1"],
+        )
+        self.assertEqual(
+            filter_patents(hit_df, year=2000, valid_codes={"G06F"})[
+                "patent_id"
+            ].tolist(),
+            ["EP-3-B1"],
+        )
+
+    def test_archive_round_trip(self):
+        """Test archived hits are read back unchanged, with whether they are complete."""
+        self.assertIsNone(load_patent_archive("SCHEMBLTEST1"))
+        self.assertIsNone(load_archive_info("SCHEMBLTEST1"))
+
+        hit_df = save_patent_archive("SCHEMBLTEST1", HITS, total=3, complete=True)
+        pd.testing.assert_frame_equal(load_patent_archive("SCHEMBLTEST1"), hit_df)
+        self.assertEqual(
+            load_archive_info("SCHEMBLTEST1"),
+            {"total": 3, "rows": 3, "complete": True},
+        )
+
+        # A scrape that stopped early or found no total is incomplete, even with as many hits as reported
+        save_patent_archive("SCHEMBLTEST2", list(HITS)[:1], total=1, complete=False)
+        save_patent_archive("SCHEMBLTEST3", [], total=None, complete=False)
+        # All pages were scraped, although they listed fewer hits than reported
+        save_patent_archive("SCHEMBLTEST4", list(HITS)[:1], total=3, complete=True)
+        self.assertEqual(
+            incomplete_archives(
+                ["SCHEMBLTEST1", "SCHEMBLTEST2", "SCHEMBLTEST3", "SCHEMBLTEST4"]
+            ),
+            ["SCHEMBLTEST2", "SCHEMBLTEST3"],
+        )
+
+        # Archives written before their description count as complete
+        os.remove(f"{ARCHIVE_DIR}/SCHEMBLTEST2.json")
+        self.assertTrue(load_archive_info("SCHEMBLTEST2")["complete"])
+
+    @mock.patch("pemt.patent_extractor.patent_enrichment.get_patent_hits")
+    def test_rescrape_incomplete(self, get_patent_hits):
+        """Test compounds whose archive is incomplete are scraped again on the next run."""
+
+        def extract(**kwargs) -> PatentExtractor:
+            extractor = PatentExtractor("test_enrichment_run", "chromedriver", **kwargs)
+            extractor.extract("CHEMBL1", "SCHEMBLTEST1")
+            extractor.close()
+            return extractor
+
+        # The link to the next page was missing, one of the three patents was scraped
+        get_patent_hits.return_value = ({sorted(HITS)[-1]}, 3, False)
+        extractor = extract()
+        self.assertEqual(get_patent_hits.call_count, 1)
+        self.assertEqual(incomplete_archives(["SCHEMBLTEST1"]), ["SCHEMBLTEST1"])
+        self.assertIn(("CHEMBL1", "SCHEMBLTEST1"), extractor.store)
+
+        get_patent_hits.return_value = (HITS, 3, True)
+        extractor = extract()
+        self.assertEqual(get_patent_hits.call_count, 2)
+        self.assertEqual(incomplete_archives(["SCHEMBLTEST1"]), [])
+        self.assertEqual(extractor.store.to_wide()["patent_id"].tolist(), ["US-1-A"])
+
+        # Complete archives are only scraped again on request
+        extract()
+        self.assertEqual(get_patent_hits.call_count, 2)
+        extract(rescrape=True)
+        self.assertEqual(get_patent_hits.call_count, 3)
+
+    def test_refilter_patents(self):
+        """Test the patent store is rebuilt from the archives with other filters."""
+        write_chemical_table(
+            pd.DataFrame(
+                {
+                    "chembl": ["CHEMBL1", "CHEMBL2", "CHEMBL3"],
+                    "schembl_id": ["SCHEMBLTEST1", "SCHEMBLTEST2", None],
+                    "name": ["a", "b", "c"],
+                }
+            ),
+            "test_enrichment_refilter",
+        )
+        save_patent_archive("SCHEMBLTEST1", HITS, total=3, complete=True)
+        save_patent_archive("SCHEMBLTEST2", list(HITS)[:1], total=3, complete=False)
+
+        patent_df = refilter_patents("test_enrichment_refilter", patent_year=2011)
+
+        self.assertEqual(sorted(patent_df["chembl"].unique()), ["CHEMBL1", "CHEMBL2"])
+        self.assertEqual(patent_df["patent_id"].dropna().tolist(), [])
+
+        patent_df = refilter_patents(
+            "test_enrichment_refilter", patent_year=2011, valid_codes={"G06F"}
+        )
+        self.assertEqual(
+            patent_df[patent_df["chembl"] == "CHEMBL1"]["patent_id"].tolist(),
+            ["EP-3-B1"],
+        )
+
+    @mock.patch(
+        "pemt.client.call", side_effect=lambda service, func, *args: func(*args)
+    )
+    @mock.patch("pemt.patent_extractor.patent_enrichment.time.sleep")
+    @mock.patch("pemt.patent_extractor.patent_enrichment._import_webdriver")
+    def test_resume_scraping(self, import_webdriver, *_):
+        """Test an interrupted scrape resumes from the page after its last checkpoint."""
+        visited = []
+        checkpoints = []
+        import_webdriver.return_value.Chrome.side_effect = [
+            FakeDriver(120, failing_page=3, visited=visited),
+            FakeDriver(120, visited=visited),
+        ]
+
+        progress = {}
+        with self.assertRaises(ConnectionError):
+            get_patent_hits(
+                "SCHEMBLTEST1",
+                "linux",
+                "chromedriver",
+                progress=progress,
+                checkpoint=lambda state: checkpoints.append(len(state["rows"])),
+            )
+        self.assertEqual(checkpoints, [50, 100])
+        self.assertEqual(progress["page"], 2)
+        self.assertEqual(progress["url"], "https://surechembl.test/results?page=3")
+
+        patent_hits, total, complete = get_patent_hits(
+            "SCHEMBLTEST1", "linux", "chromedriver", progress=progress
+        )
+        self.assertEqual(total, 120)
+        self.assertTrue(complete)
+        self.assertEqual(len(patent_hits), 120)
+        self.assertEqual(len(visited), len(set(visited)))
+        self.assertEqual(visited[-1], "https://surechembl.test/results?page=3")
+
+        # All pages were scraped, the browser is not started again
+        self.assertEqual(
+            get_patent_hits("SCHEMBLTEST1", "linux", "chromedriver", progress=progress),
+            (patent_hits, 120, True),
+        )
+        self.assertEqual(import_webdriver.return_value.Chrome.call_count, 2)
+
+    @mock.patch(
+        "pemt.client.call", side_effect=lambda service, func, *args: func(*args)
+    )
+    @mock.patch("pemt.patent_extractor.patent_enrichment.time.sleep")
+    @mock.patch("pemt.patent_extractor.patent_enrichment._import_webdriver")
+    def test_fewer_hits_than_reported(self, import_webdriver, *_):
+        """Test a scrape is complete once its last page is reached, even with fewer hits than reported."""
+        import_webdriver.return_value.Chrome.return_value = FakeDriver(90, reported=120)
+
+        patent_hits, total, complete = get_patent_hits(
+            "SCHEMBLTEST1", "linux", "chromedriver"
+        )
+        self.assertEqual((len(patent_hits), total, complete), (90, 120, True))
+
+    def test_extractor_progress(self):
+        """Test the progress is checkpointed page by page and cleared once the compound is archived."""
+        hits = sorted(HITS)
+
+        def interrupted(progress, checkpoint, **kwargs):
+            progress.update({"page": 0, "url": "page1", "total": 3, "rows": []})
+            for page, row in enumerate(hits[:2], start=1):
+                progress["rows"].append(row)
+                progress.update({"page": page, "url": f"page{page + 1}"})
+                checkpoint(progress)
+            raise ConnectionError(progress["url"])
+
+        def resumed(progress, checkpoint, **kwargs):
+            self.assertEqual(progress["url"], "page3")
+            self.assertEqual([tuple(row) for row in progress["rows"]], hits[:2])
+            progress["rows"].append(hits[2])
+            progress.update({"page": 3, "url": None, "complete": True})
+            checkpoint(progress)
+            self.assertIsNone(load_patent_archive("SCHEMBLTEST1"))
+            return set(tuple(row) for row in progress["rows"]), 3, True
+
+        for table_format in ("tsv", "sqlite"):
+            with self.subTest(
+                table_format=table_format
+            ), tempfile.TemporaryDirectory() as directory, mock.patch.object(
+                workspace, "WORKSPACE_DIR", directory
+            ):
+                with mock.patch(
+                    "pemt.patent_extractor.patent_enrichment.get_patent_hits",
+                    side_effect=interrupted,
+                ), self.assertRaises(ConnectionError):
+                    PatentExtractor(
+                        "test_enrichment_progress",
+                        "chromedriver",
+                        table_format=table_format,
+                    ).extract("CHEMBL1", "SCHEMBLTEST1")
+
+                extractor = PatentExtractor(
+                    "test_enrichment_progress",
+                    "chromedriver",
+                    table_format=table_format,
+                )
+                self.assertEqual(
+                    [tuple(row) for row in extractor.progress["SCHEMBLTEST1"]["rows"]],
+                    hits[:2],
+                )
+                if table_format == "tsv":
+                    # Each checkpoint after the first one only adds the new row
+                    with open(extractor.progress_file) as f:
+                        self.assertEqual(len(f.readlines()), 2)
+
+                with mock.patch(
+                    "pemt.patent_extractor.patent_enrichment.get_patent_hits",
+                    side_effect=resumed,
+                ):
+                    extractor.extract("CHEMBL1", "SCHEMBLTEST1")
+
+                self.assertEqual(extractor.progress, {})
+                if table_format == "tsv":
+                    self.assertEqual(_load_progress(extractor.progress_file), {})
+                else:
+                    self.assertEqual(extractor.workspace.load_progress(), {})
+                self.assertEqual(len(load_patent_archive("SCHEMBLTEST1")), 3)
+
+                extractor.close()
+                workspace.close_workspaces()
+                os.remove(f"{ARCHIVE_DIR}/SCHEMBLTEST1.tsv.gz")
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the normalized patent store."""
+
+import os
+import unittest
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from pemt.patent_extractor.patent_store import PATENT_COLUMNS, PatentStore
+
+HITS = pd.DataFrame(
+    [
+        ("US-1-A", "2010-01-01", "A61P 3/00", "UNIV BOSTON"),
+        ("EP-2-B1", "2012-05-01", "C07D 401/04", "NOVARTIS AG"),
+    ],
+    columns=PATENT_COLUMNS,
+)
+
+
+class TestPatentStore(unittest.TestCase):
+    """Tests for the patent store."""
+
+    def setUp(self):
+        """Create a store with a patent shared by two chemicals."""
+        self.store = PatentStore("test_store")
+        self.store.add("CHEMBL1", "SCHEMBL1", HITS)
+        self.store.add("CHEMBL2", "SCHEMBL2", HITS.iloc[:1])
+        self.store.add("CHEMBL3", "SCHEMBL3", HITS.iloc[0:0])
+
+    def tearDown(self):
+        """Remove the files of the store."""
+        for file_path in [
+            self.store.patent_file,
+            self.store.chemical_file,
+            self.store.edge_file,
+            self.store.legacy_file,
+        ]:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+    def test_patents_stored_once(self):
+        """Test shared patents are stored once and linked by index."""
+        self.assertEqual(len(self.store.patents), 2)
+        self.assertEqual(self.store.edges.tolist(), [[0, 0], [0, 1], [1, 0]])
+        self.assertIn(("CHEMBL3", "SCHEMBL3"), self.store)
+
+    def test_wide_format(self):
+        """Test the wide patent data has a row per chemical and patent."""
+        wide_df = self.store.to_wide()
+        self.assertEqual(wide_df.shape[0], 4)
+        self.assertTrue(
+            wide_df[wide_df["chembl"] == "CHEMBL3"]["patent_id"].isna().all()
+        )
+
+    def test_round_trip(self):
+        """Test the store can be saved and loaded, also from the wide file."""
+        self.store.save()
+        loaded = PatentStore.load("test_store")
+        self.assertTrue(loaded.to_wide().equals(self.store.to_wide()))
+
+        self.store.export()
+        for file_path in [
+            self.store.patent_file,
+            self.store.chemical_file,
+            self.store.edge_file,
+        ]:
+            os.remove(file_path)
+        converted = PatentStore.load("test_store")
+        self.assertEqual(converted.edges.tolist(), self.store.edges.tolist())
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_format_switch(self):
+        """Test a store saved as TSV is loaded and saved again as Parquet."""
+        self.store.save()
+        loaded = PatentStore.load("test_store", table_format="parquet")
+        loaded.save()
+
+        self.assertTrue(loaded.patent_file.endswith(".parquet"))
+        self.assertFalse(os.path.exists(self.store.patent_file))
+
+        reloaded = PatentStore.load("test_store", table_format="parquet")
+        self.assertEqual(reloaded.patents, self.store.patents)
+        self.assertTrue(reloaded.to_wide().equals(self.store.to_wide()))
+
+        for file_path in [reloaded.patent_file, reloaded.chemical_file]:
+            os.remove(file_path)
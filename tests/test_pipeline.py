@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the streaming PEMT pipeline."""
+
+import glob
+import os
+import threading
+import unittest
+from unittest import mock
+
+from pemt.constants import ARCHIVE_DIR, MAPPER_DIR, PATENT_DIR
+from pemt.pipeline import run_pipeline
+
+GENE_CHEMICALS = {
+    "P00001": ["CHEMBL1", "CHEMBL2"],
+    "P00002": ["CHEMBL2", "CHEMBL3"],
+    "P00003": [],
+}
+SURECHEMBL = {"CHEMBL1": "SCHEMBLTEST1", "CHEMBL2": "SCHEMBLTEST2"}
+PATENTS = {
+    "SCHEMBLTEST1": {("US-1-A", "2010-01-01", "A61P 3/00", "UNIV BOSTON")},
+    "SCHEMBLTEST2": {
+        ("US-1-A", "2010-01-01", "A61P 3/00", "UNIV BOSTON"),
+        ("US-2-A", "1995-01-01", "A61P 3/00", "NOVARTIS AG"),
+    },
+}
+
+
+class TestPipeline(unittest.TestCase):
+    """Tests for running the stages concurrently."""
+
+    def tearDown(self):
+        """Remove the files of the test analysis."""
+        for directory in (MAPPER_DIR, PATENT_DIR):
+            for file_path in glob.glob(f"{directory}/test_pipeline_*"):
+                os.remove(file_path)
+        for file_path in glob.glob(f"{ARCHIVE_DIR}/SCHEMBLTEST*"):
+            os.remove(file_path)
+
+    @mock.patch(
+        "pemt.patent_extractor.patent_enrichment.get_patent_hits",
+        side_effect=lambda schembl_id, **kwargs: (PATENTS[schembl_id], 1, True),
+    )
+    @mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_surechembl_id",
+        side_effect=lambda chemical_id, **kwargs: SURECHEMBL.get(chemical_id),
+    )
+    @mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_chemical_names",
+        side_effect=lambda chembl_id: chembl_id.lower(),
+    )
+    @mock.patch(
+        "pemt.pipeline.target_to_chemical",
+        side_effect=lambda protein, **kwargs: GENE_CHEMICALS[protein],
+    )
+    @mock.patch("pemt.pipeline.load_target_mappers", return_value=({}, {}))
+    def test_run_pipeline(self, *_):
+        """Test chemicals flow through all stages and every stage writes its files."""
+        gene_chemical_dict, patent_df = run_pipeline(
+            analysis_name="test_pipeline",
+            chrome_driver_path="chromedriver",
+            gene_list=list(GENE_CHEMICALS),
+            is_uniprot=True,
+            queue_size=1,
+        )
+
+        self.assertEqual(gene_chemical_dict, GENE_CHEMICALS)
+        self.assertEqual(
+            sorted(zip(patent_df["chembl"], patent_df["patent_id"])),
+            [("CHEMBL1", "US-1-A"), ("CHEMBL2", "US-1-A")],
+        )
+        self.assertTrue(
+            os.path.exists(f"{MAPPER_DIR}/test_pipeline_gene_to_chemicals.json")
+        )
+        self.assertTrue(os.path.exists(f"{PATENT_DIR}/test_pipeline_chemicals.tsv"))
+        self.assertTrue(os.path.exists(f"{PATENT_DIR}/test_pipeline_patents.tsv"))
+
+    @mock.patch("pemt.pipeline.target_to_chemical")
+    @mock.patch("pemt.pipeline.load_target_mappers", return_value=({}, {}))
+    def test_extractor_fails(self, _, target_to_chemical):
+        """Test no stage is started when the patent extractor cannot be created."""
+        with self.assertRaises(AssertionError):
+            run_pipeline(
+                analysis_name="test_pipeline",
+                chrome_driver_path="chromedriver",
+                os_system="amiga",
+                gene_list=list(GENE_CHEMICALS),
+                is_uniprot=True,
+            )
+
+        target_to_chemical.assert_not_called()
+        self.assertFalse(
+            any(
+                thread.name in ("chemical-extractor", "chemical-harmonizer")
+                for thread in threading.enumerate()
+            )
+        )
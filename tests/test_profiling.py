@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the profiling of the stages."""
+
+import json
+import os
+import pstats
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from click.testing import CliRunner
+
+from pemt import metrics
+from pemt.profiling import Profiler, format_summary
+
+
+def _allocate() -> list:
+    """Allocate memory that is kept after the stage."""
+    return [str(idx) * 10 for idx in range(20000)]
+
+
+def _compute() -> int:
+    """Spend some CPU time."""
+    return sum(idx * idx for idx in range(200000))
+
+
+class TestProfiler(unittest.TestCase):
+    """Tests for profiling the stages of a run."""
+
+    def setUp(self):
+        """Start with an empty registry."""
+        metrics.reset()
+
+    def tearDown(self):
+        """Leave an empty registry for the other tests."""
+        metrics.reset()
+
+    def test_stage(self):
+        """Test the CPU time, network wait and memory of a stage are recorded."""
+        with Profiler() as profiler:
+            with metrics.stage("chemicals"):
+                kept = _allocate()
+                _compute()
+                with metrics.request("chembl"):
+                    time.sleep(0.05)
+                # Stages within a stage are part of it
+                with metrics.stage("harmonizer"):
+                    _compute()
+
+        # Stages outside of the profiler are not profiled
+        with metrics.stage("patents"):
+            pass
+
+        summary = profiler.summary()
+        self.assertEqual(list(summary), ["chemicals"])
+        stats = summary["chemicals"]
+        self.assertEqual(stats["runs"], 1)
+        self.assertGreaterEqual(stats["network_seconds"], 0.05)
+        self.assertGreater(stats["compute_seconds"], 0)
+        self.assertLessEqual(
+            stats["network_seconds"] + stats["compute_seconds"],
+            stats["wall_seconds"] * 1.01,
+        )
+        self.assertGreater(stats["peak_memory_mb"], 0.5)
+        self.assertIn("test_profiling.py", stats["top_allocations"][0]["site"])
+        self.assertTrue(
+            any("_compute" in spot["function"] for spot in stats["hot_spots"])
+        )
+        self.assertIn("Profile chemicals:", format_summary(summary))
+        self.assertEqual(len(kept), 20000)
+
+    def test_overlapping_requests(self):
+        """Test requests in flight at once in a thread count once in its network wait."""
+        before, _ = metrics.network_seconds()
+        with metrics.network_wait():
+            with metrics.network_wait():
+                time.sleep(0.02)
+            time.sleep(0.02)
+        after, _ = metrics.network_seconds()
+
+        self.assertGreaterEqual(after - before, 0.04)
+        self.assertLess(after - before, 0.5)
+
+    def test_write(self):
+        """Test the profiles are written as pstats dumps with a JSON summary."""
+        with Profiler() as profiler:
+            with metrics.stage("chemicals"):
+                _compute()
+
+        with tempfile.TemporaryDirectory() as directory:
+            with mock.patch("pemt.profiling.PROFILE_DIR", directory):
+                profiler.write("test_run", {"analysis": "test"})
+
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ["test_run_chemicals.prof", "test_run_profile.json"],
+            )
+            stats = pstats.Stats(f"{directory}/test_run_chemicals.prof")
+            with open(f"{directory}/test_run_profile.json") as f:
+                data = json.load(f)
+
+        self.assertGreater(stats.total_calls, 0)
+        self.assertEqual(data["analysis"], "test")
+        self.assertEqual(list(data["stages"]), ["chemicals"])
+
+    def test_cli(self):
+        """Test commands run with --profile write the profiles of their stages."""
+        from pemt.cli import main
+
+        @metrics.stage("chemicals")
+        def extract(**kwargs):
+            _compute()
+            return {"P00001": ["CHEMBLTEST1"]}
+
+        with tempfile.TemporaryDirectory() as directory, mock.patch(
+            "pemt.cli._run_chemical_stage", side_effect=extract
+        ), mock.patch("pemt.profiling.PROFILE_DIR", directory), mock.patch.object(
+            metrics, "METRICS_DIR", directory
+        ):
+            gene_file = os.path.join(directory, "genes.txt")
+            open(gene_file, "w").close()
+            result = CliRunner().invoke(
+                main,
+                [
+                    "run-chemical-extractor",
+                    "--name",
+                    "test_profile",
+                    "--data",
+                    gene_file,
+                    "--profile",
+                ],
+            )
+            files = os.listdir(directory)
+
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn("Profile chemicals:", result.output)
+        self.assertIn("test_profile_run-chemical-extractor_chemicals.prof", files)
+        self.assertIn("test_profile_run-chemical-extractor_profile.json", files)
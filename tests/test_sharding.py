@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for sharded runs and their merge."""
+
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from pemt.chemical_extractor.experimental_data_extraction import (
+    extract_chemicals,
+    load_gene_chemicals,
+)
+from pemt.constants import ARCHIVE_DIR, MAPPER_DIR, PATENT_DIR
+from pemt.merge import merge_shards
+from pemt.patent_extractor.patent_chemical_harmonizer import harmonize_chemicals
+from pemt.patent_extractor.patent_enrichment import extract_patent
+from pemt.patent_extractor.patent_store import PatentStore
+from pemt.sharding import in_shard, parse_shard, shard_name
+
+from .test_pipeline import GENE_CHEMICALS, PATENTS, SURECHEMBL
+
+
+class TestSharding(unittest.TestCase):
+    """Tests for partitioning the work of the stages."""
+
+    def test_parse_shard(self):
+        """Test shards are given as i/N with i from 0 to N - 1."""
+        self.assertEqual(parse_shard("1/4"), (1, 4))
+        for value in ("4/4", "1", "a/b", "0/0"):
+            with self.assertRaises(ValueError):
+                parse_shard(value)
+
+    def test_partition(self):
+        """Test every identifier belongs to exactly one shard."""
+        identifiers = [f"CHEMBL{i}" for i in range(100)]
+        shards = [(index, 3) for index in range(3)]
+
+        for identifier in identifiers:
+            self.assertEqual(sum(in_shard(identifier, shard) for shard in shards), 1)
+        self.assertTrue(in_shard("CHEMBL1"))
+        self.assertEqual(shard_name("test", (0, 3)), "test_shard0of3")
+
+
+class TestMerge(unittest.TestCase):
+    """Tests for merging the shards of an analysis."""
+
+    def setUp(self):
+        """Write the gene file."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.gene_file = os.path.join(self.directory.name, "genes.csv")
+        with open(self.gene_file, "w") as f:
+            f.write("uniprot\n" + "\n".join(GENE_CHEMICALS) + "\n")
+
+    def tearDown(self):
+        """Remove the files of the test analysis."""
+        self.directory.cleanup()
+        for directory in (MAPPER_DIR, PATENT_DIR):
+            for file_path in glob.glob(f"{directory}/*test_shard*"):
+                os.remove(file_path)
+        for file_path in glob.glob(f"{ARCHIVE_DIR}/SCHEMBLTEST*"):
+            os.remove(file_path)
+
+    @mock.patch(
+        "pemt.patent_extractor.patent_enrichment.get_patent_hits",
+        side_effect=lambda schembl_id, **kwargs: (PATENTS[schembl_id], 1, True),
+    )
+    @mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_surechembl_id",
+        side_effect=lambda chemical_id, **kwargs: SURECHEMBL.get(chemical_id),
+    )
+    @mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_chemical_names",
+        side_effect=lambda chembl_id: chembl_id.lower(),
+    )
+    @mock.patch(
+        "pemt.chemical_extractor.experimental_data_extraction.target_to_chemical",
+        side_effect=lambda protein, **kwargs: GENE_CHEMICALS[protein],
+    )
+    @mock.patch(
+        "pemt.chemical_extractor.experimental_data_extraction.load_target_mappers",
+        return_value=({}, {}),
+    )
+    def test_merge_shards(self, *_):
+        """Test the merged shards give the same result as an unsharded run."""
+        for index in range(2):
+            shard = (index, 2)
+            extract_chemicals(
+                analysis_name="test_shard",
+                gene_file_path=self.gene_file,
+                is_uniprot=True,
+                shard=shard,
+            )
+            harmonize_chemicals(analysis_name="test_shard", shard=shard)
+            extract_patent(
+                analysis_name="test_shard",
+                chrome_driver_path="chromedriver",
+                shard=shard,
+            )
+
+        self.assertEqual(
+            merge_shards("test_shard", 2), ["chemicals", "harmonizer", "patents"]
+        )
+
+        self.assertEqual(load_gene_chemicals("test_shard"), GENE_CHEMICALS)
+        patent_df = PatentStore.load("test_shard").to_wide().dropna()
+        self.assertEqual(
+            sorted(zip(patent_df["chembl"], patent_df["patent_id"])),
+            [("CHEMBL1", "US-1-A"), ("CHEMBL2", "US-1-A")],
+        )
+        self.assertTrue(os.path.exists(f"{PATENT_DIR}/test_shard_gene_patent_data.tsv"))
+
+    def test_missing_shard(self):
+        """Test a stage is not merged while some shards have not run it."""
+        with open(
+            f"{MAPPER_DIR}/test_shard_shard0of2_gene_to_chemicals.json", "w"
+        ) as f:
+            f.write("{}")
+
+        with self.assertRaises(ValueError):
+            merge_shards("test_shard", 2)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for reading and writing the PEMT tables."""
+
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+from pemt.tables import find_table, read_table, read_table_chunks, write_table
+
+PATENTS = pd.DataFrame(
+    {
+        "chembl": ["CHEMBL1", "CHEMBL1", "CHEMBL2"],
+        "patent_id": ["US-1-A", "EP-2-B1", None],
+        "date": ["2010-01-01", "2012-05-01", None],
+        "ipc": ["A61P 3/00", "A61P 3/00", None],
+        "assignee": ["UNIV BOSTON", "NOVARTIS AG", None],
+    }
+)
+
+
+class TestTables(unittest.TestCase):
+    """Tests for the table formats."""
+
+    def setUp(self):
+        """Create a directory for the tables."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.stem = os.path.join(self.directory.name, "test_patent_data")
+
+    def tearDown(self):
+        """Remove the tables."""
+        self.directory.cleanup()
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_typed_columns(self):
+        """Test binary formats keep dates and categoricals and can be read back as strings."""
+        for table_format in ("parquet", "feather"):
+            file_path = write_table(PATENTS, self.stem, table_format)
+
+            df = read_table(file_path)
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(df["date"]))
+            self.assertIsInstance(df["ipc"].dtype, pd.CategoricalDtype)
+
+            df = read_table(file_path, typed=False)
+            self.assertEqual(df["date"].tolist()[:2], ["2010-01-01", "2012-05-01"])
+            self.assertTrue(df.loc[2, ["patent_id", "date", "ipc"]].isna().all())
+
+    @unittest.skipIf(pyarrow is None, "pyarrow is not installed")
+    def test_format_switch(self):
+        """Test writing a table in another format replaces the stale file."""
+        write_table(PATENTS, self.stem, "tsv")
+        write_table(PATENTS, self.stem, "parquet")
+
+        self.assertFalse(os.path.exists(f"{self.stem}.tsv"))
+        self.assertEqual(find_table(self.stem, "tsv"), f"{self.stem}.parquet")
+        self.assertIsNone(find_table(os.path.join(self.directory.name, "missing")))
+
+    def test_chunks(self):
+        """Test a table can be read a number of rows at a time in every format."""
+        for table_format in ("tsv", "parquet", "feather") if pyarrow else ("tsv",):
+            file_path = write_table(PATENTS, self.stem, table_format)
+
+            chunks = list(read_table_chunks(file_path, 2, typed=False))
+            self.assertEqual(
+                pd.concat(chunks, ignore_index=True)["patent_id"].tolist()[:2],
+                ["US-1-A", "EP-2-B1"],
+            )
+            if table_format != "feather":
+                self.assertEqual([len(chunk) for chunk in chunks], [2, 1])
+
+    def test_unknown_format(self):
+        """Test an unknown format is refused."""
+        with self.assertRaises(ValueError):
+            write_table(PATENTS, self.stem, "xlsx")
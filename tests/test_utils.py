@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for the utility functions."""
+
+import asyncio
+import unittest
+from unittest import mock
+from urllib.error import URLError
+
+import pandas as pd
+
+from pemt.client import CircuitOpenError
+from pemt.patent_extractor.patent_chemical_harmonizer import ChemicalHarmonizer
+from pemt.utils import (
+    attach_genes,
+    get_chemical_names,
+    get_chemical_names_async,
+    get_hgnc_id,
+)
+
+
+class TestAttachGenes(unittest.TestCase):
+    """Tests for annotating patents with genes."""
+
+    def test_attach_genes(self):
+        """Test genes are joined per chemical and chemicals without genes get an empty string."""
+        patent_df = pd.DataFrame(
+            {
+                "chembl": ["CHEMBL2", "CHEMBL1", "CHEMBL2", "CHEMBL9"],
+                "patent_id": ["US-1-A", "US-1-A", "EP-2-B1", "WO-3-A1"],
+            },
+            index=[10, 11, 12, 13],
+        )
+        gene_chemical_dict = {
+            "TP53": ["CHEMBL1", "CHEMBL2"],
+            "EGFR": ["CHEMBL2", "CHEMBL2"],
+            "BRCA1": [],
+        }
+
+        output = attach_genes(patent_df, gene_chemical_dict)
+
+        self.assertEqual(
+            output["genes"].tolist(), ["EGFR, TP53", "TP53", "EGFR, TP53", ""]
+        )
+        self.assertEqual(output.index.tolist(), [10, 11, 12, 13])
+        self.assertNotIn("genes", patent_df.columns)
+
+
+class TestHgncId(unittest.TestCase):
+    """Tests for mapping HGNC symbols to HGNC identifiers."""
+
+    def test_through_client(self):
+        """Test the mapping is downloaded through the client of the HGNC service."""
+        mapping = pd.DataFrame(
+            {"HGNC ID": ["HGNC:11998"]},
+            index=pd.Index(["TP53"], name="Approved symbol"),
+        )
+        with mock.patch("pemt.utils.client.call", return_value=mapping) as call:
+            self.assertEqual(get_hgnc_id(), {"TP53": "HGNC:11998"})
+
+        self.assertEqual(call.call_args.args[:2], ("genenames", pd.read_csv))
+
+
+class TestChemicalNames(unittest.TestCase):
+    """Tests for looking up the names of chemicals in PubChem."""
+
+    def test_unavailable(self):
+        """Test the lookup fails while PubChem cannot be reached, rather than naming the chemical by its ChEMBL id."""
+        for error in (CircuitOpenError("pubchem"), URLError("timed out")):
+            with mock.patch(
+                "pemt.utils.get_synonyms", side_effect=error
+            ), self.assertRaises(type(error)):
+                get_chemical_names("CHEMBL1")
+
+            async def get_synonyms_async(name):
+                raise error
+
+            with mock.patch(
+                "pemt.utils.get_synonyms_async", side_effect=get_synonyms_async
+            ), self.assertRaises(type(error)):
+                asyncio.run(get_chemical_names_async("CHEMBL1"))
+
+        # Only compounds unknown to PubChem are named by their ChEMBL id
+        with mock.patch("pemt.utils.get_synonyms", return_value=[]):
+            self.assertEqual(get_chemical_names("CHEMBL1"), "CHEMBL1")
+
+    def test_harmonizer_unavailable(self):
+        """Test the harmonizer records no chemical while PubChem is unavailable, and names it once it is back."""
+        harmonizer = ChemicalHarmonizer("test_utils_names")
+        harmonizer.chemical_mapper = {"CHEMBL1": "SCHEMBL1"}
+
+        with mock.patch(
+            "pemt.client.fetch_json", side_effect=CircuitOpenError("pubchem")
+        ), self.assertRaises(CircuitOpenError):
+            harmonizer.harmonize("CHEMBL1")
+
+        self.assertEqual(harmonizer.chemicals, {})
+        self.assertEqual(harmonizer.chemical_names, {})
+
+        with mock.patch(
+            "pemt.client.fetch_json",
+            return_value={
+                "InformationList": {"Information": [{"Synonym": ["aspirin"]}]}
+            },
+        ):
+            self.assertEqual(harmonizer.harmonize("CHEMBL1"), "SCHEMBL1")
+        self.assertEqual(harmonizer.chemicals["CHEMBL1"]["name"], "aspirin")
+        self.assertEqual(harmonizer.chemical_names, {"CHEMBL1": "aspirin"})
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""Tests for keeping the state of an analysis in a SQLite workspace."""
+
+import glob
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from pemt import workspace
+from pemt.chemical_extractor.experimental_data_extraction import (
+    extract_chemicals,
+    load_gene_chemicals,
+)
+from pemt.constants import ARCHIVE_DIR, MAPPER_DIR, PATENT_DIR
+from pemt.manifest import file_digest, file_signature
+from pemt.merge import merge_shards
+from pemt.patent_extractor.patent_chemical_harmonizer import (
+    ChemicalHarmonizer,
+    harmonize_chemicals,
+)
+from pemt.patent_extractor.patent_enrichment import extract_patent
+from pemt.patent_extractor.patent_store import PatentStore
+
+from .test_pipeline import GENE_CHEMICALS, PATENTS, SURECHEMBL
+
+PATCHES = [
+    mock.patch(
+        "pemt.patent_extractor.patent_enrichment.get_patent_hits",
+        side_effect=lambda schembl_id, **kwargs: (PATENTS[schembl_id], 1, True),
+    ),
+    mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_surechembl_id",
+        side_effect=lambda chemical_id, **kwargs: SURECHEMBL.get(chemical_id),
+    ),
+    mock.patch(
+        "pemt.patent_extractor.patent_chemical_harmonizer.get_chemical_names",
+        side_effect=lambda chembl_id: chembl_id.lower(),
+    ),
+    mock.patch(
+        "pemt.chemical_extractor.experimental_data_extraction.target_to_chemical",
+        side_effect=lambda protein, **kwargs: GENE_CHEMICALS[protein],
+    ),
+    mock.patch(
+        "pemt.chemical_extractor.experimental_data_extraction.load_target_mappers",
+        return_value=({"P00001": "CHEMBLT1"}, {}),
+    ),
+]
+
+
+class TestWorkspace(unittest.TestCase):
+    """Tests for running the stages with the sqlite format."""
+
+    def setUp(self):
+        """Keep the workspaces in a temporary directory and mock the web services."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.gene_file = os.path.join(self.directory.name, "genes.csv")
+        with open(self.gene_file, "w") as f:
+            f.write("uniprot\n" + "\n".join(GENE_CHEMICALS) + "\n")
+
+        for patcher in PATCHES + [
+            mock.patch.object(workspace, "WORKSPACE_DIR", self.directory.name)
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Close the workspaces and remove the files of the test analysis."""
+        workspace.close_workspaces()
+        self.directory.cleanup()
+        for directory in (MAPPER_DIR, PATENT_DIR):
+            for file_path in glob.glob(f"{directory}/*test_workspace*"):
+                os.remove(file_path)
+        for file_path in glob.glob(f"{ARCHIVE_DIR}/SCHEMBLTEST*"):
+            os.remove(file_path)
+
+    def _run_stages(self, **kwargs):
+        """Run the three stages of the test analysis with the sqlite format."""
+        extract_chemicals(
+            analysis_name="test_workspace",
+            gene_file_path=self.gene_file,
+            is_uniprot=True,
+            table_format="sqlite",
+            **kwargs,
+        )
+        harmonize_chemicals("test_workspace", table_format="sqlite", **kwargs)
+        return extract_patent(
+            "test_workspace",
+            chrome_driver_path="chromedriver",
+            table_format="sqlite",
+            **kwargs,
+        )
+
+    def test_stages(self):
+        """Test the stages write their state to the workspace only, where it is indexed."""
+        patent_df = self._run_stages()
+
+        self.assertEqual(
+            sorted(zip(patent_df.dropna()["chembl"], patent_df.dropna()["patent_id"])),
+            [("CHEMBL1", "US-1-A"), ("CHEMBL2", "US-1-A")],
+        )
+        self.assertEqual(glob.glob(f"{MAPPER_DIR}/*test_workspace*"), [])
+        self.assertEqual(glob.glob(f"{PATENT_DIR}/*test_workspace*"), [])
+
+        # Resuming reads the state back from the workspace
+        self.assertEqual(
+            load_gene_chemicals("test_workspace", "sqlite"), GENE_CHEMICALS
+        )
+        harmonizer = ChemicalHarmonizer("test_workspace", table_format="sqlite")
+        self.assertEqual(
+            harmonizer.chemical_names,
+            {"CHEMBL1": "chembl1", "CHEMBL2": "chembl2", "CHEMBL3": "chembl3"},
+        )
+        store = PatentStore.load("test_workspace", "sqlite")
+        self.assertEqual(store.filters["year"], 2000)
+        pd.testing.assert_frame_equal(store.to_wide(), patent_df)
+
+        analysis = workspace.get_workspace("test_workspace")
+        self.assertEqual(analysis.genes_of("CHEMBL2"), ["P00001", "P00002"])
+        self.assertEqual(analysis.patents_of("CHEMBL2"), ["US-1-A"])
+        self.assertEqual(
+            analysis.query("SELECT target FROM genes WHERE gene = 'P00001'"),
+            [("CHEMBLT1",)],
+        )
+
+    def test_incremental_save(self):
+        """Test a save only adds the rows that are new since the previous one."""
+        store = PatentStore("test_workspace", "sqlite")
+        store.add(
+            "CHEMBL1",
+            "SCHEMBLTEST1",
+            pd.DataFrame(
+                sorted(PATENTS["SCHEMBLTEST1"]),
+                columns=["patent_id", "date", "ipc", "assignee"],
+            ),
+        )
+        store.save()
+
+        store = PatentStore.load("test_workspace", "sqlite")
+        store.add(
+            "CHEMBL2",
+            "SCHEMBLTEST2",
+            pd.DataFrame(
+                sorted(PATENTS["SCHEMBLTEST2"]),
+                columns=["patent_id", "date", "ipc", "assignee"],
+            ),
+        )
+        with mock.patch.object(
+            workspace.Workspace,
+            "save_patent_store",
+            autospec=True,
+            side_effect=workspace.Workspace.save_patent_store,
+        ) as save:
+            store.save()
+
+        kwargs = save.call_args[1]
+        self.assertFalse(kwargs["replace"])
+        self.assertEqual(kwargs["edges"], [(1, 0), (1, 1)])
+
+        analysis = workspace.get_workspace("test_workspace")
+        self.assertEqual(len(analysis.load_patents()), 2)
+        self.assertEqual(analysis.load_edges(), [(0, 0), (1, 0), (1, 1)])
+
+    def test_manifest_digest(self):
+        """Test the tables of a workspace can be inputs and outputs of stage manifests."""
+        address = workspace.workspace_table("test_workspace", "gene_chemicals")
+        self.assertIsNone(file_digest(address))
+
+        self._run_stages()
+        digest = file_digest(address)
+        signature = file_signature(address)
+        self.assertEqual(file_digest(address), digest)
+        self.assertEqual(file_signature(address), signature)
+
+        with workspace.get_workspace("test_workspace").transaction() as connection:
+            connection.execute(
+                "INSERT INTO gene_chemicals VALUES ('P00003', 0, 'CHEMBL4')"
+            )
+        self.assertNotEqual(file_digest(address), digest)
+        self.assertNotEqual(file_signature(address), signature)
+
+    def test_export(self):
+        """Test the files of the other formats can be written from the workspace."""
+        patent_df = self._run_stages()
+
+        output_files = workspace.export_workspace("test_workspace")
+
+        self.assertEqual(len(output_files), 7)
+        self.assertTrue(all(os.path.exists(file_path) for file_path in output_files))
+        self.assertEqual(load_gene_chemicals("test_workspace"), GENE_CHEMICALS)
+        pd.testing.assert_frame_equal(
+            PatentStore.load("test_workspace").to_wide().fillna(""),
+            patent_df.fillna(""),
+        )
+
+    def test_merge_shards(self):
+        """Test the workspaces of the shards of an analysis are merged into its workspace."""
+        for index in range(2):
+            self._run_stages(shard=(index, 2))
+
+        self.assertEqual(
+            merge_shards("test_workspace", 2, table_format="sqlite"),
+            ["chemicals", "harmonizer", "patents"],
+        )
+        self.assertEqual(
+            load_gene_chemicals("test_workspace", "sqlite"), GENE_CHEMICALS
+        )
+        patent_df = PatentStore.load("test_workspace", "sqlite").to_wide().dropna()
+        self.assertEqual(
+            sorted(zip(patent_df["chembl"], patent_df["patent_id"])),
+            [("CHEMBL1", "US-1-A"), ("CHEMBL2", "US-1-A")],
+        )